@@ -8,6 +8,11 @@ Versione avanzata con supporto per pagine specifiche, formati multipli, effetti
 """
 
 import os
+import re
+import hashlib
+import io
+import shutil
+import zlib
 import smtplib
 import ssl
 import json
@@ -18,14 +23,49 @@ from email.mime.base import MIMEBase
 from email import encoders
 from reportlab.pdfgen import canvas
 from reportlab.lib.pagesizes import letter
-from PyPDF2 import PdfWriter, PdfReader
+from reportlab.lib.utils import ImageReader
+import PyPDF2
+from PyPDF2 import PageObject, PdfWriter, PdfReader
+from PyPDF2.generic import (
+    ArrayObject, ByteStringObject, DecodedStreamObject, DictionaryObject, FloatObject,
+    IndirectObject, NameObject, NumberObject, RectangleObject, StreamObject,
+    create_string_object,
+)
 from PIL import Image, ImageDraw
 import tempfile
+import abc
 import argparse
+import base64
+import contextlib
+import copy
+import csv
+import ctypes
+import ctypes.util
+import email.policy
+import email.utils
+import functools
+import glob
+import itertools
+import multiprocessing.util
+import select
+import signal
+import socketserver
+import string
+import struct
 import sys
+import threading
+import time
+import urllib.parse
+import uuid
+from collections import OrderedDict, deque
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, as_completed, wait
+from concurrent.futures.process import BrokenProcessPool
+from email.parser import BytesParser
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from multiprocessing import get_all_start_methods, get_context
 from pathlib import Path
-from datetime import datetime
-from typing import List, Dict, Tuple, Optional
+from datetime import datetime, timezone
+from typing import List, Dict, NamedTuple, Tuple, Optional
 
 # Tutte le funzionalità avanzate sono ora integrate direttamente
 
@@ -39,31 +79,27 @@ def create_watermark_pdf(
     original_pdf_path=None,
 ):
     """
-    Crea un PDF temporaneo contenente solo il marchio (watermark).
+    Crea un PDF su disco contenente solo il marchio (watermark).
+    
+    La pipeline di firma lavora in memoria con create_watermark_pdf_bytes();
+    questa funzione serve quando il chiamante ha bisogno di un file.
     
     Args:
-        image_path (str): Percorso dell'immagine del marchio
+        image_path (str | PIL.Image.Image | bytes): Immagine del marchio (percorso,
+            immagine già aperta o byte del file)
         scale_factor (float): Fattore di scala per ridimensionare il marchio
-        output_path (str): Percorso del file PDF temporaneo (opzionale)
+        output_path (str): Percorso del file PDF (opzionale, altrimenti file temporaneo)
         position (str): Posizione del marchio ("bottom-right", "bottom-left", "top-right", "top-left", "center")
         page_size (tuple): Dimensioni pagina (larghezza, altezza) in punti.
-        original_pdf_path (str): PDF da cui ricavare la dimensione pagina se page_size non 
-            è fornito.    
+        original_pdf_path (str | bytes): PDF (percorso o contenuto in memoria) da
+            cui ricavare la dimensione pagina se page_size non è fornito.
     Returns:
-        str: Percorso del file PDF temporaneo creato
+        str: Percorso del file PDF creato
     """
-    if output_path is None:
-        # Crea un file temporaneo
-        temp_file = tempfile.NamedTemporaryFile(delete=False, suffix='.pdf')
-        output_path = temp_file.name
-        temp_file.close()    # Usa la funzione condivisa per calcolare le dimensioni
-    img_width, img_height, _, _ = calculate_watermark_size_points(image_path, scale_factor)
-    
-    # Crea un PDF con l'immagine
     # Determina dimensioni pagina
     if page_size is None and original_pdf_path:
         try:
-            with open(original_pdf_path, "rb") as f:
+            with _open_binary(original_pdf_path) as f:
                 reader = PdfReader(f)
                 first_page = reader.pages[0]
                 page_width = float(first_page.mediabox.width)
@@ -71,13 +107,83 @@ def create_watermark_pdf(
                 page_size = (page_width, page_height)
         except Exception:
             page_size = letter
+    
+    data = create_watermark_pdf_bytes(image_path, scale_factor, position, page_size)
+    
+    if output_path is None:
+        # Crea un file temporaneo
+        temp_file = tempfile.NamedTemporaryFile(delete=False, suffix='.pdf')
+        output_path = temp_file.name
+        temp_file.close()
+    with open(output_path, 'wb') as f:
+        f.write(data)
+    
+    return output_path
+
+
+def create_watermark_pdf_bytes(image, scale_factor=1.0, position="bottom-right",
+                               page_size=None) -> bytes:
+    """
+    Crea in memoria il PDF di una pagina contenente solo il marchio.
+    
+    Args:
+        image (str | PIL.Image.Image | bytes): Immagine del marchio (percorso,
+            immagine già aperta o byte del file, vedi decode_signature_image)
+        scale_factor (float): Fattore di scala per ridimensionare il marchio
+        position (str): Posizione del marchio ("bottom-right", "bottom-left",
+            "top-right", "top-left", "center" o "custom:x,y")
+        page_size (tuple): Dimensioni pagina (larghezza, altezza) in punti (default Letter)
+    
+    Returns:
+        bytes: Contenuto del PDF
+    """
     if page_size is None:
         page_size = letter
-    page_width, page_height = page_size
-
+    image = decode_signature_image(image)
+    x_position, y_position, img_width, img_height = calculate_watermark_position(
+        image, scale_factor, position, page_size
+    )
+    
     # Crea un PDF con l'immagine
-    c = canvas.Canvas(output_path, pagesize=page_size)
-      # Calcola la posizione dell'immagine in base al parametro position
+    buffer = io.BytesIO()
+    c = canvas.Canvas(buffer, pagesize=page_size)
+    if isinstance(image, Image.Image):
+        image = ImageReader(image)
+    else:
+        try:
+            image = SIGNATURE_IMAGES.get(image).reader
+        except OSError:
+            # Formati non gestiti da PIL: ReportLab legge direttamente il file
+            pass
+    c.drawImage(image, x_position, y_position, 
+                width=img_width, height=img_height, mask='auto')
+    c.save()
+    
+    return buffer.getvalue()
+
+
+def calculate_watermark_position(image, scale_factor, position, page_size):
+    """
+    Calcola posizione e dimensioni del marchio su una pagina.
+    
+    Usata da tutti i motori PDF, così il marchio finisce nello stesso punto
+    indipendentemente dal motore scelto.
+    
+    Args:
+        image: Percorso dell'immagine o PIL.Image.Image
+        scale_factor: Fattore di scala
+        position: Posizione ("bottom-right", ..., "center" o "custom:x,y")
+        page_size: Dimensioni (larghezza, altezza) della pagina visualizzata in punti
+    
+    Returns:
+        Tuple (x, y, larghezza, altezza) in punti, origine in basso a sinistra
+    """
+    # Usa la funzione condivisa per calcolare le dimensioni
+    img_width, img_height, _, _ = calculate_watermark_size_points(image, scale_factor)
+    
+    page_width, page_height = page_size
+    
+    # Calcola la posizione dell'immagine in base al parametro position
     # Lascia un margine di 20 punti dai bordi
     margin = 20
     
@@ -118,15 +224,826 @@ def create_watermark_pdf(
     if y_position + img_height > page_height:
         y_position = page_height - img_height - margin
     
-    c.drawImage(image_path, x_position, y_position, 
-                width=img_width, height=img_height, mask='auto')
-    c.save()
+    return x_position, y_position, img_width, img_height
+
+
+class _BufferReader(io.RawIOBase):
+    """
+    Stream in sola lettura su un buffer (bytearray, memoryview, mmap) senza
+    copiarlo: solo i byte letti vengono copiati.
+    """
     
-    return output_path
+    def __init__(self, buffer):
+        self._view = memoryview(buffer).cast('B')
+        self._pos = 0
+    
+    def readable(self):
+        return True
+    
+    def seekable(self):
+        return True
+    
+    def read(self, size=-1):
+        end = len(self._view) if size is None or size < 0 else min(len(self._view), self._pos + size)
+        data = self._view[self._pos:end].tobytes()
+        self._pos = max(self._pos, end)
+        return data
+    
+    def readinto(self, buffer):
+        data = self.read(len(buffer))
+        buffer[:len(data)] = data
+        return len(data)
+    
+    def seek(self, offset, whence=os.SEEK_SET):
+        base = {os.SEEK_SET: 0, os.SEEK_CUR: self._pos, os.SEEK_END: len(self._view)}[whence]
+        self._pos = max(0, base + offset)
+        return self._pos
+    
+    def tell(self):
+        return self._pos
+
+
+def _is_path(source):
+    return isinstance(source, (str, os.PathLike))
+
+
+def _binary_stream(source):
+    """
+    Stream binario con posizionamento su un contenuto in memoria.
+    
+    ``source`` può essere bytes (usati senza copia tramite BytesIO), un altro
+    oggetto buffer (bytearray, memoryview, mmap) o un file-like binario. I
+    file-like senza seek() vengono letti per intero. Per i percorsi
+    restituisce None: li apre il chiamante.
+    
+    Returns:
+        Tuple (stream o None, True se lo stream va chiuso dal chiamante)
+    """
+    if _is_path(source):
+        return None, False
+    if isinstance(source, bytes):
+        return io.BytesIO(source), True
+    if hasattr(source, 'read'):
+        seekable = getattr(source, 'seekable', None)
+        if seekable is not None and seekable():
+            source.seek(0)
+            return source, False
+        return io.BytesIO(source.read()), True
+    try:
+        return _BufferReader(source), True
+    except TypeError:
+        raise TypeError(f"Sorgente non valida: {type(source).__name__} "
+                        f"(attesi percorso, bytes, buffer o file binario)") from None
+
+
+@contextlib.contextmanager
+def _open_binary(source):
+    """Stream di lettura su un percorso o un contenuto in memoria, chiuso se aperto qui."""
+    stream, owned = _binary_stream(source)
+    if stream is None:
+        stream, owned = open(source, 'rb'), True
+    try:
+        yield stream
+    finally:
+        if owned:
+            stream.close()
+
+
+def _source_name(source, default='documento.pdf'):
+    """Nome da mostrare per una sorgente (percorso, file con .name, o in memoria)."""
+    if _is_path(source):
+        return Path(source).name
+    name = getattr(source, 'name', None)
+    return Path(name).name if isinstance(name, str) else default
+
+
+@contextlib.contextmanager
+def _output_stream(target):
+    """Stream su cui scrivere l'output: il file-like indicato o il percorso aperto in scrittura."""
+    if _is_path(target):
+        with open(target, 'wb') as f:
+            yield f
+    else:
+        yield target
+
+
+class PdfDocumentSession:
+    """
+    Sessione di lavoro su un PDF di input.
+    
+    Il documento viene aperto e analizzato con PdfReader una sola volta; reader,
+    numero di pagine, dimensioni pagina e selezione delle pagine sono poi
+    condivisi da tutte le fasi della pipeline (creazione marchio, selezione,
+    unione e scrittura). Il file resta aperto finché la sessione è attiva,
+    perché PyPDF2 legge gli oggetti in modo pigro.
+    
+    Il documento può essere anche in memoria (bytes, buffer o file-like
+    binario, vedi _binary_stream): in quel caso ``path`` è None e un file-like
+    del chiamante non viene chiuso dalla sessione.
+    
+    Uso:
+        with PdfDocumentSession("documento.pdf") as session:
+            pagine = session.select_pages("1-3")
+    """
+    
+    # Numero totale di analisi eseguite (usato dai benchmark)
+    parse_count = 0
+    
+    def __init__(self, pdf_path):
+        stream, owned = _binary_stream(pdf_path)
+        self.path = pdf_path if stream is None else None
+        self._file = open(pdf_path, 'rb') if stream is None else stream
+        self._owns_file = stream is None or owned
+        try:
+            self.reader = PdfReader(self._file)
+            self.total_pages = len(self.reader.pages)
+        except Exception:
+            self.close()
+            raise
+        PdfDocumentSession.parse_count += 1
+        self._page_size = None
+        self._selections = {}
+    
+    @property
+    def page_size(self):
+        """Dimensioni (larghezza, altezza) in punti della prima pagina."""
+        if self._page_size is None:
+            if self.total_pages == 0:
+                self._page_size = letter
+            else:
+                first_page = self.reader.pages[0]
+                self._page_size = (
+                    float(first_page.mediabox.width),
+                    float(first_page.mediabox.height),
+                )
+        return self._page_size
+    
+    def select_pages(self, pages='all', exclude_pages=None):
+        """
+        Restituisce la PageSelection delle pagine da firmare, compilata una
+        sola volta per ogni combinazione di specifica ed esclusione.
+        """
+        key = (pages or 'all', exclude_pages or None)
+        if key not in self._selections:
+            self._selections[key] = PageSelection(key[0], self.total_pages, exclude=key[1])
+        return self._selections[key]
+    
+    def close(self):
+        """Chiude il file sottostante (se aperto dalla sessione)."""
+        if self._owns_file and not self._file.closed:
+            self._file.close()
+    
+    def __enter__(self):
+        return self
+    
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
+        return False
+
+
+# Matrice identità: il marchio è già nello spazio della pagina
+IDENTITY_MATRIX = (1, 0, 0, 1, 0, 0)
+
+
+def page_geometry(page):
+    """
+    Geometria visibile di una pagina: (x0, y0, x1, y1, rotazione).
+
+    Il riquadro è il /CropBox (o il /MediaBox se assente) con coordinate
+    arrotondate al centesimo di punto; la rotazione /Rotate è normalizzata a
+    0, 90, 180 o 270 gradi.
+    """
+    box = page.cropbox
+    xs = (float(box.left), float(box.right))
+    ys = (float(box.bottom), float(box.top))
+    rotate = page.get('/Rotate')
+    rotation = int(rotate.get_object()) % 360 // 90 * 90 if rotate is not None else 0
+    return (round(min(xs), 2), round(min(ys), 2),
+            round(max(xs), 2), round(max(ys), 2), rotation)
+
+
+def visual_page_size(geometry):
+    """Dimensioni (larghezza, altezza) della pagina così come viene visualizzata."""
+    x0, y0, x1, y1, rotation = geometry
+    if rotation in (90, 270):
+        return (y1 - y0, x1 - x0)
+    return (x1 - x0, y1 - y0)
+
+
+def placement_matrix(geometry):
+    """
+    Matrice [a b c d e f] che porta un marchio costruito per la pagina
+    visualizzata (origine in basso a sinistra, dimensioni visual_page_size)
+    nello spazio utente della pagina, tenendo conto di origine del riquadro
+    e rotazione.
+    """
+    x0, y0, x1, y1, rotation = geometry
+    width, height = x1 - x0, y1 - y0
+    matrices = {
+        0: (1, 0, 0, 1, x0, y0),
+        90: (0, 1, -1, 0, x0 + width, y0),
+        180: (-1, 0, 0, -1, x0 + width, y0 + height),
+        270: (0, -1, 1, 0, x0, y0 + height),
+    }
+    return matrices[rotation]
+
+
+class SignatureImage:
+    """
+    Immagine della firma decodificata una sola volta.
+    
+    Espone pixel (image), dimensioni, presenza del canale alfa, impronta del
+    file, l'ImageReader di ReportLab e le miniature per l'anteprima. L'oggetto
+    è condiviso tra tutti gli utilizzatori: chi deve modificare l'immagine
+    (ridimensionamento, putalpha, effetti) lavora su una copia.
+    """
+    
+    def __init__(self, path, image, digest):
+        self.path = path
+        self.image = image
+        self.size = image.size
+        self.has_alpha = image.mode in ('RGBA', 'LA') or 'transparency' in image.info
+        self.nbytes = image.width * image.height * len(image.getbands())
+        # Impronta SHA-256 dei byte del file da cui sono stati decodificati i pixel
+        self.digest = digest
+        self._reader = None
+        self._thumbnails = {}
+    
+    @property
+    def reader(self):
+        """ImageReader di ReportLab costruito sui pixel già decodificati."""
+        if self._reader is None:
+            self._reader = ImageReader(self.image)
+        return self._reader
+    
+    def thumbnail(self, max_size):
+        """Miniatura (condivisa) che rientra in max_size, per le anteprime."""
+        max_size = tuple(max_size)
+        if max_size not in self._thumbnails:
+            thumb = self.image.copy()
+            thumb.thumbnail(max_size, Image.Resampling.LANCZOS)
+            self._thumbnails[max_size] = thumb
+        return self._thumbnails[max_size]
+
+
+class SignatureImageRegistry:
+    """
+    Registro delle immagini di firma decodificate, condiviso dal processo.
+    
+    La chiave è (percorso assoluto, mtime, dimensione del file): se il file
+    cambia su disco viene decodificato di nuovo. Dimensionamento, effetti,
+    disegno nel PDF e anteprima della GUI usano la stessa SignatureImage
+    invece di riaprire il file. La memoria è limitata a max_bytes di pixel
+    decodificati, eliminando le immagini usate meno di recente.
+    """
+    
+    def __init__(self, max_bytes: int = 64 * 1024 * 1024):
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()
+        self._size = 0
+        self._lock = threading.Lock()
+    
+    def get(self, path) -> SignatureImage:
+        """
+        Restituisce la SignatureImage per path, decodificandola se necessario.
+        Solleva OSError se il file non esiste o non è un'immagine leggibile.
+        """
+        stat = os.stat(path)
+        key = (os.path.abspath(path), stat.st_mtime_ns, stat.st_size)
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return entry
+            self.misses += 1
+        
+        # Impronta e pixel vengono dagli stessi byte letti una sola volta
+        with open(path, 'rb') as f:
+            data = f.read()
+        with Image.open(io.BytesIO(data)) as img:
+            img.load()
+            # Scala di grigi con alfa: RGBA, così ReportLab conserva la trasparenza
+            image = img.convert('RGBA') if img.mode == 'LA' else img.copy()
+        entry = SignatureImage(path, image, hashlib.sha256(data).hexdigest())
+        
+        with self._lock:
+            if key not in self._entries:
+                self._entries[key] = entry
+                self._size += entry.nbytes
+                while self._size > self.max_bytes and len(self._entries) > 1:
+                    _, old = self._entries.popitem(last=False)
+                    self._size -= old.nbytes
+            return self._entries[key]
+    
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._size = 0
+            self.hits = self.misses = 0
+    
+    def stats(self) -> dict:
+        with self._lock:
+            return {'hits': self.hits, 'misses': self.misses,
+                    'entries': len(self._entries), 'bytes': self._size}
+
+
+# Registro delle immagini di firma condiviso da libreria e GUI
+SIGNATURE_IMAGES = SignatureImageRegistry()
+
+
+def _file_digest(path) -> str:
+    """Impronta SHA-256 di un file o di un contenuto in memoria (bytes, buffer, file-like)."""
+    if not _is_path(path) and not hasattr(path, 'read'):
+        return hashlib.sha256(path).hexdigest()
+    digest = hashlib.sha256()
+    with _open_binary(path) as f:
+        for chunk in iter(lambda: f.read(1024 * 1024), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def image_digest(image) -> str:
+    """
+    Impronta SHA-256 del contenuto di un'immagine (percorso o PIL.Image.Image).
+    
+    Per le immagini in memoria si usano modalità, dimensioni e pixel, così due
+    immagini identiche producono la stessa impronta indipendentemente dal file
+    da cui provengono; per i percorsi l'impronta del file, calcolata una volta
+    da SIGNATURE_IMAGES; per i byte di un file l'impronta dei byte stessi.
+    """
+    if not _is_path(image) and not isinstance(image, Image.Image):
+        return _file_digest(image)
+    if isinstance(image, Image.Image):
+        digest = hashlib.sha256()
+        digest.update(f"{image.mode}:{image.size[0]}x{image.size[1]}:".encode('ascii'))
+        digest.update(image.tobytes())
+        return digest.hexdigest()
+    try:
+        return SIGNATURE_IMAGES.get(image).digest
+    except OSError:
+        # File non decodificabile come immagine: impronta dei soli byte
+        return _file_digest(image)
+
+
+class CompiledStampCache:
+    """
+    Cache LRU dei PDF dei marchi già compilati, condivisa da tutto il processo.
+    
+    La chiave comprende l'impronta del contenuto dell'immagine e tutti i
+    parametri del marchio (scala, posizione, dimensione pagina, effetti), così
+    firme consecutive con la stessa immagine non rieseguono ReportLab.
+    Si memorizzano i byte del PDF (immutabili): ogni chiamata ne ricava pagine
+    proprie e può modificarle senza effetti sulle altre.
+    
+    Lo spazio è limitato in byte: superato max_bytes vengono eliminate le voci
+    usate meno di recente. I contatori hits/misses/evictions (vedi stats())
+    servono a dimensionare la cache. Se è attiva una DiskStampCache (attributo
+    disk) le voci assenti in memoria vengono cercate e salvate anche su disco.
+    """
+    
+    def __init__(self, max_bytes: int = 64 * 1024 * 1024):
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._entries = OrderedDict()
+        self._size = 0
+        self._lock = threading.Lock()
+        # Secondo livello opzionale (DiskStampCache), vedi enable_disk_stamp_cache()
+        self.disk = None
+    
+    def get_or_build(self, key, build) -> bytes:
+        """Restituisce i byte in cache per key, creandoli con build() se assenti."""
+        with self._lock:
+            data = self._entries.get(key)
+            if data is not None:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return data
+            self.misses += 1
+        # La compilazione avviene fuori dal lock: altri thread non restano bloccati
+        data = self.disk.get(key) if self.disk is not None else None
+        if data is None:
+            data = build()
+            if self.disk is not None:
+                self.disk.put(key, data)
+        with self._lock:
+            if key not in self._entries and len(data) <= self.max_bytes:
+                self._entries[key] = data
+                self._size += len(data)
+                self._evict()
+        return data
+    
+    def _evict(self):
+        while self._size > self.max_bytes and self._entries:
+            _, data = self._entries.popitem(last=False)
+            self._size -= len(data)
+            self.evictions += 1
+    
+    def resize(self, max_bytes: int):
+        """Cambia la dimensione massima, eliminando subito le voci in eccesso."""
+        with self._lock:
+            self.max_bytes = max_bytes
+            self._evict()
+    
+    def clear(self):
+        """Svuota la cache e azzera i contatori."""
+        with self._lock:
+            self._entries.clear()
+            self._size = 0
+            self.hits = self.misses = self.evictions = 0
+    
+    def stats(self) -> dict:
+        """Contatori e occupazione attuale della cache."""
+        with self._lock:
+            stats = {
+                'hits': self.hits,
+                'misses': self.misses,
+                'evictions': self.evictions,
+                'entries': len(self._entries),
+                'bytes': self._size,
+                'max_bytes': self.max_bytes,
+            }
+        if self.disk is not None:
+            stats['disk'] = self.disk.stats()
+        return stats
+
+
+# Cartella predefinita della cache su disco, accanto alla configurazione della GUI
+DEFAULT_STAMP_CACHE_DIR = Path.home() / ".pdf_signer" / "stamp_cache"
+
+
+class DiskStampCache:
+    """
+    Cache persistente su disco dei marchi compilati, indirizzata per contenuto.
+    
+    Ogni voce è un file il cui nome è l'impronta SHA-256 della chiave (impronta
+    dell'immagine più tutti i parametri), distribuito in sottocartelle di due
+    caratteri. Processi diversi, anche in esecuzione contemporanea, possono
+    condividere la stessa cartella:
+    
+    - la scrittura avviene in un file temporaneo nella stessa cartella, poi
+      spostato al suo posto con os.replace() (atomico): un lettore vede il
+      file completo oppure nessun file;
+    - a ogni lettura l'mtime del file viene aggiornato e usato per l'ordine LRU;
+    - la pulizia elimina le voci più vecchie di max_age secondi e poi le meno
+      usate di recente finché la cartella rientra in max_bytes; un file già
+      eliminato da un altro processo viene semplicemente ignorato.
+    """
+    
+    SUFFIX = '.bin'
+    
+    def __init__(self, directory=None, max_bytes: int = 256 * 1024 * 1024,
+                 max_age: float = 30 * 24 * 3600, prune_interval: float = 60.0):
+        self.directory = Path(directory) if directory else DEFAULT_STAMP_CACHE_DIR
+        self.max_bytes = max_bytes
+        self.max_age = max_age
+        self.prune_interval = prune_interval
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._last_prune = 0.0
+        # I contatori sono condivisi dai thread della firma in blocco
+        self._lock = threading.Lock()
+        self.directory.mkdir(parents=True, exist_ok=True)
+    
+    def _path(self, key) -> Path:
+        name = hashlib.sha256(repr(key).encode('utf-8')).hexdigest()
+        return self.directory / name[:2] / (name + self.SUFFIX)
+    
+    def get(self, key) -> Optional[bytes]:
+        """Restituisce i byte memorizzati per key, o None se assenti."""
+        path = self._path(key)
+        try:
+            with open(path, 'rb') as f:
+                data = f.read()
+            os.utime(path)
+        except OSError:
+            self._count('misses')
+            return None
+        self._count('hits')
+        return data
+    
+    def _count(self, counter, amount=1):
+        with self._lock:
+            setattr(self, counter, getattr(self, counter) + amount)
+    
+    def put(self, key, data: bytes) -> bool:
+        """Memorizza i byte per key in modo atomico; False se la scrittura non riesce."""
+        path = self._path(key)
+        try:
+            path.parent.mkdir(exist_ok=True)
+            fd, temp_path = tempfile.mkstemp(dir=path.parent, suffix='.tmp')
+            try:
+                with os.fdopen(fd, 'wb') as f:
+                    f.write(data)
+                os.replace(temp_path, path)
+            except BaseException:
+                with contextlib.suppress(OSError):
+                    os.unlink(temp_path)
+                raise
+        except OSError as e:
+            # La cache è un'ottimizzazione: un errore di scrittura non blocca la firma
+            print(f"⚠️ Cache marchi non scrivibile: {e}")
+            return False
+        if time.monotonic() - self._last_prune >= self.prune_interval:
+            self.prune()
+        return True
+    
+    def prune(self):
+        """Elimina le voci scadute e quelle meno usate oltre il limite di spazio."""
+        self._last_prune = time.monotonic()
+        now = time.time()
+        entries = []
+        for path in self.directory.glob('*/*' + self.SUFFIX):
+            try:
+                stat = path.stat()
+            except OSError:
+                continue
+            if now - stat.st_mtime > self.max_age:
+                self._remove(path)
+            else:
+                entries.append((stat.st_mtime, stat.st_size, path))
+        total = sum(size for _, size, _ in entries)
+        for _, size, path in sorted(entries):
+            if total <= self.max_bytes:
+                break
+            self._remove(path)
+            total -= size
+    
+    def _remove(self, path):
+        try:
+            path.unlink()
+        except OSError:
+            return
+        self._count('evictions')
+    
+    def stats(self) -> dict:
+        with self._lock:
+            return {'hits': self.hits, 'misses': self.misses, 'evictions': self.evictions}
+
+
+# Cache dei marchi compilati condivisa da tutte le firme del processo
+STAMP_CACHE = CompiledStampCache()
+
+
+def enable_disk_stamp_cache(directory=None, max_bytes: int = 256 * 1024 * 1024):
+    """
+    Attiva la cache persistente su disco dietro STAMP_CACHE (default
+    ~/.pdf_signer/stamp_cache) e la restituisce.
+    """
+    STAMP_CACHE.disk = DiskStampCache(directory, max_bytes)
+    return STAMP_CACHE.disk
+
+
+# Cambia quando cambia l'output prodotto a parità di input: invalida la cache degli output
+OUTPUT_CACHE_VERSION = 1
+DEFAULT_OUTPUT_CACHE_DIR = Path.home() / ".pdf_signer" / "output_cache"
+
+# Parametri che non cambiano il PDF prodotto (consegna del risultato)
+_OUTPUT_NEUTRAL_KEYS = ('email_config', 'email_recipients', 'email_template',
+                        'email_subject', 'email_body', 'email_outbox')
+
+
+class OutputCache(DiskStampCache):
+    """
+    Cache su disco dei PDF firmati, indirizzata per contenuto.
+    
+    La chiave è l'impronta dei byte dell'input più quella dei parametri di
+    firma (immagine per contenuto, vedi job_params_hash) e della versione
+    del motore PDF: lo stesso documento ripresentato con lo stesso profilo
+    viene copiato dalla cache invece di essere firmato di nuovo. Scrittura
+    atomica, LRU e pulizia come DiskStampCache.
+    
+    Un output dipende dall'ora della firma (timestamp, metadati) solo fuori
+    dalla modalità deterministica: in quel caso il lavoro non passa dalla
+    cache. Con ``link`` gli output sono hard link alle voci della cache
+    (nessuna copia) e non vanno modificati sul posto.
+    """
+    
+    SUFFIX = '.pdf'
+    
+    def __init__(self, directory=None, max_bytes: int = 1024 * 1024 * 1024,
+                 max_age: float = 30 * 24 * 3600, prune_interval: float = 60.0, link: bool = False):
+        super().__init__(directory or DEFAULT_OUTPUT_CACHE_DIR, max_bytes, max_age, prune_interval)
+        self.link = link
+        self.stores = 0
+        self.bytes_saved = 0
+    
+    def key(self, input_pdf_path, watermark_image_path, scale_factor, position, kwargs):
+        """Chiave del lavoro, o None se il suo output non è riproducibile."""
+        deterministic = kwargs.get('deterministic', False)
+        if not deterministic and (kwargs.get('timestamp') or kwargs.get('add_metadata')):
+            return None
+        options = {k: v for k, v in kwargs.items() if k not in _OUTPUT_NEUTRAL_KEYS}
+        return (
+            OUTPUT_CACHE_VERSION,
+            _file_digest(input_pdf_path),  # percorso o contenuto in memoria
+            job_params_hash(watermark_image_path, scale_factor, position, options),
+            get_pdf_engine(kwargs.get('engine') or 'pypdf2').version(),
+            os.environ.get('SOURCE_DATE_EPOCH') if deterministic else None,
+        )
+    
+    def get(self, key) -> Optional[bytes]:
+        """Output memorizzato per key come bytes (firma in memoria), o None se assente."""
+        data = super().get(key)
+        if data is not None:
+            self._count('bytes_saved', len(data))
+        return data
+    
+    def put(self, key, data: bytes) -> bool:
+        """Memorizza l'output in memoria appena prodotto per key."""
+        stored = super().put(key, data)
+        self._count('stores', stored)
+        return stored
+    
+    def fetch(self, key, output_pdf_path) -> bool:
+        """Scrive in output_pdf_path l'output memorizzato per key; False se assente."""
+        path = self._path(key)
+        try:
+            self._place(path, output_pdf_path)
+            os.utime(path)
+            size = os.path.getsize(output_pdf_path)
+        except OSError:
+            self._count('misses')
+            return False
+        self._count('hits')
+        self._count('bytes_saved', size)
+        return True
+    
+    def store(self, key, output_pdf_path):
+        """Memorizza l'output appena prodotto per key."""
+        path = self._path(key)
+        try:
+            path.parent.mkdir(exist_ok=True)
+            self._place(output_pdf_path, path)
+        except OSError as e:
+            print(f"⚠️ Cache output non scrivibile: {e}")
+            return
+        self._count('stores')
+        if time.monotonic() - self._last_prune >= self.prune_interval:
+            self.prune()
+    
+    def _place(self, source, target):
+        """Copia (o collega) source in target passando da un file temporaneo."""
+        with contextlib.suppress(OSError):
+            if os.path.samefile(source, target):
+                return  # Già collegati: rename() sullo stesso file non farebbe nulla
+        fd, temp_path = tempfile.mkstemp(dir=os.path.dirname(os.path.abspath(target)),
+                                         prefix='.', suffix='.tmp')
+        os.close(fd)
+        try:
+            linked = False
+            if self.link:
+                os.unlink(temp_path)
+                try:
+                    os.link(source, temp_path)
+                    linked = True
+                except OSError:
+                    pass  # Filesystem diversi o senza hard link: si copia
+            if not linked:
+                shutil.copyfile(source, temp_path)
+            os.replace(temp_path, target)
+        except BaseException:
+            with contextlib.suppress(OSError):
+                os.unlink(temp_path)
+            raise
+    
+    def stats(self) -> dict:
+        stats = super().stats()
+        lookups = stats['hits'] + stats['misses']
+        with self._lock:
+            stats.update(stores=self.stores, bytes_saved=self.bytes_saved)
+        stats['hit_rate'] = round(stats['hits'] / lookups, 3) if lookups else 0.0
+        return stats
+
+
+# Cache degli output firmati, disattivata finché non si chiama enable_output_cache()
+OUTPUT_CACHE = None
+
+
+def enable_output_cache(directory=None, max_bytes: int = 1024 * 1024 * 1024, link: bool = False):
+    """
+    Attiva per add_watermark_to_pdf() la cache degli output firmati (default
+    ~/.pdf_signer/output_cache) e la restituisce.
+    """
+    global OUTPUT_CACHE
+    OUTPUT_CACHE = OutputCache(directory, max_bytes, link=link)
+    return OUTPUT_CACHE
+
+
+class StampCache:
+    """
+    Marchi compilati per geometria di pagina.
+
+    Documenti con pagine di formati diversi (A4, Letter, orizzontali), riquadri
+    /CropBox spostati o pagine ruotate con /Rotate richiedono un marchio
+    posizionato diversamente su ogni tipo di pagina. Invece di rigenerarlo per
+    ogni pagina, ogni geometria distinta viene calcolata una sola volta e
+    memorizzata con chiave (riquadro, rotazione, posizione, scala, effetti):
+    per ogni pagina il marchio si ottiene con una ricerca in un dizionario.
+
+    Il PDF del marchio viene generato in memoria una volta per ogni dimensione
+    visibile (due geometrie con la stessa dimensione visibile lo condividono) e
+    portato sulla pagina con placement_matrix(). Firma e timestamp possono
+    essere percorsi o immagini PIL già in memoria. I PDF compilati vengono
+    riutilizzati tra chiamate successive tramite STAMP_CACHE.
+
+    Con mode="merge" lookup() restituisce pagine già posizionate da unire con
+    merge_page(); con mode="xobject" restituisce un'unica pagina (firma e
+    timestamp uniti) e la matrice da applicare quando il XObject viene
+    richiamato.
+    """
+
+    def __init__(self, image, scale_factor=1.0, position="bottom-right",
+                 timestamp_image=None, timestamp_position="bottom-right",
+                 effects=(), mode="merge"):
+        self.image = image
+        self.scale_factor = scale_factor
+        self.position = position
+        self.timestamp_image = timestamp_image
+        self.timestamp_position = timestamp_position
+        self.mode = mode
+        self.params = (position, scale_factor, tuple(effects), timestamp_position)
+        self._digest = image_digest(image)
+        self.stamps_built = 0
+        self._stamps = {}
+        self._placements = {}
+
+    @property
+    def geometries(self):
+        """Numero di geometrie di pagina distinte incontrate."""
+        return len(self._placements)
+
+    def _load(self, image, digest, scale_factor, position, page_size, effects=(), shared=True):
+        def build():
+            return create_watermark_pdf_bytes(image, scale_factor, position, page_size)
+        if not shared:
+            return PdfReader(io.BytesIO(build())).pages[0]
+        key = (digest, scale_factor, position, page_size, effects)
+        return PdfReader(io.BytesIO(STAMP_CACHE.get_or_build(key, build))).pages[0]
+
+    def _stamp_pages(self, size):
+        """Pagine del marchio (firma e timestamp) per una dimensione visibile."""
+        key = (size, self.params)
+        if key not in self._stamps:
+            pages = [self._load(self.image, self._digest, self.scale_factor,
+                                self.position, size, self.params[2])]
+            if self.timestamp_image:
+                # Il timestamp cambia a ogni firma: resta fuori da STAMP_CACHE (e
+                # dalla cache su disco), dove occuperebbe solo spazio
+                pages.append(self._load(self.timestamp_image, None, 0.5,
+                                        self.timestamp_position, size, shared=False))
+            if self.mode == 'xobject' and len(pages) > 1:
+                # Firma e timestamp vengono uniti una volta e registrati come XObject
+                pages[0].merge_page(pages[1])
+                pages = pages[:1]
+            self._stamps[key] = pages
+            self.stamps_built += 1
+        return self._stamps[key]
+
+    def _place(self, geometry):
+        size = visual_page_size(geometry)
+        pages = self._stamp_pages(size)
+        matrix = placement_matrix(geometry)
+        if self.mode == 'xobject' or matrix == IDENTITY_MATRIX:
+            return pages, matrix
+        # Modalità merge: il marchio viene trasformato una sola volta per geometria.
+        # I valori passano come FloatObject da stringa per evitare decimali spuri.
+        x0, y0, x1, y1, _ = geometry
+        overlay = PageObject.create_blank_page(None, size[0], size[1])
+        for page in pages:
+            overlay.merge_page(page)
+        overlay.add_transformation(tuple(FloatObject(_pdf_number(v)) for v in matrix))
+        overlay.mediabox = RectangleObject([FloatObject(_pdf_number(v)) for v in (x0, y0, x1, y1)])
+        return [overlay], IDENTITY_MATRIX
+
+    def lookup(self, page):
+        """Restituisce (pagine marchio, matrice) per la geometria della pagina."""
+        key = (page_geometry(page), self.params)
+        placement = self._placements.get(key)
+        if placement is None:
+            placement = self._placements[key] = self._place(key[0])
+        return placement
+
+    def close(self):
+        """Rilascia i marchi compilati."""
+        self._stamps.clear()
+        self._placements.clear()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
+        return False
 
 
 def add_watermark_to_pdf(input_pdf_path, watermark_image_path, output_pdf_path, 
-                         scale_factor=1.0, position="bottom-right", **kwargs):
+                         scale_factor=1.0, position="bottom-right", session=None, **kwargs):
     """
     Aggiunge un marchio a tutte le pagine di un file PDF.
     Versione estesa con supporto per funzionalità avanzate.
@@ -137,6 +1054,8 @@ def add_watermark_to_pdf(input_pdf_path, watermark_image_path, output_pdf_path,
         output_pdf_path (str): Percorso del file PDF di output
         scale_factor (float): Fattore di scala per il marchio (default: 1.0)
         position (str): Posizione del marchio ("bottom-right", "bottom-left", "top-right", "top-left", "center")
+        session (PdfDocumentSession): sessione già aperta sull'input (opzionale,
+            evita una seconda analisi del documento)
         **kwargs: Parametri avanzati (pages, opacity, border_enabled, timestamp_enabled, etc.)
     """
     # Verifica che i file esistano
@@ -145,11 +1064,26 @@ def add_watermark_to_pdf(input_pdf_path, watermark_image_path, output_pdf_path,
     
     if not os.path.exists(watermark_image_path):
         raise FileNotFoundError(f"Immagine marchio non trovata: {watermark_image_path}")
+    
+    # Stesso documento con gli stessi parametri: l'output arriva dalla cache (se attiva)
+    cache = OUTPUT_CACHE
+    cache_key = cache.key(input_pdf_path, watermark_image_path, scale_factor, position,
+                          kwargs) if cache else None
+    if cache_key:
+        if cache.fetch(cache_key, output_pdf_path):
+            print(f"♻️ Output dalla cache: {output_pdf_path}")
+            _email_signed_pdf(output_pdf_path, kwargs)
+            return True
+        _unlink_shared_output(input_pdf_path, output_pdf_path)
+    
       # Se sono richieste funzionalità avanzate, usa la funzione avanzata
     if _has_advanced_features(kwargs):
         print("🚀 Modalità avanzata attivata")
-        return add_watermark_to_pdf_advanced(input_pdf_path, watermark_image_path, output_pdf_path, 
-                                            scale_factor, position, **kwargs)
+        ok = add_watermark_to_pdf_advanced(input_pdf_path, watermark_image_path, output_pdf_path, 
+                                           scale_factor, position, session=session, **kwargs)
+        if ok and cache_key:
+            cache.store(cache_key, output_pdf_path)
+        return ok
     
     # Modalità standard (retrocompatibilità)
     print(f"Creazione del marchio con fattore di scala: {scale_factor}")
@@ -159,124 +1093,82 @@ def add_watermark_to_pdf(input_pdf_path, watermark_image_path, output_pdf_path,
     pages_to_process = kwargs.get('pages', 'all')
     exclude_pages = kwargs.get('exclude_pages', None)
 
-    # Ricava dimensioni pagina dal PDF originale
-    with open(input_pdf_path, 'rb') as f:
-        reader_tmp = PdfReader(f)
-        first_page = reader_tmp.pages[0]
-        page_size = (
-            float(first_page.mediabox.width),
-            float(first_page.mediabox.height),
-        )
-
-    watermark_pdf_path = create_watermark_pdf(
-        watermark_image_path,
-        scale_factor,
-        position=position,
-        page_size=page_size,
-    )
-    
-    try:
-        # Leggi il PDF originale
-        print(f"Lettura del PDF: {input_pdf_path}")
-        with open(input_pdf_path, 'rb') as input_file:
-            input_pdf = PdfReader(input_file)
-            total_pages = len(input_pdf.pages)            # Determina pagine da processare
-            if pages_to_process != 'all':
-                pages_indices = parse_pages_specification(pages_to_process, total_pages)
-                if exclude_pages:
-                    excluded = parse_pages_specification(exclude_pages, total_pages)
-                    pages_indices = [p for p in pages_indices if p not in excluded]
+    # Il PDF originale viene analizzato una sola volta per tutta la pipeline
+    print(f"Lettura del PDF: {input_pdf_path}")
+    with (contextlib.nullcontext(session) if session else PdfDocumentSession(input_pdf_path)) as session, \
+            StampCache(watermark_image_path, scale_factor, position) as stamps:
+        total_pages = session.total_pages
+        # Determina pagine da processare
+        pages_indices = session.select_pages(pages_to_process, exclude_pages)
+        
+        # Crea il PDF di output
+        output_pdf = PdfWriter()
+        
+        # Aggiungi il marchio a ogni pagina (un marchio per geometria di pagina)
+        print(f"Elaborazione di {total_pages} pagine...")
+        
+        for i, page in enumerate(session.reader.pages):
+            if i in pages_indices:
+                print(f"Firmo pagina {i+1}/{total_pages}")
+                # Aggiungi il marchio alla pagina
+                for stamp_page in stamps.lookup(page)[0]:
+                    page.merge_page(stamp_page)
             else:
-                pages_indices = list(range(total_pages))
+                print(f"Salto pagina {i+1}/{total_pages}")
             
-            # Leggi il PDF del marchio
-            with open(watermark_pdf_path, 'rb') as watermark_file:
-                watermark_pdf = PdfReader(watermark_file)
-                watermark_page = watermark_pdf.pages[0]
-                
-                # Crea il PDF di output
-                output_pdf = PdfWriter()
-                
-                # Aggiungi il marchio a ogni pagina
-                print(f"Elaborazione di {total_pages} pagine...")
-                
-                for i, page in enumerate(input_pdf.pages):
-                    if i in pages_indices:
-                        print(f"Firmo pagina {i+1}/{total_pages}")
-                        # Aggiungi il marchio alla pagina
-                        page.merge_page(watermark_page)
-                    else:
-                        print(f"Salto pagina {i+1}/{total_pages}")
-                    
-                    output_pdf.add_page(page)
-                
-                # Aggiungi metadati base se specificati
-                if kwargs.get('add_metadata', False):
-                    metadata = {}
-                    if kwargs.get('author'):
-                        metadata['/Author'] = kwargs['author']
-                    if kwargs.get('title'):
-                        metadata['/Title'] = kwargs['title']
-                    if kwargs.get('subject'):
-                        metadata['/Subject'] = kwargs['subject']
-                    metadata['/Creator'] = 'PDF Signer'
-                    metadata['/ModDate'] = f"D:{datetime.now().strftime('%Y%m%d%H%M%S')}"
-                    output_pdf.add_metadata(metadata)
-                
-                # Salva il PDF modificato
-                print(f"Salvataggio del PDF modificato: {output_pdf_path}")
-                with open(output_pdf_path, 'wb') as output_file:
-                    output_pdf.write(output_file)
-    
-    finally:
-        # Elimina il file temporaneo
-        try:
-            os.unlink(watermark_pdf_path)
-        except:
-            pass
+            output_pdf.add_page(page)
+        
+        # Aggiungi metadati base se specificati
+        if kwargs.get('add_metadata', False):
+            metadata = {}
+            if kwargs.get('author'):
+                metadata['/Author'] = kwargs['author']
+            if kwargs.get('title'):
+                metadata['/Title'] = kwargs['title']
+            if kwargs.get('subject'):
+                metadata['/Subject'] = kwargs['subject']
+            metadata['/Creator'] = 'PDF Signer'
+            metadata['/ModDate'] = f"D:{datetime.now().strftime('%Y%m%d%H%M%S')}"
+            output_pdf.add_metadata(metadata)
+        
+        # Salva il PDF modificato
+        print(f"Salvataggio del PDF modificato: {output_pdf_path}")
+        with open(output_pdf_path, 'wb') as output_file:
+            output_pdf.write(output_file)
     
+    if cache_key:
+        cache.store(cache_key, output_pdf_path)
     print(f"Operazione completata! PDF salvato in: {output_pdf_path}")
+    return True
+
+
+def _unlink_shared_output(input_pdf_path, output_pdf_path):
+    """
+    Un output precedente collegato alla cache (OutputCache con link) va
+    staccato prima di riscriverlo, altrimenti la scrittura modificherebbe
+    anche la voce della cache.
+    """
+    try:
+        if os.stat(output_pdf_path).st_nlink > 1 and not os.path.samefile(input_pdf_path,
+                                                                            output_pdf_path):
+            os.unlink(output_pdf_path)
+    except OSError:
+        pass
 
 
 def _has_advanced_features(kwargs):
     """Verifica se sono richieste funzionalità avanzate."""
     advanced_keys = [
         'pages', 'exclude_pages', 'opacity', 'border_width', 'shadow_enabled', 
-        'timestamp', 'add_metadata', 'email_config', 'email_recipients'
+        'timestamp', 'add_metadata', 'email_config', 'email_recipients', 'stamp_mode',
+        'incremental', 'engine', 'shards', 'deterministic'
     ]
     return any(key in kwargs for key in advanced_keys)
 
 
 def _parse_pages_basic(pages_spec, total_pages):
-    """Analisi base delle pagine senza il modulo avanzato."""
-    pages = []
-
-    if pages_spec == 'first':
-        if total_pages > 0:
-            pages.append(0)
-    elif pages_spec == 'last':
-        if total_pages > 0:
-            pages.append(total_pages - 1)
-    elif pages_spec.isdigit():
-        page_num = int(pages_spec) - 1
-        if 0 <= page_num < total_pages:
-            pages.append(page_num)
-    else:
-        # Gestione base di range separati da virgole
-        for part in pages_spec.split(','):
-            part = part.strip()
-            if '-' in part:
-                try:
-                    start, end = map(int, part.split('-'))
-                    pages.extend(range(start - 1, min(end, total_pages)))
-                except ValueError:
-                    continue
-            elif part.isdigit():
-                page_num = int(part) - 1
-                if 0 <= page_num < total_pages:
-                    pages.append(page_num)
-
-    return sorted(list(set(pages)))
+    """Analisi base delle pagine (lista ordinata 0-indexed) tramite PageSelection."""
+    return list(PageSelection(pages_spec, total_pages))
 
 
 def interactive_mode():
@@ -476,676 +1368,5377 @@ def interactive_mode():
     
 
 
-def command_line_mode():
-    """Modalità da riga di comando del programma con supporto opzioni avanzate."""
-    parser = argparse.ArgumentParser(
-        description="Aggiunge un marchio a tutte le pagine di un file PDF",
-        formatter_class=argparse.RawDescriptionHelpFormatter,
-        epilog="""
-Esempi d'uso:
+# --- Firma in blocco -------------------------------------------------------
 
-  # Firma base
-  %(prog)s documento.pdf -w sign.png -o documento_firmato.pdf
+DEFAULT_NAME_TEMPLATE = "{stem}_signed{suffix}"
 
-  # Firma solo prima pagina con scala personalizzata
-  %(prog)s documento.pdf -w sign.png -s 0.3 --pages first
 
-  # Firma con opzioni avanzate (richiede pdf_signer_advanced.py)
-  %(prog)s documento.pdf -w sign.png --opacity 0.6 --border --timestamp
+def _is_glob(pattern):
+    return any(ch in pattern for ch in '*?[')
 
-Formati immagine supportati: PNG, JPG, JPEG, GIF (SVG con modulo avanzato)
-        """
-    )
+
+def expand_pdf_inputs(patterns):
+    """
+    Espande percorsi, glob (anche ``**``) e directory (ricorsive) nell'elenco
+    ordinato dei PDF da firmare.
     
-    # Argomenti base
-    parser.add_argument(
-        "input_pdf",
-        help="Percorso del file PDF di input"
-    )
-    parser.add_argument(
-        "-o", "--output",
-        help="Percorso del file PDF di output (default: aggiunge '_signed' al nome originale)"
-    )
-    parser.add_argument(
-        "-s", "--scale",
-        type=float,
-        default=0.2,
-        help="Fattore di scala per il marchio (default: 0.2)"
-    )
-    parser.add_argument(
-        "-w", "--watermark",
-        default="sign.png",
-        help="Percorso dell'immagine del marchio (default: sign.png)"
-    )
-    parser.add_argument(
-        "-p", "--position",
-        choices=["bottom-right", "bottom-left", "top-right", "top-left", "center"],
-        default="bottom-right",
-        help=(
-            "Posizione del marchio (default: bottom-right). "
-            "Opzioni: bottom-right, bottom-left, top-right, top-left, center"
+    Returns:
+        lista di coppie (percorso, radice): la radice è la directory o la parte
+        fissa del glob da cui il file è stato trovato, usata per riprodurre la
+        struttura delle sottocartelle nella directory di output
+    """
+    found = {}
+    for pattern in patterns:
+        if os.path.isdir(pattern):
+            root = pattern
+            for dirpath, dirnames, filenames in os.walk(pattern):
+                dirnames.sort()
+                for filename in filenames:
+                    if filename.lower().endswith('.pdf'):
+                        found.setdefault(os.path.join(dirpath, filename), root)
+        elif _is_glob(pattern):
+            # La radice è la parte del pattern che precede il primo carattere jolly
+            fixed = []
+            for part in Path(pattern).parts:
+                if _is_glob(part):
+                    break
+                fixed.append(part)
+            root = os.path.join(*fixed) if fixed else '.'
+            for path in glob.glob(pattern, recursive=True):
+                if os.path.isfile(path) and path.lower().endswith('.pdf'):
+                    found.setdefault(path, root)
+        else:
+            found.setdefault(pattern, os.path.dirname(pattern))
+    return sorted(found.items())
+
+
+def batch_output_path(input_pdf_path, root, output_dir=None, name_template=DEFAULT_NAME_TEMPLATE,
+                      index=0):
+    """
+    Percorso di output di un file della firma in blocco.
+    
+    Segnaposto del modello: {stem}, {suffix}, {name}, {index}. Con output_dir
+    la struttura delle sottocartelle rispetto alla radice viene mantenuta,
+    altrimenti il file firmato viene scritto accanto all'originale.
+    """
+    source = Path(input_pdf_path)
+    try:
+        name = name_template.format(stem=source.stem, suffix=source.suffix,
+                                    name=source.name, index=index)
+    except (KeyError, IndexError, ValueError) as e:
+        raise ValueError(f"Modello di nome non valido: {name_template} ({e})") from None
+    if output_dir is None:
+        return str(source.parent / name)
+    relative = os.path.relpath(source.parent, root) if root else '.'
+    if relative.startswith('..'):
+        relative = '.'
+    return os.path.normpath(os.path.join(output_dir, relative, name))
+
+
+class BatchResult(NamedTuple):
+    """Esito della firma di un file in blocco."""
+    input_path: str
+    output_path: str
+    ok: bool
+    pages: int
+    seconds: float
+    error: Optional[str] = None
+    fingerprint: Optional[tuple] = None  # (dimensione, mtime_ns) dell'input firmato
+    skipped: bool = False  # già firmato in un'esecuzione precedente (vedi BatchJournal)
+    cached_bytes: int = 0  # dimensione dell'output se copiato dalla cache (vedi OutputCache)
+
+
+# Parametri condivisi dai processi della firma in blocco (vedi _batch_worker_init)
+_BATCH_JOB = None
+
+
+def _batch_worker_init(watermark_image_path, scale_factor, position, kwargs, stamp_cache=None,
+                       output_cache=None, fingerprint_input=False):
+    """
+    Prepara un processo della firma in blocco: l'immagine della firma viene
+    decodificata ed elaborata una volta sola e i marchi compilati restano in
+    STAMP_CACHE per tutti i file assegnati al processo. ``fingerprint_input``
+    chiede l'impronta degli input (registro di ripresa).
+    """
+    global _BATCH_JOB
+    _BATCH_JOB = (watermark_image_path, scale_factor, position, kwargs, fingerprint_input)
+    if stamp_cache:
+        enable_disk_stamp_cache(*stamp_cache)
+    if output_cache:
+        enable_output_cache(*output_cache)
+    try:
+        cached_signature_image(
+            watermark_image_path,
+            kwargs.get('border_width', 0),
+            kwargs.get('border_color', (0, 0, 0)),
+            kwargs.get('shadow_enabled', False),
+            kwargs.get('shadow_offset', (5, 5)),
         )
-    )
+    except Exception:
+        pass  # L'errore verrà riportato file per file
+
+
+def _batch_sign_one(input_pdf_path, output_pdf_path):
+    """Firma un file con i parametri comuni del lotto (vedi _batch_worker_init)."""
+    return _sign_one(input_pdf_path, output_pdf_path, *_BATCH_JOB)
+
+
+def _sign_one(input_pdf_path, output_pdf_path, watermark_image_path, scale_factor, position, kwargs,
+              fingerprint_input=False):
+    """
+    Firma un file in un processo di lavoro; gli errori non escono dal processo.
+    Con ``fingerprint_input`` il risultato riporta l'impronta dell'input (una
+    stat), che serve solo al registro di ripresa.
+    """
+    log = io.StringIO()
+    start = time.perf_counter()
+    pages = 0
+    fingerprint = None
+    hits = OUTPUT_CACHE.hits if OUTPUT_CACHE else 0
+    try:
+        os.makedirs(os.path.dirname(output_pdf_path) or '.', exist_ok=True)
+        if fingerprint_input:
+            # Impronta prima della firma: identifica la versione dell'input effettivamente firmata
+            fingerprint = input_fingerprint(input_pdf_path)
+        with contextlib.redirect_stdout(log):
+            if kwargs.get('engine', 'pypdf2') == 'pypdf2' and OUTPUT_CACHE is None:
+                # La sessione fornisce il numero di pagine senza una seconda analisi
+                with PdfDocumentSession(input_pdf_path) as session:
+                    pages = session.total_pages
+                    ok = add_watermark_to_pdf(input_pdf_path, watermark_image_path, output_pdf_path,
+                                              scale_factor, position, session=session, **kwargs)
+            else:
+                # Con la cache degli output l'input viene analizzato solo se non c'è già il risultato
+                ok = add_watermark_to_pdf(input_pdf_path, watermark_image_path, output_pdf_path,
+                                          scale_factor, position, **kwargs)
+                if ok:
+                    pages = _output_page_count(output_pdf_path, kwargs.get('engine', 'pypdf2'))
+        error = None
+        if not ok:
+            errors = [line for line in log.getvalue().splitlines() if line.startswith('❌')]
+            error = errors[-1].lstrip('❌ ').strip() if errors else "firma non riuscita"
+    except Exception as e:
+        ok, error = False, f"{type(e).__name__}: {e}"
+    cached_bytes = 0
+    if ok and OUTPUT_CACHE and OUTPUT_CACHE.hits > hits:
+        cached_bytes = os.path.getsize(output_pdf_path)
+    return BatchResult(input_pdf_path, output_pdf_path, ok, pages if ok else 0,
+                       time.perf_counter() - start, error, fingerprint, cached_bytes=cached_bytes)
+
+
+def _output_page_count(output_pdf_path, engine):
+    """
+    Numero di pagine di un PDF prodotto (percorso o bytes), senza analizzarne
+    l'albero delle pagine.
+    """
+    if engine == 'pymupdf':
+        fitz = _import_fitz()
+        doc = (fitz.open(output_pdf_path) if _is_path(output_pdf_path)
+               else fitz.open(stream=output_pdf_path, filetype='pdf'))
+        with doc:
+            return doc.page_count
+    with _open_binary(output_pdf_path) as stream:
+        return int(PdfReader(stream).trailer['/Root']['/Pages']['/Count'])
+
+
+def sign_batch(jobs, watermark_image_path, scale_factor=1.0, position="bottom-right",
+               workers=None, stamp_cache=None, progress=None, journal=None, output_cache=None,
+               **kwargs):
+    """
+    Firma in parallelo un elenco di file con gli stessi parametri.
     
-    # Opzioni per selezione pagine
-    parser.add_argument(
-        "--pages",
-        default="all",
-        help="Pagine da firmare: 'all', 'first', 'last', '1,3,5-10' (default: all)"
-    )
-    parser.add_argument(
-        "--exclude",
-        help="Pagine da escludere (stesso formato di --pages)"
-    )
-      # Opzioni per effetti
-    parser.add_argument(
-        "--border-width",
-        type=int,
-        default=0,
-        help="Spessore bordo in pixel (0=disabilitato, default: 0)"
-    )
-    parser.add_argument(
-        "--border-color",
-        default="0,0,0",
-        help="Colore bordo formato 'R,G,B' (default: 0,0,0)"
-    )
-    parser.add_argument(
-        "--shadow",
-        action='store_true',
-        help="Abilita ombra sulla firma"
-    )
-    parser.add_argument(
-        "--shadow-offset",
-        default="5,5",
-        help="Offset ombra formato 'x,y' (default: 5,5)"
-    )
+    Args:
+        jobs: coppie (input, output)
+        workers: numero di processi (default: numero di core; 1 = nel processo corrente)
+        stamp_cache: (directory, max_bytes) della cache su disco dei marchi, o None
+        progress: funzione chiamata con ogni BatchResult appena disponibile
+        journal: BatchJournal in cui registrare gli esiti; i file già firmati
+            secondo le voci caricate con BatchJournal.load() vengono saltati
+        output_cache: (directory, max_bytes, link) della cache degli output, o None
+        **kwargs: parametri di add_watermark_to_pdf
     
-    # Opzioni timestamp
-    parser.add_argument(
-        "--timestamp",
-        action='store_true',
-        help="Aggiungi timestamp"
-    )
-    parser.add_argument(
-        "--timestamp-format",
-        choices=["short", "long", "full", "iso", "custom"],
-        default="short",
-        help="Formato timestamp (default: short)"
-    )
-    parser.add_argument(
-        "--timestamp-custom",
-        help="Formato personalizzato per timestamp (per format=custom)"
-    )
+    L'errore su un file non interrompe gli altri: ogni file produce un
+    BatchResult, restituiti nell'ordine di ``jobs``.
+    """
+    jobs = list(jobs)
+    results = [None] * len(jobs)
+    params = job_params_hash(watermark_image_path, scale_factor, position, kwargs) if journal else None
+    todo = []
+    for index, (input_pdf_path, output_pdf_path) in enumerate(jobs):
+        if journal and journal.is_completed(input_pdf_path, output_pdf_path, params):
+            results[index] = BatchResult(input_pdf_path, output_pdf_path, True, 0, 0.0, skipped=True)
+        else:
+            todo.append(index)
+    workers = max(1, min(workers or os.cpu_count() or 1, len(todo) or 1))
+    initargs = (watermark_image_path, scale_factor, position, kwargs, stamp_cache, output_cache,
+                journal is not None)
     
-    # Opzioni metadati
-    parser.add_argument(
-        "--add-metadata",
-        action='store_true',
-        help="Aggiungi metadati al PDF"
-    )
-    parser.add_argument(
-        "--author",
-        help="Autore del documento"
-    )
-    parser.add_argument(
-        "--title",
-        help="Titolo del documento"
-    )
-    parser.add_argument(
-        "--subject",
-        help="Soggetto del documento"
-    )
+    def done(index, result):
+        results[index] = result
+        if journal:
+            journal.record(result, params)
+        if progress:
+            progress(result)
     
-    # Opzioni email
-    parser.add_argument(
-        "--email-config",
-        help="Percorso file configurazione email (YAML/JSON)"
-    )
-    parser.add_argument(
-        "--email-recipients",
-        help="Destinatari email separati da virgola"
-    )
-    parser.add_argument(
-        "--email-template",
-        help="Percorso template email"
-    )
+    if not todo:
+        return results
     
-    args = parser.parse_args()
+    if workers == 1:
+        global _BATCH_JOB, OUTPUT_CACHE
+        previous = _BATCH_JOB, STAMP_CACHE.disk, OUTPUT_CACHE
+        _batch_worker_init(*initargs)
+        try:
+            for index in todo:
+                done(index, _batch_sign_one(*jobs[index]))
+        finally:
+            _BATCH_JOB = previous[0]
+            if stamp_cache:
+                STAMP_CACHE.disk = previous[1]
+            if output_cache:
+                OUTPUT_CACHE = previous[2]
+        return results
     
-    # Verifica se il file watermark di default esiste, altrimenti prova altri file comuni
-    if args.watermark == "sign.png" and not os.path.exists(args.watermark):
-        # Lista di file comuni da provare
-        common_files = ["signAL.png", "signature.png", "sign.jpg", "signature.jpg"]
-        found_file = None
-        
-        for file in common_files:
-            if os.path.exists(file):
-                found_file = file
-                print(f"📁 File marchio di default non trovato, uso: {file}")
-                break
+    with ProcessPoolExecutor(max_workers=workers, initializer=_batch_worker_init,
+                             initargs=initargs) as pool:
+        futures = {pool.submit(_batch_sign_one, *jobs[index]): index for index in todo}
+        for future in as_completed(futures):
+            index = futures[future]
+            try:
+                result = future.result()
+            except Exception as e:
+                # Processo terminato in modo anomalo: il file risulta fallito
+                input_pdf_path, output_pdf_path = jobs[index]
+                result = BatchResult(input_pdf_path, output_pdf_path, False, 0, 0.0,
+                                     f"{type(e).__name__}: {e}")
+            done(index, result)
+    return results
+
+
+def summarize_batch(results, elapsed):
+    """Riepilogo della firma in blocco: file, pagine e throughput."""
+    skipped = sum(1 for r in results if r.skipped)
+    signed = [r for r in results if r.ok and not r.skipped]
+    pages = sum(r.pages for r in signed)
+    cached = [r for r in signed if r.cached_bytes]
+    return {
+        'files': len(results),
+        'signed': len(signed),
+        'skipped': skipped,
+        'failed': len(results) - len(signed) - skipped,
+        'pages': pages,
+        'cache_hits': len(cached),
+        'cache_hit_rate': round(len(cached) / len(signed), 3) if signed else 0.0,
+        'bytes_saved': sum(r.cached_bytes for r in cached),
+        'elapsed_s': round(elapsed, 3),
+        'files_per_s': round(len(signed) / elapsed, 2) if elapsed else 0.0,
+        'pages_per_s': round(pages / elapsed, 1) if elapsed else 0.0,
+    }
+
+
+# --- Registro di ripresa -----------------------------------------------------
+
+JOURNAL_NAME = ".pdf_signer_journal.jsonl"
+
+
+def input_fingerprint(path):
+    """
+    (dimensione, mtime_ns) di un file di input: quanto confronta
+    BatchJournal.is_completed, senza rileggere il contenuto.
+    """
+    st = os.stat(path)
+    return st.st_size, st.st_mtime_ns
+
+
+def job_params_hash(watermark_image_path, scale_factor, position, kwargs):
+    """
+    Impronta dei parametri di firma di un lavoro: l'immagine della firma
+    conta per contenuto, gli altri parametri per valore.
+    """
+    try:
+        image = image_digest(watermark_image_path)
+    except OSError:
+        image = os.path.abspath(str(watermark_image_path))  # l'errore emergerà alla firma
+    payload = repr([image, scale_factor, position, sorted((k, repr(v)) for k, v in kwargs.items())])
+    return hashlib.sha256(payload.encode('utf-8')).hexdigest()
+
+
+class BatchJournal:
+    """
+    Registro append-only (JSONL) degli esiti della firma in blocco, per
+    riprendere un lotto interrotto senza rifare i file già firmati.
+    
+    Ogni riga registra input e output, impronta dell'input (dimensione e
+    mtime), impronta dei parametri ed esito. Ogni riga viene
+    scritta subito al sistema operativo, quindi sopravvive alla terminazione
+    del processo; l'fsync invece è raggruppato (ogni ``sync_every`` righe o
+    ``sync_interval`` secondi, e alla chiusura): dopo un riavvio si perdono
+    al più le ultime righe, i cui file vengono semplicemente rifirmati.
+    """
+    
+    def __init__(self, path, sync_every: int = 64, sync_interval: float = 1.0):
+        self.path = str(path)
+        self.sync_every = sync_every
+        self.sync_interval = sync_interval
+        self.records = 0
+        self.syncs = 0
+        self._completed = {}
+        self._file = None
+        self._unsynced = 0
+        self._last_sync = time.monotonic()
+    
+    @staticmethod
+    def _key(input_pdf_path, output_pdf_path, params_hash):
+        return os.path.abspath(input_pdf_path), os.path.abspath(output_pdf_path), params_hash
+    
+    def load(self) -> int:
+        """
+        Legge il registro esistente; restituisce il numero di lavori completati.
         
-        if found_file:
-            args.watermark = found_file
-        else:
-            print(f"❌ Errore: File marchio non trovato: {args.watermark}")
-            print("💡 File disponibili nella directory:")
-            for file in os.listdir('.'):
-                if file.lower().endswith(('.png', '.jpg', '.jpeg', '.gif', '.svg')):
-                    print(f"   - {file}")
-            return 1
+        Vale l'ultima riga di ogni lavoro; le righe illeggibili (ad esempio
+        l'ultima, troncata da un'interruzione) vengono ignorate.
+        """
+        self._completed = {}
+        try:
+            f = open(self.path, encoding='utf-8')
+        except FileNotFoundError:
+            return 0
+        with f:
+            for line in f:
+                try:
+                    entry = json.loads(line)
+                    key = (entry['input'], entry['output'], entry['params_hash'])
+                    if entry['status'] == 'ok':
+                        self._completed[key] = (entry['input_size'], entry['input_mtime_ns'])
+                    else:
+                        self._completed.pop(key, None)
+                except (ValueError, KeyError, TypeError):
+                    continue
+        return len(self._completed)
     
-    # Determina il percorso di output se non specificato
-    if args.output is None:
-        input_path = Path(args.input_pdf)
-        output_name = input_path.stem + "_signed" + input_path.suffix
-        args.output = str(input_path.parent / output_name)
+    def is_completed(self, input_pdf_path, output_pdf_path, params_hash) -> bool:
+        """
+        True se il lavoro risulta firmato con gli stessi parametri, l'input non
+        è cambiato da allora e l'output esiste ancora: una ricerca e due stat,
+        indipendentemente dalla lunghezza del registro.
+        """
+        signature = self._completed.get(self._key(input_pdf_path, output_pdf_path, params_hash))
+        if signature is None:
+            return False
+        try:
+            st = os.stat(input_pdf_path)
+        except OSError:
+            return False
+        return (st.st_size, st.st_mtime_ns) == signature and os.path.exists(output_pdf_path)
+    
+    def record(self, result, params_hash):
+        """Aggiunge l'esito di un lavoro (BatchResult) al registro."""
+        input_path, output_path, _ = self._key(result.input_path, result.output_path, params_hash)
+        size, mtime_ns = result.fingerprint or (None, None)
+        entry = {
+            'input': input_path,
+            'output': output_path,
+            'input_size': size,
+            'input_mtime_ns': mtime_ns,
+            'params_hash': params_hash,
+            'status': 'ok' if result.ok and result.fingerprint else 'failed',
+            'pages': result.pages,
+            'error': result.error,
+            'time': datetime.now().isoformat(timespec='seconds'),
+        }
+        if self._file is None:
+            self._open()
+        self._file.write(json.dumps(entry, ensure_ascii=False) + '\n')
+        self._file.flush()
+        self.records += 1
+        self._unsynced += 1
+        if (self._unsynced >= self.sync_every
+                or time.monotonic() - self._last_sync >= self.sync_interval):
+            self.sync()
+    
+    def _open(self):
+        os.makedirs(os.path.dirname(os.path.abspath(self.path)), exist_ok=True)
+        self._file = open(self.path, 'a+b')
+        # Un'interruzione può lasciare l'ultima riga troncata: la nuova riga parte a capo
+        if self._file.tell():
+            self._file.seek(-1, os.SEEK_END)
+            if self._file.read(1) != b'\n':
+                self._file.write(b'\n')
+        self._file = io.TextIOWrapper(self._file, encoding='utf-8')
+    
+    def sync(self):
+        """Rende durevoli su disco le righe scritte finora."""
+        if self._file is not None and self._unsynced:
+            self._file.flush()
+            os.fsync(self._file.fileno())
+            self.syncs += 1
+        self._unsynced = 0
+        self._last_sync = time.monotonic()
+    
+    def close(self):
+        if self._file is not None:
+            self.sync()
+            self._file.close()
+            self._file = None
+    
+    def __enter__(self):
+        return self
     
+    def __exit__(self, *exc_info):
+        self.close()
+
+
+def _open_journal(args, default_dir):
+    """Registro della riga di comando (None con --no-journal), già letto con --resume."""
+    if args.no_journal:
+        return None
+    journal = BatchJournal(args.journal or os.path.join(default_dir, JOURNAL_NAME))
+    if args.resume:
+        completed = journal.load()
+        print(f"⏯️ Ripresa da {journal.path}: {completed} file già firmati")
+    return journal
+
+
+def _output_cache_option(args):
+    """(directory, max_bytes, link) della cache degli output richiesta, o None."""
+    if not args.output_cache:
+        return None
+    return args.output_cache, args.output_cache_size * 1024 * 1024, args.output_cache_link
+
+
+def _print_cache_summary(summary):
+    print(f"♻️ Cache output: {summary['cache_hits']}/{summary['signed']} file "
+          f"({summary['cache_hit_rate']:.0%}), {summary['bytes_saved'] / 1024:.0f} KB "
+          f"non rigenerati")
+
+
+def _run_batch(args, kwargs):
+    """Firma in blocco da riga di comando; restituisce il codice di uscita."""
+    inputs = expand_pdf_inputs(args.input_pdf)
+    jobs = []
+    for index, (path, root) in enumerate(inputs, 1):
+        jobs.append((path, batch_output_path(path, root, args.output_dir, args.name_template, index)))
+    # Non rifirmare gli output prodotti da questo stesso lotto (es. rilancio sulla stessa cartella)
+    outputs = {os.path.abspath(output) for _, output in jobs}
+    jobs = [(path, output) for path, output in jobs if os.path.abspath(path) not in outputs]
+    if not jobs:
+        print("❌ Nessun file PDF trovato")
+        return 1
+    
+    workers = max(1, min(args.jobs or os.cpu_count() or 1, len(jobs)))
+    stamp_cache = (args.stamp_cache, args.stamp_cache_size * 1024 * 1024) if args.stamp_cache else None
+    print(f"🔄 Firma in blocco: {len(jobs)} file, {workers} processi")
+    
+    def progress(result):
+        if result.ok:
+            print(f"✓ {result.input_path} → {result.output_path} "
+                  f"({result.pages} pagine, {result.seconds:.2f}s)")
+        else:
+            print(f"✗ {result.input_path}: {result.error}")
+    
+    journal = _open_journal(args, args.output_dir or '.')
+    start = time.perf_counter()
     try:
-        kwargs = {}
-        
-        # Pagine
+        results = sign_batch(jobs, args.watermark, args.scale, args.position, workers=workers,
+                             stamp_cache=stamp_cache, progress=progress, journal=journal,
+                             output_cache=_output_cache_option(args), **kwargs)
+    finally:
+        if journal:
+            journal.close()
+    summary = summarize_batch(results, time.perf_counter() - start)
+    
+    print(f"\n📊 Firmati {summary['signed']}/{summary['files']} file, {summary['pages']} pagine "
+          f"in {summary['elapsed_s']:.2f}s ({summary['files_per_s']} file/s, "
+          f"{summary['pages_per_s']} pagine/s)")
+    if summary['skipped']:
+        print(f"⏭️ {summary['skipped']} file già firmati saltati")
+    if args.output_cache:
+        _print_cache_summary(summary)
+    if summary['failed']:
+        print(f"❌ {summary['failed']} file non firmati:")
+        for result in results:
+            if not result.ok:
+                print(f"   - {result.input_path}: {result.error}")
+        return 1
+    return 0
+
+
+# --- Manifest di lavori ------------------------------------------------------
+
+DEFAULT_PROFILES_PATH = Path.home() / ".pdf_signer" / "profiles.json"
+
+
+def _parse_bool(value):
+    if isinstance(value, bool):
+        return value
+    text = str(value).strip().lower()
+    if text in ('1', 'true', 'yes', 'y', 'si', 'sì', 'on'):
+        return True
+    if text in ('0', 'false', 'no', 'n', 'off', ''):
+        return False
+    raise ValueError(f"valore booleano non valido: {value}")
+
+
+def _parse_int_tuple(size):
+    def parse(value):
+        if isinstance(value, (list, tuple)):
+            parts = [int(v) for v in value]
+        else:
+            parts = [int(v) for v in str(value).replace(';', ',').split(',')]
+        if len(parts) != size:
+            raise ValueError(f"attesi {size} valori: {value}")
+        return tuple(parts)
+    return parse
+
+
+def _parse_list(value):
+    if isinstance(value, (list, tuple)):
+        return [str(v).strip() for v in value if str(v).strip()]
+    return [v.strip() for v in str(value).replace(';', ',').split(',') if v.strip()]
+
+
+def _parse_pages(value):
+    return PageSelection.validate(str(value))
+
+
+# Colonne del manifest e conversione dei valori (le celle CSV sono stringhe).
+# Oltre a input/output/profile ogni riga può impostare qualsiasi parametro di
+# add_watermark_to_pdf_advanced() elencato qui.
+MANIFEST_FIELDS = {
+    'input': str,
+    'output': str,
+    'profile': str,
+    'watermark': str,
+    'scale': float,
+    'position': str,
+    'pages': _parse_pages,
+    'exclude_pages': _parse_pages,
+    'opacity': float,
+    'border_width': int,
+    'border_color': _parse_int_tuple(3),
+    'shadow_enabled': _parse_bool,
+    'shadow_offset': _parse_int_tuple(2),
+    'timestamp': _parse_bool,
+    'timestamp_format': str,
+    'timestamp_custom': str,
+    'timestamp_position': str,
+    'add_metadata': _parse_bool,
+    'author': str,
+    'title': str,
+    'subject': str,
+    'email_config': str,
+    'email_recipients': _parse_list,
+    'email_subject': str,
+    'email_body': str,
+    'email_template': str,
+    'stamp_mode': str,
+    'incremental': _parse_bool,
+    'engine': str,
+    'shards': int,
+    'shard_threshold': int,
+}
+
+# Parametri che determinano il marchio: le righe che li condividono vengono
+# firmate dallo stesso processo, che riusa il marchio già compilato
+STAMP_PARAMETERS = (
+    'watermark', 'scale', 'position', 'opacity', 'border_width', 'border_color',
+    'shadow_enabled', 'shadow_offset', 'timestamp', 'timestamp_format',
+    'timestamp_custom', 'timestamp_position', 'stamp_mode', 'incremental', 'engine',
+)
+
+
+def load_profiles(path=None):
+    """Profili salvati dalla GUI (``~/.pdf_signer/profiles.json``); {} se assente."""
+    path = Path(path) if path else DEFAULT_PROFILES_PATH
+    if not path.exists():
+        return {}
+    with open(path, 'r', encoding='utf-8') as f:
+        return json.load(f)
+
+
+def profile_options(profile):
+    """Converte un profilo della GUI nei campi di una riga del manifest."""
+    options = {}
+    renamed = {
+        'scale': 'scale', 'position': 'position', 'opacity': 'opacity',
+        'watermark_path': 'watermark', 'border_width': 'border_width',
+        'border_color': 'border_color', 'shadow_enabled': 'shadow_enabled',
+        'shadow_offset': 'shadow_offset', 'timestamp_enabled': 'timestamp',
+        'timestamp_format': 'timestamp_format', 'timestamp_position': 'timestamp_position',
+        'add_metadata': 'add_metadata', 'metadata_author': 'author',
+        'metadata_title': 'title', 'metadata_subject': 'subject',
+        'email_subject': 'email_subject', 'email_template': 'email_template',
+    }
+    for key, field in renamed.items():
+        if profile.get(key) not in (None, ''):
+            options[field] = profile[key]
+    pages = profile.get('pages')
+    if pages == 'custom':
+        pages = profile.get('pages_range')
+    if pages:
+        options['pages'] = pages
+    if profile.get('email_enabled') and profile.get('email_to'):
+        options['email_recipients'] = _parse_list(profile['email_to']) + \
+            _parse_list(profile.get('email_cc') or '')
+    return options
+
+
+def iter_manifest(path):
+    """
+    Legge il manifest una riga alla volta (JSON Lines o CSV con intestazione,
+    in base all'estensione). Restituisce coppie (numero di riga, dizionario);
+    le righe vuote e i commenti ``#`` dei file JSONL vengono saltati.
+    """
+    if str(path).lower().endswith('.csv'):
+        with open(path, 'r', encoding='utf-8-sig', newline='') as f:
+            reader = csv.DictReader(f)
+            for row in reader:
+                if row.pop(None, None):
+                    yield reader.line_num, {'_error': "più valori che colonne"}
+                    continue
+                yield reader.line_num, {key.strip(): value for key, value in row.items()
+                                        if key and value not in (None, '')}
+        return
+    with open(path, 'r', encoding='utf-8') as f:
+        for line_number, line in enumerate(f, 1):
+            line = line.strip()
+            if not line or line.startswith('#'):
+                continue
+            try:
+                row = json.loads(line)
+            except json.JSONDecodeError as e:
+                yield line_number, {'_error': f"JSON non valido: {e}"}
+                continue
+            yield line_number, row if isinstance(row, dict) else {'_error': "la riga non è un oggetto"}
+
+
+class ManifestJob(NamedTuple):
+    """Riga del manifest risolta in parametri di firma."""
+    row: int
+    input_path: str
+    output_path: str
+    watermark: str
+    scale: float
+    position: str
+    kwargs: dict
+    
+    def stamp_key(self):
+        options = dict(self.kwargs, watermark=self.watermark, scale=self.scale,
+                       position=self.position)
+        return repr([(key, options.get(key)) for key in STAMP_PARAMETERS])
+
+
+def resolve_manifest_row(row, defaults, profiles, base_dir='.', output_dir=None,
+                         name_template=DEFAULT_NAME_TEMPLATE, index=0):
+    """
+    Unisce i parametri di una riga: valori predefiniti (riga di comando) <
+    profilo indicato nella riga < colonne della riga.
+    
+    Raises:
+        ValueError: colonna sconosciuta, valore non valido o profilo assente
+    """
+    if '_error' in row:
+        raise ValueError(row['_error'])
+    options = dict(defaults)
+    name = row.get('profile')
+    if name:
+        if name not in profiles:
+            raise ValueError(f"profilo sconosciuto: {name}")
+        options.update(profile_options(profiles[name]))
+    for key, value in row.items():
+        if key not in MANIFEST_FIELDS:
+            raise ValueError(f"colonna sconosciuta: {key}")
+        options[key] = value
+    for key, value in list(options.items()):
+        if key in MANIFEST_FIELDS and value is not None:
+            try:
+                options[key] = MANIFEST_FIELDS[key](value)
+            except (TypeError, ValueError, argparse.ArgumentTypeError) as e:
+                raise ValueError(f"{key}: {e}") from None
+    
+    if not options.get('input'):
+        raise ValueError("colonna 'input' mancante")
+    # I percorsi relativi si riferiscono alla cartella del manifest
+    input_path = os.path.join(base_dir, options.pop('input'))
+    output = options.pop('output', None)
+    if output:
+        output_path = os.path.join(base_dir, output)
+    else:
+        output_path = batch_output_path(input_path, os.path.dirname(input_path), output_dir,
+                                        name_template, index)
+    watermark = options.pop('watermark', 'sign.png')
+    if not os.path.isabs(watermark) and os.path.exists(os.path.join(base_dir, watermark)):
+        watermark = os.path.join(base_dir, watermark)
+    options.pop('profile', None)
+    scale = options.pop('scale', 0.2)
+    position = options.pop('position', 'bottom-right')
+    return ManifestJob(index, input_path, output_path, watermark, scale, position, options)
+
+
+def _manifest_worker_init(stamp_cache=None, output_cache=None):
+    """
+    Prepara un processo dei lavori da manifest: le cache su disco richieste
+    vanno attivate in ogni processo (con spawn non si ereditano dal
+    processo principale).
+    """
+    if stamp_cache:
+        enable_disk_stamp_cache(*stamp_cache)
+    if output_cache:
+        enable_output_cache(*output_cache)
+
+
+def _sign_manifest_group(jobs, fingerprint_input=False):
+    """Firma in sequenza righe con lo stesso marchio (processo di lavoro)."""
+    return [
+        (job.row, _sign_one(job.input_path, job.output_path, job.watermark, job.scale,
+                            job.position, job.kwargs, fingerprint_input))
+        for job in jobs
+    ]
+
+
+def run_manifest(rows, defaults=None, profiles=None, workers=None, base_dir='.',
+                 output_dir=None, name_template=DEFAULT_NAME_TEMPLATE, window=1000,
+                 group_size=16, progress=None, journal=None, stamp_cache=None, output_cache=None):
+    """
+    Esegue i lavori del manifest in parallelo.
+    
+    Le righe vengono lette a blocchi di ``window`` (il manifest non viene mai
+    caricato per intero); in ogni blocco quelle con gli stessi parametri del
+    marchio sono raggruppate e inviate allo stesso processo a gruppi di
+    ``group_size``, così il marchio viene compilato una volta per processo.
+    Con ``journal`` gli esiti vengono registrati e le righe già firmate
+    (vedi BatchJournal.load) saltate, come in sign_batch. ``stamp_cache`` e
+    ``output_cache`` attivano le cache su disco in ogni processo, come in
+    sign_batch.
+    
+    Returns:
+        lista di (numero di riga, BatchResult), nell'ordine di completamento
+    """
+    defaults = defaults or {}
+    profiles = profiles or {}
+    workers = max(1, workers or os.cpu_count() or 1)
+    results = []
+    params = {}  # numero di riga -> impronta dei parametri, per i lavori in corso
+    
+    def done(row, result):
+        results.append((row, result))
+        if row in params:
+            journal.record(result, params.pop(row))
+        if progress:
+            progress(row, result)
+    
+    def batches():
+        block = []
+        for index, (row_number, row) in enumerate(rows, 1):
+            try:
+                job = resolve_manifest_row(row, defaults, profiles, base_dir,
+                                           output_dir, name_template, index)._replace(row=row_number)
+            except ValueError as e:
+                source = row.get('input', '?') if isinstance(row, dict) else '?'
+                done(row_number, BatchResult(str(source), '', False, 0, 0.0, str(e)))
+            else:
+                if journal:
+                    job_hash = job_params_hash(job.watermark, job.scale, job.position, job.kwargs)
+                    if journal.is_completed(job.input_path, job.output_path, job_hash):
+                        results.append((row_number, BatchResult(job.input_path, job.output_path,
+                                                                True, 0, 0.0, skipped=True)))
+                        continue
+                    params[row_number] = job_hash
+                block.append(job)
+            if len(block) >= window:
+                yield from _group_jobs(block, group_size)
+                block = []
+        if block:
+            yield from _group_jobs(block, group_size)
+    
+    if workers == 1:
+        global OUTPUT_CACHE
+        previous = STAMP_CACHE.disk, OUTPUT_CACHE
+        _manifest_worker_init(stamp_cache, output_cache)
+        try:
+            for group in batches():
+                for row, result in _sign_manifest_group(group, journal is not None):
+                    done(row, result)
+        finally:
+            if stamp_cache:
+                STAMP_CACHE.disk = previous[0]
+            if output_cache:
+                OUTPUT_CACHE = previous[1]
+        return results
+    
+    with ProcessPoolExecutor(max_workers=workers, initializer=_manifest_worker_init,
+                             initargs=(stamp_cache, output_cache)) as pool:
+        pending = {}
+        for group in batches():
+            # Al più due gruppi in coda per processo: memoria limitata anche con manifest enormi
+            while len(pending) >= workers * 2:
+                finished, _ = wait(pending, return_when=FIRST_COMPLETED)
+                for future in finished:
+                    _collect_group(future, pending.pop(future), done)
+            pending[pool.submit(_sign_manifest_group, group, journal is not None)] = group
+        for future in as_completed(list(pending)):
+            _collect_group(future, pending.pop(future), done)
+    return results
+
+
+def _group_jobs(jobs, group_size):
+    groups = {}
+    for job in jobs:
+        groups.setdefault(job.stamp_key(), []).append(job)
+    for same_stamp in groups.values():
+        for start in range(0, len(same_stamp), group_size):
+            yield same_stamp[start:start + group_size]
+
+
+def _collect_group(future, group, done):
+    try:
+        for row, result in future.result():
+            done(row, result)
+    except Exception as e:
+        for job in group:
+            done(job.row, BatchResult(job.input_path, job.output_path, False, 0, 0.0,
+                                      f"{type(e).__name__}: {e}"))
+
+
+def _run_manifest(args, kwargs):
+    """Lavori da manifest da riga di comando; restituisce il codice di uscita."""
+    try:
+        profiles = load_profiles(args.profiles)
+    except (OSError, ValueError) as e:
+        print(f"❌ Profili non leggibili: {e}")
+        return 1
+    # I parametri della riga di comando valgono per tutte le righe che non li ridefiniscono
+    defaults = dict(kwargs, watermark=args.watermark, scale=args.scale, position=args.position)
+    stamp_cache = (args.stamp_cache, args.stamp_cache_size * 1024 * 1024) if args.stamp_cache else None
+    
+    workers = args.jobs or os.cpu_count() or 1
+    print(f"🔄 Manifest {args.manifest}: {workers} processi")
+    
+    def progress(row, result):
+        if result.ok:
+            print(f"✓ riga {row}: {result.input_path} → {result.output_path} "
+                  f"({result.pages} pagine, {result.seconds:.2f}s)")
+        else:
+            print(f"✗ riga {row}: {result.input_path}: {result.error}")
+    
+    base_dir = os.path.dirname(os.path.abspath(args.manifest))
+    journal = _open_journal(args, args.output_dir or base_dir)
+    start = time.perf_counter()
+    try:
+        results = run_manifest(
+            iter_manifest(args.manifest), defaults, profiles, workers, base_dir=base_dir,
+            output_dir=args.output_dir, name_template=args.name_template, progress=progress,
+            journal=journal, stamp_cache=stamp_cache, output_cache=_output_cache_option(args),
+        )
+    except OSError as e:
+        print(f"❌ Manifest non leggibile: {e}")
+        return 1
+    finally:
+        if journal:
+            journal.close()
+    summary = summarize_batch([result for _, result in results], time.perf_counter() - start)
+    
+    print(f"\n📊 Firmati {summary['signed']}/{summary['files']} file, {summary['pages']} pagine "
+          f"in {summary['elapsed_s']:.2f}s ({summary['files_per_s']} file/s, "
+          f"{summary['pages_per_s']} pagine/s)")
+    if summary['skipped']:
+        print(f"⏭️ {summary['skipped']} righe già firmate saltate")
+    if args.output_cache:
+        _print_cache_summary(summary)
+    if summary['failed']:
+        print(f"❌ {summary['failed']} righe non firmate:")
+        for row, result in sorted(results, key=lambda item: item[0]):
+            if not result.ok:
+                print(f"   - riga {row}: {result.input_path}: {result.error}")
+        return 1
+    return 0
+
+
+# --- Cartella sorvegliata ---------------------------------------------------
+
+# Maschere inotify (linux/inotify.h)
+_IN_MODIFY = 0x00000002
+_IN_CLOSE_WRITE = 0x00000008
+_IN_MOVED_TO = 0x00000080
+_IN_CREATE = 0x00000100
+_IN_Q_OVERFLOW = 0x00004000
+_INOTIFY_EVENT = struct.Struct('iIII')
+
+
+def _is_watch_candidate(name):
+    """PDF da firmare: esclude file nascosti, temporanei e parziali."""
+    return (name.lower().endswith('.pdf') and not name.startswith(('.', '~$'))
+            and not name.endswith(('.part', '.tmp')))
+
+
+def _list_pdf_files(directory):
+    try:
+        with os.scandir(directory) as entries:
+            return [entry.path for entry in entries
+                    if entry.is_file() and _is_watch_candidate(entry.name)]
+    except FileNotFoundError:
+        return []
+
+
+class _PollingWatcher:
+    """Sorveglianza per scansione periodica (qualsiasi piattaforma, share di rete)."""
+    
+    name = 'polling'
+    
+    def __init__(self, directories, interval=1.0):
+        self.directories = list(directories)
+        self.interval = interval
+        self._next_scan = 0.0
+    
+    def poll(self, timeout):
+        """Restituisce i PDF candidati, attendendo al più ``timeout`` secondi."""
+        delay = self._next_scan - time.monotonic()
+        if delay > 0:
+            time.sleep(min(delay, timeout))
+            if time.monotonic() < self._next_scan:
+                return []
+        self._next_scan = time.monotonic() + self.interval
+        return [path for directory in self.directories for path in _list_pdf_files(directory)]
+    
+    def close(self):
+        pass
+
+
+class _InotifyWatcher:
+    """
+    Sorveglianza con inotify (Linux) tramite ctypes, senza dipendenze esterne.
+    Alla creazione e in caso di eventi persi (IN_Q_OVERFLOW) le directory
+    vengono riscansionate per intero.
+    """
+    
+    name = 'inotify'
+    MASK = _IN_CLOSE_WRITE | _IN_MOVED_TO | _IN_CREATE | _IN_MODIFY
+    
+    def __init__(self, directories):
+        if not sys.platform.startswith('linux'):
+            raise OSError("inotify disponibile solo su Linux")
+        libc = ctypes.CDLL(ctypes.util.find_library('c') or 'libc.so.6', use_errno=True)
+        self._fd = libc.inotify_init1(os.O_NONBLOCK | os.O_CLOEXEC)
+        if self._fd < 0:
+            raise OSError(ctypes.get_errno(), "inotify_init1 non riuscita")
+        self._directories = {}
+        try:
+            for directory in directories:
+                wd = libc.inotify_add_watch(self._fd, os.fsencode(directory), self.MASK)
+                if wd < 0:
+                    errno = ctypes.get_errno()
+                    raise OSError(errno, f"inotify_add_watch non riuscita: {directory}")
+                self._directories[wd] = directory
+        except Exception:
+            os.close(self._fd)
+            raise
+        self._rescan = True
+    
+    def poll(self, timeout):
+        if self._rescan:
+            self._rescan = False
+            return [path for directory in self._directories.values()
+                    for path in _list_pdf_files(directory)]
+        readable, _, _ = select.select([self._fd], [], [], timeout)
+        if not readable:
+            return []
+        try:
+            data = os.read(self._fd, 64 * 1024)
+        except BlockingIOError:
+            return []
+        paths, offset = [], 0
+        while offset + _INOTIFY_EVENT.size <= len(data):
+            wd, mask, _, length = _INOTIFY_EVENT.unpack_from(data, offset)
+            offset += _INOTIFY_EVENT.size
+            name = data[offset:offset + length].rstrip(b'\0')
+            offset += length
+            if mask & _IN_Q_OVERFLOW:
+                self._rescan = True
+            elif wd in self._directories and name:
+                name = os.fsdecode(name)
+                if _is_watch_candidate(name):
+                    paths.append(os.path.join(self._directories[wd], name))
+        return paths
+    
+    def close(self):
+        if self._fd >= 0:
+            os.close(self._fd)
+            self._fd = -1
+
+
+def create_watcher(directories, backend='auto', poll_interval=1.0):
+    """
+    Crea il sorvegliante delle directory: ``'inotify'``, ``'polling'`` o
+    ``'auto'`` (inotify se disponibile, altrimenti scansione periodica).
+    """
+    if backend not in ('auto', 'inotify', 'polling'):
+        raise ValueError(f"Sorveglianza non valida: {backend}")
+    if backend != 'polling':
+        try:
+            return _InotifyWatcher(directories)
+        except (OSError, AttributeError) as e:
+            if backend == 'inotify':
+                raise
+            print(f"⚠️ inotify non disponibile ({e}): uso la scansione periodica")
+    return _PollingWatcher(directories, poll_interval)
+
+
+class _StabilityTracker:
+    """
+    Un file è completo quando dimensione e data di modifica restano invariate
+    per ``settle`` secondi (lo scanner ha finito di scriverlo).
+    """
+    
+    def __init__(self, settle=2.0):
+        self.settle = settle
+        self._files = {}   # percorso -> (dimensione, mtime_ns, stabile da)
+    
+    def __len__(self):
+        return len(self._files)
+    
+    def add(self, path):
+        self._files.setdefault(path, None)
+    
+    def discard(self, path):
+        self._files.pop(path, None)
+    
+    def ready(self, now=None):
+        """Percorsi stabili, nell'ordine in cui sono stati rilevati."""
+        now = time.monotonic() if now is None else now
+        ready = []
+        for path, state in list(self._files.items()):
+            try:
+                st = os.stat(path)
+            except FileNotFoundError:
+                del self._files[path]
+                continue
+            signature = (st.st_size, st.st_mtime_ns)
+            if state is None or state[:2] != signature:
+                self._files[path] = signature + (now,)
+            elif st.st_size > 0 and now - state[2] >= self.settle:
+                ready.append(path)
+        return ready
+
+
+def _unique_path(path):
+    """``path`` o, se esiste già, la variante con un suffisso numerico."""
+    stem, suffix = os.path.splitext(path)
+    candidate, counter = path, 1
+    while os.path.exists(candidate):
+        candidate = f"{stem}.{counter}{suffix}"
+        counter += 1
+    return candidate
+
+
+class WatchFolder:
+    """
+    Firma i PDF che arrivano in una o più directory (es. cartella di uno scanner).
+    
+    Per ogni directory sorvegliata:
+      - i file completi (vedi _StabilityTracker) vengono firmati dal pool di
+        processi della firma in blocco, con immagine e marchi già pronti;
+      - il PDF firmato compare in ``output_dir`` solo a scrittura terminata;
+      - l'originale viene spostato in ``processed_dir`` o, in caso di errore,
+        in ``failed_dir`` insieme a un file ``.error.txt`` con il motivo.
+    
+    Al più ``queue_size`` file sono in lavorazione contemporaneamente; gli
+    altri restano nella cartella finché non si libera un posto.
+    
+    Se un processo di lavoro termina in modo anomalo (memoria esaurita,
+    crash di una libreria PDF) il pool viene ricreato e i file che erano in
+    lavorazione tornano in coda come sospetti: ognuno viene poi firmato da
+    solo, e solo quello che fa terminare di nuovo il processo finisce in
+    ``failed_dir``.
+    """
+    
+    def __init__(self, directories, watermark_image_path, scale_factor=1.0,
+                 position="bottom-right", output_dir=None, failed_dir=None,
+                 processed_dir=None, name_template=DEFAULT_NAME_TEMPLATE, workers=None,
+                 queue_size=None, settle=2.0, backend='auto', poll_interval=1.0,
+                 stamp_cache=None, output_cache=None, **kwargs):
+        self.directories = [os.path.abspath(d) for d in directories]
+        for directory in self.directories:
+            if not os.path.isdir(directory):
+                raise FileNotFoundError(f"Directory non trovata: {directory}")
+        self.watermark_image_path = watermark_image_path
+        self.scale_factor = scale_factor
+        self.position = position
+        self.kwargs = kwargs
+        self.name_template = name_template
+        self.workers = max(1, workers or os.cpu_count() or 1)
+        self.queue_size = max(1, queue_size or self.workers * 2)
+        self.settle = settle
+        self.backend = backend
+        self.poll_interval = poll_interval
+        self.stamp_cache = stamp_cache
+        self.output_cache = output_cache
+        self._dirs = {
+            directory: tuple(os.path.abspath(d) if d else os.path.join(directory, default)
+                             for d, default in ((output_dir, 'signed'), (failed_dir, 'failed'),
+                                                (processed_dir, 'processed')))
+            for directory in self.directories
+        }
+        for targets in self._dirs.values():
+            if any(os.path.normcase(t) in map(os.path.normcase, self.directories) for t in targets):
+                raise ValueError("Le directory di output, failed e processed devono essere "
+                                 "diverse da quelle sorvegliate")
+        self.stats = {'signed': 0, 'failed': 0, 'pages': 0, 'pool_restarts': 0}
+        self._stop = threading.Event()
+        self._suspects = set()   # file in lavorazione durante un arresto anomalo del pool
+        self._pool = None
+    
+    def stop(self):
+        """Chiede l'arresto: i file in lavorazione vengono completati."""
+        self._stop.set()
+    
+    def _targets(self, path):
+        directory = os.path.dirname(path)
+        output_dir, failed_dir, processed_dir = self._dirs[directory]
+        output = batch_output_path(path, directory, output_dir, self.name_template)
+        return output, failed_dir, processed_dir
+    
+    def _finish(self, path, partial, result, started):
+        output, failed_dir, processed_dir = self._targets(path)
+        if result.ok:
+            os.makedirs(os.path.dirname(output), exist_ok=True)
+            os.replace(partial, output)
+            os.makedirs(processed_dir, exist_ok=True)
+            shutil.move(path, _unique_path(os.path.join(processed_dir, os.path.basename(path))))
+            self.stats['signed'] += 1
+            self.stats['pages'] += result.pages
+            latency = time.monotonic() - started
+            print(f"✓ {os.path.basename(path)} → {output} "
+                  f"({result.pages} pagine, {latency * 1000:.0f} ms)")
+        else:
+            with contextlib.suppress(FileNotFoundError):
+                os.unlink(partial)
+            os.makedirs(failed_dir, exist_ok=True)
+            target = _unique_path(os.path.join(failed_dir, os.path.basename(path)))
+            shutil.move(path, target)
+            with open(target + '.error.txt', 'w', encoding='utf-8') as f:
+                f.write(f"{result.error}\n")
+            self.stats['failed'] += 1
+            print(f"✗ {os.path.basename(path)} → {failed_dir}: {result.error}")
+    
+    def _new_pool(self):
+        self._pool = ProcessPoolExecutor(
+            max_workers=self.workers, initializer=_batch_worker_init,
+            initargs=(self.watermark_image_path, self.scale_factor, self.position,
+                      self.kwargs, self.stamp_cache, self.output_cache),
+        )
+        return self._pool
+    
+    def _collect(self, future, path, partial, started, tracker=None):
+        """
+        Completa un file; True se il pool si è rotto. Un file coinvolto in un
+        arresto anomalo torna in ``tracker`` come sospetto (durante l'arresto
+        resta nella cartella); un sospetto, firmato da solo, è la causa.
+        """
+        broken = False
+        try:
+            result = future.result()
+        except BrokenProcessPool as e:
+            with contextlib.suppress(FileNotFoundError):
+                os.unlink(partial)
+            if path not in self._suspects:
+                print(f"⚠️ {os.path.basename(path)}: processo di firma terminato, nuovo tentativo")
+                self._suspects.add(path)
+                if tracker is not None:
+                    tracker.add(path)
+                return True
+            result = BatchResult(path, partial, False, 0, 0.0, f"processo di firma terminato: {e}")
+            broken = True
+        except Exception as e:
+            result = BatchResult(path, partial, False, 0, 0.0, f"{type(e).__name__}: {e}")
+        self._suspects.discard(path)
+        try:
+            self._finish(path, partial, result, started)
+        except OSError as e:
+            print(f"⚠️ {path}: {e}")
+        return broken
+    
+    def _restart_pool(self, pool, in_flight, tracker):
+        """
+        Sostituisce un pool con un processo terminato: i file che erano in
+        lavorazione (anche quelli nei processi sopravvissuti, le cui future
+        falliscono insieme al pool) vengono completati o rimessi in coda.
+        """
+        pool.shutdown(wait=False)
+        for future, job in list(in_flight.items()):
+            del in_flight[future]
+            self._collect(future, *job, tracker)
+        self.stats['pool_restarts'] += 1
+        return self._new_pool()
+    
+    def run(self):
+        """Sorveglia le directory fino a stop() (o SIGINT/SIGTERM da riga di comando)."""
+        watcher = create_watcher(self.directories, self.backend, self.poll_interval)
+        tracker = _StabilityTracker(self.settle)
+        in_flight = {}   # future -> (percorso, output parziale, istante di avvio)
+        tick = min(0.5, max(self.settle / 4, 0.05))
+        print(f"👀 Sorveglio {', '.join(self.directories)} ({watcher.name}, "
+              f"{self.workers} processi, coda {self.queue_size})")
+        pool = self._new_pool()
+        try:
+            while not self._stop.is_set():
+                for path in watcher.poll(tick):
+                    if path not in (job[0] for job in in_flight.values()):
+                        tracker.add(path)
+                
+                broken = False
+                ready = tracker.ready()
+                suspects = [path for path in ready if path in self._suspects]
+                for path in suspects[:1] or ready:
+                    if len(in_flight) >= self.queue_size:
+                        break   # coda piena: il file resta in attesa nella cartella
+                    if path in self._suspects and in_flight:
+                        break   # il sospetto attende di essere firmato da solo
+                    tracker.discard(path)
+                    output = self._targets(path)[0]
+                    partial = os.path.join(os.path.dirname(output),
+                                           f".{os.path.basename(output)}.part")
+                    os.makedirs(os.path.dirname(partial), exist_ok=True)
+                    try:
+                        future = pool.submit(_batch_sign_one, path, partial)
+                    except BrokenProcessPool:
+                        # Processo terminato mentre il pool era inattivo: il file riprova dopo
+                        tracker.add(path)
+                        broken = True
+                        break
+                    in_flight[future] = (path, partial, time.monotonic())
+                    if path in self._suspects:
+                        break
+                
+                for future in [f for f in in_flight if f.done()]:
+                    broken |= self._collect(future, *in_flight.pop(future), tracker)
+                if broken:
+                    print("⚠️ Processo di firma terminato in modo anomalo: riavvio il pool")
+                    pool = self._restart_pool(pool, in_flight, tracker)
+            
+            # Arresto ordinato: completa i file già in lavorazione (quelli coinvolti
+            # in un arresto anomalo restano nella cartella per il prossimo avvio)
+            for future, job in in_flight.items():
+                self._collect(future, *job)
+        finally:
+            self._pool.shutdown(wait=True)
+            watcher.close()
+        print(f"📊 Firmati {self.stats['signed']} file ({self.stats['pages']} pagine), "
+              f"{self.stats['failed']} non firmati")
+        return self.stats
+
+
+def _run_watch(args, kwargs):
+    """Cartella sorvegliata da riga di comando; restituisce il codice di uscita."""
+    stamp_cache = (args.stamp_cache, args.stamp_cache_size * 1024 * 1024) if args.stamp_cache else None
+    try:
+        watch = WatchFolder(
+            args.input_pdf, args.watermark, args.scale, args.position,
+            output_dir=args.output_dir, failed_dir=args.failed_dir,
+            processed_dir=args.processed_dir, name_template=args.name_template,
+            workers=args.jobs, queue_size=args.queue_size, settle=args.settle,
+            backend=args.watch_backend, poll_interval=args.poll_interval,
+            stamp_cache=stamp_cache, output_cache=_output_cache_option(args), **kwargs
+        )
+    except (FileNotFoundError, ValueError) as e:
+        print(f"❌ {e}")
+        return 1
+    
+    def shutdown(signum, frame):
+        print("\n⏹️ Arresto: completo i file in lavorazione...")
+        watch.stop()
+    
+    signal.signal(signal.SIGINT, shutdown)
+    signal.signal(signal.SIGTERM, shutdown)
+    watch.run()
+    return 0
+
+
+# --- Servizio di firma locale ------------------------------------------------
+
+DEFAULT_SERVICE_PORT = 8765
+
+# Campi che il client non può indicare: percorsi sul server (la firma arriva
+# dalla configurazione del servizio o da un profilo) e invio email, che
+# userebbe l'account SMTP del servizio (destinatari e testo solo dai profili)
+SERVICE_FORBIDDEN_FIELDS = ('input', 'output', 'watermark', 'email_config', 'email_template',
+                            'email_outbox', 'email_recipients', 'email_subject', 'email_body')
+
+
+def _service_worker_init(watermark_image_path, kwargs, stamp_cache=None, output_cache=None):
+    """
+    Prepara un processo del servizio: moduli già importati (fork), firma
+    predefinita decodificata ed elaborata, cache su disco attive.
+    """
+    if stamp_cache:
+        enable_disk_stamp_cache(*stamp_cache)
+    if output_cache:
+        enable_output_cache(*output_cache)
+    try:
+        cached_signature_image(
+            watermark_image_path,
+            kwargs.get('border_width', 0),
+            kwargs.get('border_color', (0, 0, 0)),
+            kwargs.get('shadow_enabled', False),
+            kwargs.get('shadow_offset', (5, 5)),
+        )
+        if kwargs.get('engine') == 'pymupdf':
+            _import_fitz()
+    except Exception:
+        pass  # L'errore verrà riportato richiesta per richiesta
+
+
+def _service_ping():
+    return os.getpid()
+
+
+def _service_sign(pdf_bytes, watermark_image_path, scale_factor, position, kwargs):
+    """
+    Firma un PDF ricevuto in memoria (processo di lavoro) con sign_pdf_bytes(),
+    senza file temporanei; restituisce (BatchResult, byte).
+    """
+    start = time.perf_counter()
+    data, pages, error = None, 0, None
+    hits = OUTPUT_CACHE.hits if OUTPUT_CACHE else 0
+    try:
+        with contextlib.redirect_stdout(io.StringIO()):
+            data = sign_pdf_bytes(pdf_bytes, watermark_image_path, scale_factor, position,
+                                  filename='upload.pdf', **kwargs)
+        pages = _output_page_count(data, kwargs.get('engine', 'pypdf2'))
+    except Exception as e:
+        data, error = None, f"{type(e).__name__}: {e}"
+    cached_bytes = len(data) if data and OUTPUT_CACHE and OUTPUT_CACHE.hits > hits else 0
+    result = BatchResult('upload.pdf', None, data is not None, pages, time.perf_counter() - start,
+                         error, cached_bytes=cached_bytes)
+    return result, data
+
+
+class ServiceResponse(NamedTuple):
+    """Risposta del servizio di firma, indipendente dal trasporto HTTP."""
+    status: int
+    body: bytes
+    content_type: str = 'application/json'
+    headers: Optional[dict] = None
+
+
+def _json_response(status, payload, headers=None):
+    body = json.dumps(payload, ensure_ascii=False).encode('utf-8')
+    return ServiceResponse(status, body, 'application/json', headers)
+
+
+class SigningService:
+    """
+    Servizio di firma con un pool di processi già pronti.
+    
+    I processi vengono avviati da start() (prima di aprire il socket) con la
+    firma predefinita già elaborata; le cache dei marchi restano calde tra una
+    richiesta e l'altra. Al più ``workers + max_queue`` richieste sono in
+    lavorazione o in coda: le altre vengono respinte subito con 503 e
+    Retry-After, così il client può riprovare invece di accumularsi.
+    
+    I parametri di una richiesta sono quelli del manifest (vedi
+    MANIFEST_FIELDS) più ``profile``; valgono sopra i valori predefiniti
+    del servizio, come le colonne di una riga del manifest.
+    """
+    
+    LATENCY_WINDOW = 2048
+    
+    def __init__(self, watermark_image_path='sign.png', scale_factor=0.2, position='bottom-right',
+                 workers=None, max_queue=None, max_upload=64 * 1024 * 1024, profiles=None,
+                 stamp_cache=None, output_cache=None, **kwargs):
+        self.defaults = dict(kwargs, watermark=watermark_image_path, scale=scale_factor,
+                             position=position)
+        self.workers = max(1, workers or os.cpu_count() or 1)
+        self.max_queue = self.workers * 4 if max_queue is None else max(0, max_queue)
+        self.max_upload = max_upload
+        self.profiles = profiles or {}
+        self._initargs = (watermark_image_path, kwargs, stamp_cache, output_cache)
+        self._slots = threading.BoundedSemaphore(self.workers + self.max_queue)
+        self._lock = threading.Lock()
+        self._pool = None
+        self._started = time.monotonic()
+        self._in_flight = 0
+        self._latencies = deque(maxlen=self.LATENCY_WINDOW)
+        self.counters = {'requests': {}, 'pages': 0, 'bytes_in': 0, 'bytes_out': 0,
+                         'sign_seconds': 0.0, 'pool_restarts': 0}
+    
+    def start(self):
+        """Avvia i processi e attende che siano tutti pronti."""
+        self._ensure_pool()
+        return self
+    
+    def _ensure_pool(self):
+        with self._lock:
+            if self._pool is None:
+                self._pool = self._new_pool()
+            return self._pool
+    
+    def _discard_pool(self, pool):
+        """Scarta un pool con un processo terminato; il successivo viene creato alla richiesta dopo."""
+        with self._lock:
+            if self._pool is not pool:
+                return  # Già sostituito da un'altra richiesta
+            self._pool = None
+            self.counters['pool_restarts'] += 1
+        pool.shutdown(wait=False)
+    
+    def _new_pool(self):
+        pool = ProcessPoolExecutor(max_workers=self.workers, initializer=_service_worker_init,
+                                   initargs=self._initargs)
+        for future in [pool.submit(_service_ping) for _ in range(self.workers)]:
+            future.result()
+        return pool
+    
+    def close(self):
+        with self._lock:
+            if self._pool is not None:
+                self._pool.shutdown(wait=True)
+                self._pool = None
+    
+    def __enter__(self):
+        return self.start()
+    
+    def __exit__(self, *exc_info):
+        self.close()
+    
+    @contextlib.contextmanager
+    def admission(self):
+        """
+        Posto per una richiesta: True se ottenuto, False se il servizio è
+        pieno. Il trasporto lo prende prima di leggere il corpo, così la
+        memoria occupata dagli upload resta limitata al numero di posti.
+        """
+        if not self._slots.acquire(blocking=False):
+            yield False
+            return
+        with self._lock:
+            self._in_flight += 1
+        try:
+            yield True
+        finally:
+            with self._lock:
+                self._in_flight -= 1
+            self._slots.release()
+    
+    def busy(self) -> ServiceResponse:
+        """Risposta 503 per una richiesta senza posto (vedi admission)."""
+        response = _json_response(503, {'error': "servizio occupato, riprovare"},
+                                  {'Retry-After': '1'})
+        self._account(response, time.perf_counter())
+        return response
+    
+    def sign(self, pdf_bytes, params=None, admitted=False) -> ServiceResponse:
+        """
+        Firma ``pdf_bytes`` con i parametri della richiesta (stringhe o
+        valori); ``admitted`` indica che il chiamante ha già un posto.
+        """
+        start = time.perf_counter()
+        if admitted:
+            response = self._sign(pdf_bytes, params or {})
+        else:
+            with self.admission() as admitted:
+                if not admitted:
+                    return self.busy()
+                response = self._sign(pdf_bytes, params or {})
+        self._account(response, start)
+        return response
+    
+    def _sign(self, pdf_bytes, params):
+        if not pdf_bytes:
+            return _json_response(400, {'error': "nessun PDF ricevuto"})
+        forbidden = sorted(set(params) & set(SERVICE_FORBIDDEN_FIELDS))
+        if forbidden:
+            return _json_response(400, {'error': f"parametri non ammessi: {', '.join(forbidden)}"})
+        try:
+            job = resolve_manifest_row(dict(params, input='upload.pdf'), self.defaults, self.profiles)
+        except ValueError as e:
+            return _json_response(400, {'error': str(e)})
+        
+        pool = self._ensure_pool()
+        try:
+            result, data = pool.submit(_service_sign, pdf_bytes, job.watermark, job.scale,
+                                       job.position, job.kwargs).result()
+        except BrokenProcessPool as e:
+            # Un processo è terminato in modo anomalo (es. memoria esaurita)
+            self._discard_pool(pool)
+            return _json_response(500, {'error': f"processo di firma terminato: {e}"})
+        if not result.ok:
+            return _json_response(422, {'error': result.error})
+        with self._lock:
+            self.counters['pages'] += result.pages
+            self.counters['sign_seconds'] += result.seconds
+        return ServiceResponse(200, data, 'application/pdf', {
+            'X-Pdf-Pages': str(result.pages),
+            'X-Sign-Seconds': f"{result.seconds:.4f}",
+        })
+    
+    def _account(self, response, start):
+        with self._lock:
+            requests = self.counters['requests']
+            requests[response.status] = requests.get(response.status, 0) + 1
+            self.counters['bytes_out'] += len(response.body)
+            self._latencies.append(time.perf_counter() - start)
+    
+    def health(self) -> dict:
+        with self._lock:
+            return {
+                'status': 'ok' if self._pool is not None else 'starting',
+                'pid': os.getpid(),
+                'workers': self.workers,
+                'in_flight': self._in_flight,
+                'capacity': self.workers + self.max_queue,
+                'uptime_s': round(time.monotonic() - self._started, 1),
+            }
+    
+    def metrics(self) -> dict:
+        """Contatori e latenze (p50/p90/p99 sulle ultime richieste)."""
+        with self._lock:
+            latencies = sorted(self._latencies)
+            metrics = {
+                'requests': {str(code): count for code, count in sorted(self.counters['requests'].items())},
+                'pages': self.counters['pages'],
+                'bytes_in': self.counters['bytes_in'],
+                'bytes_out': self.counters['bytes_out'],
+                'sign_seconds': round(self.counters['sign_seconds'], 4),
+                'pool_restarts': self.counters['pool_restarts'],
+                'in_flight': self._in_flight,
+            }
+        metrics['latency_s'] = {
+            name: round(latencies[min(len(latencies) - 1, int(q * len(latencies)))], 4) if latencies else 0.0
+            for name, q in (('p50', 0.50), ('p90', 0.90), ('p99', 0.99))
+        }
+        return metrics
+    
+    def metrics_text(self) -> str:
+        """Metriche nel formato di esposizione testuale di Prometheus."""
+        metrics = self.metrics()
+        lines = ['# TYPE pdf_signer_requests_total counter']
+        lines += [f'pdf_signer_requests_total{{code="{code}"}} {count}'
+                  for code, count in metrics['requests'].items()]
+        lines.append('# TYPE pdf_signer_request_seconds summary')
+        lines += [f'pdf_signer_request_seconds{{quantile="{q}"}} {metrics["latency_s"][name]}'
+                  for name, q in (('p50', '0.5'), ('p90', '0.9'), ('p99', '0.99'))]
+        for name, kind in (('pages', 'counter'), ('bytes_in', 'counter'), ('bytes_out', 'counter'),
+                           ('sign_seconds', 'counter'), ('pool_restarts', 'counter'),
+                           ('in_flight', 'gauge')):
+            suffix = '_total' if kind == 'counter' else ''
+            lines.append(f'# TYPE pdf_signer_{name}{suffix} {kind}')
+            lines.append(f'pdf_signer_{name}{suffix} {metrics[name]}')
+        return '\n'.join(lines) + '\n'
+    
+    def make_server(self, host='127.0.0.1', port=DEFAULT_SERVICE_PORT, socket_path=None):
+        """Server HTTP (TCP o socket Unix) che inoltra le richieste al servizio."""
+        if socket_path:
+            with contextlib.suppress(FileNotFoundError):
+                os.unlink(socket_path)   # socket rimasto da un'esecuzione precedente
+            server = _UnixHTTPServer(socket_path, _ServiceRequestHandler)
+        else:
+            server = _TCPHTTPServer((host, port), _ServiceRequestHandler)
+        server.service = self
+        return server
+
+
+class _TCPHTTPServer(ThreadingHTTPServer):
+    daemon_threads = True
+
+
+class _UnixHTTPServer(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+    daemon_threads = True
+
+
+def _parse_upload(content_type, body):
+    """PDF e parametri di un corpo multipart/form-data (campo file 'file' o 'pdf')."""
+    message = BytesParser(policy=email.policy.HTTP).parsebytes(
+        f"Content-Type: {content_type}\r\n\r\n".encode('latin-1') + body
+    )
+    if not message.is_multipart():
+        raise ValueError("corpo multipart non valido")
+    pdf_bytes, params = b'', {}
+    for part in message.iter_parts():
+        name = part.get_param('name', header='content-disposition')
+        if part.get_filename() is not None or name in ('file', 'pdf'):
+            pdf_bytes = part.get_payload(decode=True) or b''
+        elif name:
+            value = part.get_payload(decode=True)
+            if value is None:
+                # Campo a sua volta multipart
+                raise ValueError(f"campo non valido: {name}")
+            try:
+                params[name] = value.decode('utf-8')
+            except UnicodeDecodeError:
+                raise ValueError(f"campo non valido: {name}") from None
+    return pdf_bytes, params
+
+
+class _ServiceRequestHandler(BaseHTTPRequestHandler):
+    """
+    POST /sign   corpo application/pdf con parametri nella query string,
+                 oppure multipart/form-data (file + campi); risponde con il PDF
+    GET  /health stato del servizio (JSON)
+    GET  /metrics metriche Prometheus (?format=json per JSON)
+    """
+    
+    protocol_version = 'HTTP/1.1'
+    server_version = 'PDFSigner'
+    
+    def do_GET(self):
+        url = urllib.parse.urlsplit(self.path)
+        service = self.server.service
+        if url.path == '/health':
+            self._send(_json_response(200, service.health()))
+        elif url.path == '/metrics':
+            if urllib.parse.parse_qs(url.query).get('format') == ['json']:
+                self._send(_json_response(200, service.metrics()))
+            else:
+                self._send(ServiceResponse(200, service.metrics_text().encode('utf-8'),
+                                           'text/plain; version=0.0.4'))
+        else:
+            self._send(_json_response(404, {'error': "percorso sconosciuto"}))
+    
+    def do_POST(self):
+        url = urllib.parse.urlsplit(self.path)
+        service = self.server.service
+        if url.path != '/sign':
+            self._send(_json_response(404, {'error': "percorso sconosciuto"}))
+            return
+        try:
+            length = int(self.headers.get('Content-Length', ''))
+        except ValueError:
+            self.close_connection = True
+            self._send(_json_response(411, {'error': "Content-Length obbligatorio"}))
+            return
+        if length < 0:
+            self.close_connection = True
+            self._send(_json_response(400, {'error': "Content-Length non valido"}))
+            return
+        if length > service.max_upload:
+            # Il corpo non viene letto: la connessione va chiusa
+            self.close_connection = True
+            self._send(_json_response(413, {'error': f"PDF oltre {service.max_upload} byte"}))
+            return
+        with service.admission() as admitted:
+            if not admitted:
+                # Respinta prima di leggere il corpo: la connessione va chiusa
+                self.close_connection = True
+                self._send(service.busy())
+                return
+            body = self.rfile.read(length)
+            with service._lock:
+                service.counters['bytes_in'] += len(body)
+            params = {key: values[-1] for key, values in urllib.parse.parse_qs(url.query).items()}
+            content_type = self.headers.get('Content-Type', 'application/pdf')
+            if content_type.startswith('multipart/form-data'):
+                try:
+                    body, fields = _parse_upload(content_type, body)
+                except ValueError as e:
+                    self._send(_json_response(400, {'error': str(e)}))
+                    return
+                params.update(fields)
+            response = service.sign(body, params, admitted=True)
+        self._send(response)
+    
+    def _send(self, response):
+        self.send_response(response.status)
+        self.send_header('Content-Type', response.content_type)
+        self.send_header('Content-Length', str(len(response.body)))
+        for name, value in (response.headers or {}).items():
+            self.send_header(name, value)
+        if self.close_connection:
+            self.send_header('Connection', 'close')
+        self.end_headers()
+        self.wfile.write(response.body)
+    
+    def address_string(self):
+        # Con i socket Unix il client non ha indirizzo
+        return self.client_address[0] if self.client_address else 'unix'
+    
+    def log_message(self, format, *args):
+        pass  # Le metriche sostituiscono il log per richiesta
+
+
+def _run_serve(args, kwargs):
+    """Servizio di firma da riga di comando; restituisce il codice di uscita."""
+    try:
+        profiles = load_profiles(args.profiles)
+    except (OSError, ValueError) as e:
+        print(f"❌ Profili non leggibili: {e}")
+        return 1
+    stamp_cache = (args.stamp_cache, args.stamp_cache_size * 1024 * 1024) if args.stamp_cache else None
+    service = SigningService(
+        args.watermark, args.scale, args.position, workers=args.jobs,
+        max_queue=args.max_queue, max_upload=args.max_upload * 1024 * 1024, profiles=profiles,
+        stamp_cache=stamp_cache, output_cache=_output_cache_option(args), **kwargs
+    )
+    # I processi partono prima del socket: la prima richiesta li trova già pronti
+    with service:
+        try:
+            server = service.make_server(args.host, args.port, args.socket)
+        except OSError as e:
+            print(f"❌ Impossibile aprire il servizio: {e}")
+            return 1
+        where = f"unix:{args.socket}" if args.socket else f"http://{args.host}:{server.server_address[1]}"
+        print(f"🛰️ Servizio di firma su {where} ({service.workers} processi, "
+              f"coda {service.max_queue})")
+        
+        def shutdown(signum, frame):
+            print("\n⏹️ Arresto del servizio...")
+            threading.Thread(target=server.shutdown, daemon=True).start()
+        
+        signal.signal(signal.SIGINT, shutdown)
+        signal.signal(signal.SIGTERM, shutdown)
+        try:
+            server.serve_forever()
+        finally:
+            server.server_close()
+            if args.socket:
+                with contextlib.suppress(OSError):
+                    os.unlink(args.socket)
+    return 0
+
+
+# --- Flussi standard (stdin/stdout) -------------------------------------------
+
+# Oltre questa dimensione il PDF letto da stdin passa dalla memoria a un file
+# temporaneo anonimo (eliminato alla chiusura, mai visibile nel filesystem)
+STDIN_SPOOL_THRESHOLD = 32 * 1024 * 1024
+
+
+def _spool_stream(stream, max_size=STDIN_SPOOL_THRESHOLD):
+    """
+    Copia uno stream non posizionabile (stdin, pipe) in un
+    SpooledTemporaryFile: in memoria fino a max_size byte, poi su un file
+    temporaneo anonimo. Restituisce lo spool riavvolto all'inizio.
+    """
+    spool = tempfile.SpooledTemporaryFile(max_size=max_size, mode='w+b')
+    try:
+        shutil.copyfileobj(stream, spool, 1024 * 1024)
+        spool.seek(0)
+    except BaseException:
+        spool.close()
+        raise
+    return spool
+
+
+def _run_stream(args, kwargs, pdf_stdout=None):
+    """
+    Firma un PDF letto da stdin e/o scritto su stdout ("-"), per l'uso in
+    pipeline: cat in.pdf | pdf_signer.py - -o - | upload. Il PDF firmato
+    viene scritto solo a firma riuscita, così in caso di errore stdout resta
+    vuoto.
+    """
+    if args.input_pdf != '-' and not os.path.exists(args.input_pdf):
+        print(f"❌ Errore: File PDF non trovato: {args.input_pdf}")
+        return 1
+    with contextlib.ExitStack() as stack:
+        if args.input_pdf == '-':
+            source, name = stack.enter_context(_spool_stream(sys.stdin.buffer)), 'stdin.pdf'
+        else:
+            source, name = args.input_pdf, Path(args.input_pdf).name
+        data = sign_pdf_bytes(source, args.watermark, args.scale, args.position,
+                              filename=name, **kwargs)
+    
+    if args.output != '-':
+        with open(args.output, 'wb') as f:
+            f.write(data)
+        print(f"✅ Completato! File salvato: {args.output}")
+        return 0
+    try:
+        pdf_stdout.write(data)
+        pdf_stdout.flush()
+    except BrokenPipeError:
+        # Il lettore ha chiuso la pipe: niente traceback alla chiusura dell'interprete
+        os.dup2(os.open(os.devnull, os.O_WRONLY), pdf_stdout.fileno())
+        print("⚠️ Output interrotto: pipe chiusa dal lettore")
+        return 1
+    print(f"✅ Completato! {len(data)} byte scritti su stdout")
+    return 0
+
+
+def _page_spec_argument(value):
+    """Valida una specifica di pagine passata da riga di comando."""
+    try:
+        return PageSelection.validate(value)
+    except ValueError as e:
+        raise argparse.ArgumentTypeError(str(e))
+
+
+def command_line_mode():
+    """Modalità da riga di comando del programma con supporto opzioni avanzate."""
+    parser = argparse.ArgumentParser(
+        description="Aggiunge un marchio a tutte le pagine di un file PDF",
+        formatter_class=argparse.RawDescriptionHelpFormatter,
+        epilog="""
+Esempi d'uso:
+
+  # Firma base
+  %(prog)s documento.pdf -w sign.png -o documento_firmato.pdf
+
+  # Firma solo prima pagina con scala personalizzata
+  %(prog)s documento.pdf -w sign.png -s 0.3 --pages first
+
+  # Firma con opzioni avanzate (richiede pdf_signer_advanced.py)
+  %(prog)s documento.pdf -w sign.png --opacity 0.6 --border --timestamp
+
+  # Firma in blocco di una cartella (ricorsiva) con 8 processi
+  %(prog)s archivio/ 'scansioni/**/*.pdf' -w sign.png -j 8 --output-dir firmati/
+
+  # Ripresa di un lotto interrotto: salta i file già firmati
+  %(prog)s archivio/ -w sign.png -j 8 --output-dir firmati/ --resume
+
+  # In una pipeline: PDF da stdin, PDF firmato su stdout (messaggi su stderr)
+  cat documento.pdf | %(prog)s - -w sign.png -o - | upload
+
+  # Email accodate e spedite in sottofondo; ritenta quelle rimaste in coda
+  %(prog)s archivio/ -w sign.png --email-config email.yaml --email-recipients a@b.it --outbox
+  %(prog)s --outbox-send
+
+Formati immagine supportati: PNG, JPG, JPEG, GIF (SVG con modulo avanzato)
+        """
+    )
+    
+    # Argomenti base
+    parser.add_argument(
+        "input_pdf",
+        nargs='*',
+        help=(
+            "File PDF di input ('-' per stdin). Più file, glob (es. 'archivio/**/*.pdf') "
+            "o directory (scansionate ricorsivamente) attivano la firma in blocco"
+        )
+    )
+    parser.add_argument(
+        "-o", "--output",
+        help=(
+            "Percorso del file PDF di output, '-' per stdout (default: aggiunge '_signed' "
+            "al nome originale; con input da stdin: stdout)"
+        )
+    )
+    
+    # Firma in blocco
+    parser.add_argument(
+        "-j", "--jobs",
+        type=int,
+        metavar="N",
+        help="Processi paralleli per la firma in blocco (default: numero di core)"
+    )
+    parser.add_argument(
+        "--output-dir",
+        metavar="DIR",
+        help=(
+            "Directory dei file firmati in blocco, con la stessa struttura di "
+            "sottocartelle dell'input (default: accanto agli originali)"
+        )
+    )
+    
+    # Manifest di lavori
+    parser.add_argument(
+        "--manifest",
+        metavar="FILE",
+        help=(
+            "File .jsonl o .csv con un lavoro per riga: colonna 'input' più, "
+            "facoltativi, 'output', 'profile' e qualsiasi parametro di firma"
+        )
+    )
+    parser.add_argument(
+        "--profiles",
+        metavar="FILE",
+        help=f"Profili richiamabili dal manifest (default: {DEFAULT_PROFILES_PATH})"
+    )
+    
+    # Cartella sorvegliata
+    parser.add_argument(
+        "--watch",
+        action='store_true',
+        help=(
+            "Sorveglia le directory indicate e firma i PDF man mano che arrivano "
+            "(originali spostati in processed/ o failed/)"
+        )
+    )
+    parser.add_argument(
+        "--watch-backend",
+        choices=['auto', 'inotify', 'polling'],
+        default='auto',
+        help="Rilevamento dei nuovi file: inotify (Linux) o scansione periodica (default: auto)"
+    )
+    parser.add_argument(
+        "--poll-interval",
+        type=float,
+        default=1.0,
+        metavar="SEC",
+        help="Intervallo della scansione periodica in secondi (default: 1)"
+    )
+    parser.add_argument(
+        "--settle",
+        type=float,
+        default=2.0,
+        metavar="SEC",
+        help="Secondi senza modifiche dopo cui un file è considerato completo (default: 2)"
+    )
+    parser.add_argument(
+        "--queue-size",
+        type=int,
+        metavar="N",
+        help="File in lavorazione contemporaneamente (default: 2 × processi)"
+    )
+    parser.add_argument(
+        "--failed-dir",
+        metavar="DIR",
+        help="Directory degli originali non firmati (default: <cartella>/failed)"
+    )
+    parser.add_argument(
+        "--processed-dir",
+        metavar="DIR",
+        help="Directory degli originali firmati (default: <cartella>/processed)"
+    )
+    parser.add_argument(
+        "--name-template",
+        default=DEFAULT_NAME_TEMPLATE,
+        metavar="TEMPLATE",
+        help=(
+            "Nome dei file firmati in blocco; segnaposto {stem}, {suffix}, {name}, "
+            f"{{index}} (default: {DEFAULT_NAME_TEMPLATE})"
+        )
+    )
+    parser.add_argument(
+        "--journal",
+        metavar="FILE",
+        help=(
+            "Registro degli esiti della firma in blocco e da manifest "
+            f"(default: {JOURNAL_NAME} nella directory di output)"
+        )
+    )
+    parser.add_argument(
+        "--resume",
+        action='store_true',
+        help="Riprende un lotto interrotto saltando i file già firmati secondo il registro"
+    )
+    parser.add_argument(
+        "--no-journal",
+        action='store_true',
+        help="Non scrive il registro degli esiti"
+    )
+    
+    # Servizio di firma locale
+    parser.add_argument(
+        "--serve",
+        action='store_true',
+        help=(
+            "Avvia il servizio HTTP di firma (POST /sign con il PDF, risposta con il PDF "
+            "firmato; GET /health e /metrics)"
+        )
+    )
+    parser.add_argument(
+        "--host",
+        default="127.0.0.1",
+        help="Indirizzo del servizio (default: 127.0.0.1, solo questa macchina)"
+    )
+    parser.add_argument(
+        "--port",
+        type=int,
+        default=DEFAULT_SERVICE_PORT,
+        help=f"Porta del servizio (default: {DEFAULT_SERVICE_PORT}; 0 = porta libera)"
+    )
+    parser.add_argument(
+        "--socket",
+        metavar="PATH",
+        help="Socket Unix del servizio, al posto di host e porta"
+    )
+    parser.add_argument(
+        "--max-queue",
+        type=int,
+        metavar="N",
+        help="Richieste in coda oltre quelle in lavorazione prima di rispondere 503 (default: 4 × processi)"
+    )
+    parser.add_argument(
+        "--max-upload",
+        type=int,
+        default=64,
+        metavar="MB",
+        help="Dimensione massima di un PDF inviato al servizio in MB (default: 64)"
+    )
+    parser.add_argument(
+        "-s", "--scale",
+        type=float,
+        default=0.2,
+        help="Fattore di scala per il marchio (default: 0.2)"
+    )
+    parser.add_argument(
+        "-w", "--watermark",
+        default="sign.png",
+        help="Percorso dell'immagine del marchio (default: sign.png)"
+    )
+    parser.add_argument(
+        "-p", "--position",
+        choices=["bottom-right", "bottom-left", "top-right", "top-left", "center"],
+        default="bottom-right",
+        help=(
+            "Posizione del marchio (default: bottom-right). "
+            "Opzioni: bottom-right, bottom-left, top-right, top-left, center"
+        )
+    )
+    
+    # Opzioni per selezione pagine
+    parser.add_argument(
+        "--pages",
+        default="all",
+        type=_page_spec_argument,
+        help=(
+            "Pagine da firmare: 'all', 'first', 'last', 'odd', 'even', '1,3,5-10', "
+            "'-1' (ultima), 'last-5', '10-' (fino alla fine), '1-100:2' (con passo) "
+            "(default: all)"
+        )
+    )
+    parser.add_argument(
+        "--exclude",
+        type=_page_spec_argument,
+        help="Pagine da escludere (stesso formato di --pages)"
+    )
+      # Opzioni per effetti
+    parser.add_argument(
+        "--border-width",
+        type=int,
+        default=0,
+        help="Spessore bordo in pixel (0=disabilitato, default: 0)"
+    )
+    parser.add_argument(
+        "--border-color",
+        default="0,0,0",
+        help="Colore bordo formato 'R,G,B' (default: 0,0,0)"
+    )
+    parser.add_argument(
+        "--shadow",
+        action='store_true',
+        help="Abilita ombra sulla firma"
+    )
+    parser.add_argument(
+        "--shadow-offset",
+        default="5,5",
+        help="Offset ombra formato 'x,y' (default: 5,5)"
+    )
+    
+    # Motore di applicazione del marchio
+    parser.add_argument(
+        "--stamp-mode",
+        choices=list(STAMP_MODES),
+        default="merge",
+        help=(
+            "Applicazione del marchio: 'merge' copia il marchio in ogni pagina, "
+            "'xobject' lo registra una sola volta e lo richiama da ogni pagina "
+            "(più veloce e file più piccoli su documenti lunghi; default: merge)"
+        )
+    )
+    
+    parser.add_argument(
+        "--incremental",
+        action='store_true',
+        help=(
+            "Salva con aggiornamento incrementale: i byte originali restano invariati "
+            "e vengono accodati solo gli oggetti modificati (mantiene valide le firme "
+            "digitali esistenti)"
+        )
+    )
+    
+    parser.add_argument(
+        "--engine",
+        choices=list(PDF_ENGINES),
+        default="pypdf2",
+        help=(
+            "Motore PDF: 'pypdf2' (puro Python) o 'pymupdf' (MuPDF, più veloce su "
+            "documenti grandi; richiede PyMuPDF) (default: pypdf2)"
+        )
+    )
+    
+    parser.add_argument(
+        "--shards",
+        type=int,
+        default=1,
+        metavar="N",
+        help=(
+            "Divide le pagine di un documento grande tra N processi (motore pypdf2; "
+            "l'output è un aggiornamento incrementale) (default: 1, disattivato)"
+        )
+    )
+    parser.add_argument(
+        "--shard-threshold",
+        type=int,
+        default=SHARD_THRESHOLD,
+        metavar="PAGINE",
+        help=(
+            "Pagine da firmare oltre cui usare gli shard; i documenti più piccoli "
+            f"restano in un solo processo (default: {SHARD_THRESHOLD})"
+        )
+    )
+    
+    parser.add_argument(
+        "--stamp-cache",
+        nargs='?',
+        const=str(DEFAULT_STAMP_CACHE_DIR),
+        metavar="DIR",
+        help=(
+            "Conserva su disco marchi compilati e immagini elaborate, riutilizzati "
+            f"dalle esecuzioni successive (default: {DEFAULT_STAMP_CACHE_DIR})"
+        )
+    )
+    parser.add_argument(
+        "--stamp-cache-size",
+        type=int,
+        default=256,
+        metavar="MB",
+        help="Dimensione massima della cache su disco in MB (default: 256)"
+    )
+    parser.add_argument(
+        "--output-cache",
+        nargs='?',
+        const=str(DEFAULT_OUTPUT_CACHE_DIR),
+        metavar="DIR",
+        help=(
+            "Riusa i PDF già firmati per lo stesso input con gli stessi parametri; con "
+            "timestamp o metadati solo insieme a --deterministic "
+            f"(default: {DEFAULT_OUTPUT_CACHE_DIR})"
+        )
+    )
+    parser.add_argument(
+        "--output-cache-size",
+        type=int,
+        default=1024,
+        metavar="MB",
+        help="Dimensione massima della cache degli output in MB (default: 1024)"
+    )
+    parser.add_argument(
+        "--output-cache-link",
+        action='store_true',
+        help="Output come hard link alla cache invece di copie (da non modificare sul posto)"
+    )
+    parser.add_argument(
+        "--deterministic",
+        action='store_true',
+        help=(
+            "Output riproducibile byte per byte: data della firma da SOURCE_DATE_EPOCH "
+            "o dai metadati del PDF di input invece dell'ora corrente"
+        )
+    )
+    
+    # Opzioni timestamp
+    parser.add_argument(
+        "--timestamp",
+        action='store_true',
+        help="Aggiungi timestamp"
+    )
+    parser.add_argument(
+        "--timestamp-format",
+        choices=["short", "long", "full", "iso", "custom"],
+        default="short",
+        help="Formato timestamp (default: short)"
+    )
+    parser.add_argument(
+        "--timestamp-custom",
+        help="Formato personalizzato per timestamp (per format=custom)"
+    )
+    
+    # Opzioni metadati
+    parser.add_argument(
+        "--add-metadata",
+        action='store_true',
+        help="Aggiungi metadati al PDF"
+    )
+    parser.add_argument(
+        "--author",
+        help="Autore del documento"
+    )
+    parser.add_argument(
+        "--title",
+        help="Titolo del documento"
+    )
+    parser.add_argument(
+        "--subject",
+        help="Soggetto del documento"
+    )
+    
+    # Opzioni email
+    parser.add_argument(
+        "--email-config",
+        help="Percorso file configurazione email (YAML/JSON)"
+    )
+    parser.add_argument(
+        "--email-recipients",
+        help="Destinatari email separati da virgola"
+    )
+    parser.add_argument(
+        "--email-template",
+        help="Percorso template email"
+    )
+    parser.add_argument(
+        "--outbox",
+        nargs='?',
+        const=str(DEFAULT_OUTBOX_DIR),
+        metavar="DIR",
+        help=(
+            "Accoda le email in DIR invece di inviarle durante la firma: vengono "
+            "spedite in sottofondo, con nuovi tentativi, e quelle non ancora "
+            f"consegnate restano per l'esecuzione successiva (default: {DEFAULT_OUTBOX_DIR})"
+        )
+    )
+    parser.add_argument(
+        "--outbox-send",
+        action='store_true',
+        help="Invia le email in coda (vedi --outbox) ed esce, senza firmare documenti"
+    )
+    parser.add_argument(
+        "--outbox-workers",
+        type=int,
+        default=2,
+        metavar="N",
+        help=(
+            "Connessioni SMTP contemporanee per l'invio della coda, entro i limiti "
+            "del provider (rate_limit nella configurazione email) (default: 2)"
+        )
+    )
+    
+    args = parser.parse_args()
+    
+    # Con "-" come output stdout trasporta il PDF firmato: i messaggi vanno su stderr
+    to_stdout = args.output == '-' or (args.output is None and args.input_pdf == ['-'])
+    pdf_stdout = sys.stdout.buffer if to_stdout else None
+    with contextlib.redirect_stdout(sys.stderr) if to_stdout else contextlib.nullcontext():
+        return _run_command_line(parser, args, pdf_stdout)
+
+
+def _run_command_line(parser, args, pdf_stdout=None):
+    """Esegue la riga di comando già analizzata (vedi command_line_mode)."""
+    if args.outbox_workers < 1:
+        parser.error("--outbox-workers deve essere almeno 1")
+    if args.outbox_send:
+        if args.input_pdf or args.manifest or args.serve:
+            parser.error("--outbox-send invia solo le email in coda, senza file da firmare")
+        return _run_outbox_send(args)
+    if args.serve and (args.input_pdf or args.manifest or args.watch):
+        parser.error("con --serve i PDF arrivano dalle richieste al servizio")
+    if args.manifest and args.input_pdf:
+        parser.error("con --manifest i file da firmare sono indicati nel manifest")
+    if not args.manifest and not args.input_pdf and not args.serve:
+        parser.error("indicare almeno un file PDF di input (o --manifest o --serve)")
+    batch = (args.serve or args.manifest is not None or args.watch or len(args.input_pdf) > 1
+             or args.output_dir is not None
+             or args.jobs is not None
+             or any(os.path.isdir(p) or _is_glob(p) for p in args.input_pdf))
+    if batch and args.output:
+        parser.error("-o/--output vale per un solo file: per la firma in blocco usare --output-dir")
+    if batch and '-' in args.input_pdf:
+        parser.error("'-' (stdin) vale per un solo file")
+    if args.watch and not all(os.path.isdir(p) for p in args.input_pdf):
+        parser.error("--watch richiede una o più directory")
+    if args.jobs is not None and args.jobs < 1:
+        parser.error("--jobs deve essere almeno 1")
+    if args.shards < 1:
+        parser.error("--shards deve essere almeno 1")
+    if (args.resume or args.journal) and (not batch or args.watch or args.serve):
+        parser.error("--journal e --resume valgono per la firma in blocco e da manifest")
+    if args.no_journal and (args.resume or args.journal):
+        parser.error("--no-journal esclude --journal e --resume")
+    if not batch:
+        args.input_pdf = args.input_pdf[0]
+    
+    # Verifica se il file watermark di default esiste, altrimenti prova altri file comuni
+    if args.watermark == "sign.png" and not os.path.exists(args.watermark):
+        # Lista di file comuni da provare
+        common_files = ["signAL.png", "signature.png", "sign.jpg", "signature.jpg"]
+        found_file = None
+        
+        for file in common_files:
+            if os.path.exists(file):
+                found_file = file
+                print(f"📁 File marchio di default non trovato, uso: {file}")
+                break
+        
+        if found_file:
+            args.watermark = found_file
+        else:
+            print(f"❌ Errore: File marchio non trovato: {args.watermark}")
+            print("💡 File disponibili nella directory:")
+            for file in os.listdir('.'):
+                if file.lower().endswith(('.png', '.jpg', '.jpeg', '.gif', '.svg')):
+                    print(f"   - {file}")
+            return 1
+    
+    # Determina il percorso di output se non specificato (da stdin: stdout)
+    if args.output is None and not batch and args.input_pdf == '-':
+        args.output = '-'
+    elif args.output is None and not batch:
+        input_path = Path(args.input_pdf)
+        output_name = input_path.stem + "_signed" + input_path.suffix
+        args.output = str(input_path.parent / output_name)
+    
+    if args.stamp_cache:
+        enable_disk_stamp_cache(args.stamp_cache, args.stamp_cache_size * 1024 * 1024)
+    if args.output_cache:
+        enable_output_cache(*_output_cache_option(args))
+    
+    try:
+        kwargs = {}
+        
+        # Pagine
         if args.pages != "all":
             kwargs['pages'] = args.pages
         if args.exclude:
             kwargs['exclude_pages'] = args.exclude
         
-        # Effetti
-        if args.border_width > 0:
-            kwargs['border_width'] = args.border_width
+        # Effetti
+        if args.border_width > 0:
+            kwargs['border_width'] = args.border_width
+            try:
+                color_parts = [int(x) for x in args.border_color.split(',')]
+                if len(color_parts) == 3:
+                    kwargs['border_color'] = tuple(color_parts)
+            except ValueError:
+                print("⚠️ Formato colore bordo non valido, uso nero")
+                kwargs['border_color'] = (0, 0, 0)
+        
+        if args.shadow:
+            kwargs['shadow_enabled'] = True
+            try:
+                offset_parts = [int(x) for x in args.shadow_offset.split(',')]
+                if len(offset_parts) == 2:
+                    kwargs['shadow_offset'] = tuple(offset_parts)
+            except ValueError:
+                print("⚠️ Formato offset ombra non valido, uso default")
+                kwargs['shadow_offset'] = (5, 5)
+        
+        if args.stamp_mode != "merge":
+            kwargs['stamp_mode'] = args.stamp_mode
+        if args.incremental:
+            kwargs['incremental'] = True
+        if args.engine != "pypdf2":
+            kwargs['engine'] = args.engine
+        if args.shards > 1:
+            kwargs['shards'] = args.shards
+            kwargs['shard_threshold'] = args.shard_threshold
+        if args.deterministic:
+            kwargs['deterministic'] = True
+        
+        # Timestamp
+        if args.timestamp:
+            kwargs['timestamp'] = True
+            kwargs['timestamp_format'] = args.timestamp_format
+            if args.timestamp_custom:
+                kwargs['timestamp_custom'] = args.timestamp_custom
+        
+        # Metadati
+        if args.add_metadata or args.author or args.title or args.subject:
+            kwargs['add_metadata'] = True
+            if args.author:
+                kwargs['author'] = args.author
+            if args.title:
+                kwargs['title'] = args.title
+            if args.subject:
+                kwargs['subject'] = args.subject
+        
+        # Email
+        if args.email_config and args.email_recipients:
+            kwargs['email_config'] = args.email_config
+            kwargs['email_recipients'] = [r.strip() for r in args.email_recipients.split(',')]
+            if args.email_template:
+                kwargs['email_template'] = args.email_template
+        
+        sender = None
+        if args.outbox and 'email_config' in kwargs:
+            kwargs['email_outbox'] = args.outbox
+            sender = OutboxSender(args.outbox, args.outbox_workers).start()
+        try:
+            return _sign_command_line(args, kwargs, batch, pdf_stdout)
+        finally:
+            if sender is not None:
+                sender.stop()
+                _print_outbox_summary(sender.outbox, sender.stats())
+        
+    except Exception as e:
+        print(f"❌ Errore: {e}")
+        return 1
+
+
+def _sign_command_line(args, kwargs, batch, pdf_stdout=None):
+    """Firma secondo la modalità scelta (servizio, manifest, cartella, blocco, file)."""
+    if args.serve:
+        return _run_serve(args, kwargs)
+    if args.manifest:
+        return _run_manifest(args, kwargs)
+    if args.watch:
+        return _run_watch(args, kwargs)
+    if batch:
+        return _run_batch(args, kwargs)
+    if '-' in (args.input_pdf, args.output):
+        return _run_stream(args, kwargs, pdf_stdout)
+    
+    print(f"🔄 Inizio elaborazione: {args.input_pdf}")
+    if kwargs:
+        features = []
+        if 'pages' in kwargs and kwargs['pages'] != 'all':
+            features.append(f"pagine: {kwargs['pages']}")
+        if 'border_width' in kwargs:
+            features.append("bordo")
+        if 'shadow_enabled' in kwargs:
+            features.append("ombra")
+        if 'timestamp' in kwargs:
+            features.append("timestamp")
+        if 'add_metadata' in kwargs:
+            features.append("metadati")
+        if 'email_config' in kwargs:
+            features.append("email")
+        
+        if features:
+            print(f"⚙️ Funzionalità attive: {', '.join(features)}")
+    
+    success = add_watermark_to_pdf(
+        args.input_pdf,
+        args.watermark,
+        args.output,
+        args.scale,
+        args.position,
+        **kwargs
+    )
+    
+    if success:
+        print(f"✅ Completato! File salvato: {args.output}")
+        return 0
+    else:
+        print("❌ Errore nell'elaborazione")
+        return 1
+
+
+def main():
+    """Funzione principale del programma."""
+    # Se vengono passati argomenti da riga di comando (escludendo il nome del programma)
+    if len(sys.argv) > 1:
+        # Modalità riga di comando
+        return command_line_mode()
+    else:
+        # Modalità interattiva        print("=== PDF Signer - Programma per aggiungere marchio ai PDF ===")
+        print("🚀 Versione avanzata con funzionalità estese")
+        print("\nScegli la modalità:")
+        print("1. Modalità interattiva (guidata)")
+        print("2. Mostra aiuto per modalità riga di comando")
+        print("3. Esci")
+        
+        while True:
+            try:
+                choice = input("\nScegli un'opzione: ").strip()
+                
+                if choice == "1":
+                    interactive_mode()
+                    break
+                elif choice == "2":                    
+                    print("\n=== Modalità Riga di Comando ===")
+                    print("Usa il programma da terminale con questi parametri:")
+                    print(f"python {sys.argv[0]} <file_pdf> [opzioni]")
+                    print("\nOpzioni base:")
+                    print("  -o, --output PATH     Percorso del file PDF di output")
+                    print("  -s, --scale FLOAT     Fattore di scala per il marchio (default: 0.2)")
+                    print("  -w, --watermark PATH  Percorso dell'immagine marchio (default: sign.png)")
+                    print("  -p, --position POS    Posizione del marchio")
+                    print("  --pages SPEC          Pagine da firmare (all/first/last/1,3,5-10)")
+                    print("  --exclude SPEC        Pagine da escludere")
+                    print("  --border-width N      Spessore bordo")
+                    print("  --shadow              Abilita ombra")
+                    print("  --timestamp           Aggiungi data/ora")
+                    print("  --add-metadata        Aggiungi metadati")
+                    print("  --email-config PATH   Configurazione email")
+                    print("  -j, --jobs N          Processi per la firma in blocco")
+                    print("  --output-dir DIR      Directory dei file firmati in blocco")
+                    
+                    print("\nEsempi d'uso:")
+                    print(f"  python {sys.argv[0]} doc.pdf -s 0.3 -p top-left")
+                    print(f"  python {sys.argv[0]} doc.pdf --pages first --timestamp")
+                    print(f"  python {sys.argv[0]} doc.pdf --border-width 2 --shadow")
+                    print(f"  python {sys.argv[0]} cartella/ -j 4 --output-dir firmati/")
+                    input("\nPremi Invio per continuare...")
+                    continue
+                elif choice == "3":
+                    print("Arrivederci!")
+                    break
+                else:
+                    print("Opzione non valida. Scegli 1, 2 o 3.")
+                    
+            except KeyboardInterrupt:
+                print("\n\nProgramma interrotto dall'utente.")
+                break
+            except EOFError:
+                print("\n\nProgramma terminato.")
+                break
+    
+    return 0
+
+
+# Funzioni avanzate integrate
+class PageSelection:
+    """
+    Selezione di pagine compilata una sola volta per un documento.
+    
+    La specifica viene tradotta in una bitmap (un byte per pagina), quindi
+    l'appartenenza di una pagina è verificata in tempo costante e l'iterazione
+    sulle pagine selezionate avviene in modo pigro e ordinato.
+    
+    Sintassi supportata (elementi separati da virgola, pagine 1-indexed):
+        all, first, last, odd, even
+        5          singola pagina
+        -1         indice negativo, contato dalla fine (-1 = ultima pagina)
+        last-5     ultima pagina meno 5
+        3-10       intervallo inclusivo (gli estremi accettano first/last/-N)
+        10-        intervallo aperto fino all'ultima pagina
+        1-100:2    intervallo con passo
+    
+    Args:
+        spec: Specifica delle pagine da includere
+        total_pages: Numero totale di pagine nel PDF
+        exclude: Specifica (stessa sintassi) delle pagine da escludere
+        strict: Se True gli elementi non validi sollevano ValueError,
+            altrimenti vengono segnalati e ignorati
+    """
+    
+    _KEYWORDS = ('all', 'odd', 'even')
+    _TERM = r'(?:first|last(?:-\d+)?|-?\d+)'
+    _TOKEN_RE = re.compile(rf'^({_TERM})(?:(-)({_TERM})?)?(?::(\d+))?$')
+    
+    def __init__(self, spec, total_pages: int, exclude=None, strict: bool = False):
+        self.spec = spec or 'all'
+        self.exclude = exclude or None
+        self.total_pages = max(0, int(total_pages))
+        self._bits = bytearray(self.total_pages)
+        self._mark(self.spec, 1, strict)
+        if self.exclude:
+            self._mark(self.exclude, 0, strict)
+        self._count = self._bits.count(1)
+    
+    @classmethod
+    def validate(cls, spec) -> str:
+        """
+        Verifica la sintassi di una specifica senza conoscere il numero di pagine.
+        
+        Returns:
+            La specifica stessa, se valida
+        
+        Raises:
+            ValueError: se un elemento della specifica non è riconosciuto
+        """
+        for token in cls._tokens(spec):
+            cls._parse_token(token)
+        return spec
+    
+    @staticmethod
+    def _tokens(spec):
+        return [part.strip().lower() for part in str(spec).split(',') if part.strip()]
+    
+    @classmethod
+    def _parse_token(cls, token):
+        """Converte un elemento in (keyword) o (inizio, fine, passo) simbolici."""
+        if token in cls._KEYWORDS:
+            return token
+        match = cls._TOKEN_RE.match(token)
+        if not match:
+            raise ValueError(f"Formato pagina non valido: {token}")
+        start, dash, end, step = match.groups()
+        if step is not None and not dash:
+            raise ValueError(f"Il passo richiede un intervallo: {token}")
+        step = int(step) if step is not None else 1
+        if step <= 0:
+            raise ValueError(f"Passo non valido: {token}")
+        if not dash:
+            end = start
+        return start, end, step
+    
+    def _resolve(self, term):
+        """Converte un estremo simbolico in indice 0-based (può uscire dai limiti)."""
+        if term is None:
+            return self.total_pages - 1
+        if term == 'first':
+            return 0
+        if term.startswith('last'):
+            return self.total_pages - 1 - (int(term[5:]) if len(term) > 4 else 0)
+        value = int(term)
+        if value < 0:
+            return self.total_pages + value
+        return value - 1
+    
+    def _mark(self, spec, value, strict):
+        n = self.total_pages
+        fill = b'\x01' if value else b'\x00'
+        for token in self._tokens(spec):
+            try:
+                parsed = self._parse_token(token)
+            except ValueError as e:
+                if strict:
+                    raise
+                print(e)
+                continue
+            
+            if parsed == 'all':
+                start, stop, step = 0, n, 1
+            elif parsed == 'odd':
+                start, stop, step = 0, n, 2
+            elif parsed == 'even':
+                start, stop, step = 1, n, 2
+            else:
+                first, last, step = parsed
+                start = self._resolve(first)
+                if first == last:
+                    # Singola pagina: ignorata se fuori dal documento
+                    if not 0 <= start < n:
+                        continue
+                    stop = start + 1
+                else:
+                    start = max(0, start)
+                    stop = min(n, self._resolve(last) + 1)
+            
+            if start < stop:
+                count = len(range(start, stop, step))
+                self._bits[start:stop:step] = fill * count
+    
+    def __contains__(self, page_index) -> bool:
+        return 0 <= page_index < self.total_pages and self._bits[page_index] == 1
+    
+    def __iter__(self):
+        find = self._bits.find
+        index = find(1)
+        while index != -1:
+            yield index
+            index = find(1, index + 1)
+    
+    def __len__(self) -> int:
+        return self._count
+    
+    def __bool__(self) -> bool:
+        return self._count > 0
+    
+    def __eq__(self, other) -> bool:
+        if isinstance(other, PageSelection):
+            return self.total_pages == other.total_pages and self._bits == other._bits
+        if isinstance(other, (list, tuple, range)):
+            return list(self) == list(other)
+        return NotImplemented
+    
+    def head(self, count: int) -> List[int]:
+        """Restituisce le prime ``count`` pagine selezionate."""
+        return list(itertools.islice(self, count))
+    
+    def __repr__(self) -> str:
+        return (f"PageSelection({self.spec!r}, total_pages={self.total_pages}, "
+                f"exclude={self.exclude!r}, selected={self._count})")
+
+
+def parse_pages_specification(pages_str: str, total_pages: int):
+    """
+    Converte una stringa di pagine in una lista di numeri di pagina.
+    
+    Args:
+        pages_str: Stringa formato "1,3,5-10" o "first", "last", "all", "odd", "even"
+            (vedi PageSelection per la sintassi completa)
+        total_pages: Numero totale di pagine nel PDF
+        
+    Returns:
+        Lista di numeri di pagina (0-indexed)
+    """
+    return list(PageSelection(pages_str, total_pages))
+
+
+SUPPORTED_IMAGE_FORMATS = {'.png', '.jpg', '.jpeg', '.gif', '.bmp', '.tiff', '.webp'}
+
+
+def decode_signature_image(source):
+    """
+    Immagine della firma da usare nella pipeline: un percorso o una
+    PIL.Image.Image restano invariati, bytes/buffer/file-like vengono
+    decodificati in memoria (LA convertita in RGBA come in SIGNATURE_IMAGES).
+    
+    Raises:
+        OSError: se i byte non sono un'immagine leggibile
+    """
+    if _is_path(source) or isinstance(source, Image.Image):
+        return source
+    with _open_binary(source) as stream, Image.open(stream) as img:
+        img.load()
+        return img.convert('RGBA') if img.mode == 'LA' else img.copy()
+
+
+def load_signature_image(image_path: str):
+    """
+    Apre l'immagine della firma e la carica in memoria tramite SIGNATURE_IMAGES.
+    
+    Le immagini con trasparenza in scala di grigi (LA) vengono convertite in
+    RGBA, così ReportLab ne conserva il canale alfa. L'immagine restituita è
+    condivisa: va copiata prima di modificarla.
+    
+    Args:
+        image_path: Percorso dell'immagine
+        
+    Returns:
+        PIL.Image.Image caricata in memoria, oppure il percorso invariato se il
+        formato non è supportato o l'immagine non è leggibile
+    """
+    if Path(image_path).suffix.lower() not in SUPPORTED_IMAGE_FORMATS:
+        print(f"Formato non supportato: {Path(image_path).suffix}")
+        return image_path
+    
+    try:
+        return SIGNATURE_IMAGES.get(image_path).image
+    except Exception as e:
+        print(f"Errore nell'elaborazione dell'immagine: {e}")
+    
+    return image_path
+
+
+def process_image_format(image_path: str) -> str:
+    """
+    Verifica e converte l'immagine in un formato supportato se necessario.
+    
+    Variante su disco di load_signature_image(), per i chiamanti che hanno
+    bisogno di un file.
+    
+    Args:
+        image_path: Percorso dell'immagine
+        
+    Returns:
+        Percorso dell'immagine processata (potrebbe essere un file temporaneo)
+    """
+    if Path(image_path).suffix.lower() not in SUPPORTED_IMAGE_FORMATS:
+        print(f"Formato non supportato: {Path(image_path).suffix}")
+        return image_path
+    
+    try:
+        # Verifica che l'immagine sia valida
+        img = SIGNATURE_IMAGES.get(image_path).image
+        # Converti in PNG se ha trasparenza e non è già PNG
+        if img.mode in ('RGBA', 'LA') and not image_path.lower().endswith('.png'):
+            temp_file = tempfile.NamedTemporaryFile(delete=False, suffix='.png')
+            temp_path = temp_file.name
+            temp_file.close()
+            img.save(temp_path, 'PNG')
+            print(f"Immagine convertita in PNG: {temp_path}")
+            return temp_path
+            
+    except Exception as e:
+        print(f"Errore nell'elaborazione dell'immagine: {e}")
+    
+    return image_path
+
+
+def apply_image_effects(image, border_width: int = 0, border_color=(0, 0, 0),
+                        shadow_enabled: bool = False, shadow_offset=(5, 5)):
+    """
+    Applica in memoria gli effetti (bordo, ombra) a un'immagine.
+    
+    Args:
+        image: PIL.Image.Image oppure percorso dell'immagine
+        border_width: Spessore del bordo
+        border_color: Colore del bordo (R, G, B)
+        shadow_enabled: Abilita ombra
+        shadow_offset: Offset dell'ombra (x, y)
+        
+    Returns:
+        Nuova PIL.Image.Image RGBA con gli effetti (l'originale non viene
+        modificata), oppure image invariata se non ci sono effetti
+    """
+    if border_width == 0 and not shadow_enabled:
+        return image
+    
+    if not isinstance(image, Image.Image):
+        image = SIGNATURE_IMAGES.get(image).image
+    # convert() restituisce sempre una nuova immagine: l'originale condivisa resta intatta
+    img = image.convert('RGBA')
+    
+    # Aggiungi bordo
+    if border_width > 0:
+        new_size = (img.width + 2 * border_width, img.height + 2 * border_width)
+        bordered_img = Image.new('RGBA', new_size, (*border_color, 255))
+        bordered_img.paste(img, (border_width, border_width), img)
+        img = bordered_img
+    
+    # Aggiungi ombra (implementazione semplificata)
+    if shadow_enabled:
+        shadow_x, shadow_y = shadow_offset
+        shadow_size = (img.width + abs(shadow_x), img.height + abs(shadow_y))
+        shadow_img = Image.new('RGBA', shadow_size, (0, 0, 0, 0))
+        
+        # Crea ombra semplice
+        shadow = Image.new('RGBA', img.size, (50, 50, 50, 128))
+        shadow_img.paste(shadow, (max(0, shadow_x), max(0, shadow_y)), img.split()[-1])
+        shadow_img.paste(img, (max(0, -shadow_x), max(0, -shadow_y)), img)
+        img = shadow_img
+    
+    return img
+
+
+def add_image_effects(image_path: str, border_width: int = 0, border_color=(0, 0, 0),
+                     shadow_enabled: bool = False, shadow_offset=(5, 5)) -> str:
+    """
+    Aggiunge effetti all'immagine (bordo, ombra) e la salva su disco.
+    
+    Variante su disco di apply_image_effects().
+    
+    Args:
+        image_path: Percorso dell'immagine
+        border_width: Spessore del bordo
+        border_color: Colore del bordo (R, G, B)
+        shadow_enabled: Abilita ombra
+        shadow_offset: Offset dell'ombra (x, y)
+        
+    Returns:
+        Percorso dell'immagine con effetti applicati
+    """
+    if border_width == 0 and not shadow_enabled:
+        return image_path
+    
+    try:
+        img = apply_image_effects(image_path, border_width, border_color,
+                                  shadow_enabled, shadow_offset)
+        
+        # Salva immagine con effetti
+        temp_file = tempfile.NamedTemporaryFile(delete=False, suffix='.png')
+        temp_path = temp_file.name
+        temp_file.close()
+        img.save(temp_path, 'PNG')
+        return temp_path
+            
+    except Exception as e:
+        print(f"Errore nell'applicazione degli effetti: {e}")
+        return image_path
+
+
+def cached_signature_image(image_path: str, border_width: int = 0, border_color=(0, 0, 0),
+                           shadow_enabled: bool = False, shadow_offset=(5, 5)):
+    """
+    Immagine della firma con gli effetti applicati, riutilizzata tramite
+    STAMP_CACHE (anche tra processi se la cache su disco è attiva).
+    
+    La chiave è l'impronta del file originale più i parametri degli effetti.
+    Senza effetti restituisce il percorso stesso: dimensionamento, impronta e
+    disegno usano allora l'immagine già decodificata in SIGNATURE_IMAGES.
+    
+    Returns:
+        PIL.Image.Image con gli effetti, oppure il percorso senza effetti
+    """
+    if border_width == 0 and not shadow_enabled:
+        # Valida il formato e decodifica l'immagine una volta nel registro
+        load_signature_image(image_path)
+        return image_path
+    
+    key = ('signature-image', image_digest(image_path), border_width,
+           tuple(border_color), shadow_enabled, tuple(shadow_offset))
+    
+    def build():
+        image = apply_image_effects(load_signature_image(image_path), border_width,
+                                    border_color, shadow_enabled, shadow_offset)
+        buffer = io.BytesIO()
+        image.save(buffer, 'PNG')
+        return buffer.getvalue()
+    
+    with Image.open(io.BytesIO(STAMP_CACHE.get_or_build(key, build))) as img:
+        img.load()
+        return img.copy()
+
+
+def render_timestamp_image(format_type: str = 'short', custom_format: Optional[str] = None,
+                           now: Optional[datetime] = None):
+    """
+    Crea in memoria un'immagine con timestamp.
+    
+    Args:
+        format_type: Tipo di formato ('short', 'long', 'full', 'iso', 'custom')
+        custom_format: Formato personalizzato se format_type='custom'
+        now: data e ora da riportare (default: ora corrente)
+        
+    Returns:
+        PIL.Image.Image RGBA con il timestamp
+    """
+    formats = {
+        'short': '%d/%m/%Y',
+        'long': '%d/%m/%Y %H:%M',
+        'full': '%d/%m/%Y %H:%M:%S',
+        'iso': '%Y-%m-%d %H:%M:%S'
+    }
+    
+    if format_type == 'custom' and custom_format:
+        date_format = custom_format
+    else:
+        date_format = formats.get(format_type, formats['short'])
+    
+    # Genera timestamp
+    now = now or datetime.now()
+    timestamp_text = now.strftime(date_format)
+    
+    # Crea immagine semplice
+    font_size = 12
+    char_width = font_size * 0.6
+    text_width = int(len(timestamp_text) * char_width)
+    text_height = int(font_size * 1.5)
+    
+    img = Image.new('RGBA', (text_width + 20, text_height + 10), (255, 255, 255, 0))
+    draw = ImageDraw.Draw(img)
+    draw.text((10, 5), timestamp_text, fill=(0, 0, 0, 255))
+    return img
+
+
+def create_timestamp_image(format_type: str = 'short', custom_format: Optional[str] = None) -> str:
+    """
+    Crea un'immagine con timestamp e la salva su disco.
+    
+    Variante su disco di render_timestamp_image().
+    
+    Args:
+        format_type: Tipo di formato ('short', 'long', 'full', 'iso', 'custom')
+        custom_format: Formato personalizzato se format_type='custom'
+        
+    Returns:
+        Percorso dell'immagine timestamp
+    """
+    img = render_timestamp_image(format_type, custom_format)
+    
+    # Salva in file temporaneo
+    temp_file = tempfile.NamedTemporaryFile(delete=False, suffix='.png')
+    temp_path = temp_file.name
+    temp_file.close()
+    img.save(temp_path, 'PNG')
+    return temp_path
+
+
+def add_pdf_metadata(pdf_path: str, metadata: dict) -> None:
+    """
+    Aggiunge metadati a un PDF esistente.
+    
+    Args:
+        pdf_path: Percorso del PDF
+        metadata: Dizionario con metadati da aggiungere
+    """
+    try:
+        # Leggi PDF esistente
+        with open(pdf_path, 'rb') as file:
+            reader = PdfReader(file)
+            writer = PdfWriter()
+            
+            # Copia tutte le pagine
+            for page in reader.pages:
+                writer.add_page(page)
+            
+            # Aggiungi metadati esistenti
+            if reader.metadata:
+                for key, value in reader.metadata.items():
+                    writer.add_metadata({key: value})
+            
+            # Aggiungi nuovi metadati
+            writer.add_metadata(metadata)
+        
+        # Sovrascrivi il file
+        with open(pdf_path, 'wb') as file:
+            writer.write(file)
+            
+    except Exception as e:
+        print(f"Errore nell'aggiunta dei metadati: {e}")
+
+
+# --- Connessioni SMTP --------------------------------------------------------
+
+class SmtpSettings(NamedTuple):
+    """Parametri di connessione SMTP ricavati dalla configurazione email."""
+    server: str
+    port: int
+    username: Optional[str]
+    password: Optional[str]
+    use_tls: bool
+
+
+def _smtp_settings(email_config) -> SmtpSettings:
+    """Parametri SMTP dalle diverse strutture di configurazione supportate."""
+    smtp_config = email_config.get('smtp', email_config)
+    return SmtpSettings(
+        smtp_config.get('server') or smtp_config.get('smtp_server'),
+        smtp_config.get('port') or smtp_config.get('smtp_port', 587),
+        smtp_config.get('username'),
+        smtp_config.get('password'),
+        smtp_config.get('use_tls', True),
+    )
+
+
+def _smtp_connect(settings, ssl_context=None):
+    """Apre una connessione SMTP: SSL diretto sulla 465 senza TLS, altrimenti STARTTLS, poi login."""
+    if not settings.use_tls and settings.port == 465:
+        server = smtplib.SMTP_SSL(settings.server, settings.port, context=ssl_context)
+    else:
+        server = smtplib.SMTP(settings.server, settings.port)
+        if settings.use_tls:
+            if ssl_context:
+                server.starttls(context=ssl_context)
+            else:
+                server.starttls()
+    
+    if settings.username and settings.password:
+        server.login(settings.username, settings.password)
+    return server
+
+
+def _smtp_dropped(error) -> bool:
+    """True se l'errore indica una connessione chiusa dal server (da riaprire)."""
+    if isinstance(error, (smtplib.SMTPServerDisconnected, ConnectionError)):
+        return True
+    # 421: servizio non disponibile, il server chiude il canale
+    return isinstance(error, smtplib.SMTPResponseException) and error.smtp_code == 421
+
+
+class SmtpConnectionPool:
+    """
+    Connessioni SMTP riutilizzate tra più invii.
+    
+    Aprire una connessione costa handshake TLS e AUTH, e i relay limitano chi
+    ne apre troppe: il pool conserva le connessioni inattive per chiave
+    (server, porta, utente, TLS, contesto SSL) e le riusa per i messaggi
+    successivi. Una connessione inattiva da più di ``noop_interval`` secondi
+    viene verificata con NOOP prima dell'uso; oltre ``idle_timeout`` secondi
+    viene chiusa e sostituita. Se il server ha chiuso una connessione
+    riutilizzata (disconnessione o 421) l'invio viene ripetuto una volta su
+    una connessione nuova. Dopo ``max_messages`` messaggi la connessione
+    viene chiusa con QUIT, come richiesto da molti relay. Thread-safe.
+    """
+    
+    def __init__(self, max_idle: int = 2, idle_timeout: float = 60.0,
+                 noop_interval: float = 5.0, max_messages: int = 100):
+        self.max_idle = max_idle
+        self.idle_timeout = idle_timeout
+        self.noop_interval = noop_interval
+        self.max_messages = max_messages
+        self.connects = 0
+        self.reuses = 0
+        self.noops = 0
+        self.reconnects = 0
+        self.messages = 0
+        self._idle = {}   # chiave -> [(connessione, ultimo uso, messaggi inviati)]
+        self._lock = threading.Lock()
+    
+    @staticmethod
+    def _key(settings, ssl_context):
+        return (settings.server, settings.port, settings.username, settings.use_tls, ssl_context)
+    
+    def _connect(self, settings, ssl_context):
+        server = _smtp_connect(settings, ssl_context)
+        with self._lock:
+            self.connects += 1
+        return server
+    
+    def _acquire(self, key):
+        """Connessione inattiva ancora valida per key: (connessione, messaggi inviati) o None."""
+        while True:
+            with self._lock:
+                idle = self._idle.get(key)
+                if not idle:
+                    return None
+                server, last_used, sent = idle.pop()
+            age = time.monotonic() - last_used
+            if age > self.idle_timeout:
+                self._quit(server)
+                continue
+            if age > self.noop_interval:
+                with self._lock:
+                    self.noops += 1
+                try:
+                    valid = server.noop()[0] == 250
+                except (smtplib.SMTPException, OSError):
+                    valid = False
+                if not valid:
+                    self._quit(server)
+                    continue
+            with self._lock:
+                self.reuses += 1
+            return server, sent
+    
+    def _release(self, key, server, sent):
+        if sent < self.max_messages:
+            with self._lock:
+                idle = self._idle.setdefault(key, [])
+                if len(idle) < self.max_idle:
+                    idle.append((server, time.monotonic(), sent))
+                    return
+        self._quit(server)
+    
+    @staticmethod
+    def _quit(server):
+        try:
+            server.quit()
+        except (smtplib.SMTPException, OSError):
+            server.close()
+    
+    def send(self, msg, email_config, ssl_context=None):
+        """Invia msg con il server SMTP di email_config; solleva le eccezioni di smtplib."""
+        settings = _smtp_settings(email_config)
+        key = self._key(settings, ssl_context)
+        acquired = self._acquire(key)
+        server, sent = acquired or (self._connect(settings, ssl_context), 0)
+        try:
+            _send_message(server, msg)
+        except Exception as e:
+            server.close()
+            if acquired is None or not _smtp_dropped(e):
+                raise
+            # Connessione riutilizzata chiusa dal server nel frattempo: si riapre
+            with self._lock:
+                self.reconnects += 1
+            server, sent = self._connect(settings, ssl_context), 0
             try:
-                color_parts = [int(x) for x in args.border_color.split(',')]
-                if len(color_parts) == 3:
-                    kwargs['border_color'] = tuple(color_parts)
-            except ValueError:
-                print("⚠️ Formato colore bordo non valido, uso nero")
-                kwargs['border_color'] = (0, 0, 0)
+                _send_message(server, msg)
+            except Exception:
+                server.close()
+                raise
+        with self._lock:
+            self.messages += 1
+        self._release(key, server, sent + 1)
+    
+    def close(self):
+        """Chiude con QUIT tutte le connessioni inattive."""
+        with self._lock:
+            idle = [entry[0] for entries in self._idle.values() for entry in entries]
+            self._idle.clear()
+        for server in idle:
+            self._quit(server)
+    
+    def __enter__(self):
+        return self
+    
+    def __exit__(self, *exc_info):
+        self.close()
+    
+    def stats(self) -> dict:
+        with self._lock:
+            return {'connects': self.connects, 'reuses': self.reuses, 'noops': self.noops,
+                    'reconnects': self.reconnects, 'messages': self.messages,
+                    'idle': sum(len(entries) for entries in self._idle.values())}
+
+
+# Pool SMTP del processo, usato dagli invii automatici dopo la firma (vedi smtp_pool)
+SMTP_POOL = None
+_SMTP_POOL_PID = None
+
+
+def smtp_pool() -> SmtpConnectionPool:
+    """
+    Pool SMTP condiviso dal processo, creato al primo invio: firma in blocco,
+    manifest, cartella sorvegliata e servizio riusano le stesse connessioni
+    per tutti i documenti di un processo. Le connessioni vengono chiuse
+    all'uscita del processo (anche nei processi di lavoro).
+    """
+    global SMTP_POOL, _SMTP_POOL_PID
+    # Un processo figlio (fork) non deve usare i socket ereditati dal padre
+    if SMTP_POOL is None or _SMTP_POOL_PID != os.getpid():
+        SMTP_POOL, _SMTP_POOL_PID = SmtpConnectionPool(), os.getpid()
+        multiprocessing.util.Finalize(SMTP_POOL, SMTP_POOL.close, exitpriority=10)
+    return SMTP_POOL
+
+
+# --- Allegati email in streaming ----------------------------------------------
+
+# Allegati oltre questa dimensione non vengono caricati nel messaggio: sono
+# codificati in base64 a blocchi durante l'invio (DATA) o la scrittura in coda
+EMAIL_STREAM_THRESHOLD = 8 * 1024 * 1024
+# Byte letti per blocco: multiplo di 57, così ogni blocco produce righe base64 complete
+_BASE64_BLOCK = 57 * 1024
+# Byte letti per blocco dai file della coda email (una scrittura sul socket per blocco)
+_EML_BLOCK = 64 * 1024
+
+
+class _StreamedAttachment(MIMEBase):
+    """
+    Allegato letto dalla sorgente solo durante la serializzazione
+    (vedi iter_message_bytes): nel messaggio c'è un segnaposto di una riga.
+    """
+    
+    def __init__(self, source, maintype, subtype):
+        super().__init__(maintype, subtype)
+        self.source = source
+        self.token = f"pdf-signer-stream-{uuid.uuid4().hex}"
+        self.set_payload(self.token)
+        self['Content-Transfer-Encoding'] = 'base64'
+
+
+def _source_size(source) -> Optional[int]:
+    """Dimensione di un allegato senza leggerlo (None se non nota)."""
+    if _is_path(source):
+        try:
+            return os.path.getsize(source)
+        except OSError:
+            return None
+    if isinstance(source, (bytes, bytearray, memoryview)):
+        return memoryview(source).nbytes
+    return None
+
+
+def _attachment_part(source, maintype, subtype, stream_threshold=None):
+    """Parte MIME dell'allegato: in memoria, o in streaming oltre la soglia."""
+    threshold = EMAIL_STREAM_THRESHOLD if stream_threshold is None else stream_threshold
+    size = _source_size(source)
+    if size is not None and size > threshold:
+        return _StreamedAttachment(source, maintype, subtype)
+    part = MIMEBase(maintype, subtype)
+    part.set_payload(_attachment_bytes(source))
+    encoders.encode_base64(part)
+    return part
+
+
+def _streamed_parts(msg) -> dict:
+    return {part.token: part for part in msg.walk() if isinstance(part, _StreamedAttachment)}
+
+
+def _base64_lines(source):
+    """Contenuto di source in base64 (righe CRLF), un blocco alla volta."""
+    with _open_binary(source) as f:
+        pending = b''
+        while True:
+            block = f.read(_BASE64_BLOCK)
+            if not block:
+                break
+            yield pending
+            pending = base64.encodebytes(block).replace(b'\n', b'\r\n')
+        # Il CRLF finale appartiene alla riga del segnaposto
+        yield pending[:-2]
+
+
+def iter_message_bytes(msg):
+    """
+    Serializza msg (righe CRLF) a blocchi: gli allegati in streaming vengono
+    letti e codificati solo qui, con memoria costante qualunque sia la loro
+    dimensione. Per gli altri messaggi equivale a msg.as_bytes().
+    """
+    data = msg.as_bytes(policy=msg.policy.clone(linesep='\r\n'))
+    streamed = _streamed_parts(msg)
+    if not streamed:
+        yield data
+        return
+    pattern = re.compile(b'|'.join(re.escape(token.encode('ascii')) for token in streamed))
+    position = 0
+    for match in pattern.finditer(data):
+        yield data[position:match.start()]
+        yield from _base64_lines(streamed[match.group().decode('ascii')].source)
+        position = match.end()
+    yield data[position:]
+
+
+def _dot_stuffed(chunks):
+    """Raddoppia il punto a inizio riga (RFC 5321, DATA) su blocchi di qualsiasi misura."""
+    line_start = True
+    for chunk in chunks:
+        if not chunk:
+            continue
+        if line_start and chunk.startswith(b'.'):
+            chunk = b'.' + chunk
+        yield chunk.replace(b'\n.', b'\n..')
+        line_start = chunk.endswith(b'\n')
+
+
+class _EmlFile(NamedTuple):
+    """Messaggio già serializzato su disco (coda email), inviato a blocchi."""
+    path: Path
+    to_addrs: List[str]
+    
+    def from_addr(self):
+        # Solo le intestazioni: il corpo può essere grande
+        with open(self.path, 'rb') as f:
+            headers = b''.join(itertools.takewhile(lambda line: line.strip(), f))
+        from_header = BytesParser().parsebytes(headers, headersonly=True).get('From', '')
+        return email.utils.getaddresses([from_header])[0][1]
+    
+    def chunks(self):
+        """Contenuto a blocchi di _EML_BLOCK byte, con fine riga CRLF."""
+        with open(self.path, 'rb') as f:
+            pending = b''
+            for block in iter(lambda: f.read(_EML_BLOCK), b''):
+                block = pending + block
+                # Un CR finale può essere seguito dal LF all'inizio del blocco successivo
+                pending = b'\r' if block.endswith(b'\r') else b''
+                if pending:
+                    block = block[:-1]
+                yield block.replace(b'\r\n', b'\n').replace(b'\r', b'\n').replace(b'\n', b'\r\n')
+            if pending:
+                yield b'\r\n'
+
+
+def _smtp_send_stream(server, from_addr, to_addrs, chunks):
+    """
+    Come SMTP.sendmail, ma il contenuto di DATA è scritto sul socket un
+    blocco alla volta invece di essere passato come unica stringa.
+    """
+    server.ehlo_or_helo_if_needed()
+    code, response = server.mail(from_addr)
+    if code != 250:
+        _smtp_abort(server, code)
+        raise smtplib.SMTPSenderRefused(code, response, from_addr)
+    refused = {}
+    for address in to_addrs:
+        code, response = server.rcpt(address)
+        if code not in (250, 251):
+            refused[address] = (code, response)
+        if code == 421:
+            server.close()
+            raise smtplib.SMTPRecipientsRefused(refused)
+    if len(refused) == len(to_addrs):
+        _smtp_abort(server, None)
+        raise smtplib.SMTPRecipientsRefused(refused)
+    server.putcmd('data')
+    code, response = server.getreply()
+    if code != 354:
+        _smtp_abort(server, code)
+        raise smtplib.SMTPDataError(code, response)
+    line_end = True
+    for chunk in _dot_stuffed(chunks):
+        server.send(chunk)
+        line_end = chunk.endswith(b'\r\n')
+    server.send(b'.\r\n' if line_end else b'\r\n.\r\n')
+    code, response = server.getreply()
+    if code != 250:
+        _smtp_abort(server, code)
+        raise smtplib.SMTPDataError(code, response)
+    return refused
+
+
+def _smtp_abort(server, code):
+    if code == 421:
+        server.close()
+    else:
+        with contextlib.suppress(smtplib.SMTPServerDisconnected):
+            server.rset()
+
+
+def _send_message(server, msg):
+    """
+    Invia un messaggio su una connessione aperta: send_message() per i
+    messaggi in memoria, DATA a blocchi per quelli con allegati in streaming
+    e per i file della coda email.
+    """
+    if isinstance(msg, _EmlFile):
+        return _smtp_send_stream(server, msg.from_addr(), msg.to_addrs, msg.chunks())
+    if not _streamed_parts(msg):
+        return server.send_message(msg)
+    to_addrs = [address for _, address in
+                email.utils.getaddresses(msg.get_all('To', []) + msg.get_all('Cc', []))]
+    from_addr = email.utils.getaddresses([msg['From'] or ''])[0][1]
+    return _smtp_send_stream(server, from_addr, to_addrs, iter_message_bytes(msg))
+
+
+def send_email_with_pdf(pdf_path, email_config: dict, recipients: list,
+                       subject: Optional[str] = None, body: Optional[str] = None,
+                       template_path: Optional[str] = None,
+                       ssl_context: Optional[ssl.SSLContext] = None,
+                       filename: Optional[str] = None,
+                       pool: Optional['SmtpConnectionPool'] = None,
+                       context: Optional[dict] = None) -> bool:
+    """
+    Invia PDF firmato via email.
+    
+    Args:
+        pdf_path: Percorso del PDF da inviare, oppure il suo contenuto in
+            memoria (bytes, buffer o file-like binario)
+        email_config: Configurazione server email
+        recipients: Lista destinatari
+        subject: Oggetto email
+        body: Corpo email
+        template_path: Percorso template email
+        ssl_context: Contesto SSL personalizzato
+        filename: Nome dell'allegato (default: nome del file o "documento.pdf")
+        pool: SmtpConnectionPool da cui prendere la connessione; senza, ogni
+            invio apre e chiude una connessione propria
+        context: valori aggiuntivi per i segnaposto di oggetto e corpo
+            (vedi build_email_message)
         
-        if args.shadow:
-            kwargs['shadow_enabled'] = True
+    Returns:
+        True se invio riuscito
+    """
+    try:
+        msg = build_email_message(pdf_path, email_config, recipients, subject, body,
+                                  template_path, filename, context)
+        
+        # Invia su una connessione del pool (riutilizzata) o su una nuova connessione
+        if pool is not None:
+            pool.send(msg, email_config, ssl_context)
+        else:
+            server = _smtp_connect(_smtp_settings(email_config), ssl_context)
+            _send_message(server, msg)
+            server.quit()
+        
+        return True
+        
+    except Exception as e:
+        print(f"Errore nell'invio email: {e}")
+        return False
+
+
+DEFAULT_EMAIL_SUBJECT = "PDF Firmato: {filename}"
+DEFAULT_EMAIL_BODY = "In allegato il PDF firmato: {filename}"
+
+
+def build_email_message(pdf_path, email_config: dict, recipients: list,
+                        subject: Optional[str] = None, body: Optional[str] = None,
+                        template_path: Optional[str] = None,
+                        filename: Optional[str] = None,
+                        context: Optional[dict] = None) -> MIMEMultipart:
+    """
+    Costruisce il messaggio email con il PDF firmato in allegato (vedi
+    send_email_with_pdf per i parametri). Usato anche dalla coda EmailOutbox,
+    che conserva il messaggio già pronto fino all'invio.
+    
+    Il template viene analizzato una volta per versione del file
+    (EMAIL_TEMPLATES). Segnaposto disponibili in oggetto e corpo: filename,
+    pdf_name, stem, timestamp, date, time, recipient, recipients,
+    sender_name, author, title, subject, pages, pages_signed, più quelli di
+    ``context``; un segnaposto senza valore resta invariato nel testo.
+    """
+    filename = filename or _source_name(pdf_path)
+    template = None
+    if template_path and os.path.exists(template_path):
+        template = EMAIL_TEMPLATES.get(template_path)
+    
+    # Il template, se indica oggetto o corpo, prevale sui valori passati
+    subject_format = (template and template.subject) or _email_format(subject or DEFAULT_EMAIL_SUBJECT)
+    body_format = (template and template.body) or _email_format(body or DEFAULT_EMAIL_BODY)
+    
+    # Gestisci diversi formati di configurazione
+    sender = email_config.get('sender') or {}
+    from_addr = email_config.get('from_address') or sender.get('email')
+    if not from_addr:
+        from_addr = email_config.get('smtp', {}).get('username')
+    
+    now = datetime.now()
+    values = _signing_context({})
+    values.update({
+        'filename': filename,
+        'pdf_name': filename,
+        'stem': Path(filename).stem,
+        'timestamp': now.strftime("%d/%m/%Y %H:%M"),
+        'date': now.strftime("%d/%m/%Y"),
+        'time': now.strftime("%H:%M"),
+        'recipient': recipients[0] if recipients else '',
+        'recipients': ', '.join(recipients),
+        'sender_name': sender.get('name') or from_addr or '',
+    })
+    values.update(context or {})
+    
+    # Crea messaggio email
+    msg = MIMEMultipart()
+    msg['From'] = from_addr
+    msg['To'] = ', '.join(recipients)
+    msg['Subject'] = subject_format.render(values)
+    
+    # Aggiungi corpo
+    msg.attach(MIMEText(body_format.render(values), 'plain', 'utf-8'))
+    
+    # Aggiungi allegato PDF
+    if not _is_path(pdf_path) or os.path.exists(pdf_path):
+        part = _attachment_part(pdf_path, 'application', 'pdf')
+        part.add_header(
+            'Content-Disposition',
+            f'attachment; filename= {filename}'
+        )
+        msg.attach(part)
+
+    # Aggiungi eventuali allegati extra dal template (codifica base64 riusata)
+    for attachment in (template.attachments if template else ()):
+        if os.path.exists(attachment.path):
+            msg.attach(attachment.part())
+    
+    return msg
+
+
+def _attachment_bytes(source) -> bytes:
+    """Byte di un allegato: i bytes in memoria sono usati così come sono."""
+    if isinstance(source, bytes):
+        return source
+    if _is_path(source) or hasattr(source, 'read'):
+        with _open_binary(source) as f:
+            return f.read()
+    return bytes(source)
+
+
+# --- Template e configurazioni email ------------------------------------------
+
+class ParsedFileCache:
+    """
+    File di configurazione analizzati una volta e riusati, condivisi dal processo.
+    
+    Come SignatureImageRegistry la chiave è (percorso assoluto, mtime,
+    dimensione): un file modificato su disco viene analizzato di nuovo al
+    primo uso successivo. ``loader(path)`` produce il valore da conservare;
+    ``parses`` conta le analisi effettive (una per file e versione). Tiene al
+    massimo ``max_entries`` file, eliminando i meno usati di recente.
+    """
+    
+    def __init__(self, loader, max_entries: int = 64):
+        self.loader = loader
+        self.max_entries = max_entries
+        self.hits = 0
+        self.parses = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+    
+    def get(self, path):
+        """Valore analizzato per path; solleva OSError se il file non esiste."""
+        stat = os.stat(path)
+        key = (os.path.abspath(path), stat.st_mtime_ns, stat.st_size)
+        with self._lock:
+            if key in self._entries:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return self._entries[key]
+            self.parses += 1
+        value = self.loader(path)
+        with self._lock:
+            self._entries[key] = value
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+            return value
+    
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self.hits = self.parses = 0
+    
+    def stats(self) -> dict:
+        with self._lock:
+            return {'hits': self.hits, 'parses': self.parses, 'entries': len(self._entries)}
+
+
+class EmailFormat:
+    """
+    Testo con segnaposto {nome} analizzato una sola volta.
+    
+    Accetta la sintassi di str.format (specifiche come {pagine:>3} e
+    conversioni !r/!s/!a, graffe doppie per le graffe letterali), ma solo nomi
+    semplici. Un segnaposto senza valore resta nel testo così com'è invece di
+    far fallire l'invio. Solleva ValueError per graffe non bilanciate o nomi
+    non validi.
+    """
+    
+    def __init__(self, text: str):
+        self.text = text
+        self.segments = []
+        try:
+            for literal, field, spec, conversion in string.Formatter().parse(text):
+                if field is not None and not field.isidentifier():
+                    raise ValueError(f"segnaposto non valido: {{{field}}}")
+                if field is not None and spec and '{' in spec:
+                    raise ValueError(f"specifica annidata non supportata: {{{field}:{spec}}}")
+                self.segments.append((literal, field, spec, conversion))
+        except ValueError as e:
+            raise ValueError(f"Template non valido ({e}): {text[:60]!r}") from None
+        self.fields = frozenset(field for _, field, _, _ in self.segments if field is not None)
+    
+    def render(self, values: dict) -> str:
+        parts = []
+        for literal, field, spec, conversion in self.segments:
+            parts.append(literal)
+            if field is None:
+                continue
+            if field not in values:
+                suffix = (f"!{conversion}" if conversion else "") + (f":{spec}" if spec else "")
+                parts.append(f"{{{field}{suffix}}}")
+                continue
+            value = values[field]
+            if conversion == 'r':
+                value = repr(value)
+            elif conversion == 'a':
+                value = ascii(value)
+            elif conversion == 's':
+                value = str(value)
+            parts.append(format(value, spec or ''))
+        return ''.join(parts)
+
+
+class TemplateAttachment:
+    """
+    Allegato aggiuntivo di un template, risolto all'analisi del template.
+    Sotto EMAIL_STREAM_THRESHOLD la codifica base64 è calcolata una volta e
+    riusata per tutti i messaggi (di nuovo solo se il file cambia); oltre la
+    soglia l'allegato viene letto in streaming a ogni invio.
+    """
+    
+    def __init__(self, path):
+        self.path = path
+        self.name = Path(path).name
+        self._encoded = None   # (mtime_ns, dimensione, payload base64)
+        self._lock = threading.Lock()
+    
+    def part(self) -> MIMEBase:
+        stat = os.stat(self.path)
+        if stat.st_size > EMAIL_STREAM_THRESHOLD:
+            part = _StreamedAttachment(self.path, 'application', 'octet-stream')
+        else:
+            with self._lock:
+                if self._encoded is None or self._encoded[:2] != (stat.st_mtime_ns, stat.st_size):
+                    with open(self.path, 'rb') as f:
+                        data = f.read()
+                    self._encoded = (stat.st_mtime_ns, stat.st_size,
+                                     base64.encodebytes(data).decode('ascii'))
+                payload = self._encoded[2]
+            part = MIMEBase('application', 'octet-stream')
+            part.set_payload(payload)
+            part['Content-Transfer-Encoding'] = 'base64'
+        part.add_header('Content-Disposition', f'attachment; filename= {self.name}')
+        return part
+
+
+class EmailTemplate(NamedTuple):
+    """Template email compilato: oggetto e corpo (EmailFormat o None) e allegati aggiuntivi."""
+    path: str
+    subject: Optional[EmailFormat]
+    body: Optional[EmailFormat]
+    attachments: Tuple[TemplateAttachment, ...]
+
+
+# Prima riga "Oggetto: ..." o "Subject: ..." di un template di testo
+_TEXT_TEMPLATE_SUBJECT = re.compile(r'^(?:Oggetto|Subject):[ \t]*(.*?)\r?\n(?:[ \t]*\r?\n)?',
+                                    re.IGNORECASE)
+
+
+def compile_email_template(path) -> EmailTemplate:
+    """
+    Analizza un template email (YAML con subject, body e
+    additional_attachments, oppure testo) e lo valida. Nei template di testo
+    una prima riga "Oggetto: ..." indica l'oggetto. I percorsi degli allegati
+    relativi sono risolti rispetto alla cartella del template e, se non
+    esistono lì, alla cartella corrente; quelli inesistenti vengono ignorati
+    con un avviso. Solleva ValueError per un template non valido.
+    """
+    path = str(path)
+    with open(path, 'r', encoding='utf-8') as f:
+        content = f.read()
+    subject = body = None
+    attachment_paths = []
+    if path.endswith(('.yaml', '.yml')):
+        data = yaml.safe_load(content) or {}
+        if not isinstance(data, dict):
+            raise ValueError(f"Template email non valido (atteso un dizionario): {path}")
+        subject, body = data.get('subject'), data.get('body')
+        attachment_paths = data.get('additional_attachments') or []
+        if not isinstance(attachment_paths, list):
+            raise ValueError(f"additional_attachments deve essere un elenco: {path}")
+    else:
+        match = _TEXT_TEMPLATE_SUBJECT.match(content)
+        if match:
+            subject, content = match.group(1), content[match.end():]
+        body = content
+    for name, value in (('subject', subject), ('body', body)):
+        if value is not None and not isinstance(value, str):
+            raise ValueError(f"{name} del template deve essere un testo: {path}")
+    
+    attachments = []
+    base_dir = os.path.dirname(os.path.abspath(path))
+    for attach_path in attachment_paths:
+        attach_path = os.path.expanduser(str(attach_path))
+        candidates = [attach_path] if os.path.isabs(attach_path) else [
+            os.path.join(base_dir, attach_path), os.path.abspath(attach_path)]
+        found = next((c for c in candidates if os.path.isfile(c)), None)
+        if found is None:
+            print(f"⚠️ Allegato del template non trovato: {attach_path}")
+            continue
+        attachments.append(TemplateAttachment(found))
+    return EmailTemplate(
+        path,
+        EmailFormat(subject) if subject else None,
+        EmailFormat(body) if body else None,
+        tuple(attachments),
+    )
+
+
+def _read_email_config(config_path) -> dict:
+    with open(config_path, 'r', encoding='utf-8') as file:
+        if str(config_path).endswith(('.yaml', '.yml')):
+            return yaml.safe_load(file)
+        return json.load(file)
+
+
+# Template e configurazioni email analizzati una volta per file e versione
+EMAIL_TEMPLATES = ParsedFileCache(compile_email_template)
+EMAIL_CONFIGS = ParsedFileCache(_read_email_config)
+
+
+@functools.lru_cache(maxsize=256)
+def _email_format(text) -> EmailFormat:
+    """EmailFormat per oggetti e corpi passati come testo, riusato tra i messaggi."""
+    return EmailFormat(text)
+
+
+def _signing_context(kwargs) -> dict:
+    """Segnaposto ricavati dai parametri di firma: metadati e pagine firmate."""
+    pages = kwargs.get('pages', 'all')
+    pages_signed = 'tutte' if pages in (None, 'all') else str(pages)
+    if kwargs.get('exclude_pages'):
+        pages_signed += f" (escluse {kwargs['exclude_pages']})"
+    return {
+        'author': kwargs.get('author') or '',
+        'title': kwargs.get('title') or '',
+        'subject': kwargs.get('subject') or '',
+        'pages': pages_signed,
+        'pages_signed': pages_signed,
+    }
+
+
+def load_email_config(config_path: str) -> dict:
+    """
+    Carica configurazione email da file YAML o JSON. Il file viene analizzato
+    una volta e riletto solo se cambia (EMAIL_CONFIGS); ogni chiamata riceve
+    una copia, modificabile senza effetti sulle successive.
+    """
+    try:
+        return copy.deepcopy(EMAIL_CONFIGS.get(config_path))
+    except Exception as e:
+        raise ValueError(f"Errore nel caricamento configurazione email: {e}")
+
+
+# --- Limiti di invio per provider ---------------------------------------------
+
+# Limiti predefiniti dei relay più comuni (vedi email_config_example.yaml),
+# sovrascrivibili con la sezione rate_limit della configurazione email
+PROVIDER_RATE_LIMITS = {
+    'smtp.gmail.com': {'messages_per_minute': 60, 'burst': 10, 'max_connections': 3},
+    'smtp-mail.outlook.com': {'messages_per_minute': 30, 'burst': 5, 'max_connections': 3},
+    'smtp.office365.com': {'messages_per_minute': 30, 'burst': 5, 'max_connections': 3},
+    'smtp.mail.yahoo.com': {'messages_per_minute': 20, 'burst': 5, 'max_connections': 2},
+}
+
+
+def _smtp_throttled(error) -> bool:
+    """True per le risposte 4xx con cui il relay chiede di rallentare (AUTH esclusa)."""
+    if isinstance(error, smtplib.SMTPRecipientsRefused):
+        codes = [code for code, _ in error.recipients.values()]
+        return bool(codes) and all(400 <= code < 500 for code in codes)
+    if isinstance(error, smtplib.SMTPAuthenticationError):
+        return False
+    return isinstance(error, smtplib.SMTPResponseException) and 400 <= error.smtp_code < 500
+
+
+class ProviderLimit:
+    """
+    Limite di invio verso un provider: secchiello di gettoni (token bucket)
+    da ``messages_per_minute`` messaggi al minuto con ``burst`` invii
+    consecutivi, e al massimo ``max_connections`` invii contemporanei.
+    Senza messages_per_minute la velocità non è limitata.
+    
+    Adattivo: a ogni risposta 4xx di rallentamento (throttled) gli invii
+    verso il provider si fermano per ``backoff_base`` secondi, raddoppiati a
+    ogni rifiuto consecutivo fino a ``backoff_max``, e la velocità si dimezza
+    (non sotto un decimo di quella configurata); ogni invio riuscito azzera
+    la pausa e riporta la velocità verso quella configurata un decimo alla
+    volta. Thread-safe.
+    """
+    
+    def __init__(self, messages_per_minute: Optional[float] = None, burst: Optional[int] = None,
+                 max_connections: Optional[int] = None, backoff_base: float = 5.0,
+                 backoff_max: float = 120.0):
+        self.rate = messages_per_minute / 60.0 if messages_per_minute else None
+        self.current_rate = self.rate
+        self.capacity = max(1, burst or 1)
+        self.max_connections = max_connections
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+        self.sent = 0
+        self.throttles = 0
+        self.waited = 0.0
+        self._tokens = float(self.capacity)
+        self._updated = time.monotonic()
+        self._pause_until = 0.0
+        self._backoff = 0.0
+        self._slots = threading.BoundedSemaphore(max_connections) if max_connections else None
+        self._lock = threading.Lock()
+    
+    def _wait_time(self, now) -> float:
+        """Attesa necessaria prima del prossimo invio; 0 se il gettone è stato preso."""
+        pause = self._pause_until - now
+        if pause > 0:
+            return pause
+        if self.current_rate is None:
+            return 0.0
+        self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.current_rate)
+        self._updated = now
+        if self._tokens >= 1:
+            self._tokens -= 1
+            return 0.0
+        return (1 - self._tokens) / self.current_rate
+    
+    def acquire(self, cancel: Optional[threading.Event] = None) -> bool:
+        """
+        Attende un posto libero e un gettone; False se ``cancel`` viene
+        impostato nel frattempo (nessun posto occupato in quel caso).
+        """
+        if self._slots is not None:
+            while not self._slots.acquire(timeout=0.1):
+                if cancel is not None and cancel.is_set():
+                    return False
+        start = time.monotonic()
+        while True:
+            with self._lock:
+                wait = self._wait_time(time.monotonic())
+                if wait <= 0:
+                    self.waited += time.monotonic() - start
+                    return True
+            if cancel is not None and cancel.wait(wait):
+                self.release()
+                return False
+            if cancel is None:
+                time.sleep(wait)
+    
+    def release(self):
+        if self._slots is not None:
+            self._slots.release()
+    
+    def succeeded(self):
+        with self._lock:
+            self.sent += 1
+            self._backoff = 0.0
+            if self.rate is not None:
+                self.current_rate = min(self.rate, self.current_rate + self.rate / 10)
+    
+    def throttled(self):
+        with self._lock:
+            self.throttles += 1
+            self._backoff = min(self.backoff_max, self._backoff * 2 or self.backoff_base)
+            self._pause_until = time.monotonic() + self._backoff
+            if self.rate is not None:
+                self.current_rate = max(self.rate / 10, self.current_rate / 2)
+    
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                'sent': self.sent,
+                'throttled': self.throttles,
+                'messages_per_minute': round(self.current_rate * 60, 1) if self.rate else None,
+                'max_connections': self.max_connections,
+                'waited_s': round(self.waited, 3),
+                'paused_s': round(max(0.0, self._pause_until - time.monotonic()), 3),
+            }
+
+
+class SmtpRateLimiter:
+    """
+    Un ProviderLimit per ogni server e utente SMTP, creato al primo invio.
+    I limiti vengono da PROVIDER_RATE_LIMITS per i relay noti e dalla sezione
+    ``rate_limit`` della configurazione email (anche dentro ``smtp``), con
+    messages_per_minute, burst e max_connections. Per gli altri server il
+    limite è solo ``max_connections`` invii contemporanei.
+    """
+    
+    def __init__(self, max_connections: Optional[int] = None, backoff_base: float = 5.0,
+                 backoff_max: float = 120.0):
+        self.max_connections = max_connections
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+        self._limits = {}
+        self._lock = threading.Lock()
+    
+    def limit(self, email_config) -> ProviderLimit:
+        settings = _smtp_settings(email_config)
+        key = (settings.server, settings.port, settings.username)
+        with self._lock:
+            limit = self._limits.get(key)
+            if limit is None:
+                options = {'max_connections': self.max_connections}
+                options.update(PROVIDER_RATE_LIMITS.get(str(settings.server).lower(), {}))
+                smtp_config = email_config.get('smtp') if isinstance(email_config.get('smtp'), dict) else {}
+                options.update(smtp_config.get('rate_limit') or email_config.get('rate_limit') or {})
+                limit = self._limits[key] = ProviderLimit(
+                    options.get('messages_per_minute'), options.get('burst'),
+                    options.get('max_connections'), self.backoff_base, self.backoff_max)
+            return limit
+    
+    def stats(self) -> dict:
+        with self._lock:
+            limits = dict(self._limits)
+        return {(f"{user}@" if user else "") + f"{server}:{port}": limit.stats()
+                for (server, port, user), limit in limits.items()}
+
+
+# --- Coda email (outbox) ------------------------------------------------------
+
+DEFAULT_OUTBOX_DIR = Path.home() / ".pdf_signer" / "outbox"
+
+
+def _pid_alive(pid) -> bool:
+    """True se esiste un processo con questo pid."""
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        return True
+    return True
+
+
+def _smtp_permanent(error) -> bool:
+    """True per i rifiuti definitivi (5xx) da non ritentare; AUTH e rete restano temporanei."""
+    if isinstance(error, smtplib.SMTPRecipientsRefused):
+        codes = [code for code, _ in error.recipients.values()]
+        return bool(codes) and all(500 <= code < 600 for code in codes)
+    if isinstance(error, smtplib.SMTPAuthenticationError):
+        return False
+    return isinstance(error, smtplib.SMTPResponseException) and 500 <= error.smtp_code < 600
+
+
+# Password delle configurazioni in memoria accodate da questo processo, per
+# account SMTP (server, porta, utente): non vengono mai scritte nella coda
+_OUTBOX_PASSWORDS = {}
+
+
+def _smtp_account(email_config):
+    settings = _smtp_settings(email_config)
+    return settings.server, settings.port, settings.username
+
+
+def _without_password(email_config):
+    """(copia di email_config senza password, password rimossa)."""
+    config = copy.deepcopy(email_config)
+    return config, config.get('smtp', config).pop('password', None)
+
+
+def _with_password(email_config):
+    """Configurazione accodata con la password tenuta in memoria (_OUTBOX_PASSWORDS)."""
+    password = _OUTBOX_PASSWORDS.get(_smtp_account(email_config))
+    if password is None:
+        raise PermissionError("password SMTP non disponibile: il processo che ha accodato il "
+                              "messaggio è terminato (usare un file di configurazione)")
+    config = copy.deepcopy(email_config)
+    config.get('smtp', config)['password'] = password
+    return config
+
+
+class EmailOutbox:
+    """
+    Coda persistente delle email da inviare, separata dalla firma.
+    
+    La firma si limita ad accodare il messaggio già costruito (enqueue) e
+    prosegue senza attendere il server SMTP; l'invio avviene dopo, da
+    OutboxSender o da process(). Ogni messaggio è un file ``messages/<id>.eml``
+    accompagnato da una scheda JSON che si sposta tra le cartelle di stato:
+    
+    - ``pending/``: da inviare, non prima di ``next_attempt``;
+    - ``sending/<id>.<pid>.json``: preso in carico dal processo pid (lo
+      spostamento con os.rename è atomico: due mittenti, anche in processi
+      diversi, non prendono mai lo stesso messaggio);
+    - ``sent/`` e ``failed/``: esito finale (il file .eml viene eliminato).
+    
+    Ogni scrittura passa da un file temporaneo, fsync e os.replace(): dopo
+    un'interruzione la coda è sempre coerente e recover() rimette in
+    ``pending/`` i messaggi presi in carico da processi terminati (o fermi da
+    più di ``lease`` secondi). Un errore temporaneo rinvia il messaggio con
+    attesa esponenziale (``backoff_base`` · 2^tentativi, al massimo
+    ``backoff_max`` secondi); un rifiuto definitivo (5xx) o ``max_attempts``
+    tentativi lo spostano in ``failed/``. La configurazione email indicata
+    come percorso viene riletta al momento dell'invio, così le credenziali
+    non vengono copiate nella coda. Di una configurazione in memoria
+    (dizionario) si scrive una copia senza password: la password resta solo
+    nel processo che ha accodato il messaggio (vedi _OUTBOX_PASSWORDS) e,
+    se il processo termina prima dell'invio, il messaggio fallisce.
+    """
+    
+    STATES = ('pending', 'sending', 'sent', 'failed')
+    
+    def __init__(self, directory=None, max_attempts: int = 8, backoff_base: float = 30.0,
+                 backoff_max: float = 3600.0, lease: float = 600.0,
+                 keep_sent: float = 7 * 24 * 3600):
+        self.directory = Path(directory) if directory else DEFAULT_OUTBOX_DIR
+        self.max_attempts = max_attempts
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+        self.lease = lease
+        self.keep_sent = keep_sent
+        for name in ('messages',) + self.STATES:
+            (self.directory / name).mkdir(parents=True, exist_ok=True)
+        # Segnala ai mittenti di questo processo che c'è un nuovo messaggio
+        self.wakeup = threading.Event()
+    
+    @staticmethod
+    def _write(path, data):
+        """Scrittura atomica di bytes o di un iterabile di blocchi di bytes."""
+        fd, temp_path = tempfile.mkstemp(dir=path.parent, suffix='.tmp')
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                if isinstance(data, bytes):
+                    data = (data,)
+                for chunk in data:
+                    f.write(chunk)
+                f.flush()
+                os.fsync(f.fileno())
+            os.replace(temp_path, path)
+        except BaseException:
+            with contextlib.suppress(OSError):
+                os.unlink(temp_path)
+            raise
+    
+    def _write_meta(self, path, meta):
+        self._write(path, json.dumps(meta, ensure_ascii=False).encode('utf-8'))
+    
+    @staticmethod
+    def _read_meta(path):
+        with open(path, 'r', encoding='utf-8') as f:
+            return json.load(f)
+    
+    def _message_path(self, message_id):
+        return self.directory / 'messages' / f"{message_id}.eml"
+    
+    def enqueue(self, msg, email_config, recipients=None) -> str:
+        """
+        Accoda msg (email.message.Message) per l'invio con il server di
+        email_config (percorso del file di configurazione o dizionario) e
+        restituisce l'identificativo del messaggio.
+        
+        """
+        message_id = f"{time.time_ns():x}-{uuid.uuid4().hex[:8]}"
+        now = time.time()
+        meta = {
+            'id': message_id,
+            'created': now,
+            'attempts': 0,
+            'next_attempt': now,
+            'last_error': None,
+            'email_config': os.path.abspath(email_config) if _is_path(email_config) else email_config,
+            'recipients': list(recipients or msg.get_all('To', [])),
+            'subject': msg.get('Subject'),
+        }
+        if not _is_path(email_config) and _smtp_settings(email_config).password:
+            # Mai password in chiaro nella coda
+            meta['email_config'], password = _without_password(email_config)
+            _OUTBOX_PASSWORDS[_smtp_account(email_config)] = password
+            meta['password_in_memory'] = True
+        # Prima il messaggio, poi la scheda: è la scheda in pending/ a renderlo visibile
+        self._write(self._message_path(message_id), iter_message_bytes(msg))
+        self._write_meta(self.directory / 'pending' / f"{message_id}.json", meta)
+        self.wakeup.set()
+        return message_id
+    
+    def _pending(self):
+        entries = []
+        for path in (self.directory / 'pending').glob('*.json'):
+            try:
+                entries.append((self._read_meta(path)['next_attempt'], path.stem))
+            except (OSError, ValueError, KeyError):
+                continue   # già preso da un altro mittente o in scrittura
+        return sorted(entries)
+    
+    def due(self, now=None) -> List[str]:
+        """Identificativi dei messaggi da inviare ora, dal più vecchio."""
+        now = time.time() if now is None else now
+        return [message_id for next_attempt, message_id in self._pending() if next_attempt <= now]
+    
+    def next_due(self) -> Optional[float]:
+        """Istante del prossimo tentativo in attesa (None se la coda è vuota)."""
+        pending = self._pending()
+        return pending[0][0] if pending else None
+    
+    def _sending_path(self, message_id):
+        return self.directory / 'sending' / f"{message_id}.{os.getpid()}.json"
+    
+    def claim(self, message_id) -> bool:
+        """Prende in carico un messaggio in attesa; False se un altro mittente l'ha già preso."""
+        claimed = self._sending_path(message_id)
+        try:
+            os.rename(self.directory / 'pending' / f"{message_id}.json", claimed)
+        except FileNotFoundError:
+            return False
+        # os.rename conserva l'mtime: lo si aggiorna per il calcolo del lease
+        with contextlib.suppress(OSError):
+            os.utime(claimed)
+        return True
+    
+    def claim_next(self) -> Optional[str]:
+        """Prende in carico il primo messaggio scaduto (None se non ce ne sono)."""
+        for message_id in self.due():
+            if self.claim(message_id):
+                return message_id
+        return None
+    
+    def deliver(self, message_id, pool=None, limiter=None, cancel=None) -> str:
+        """
+        Invia un messaggio preso in carico con claim_next() e ne registra
+        l'esito: 'sent', 'deferred' (nuovo tentativo più tardi) o 'failed'.
+        Con un SmtpRateLimiter l'invio rispetta i limiti del provider; se
+        ``cancel`` viene impostato durante l'attesa il messaggio torna in
+        coda senza contare il tentativo ('cancelled').
+        """
+        claimed = self._sending_path(message_id)
+        meta = self._read_meta(claimed)
+        meta['attempts'] += 1
+        limit = None
+        try:
+            config = meta['email_config']
+            if isinstance(config, str):
+                config = load_email_config(config)
+            elif meta.get('password_in_memory'):
+                config = _with_password(config)
+            path = self._message_path(message_id)
+            if not path.exists():
+                raise FileNotFoundError(f"messaggio mancante: {path}")
+            # Inviato riga per riga dal file: memoria costante anche con allegati grandi
+            msg = _EmlFile(path, meta['recipients'])
+            if limiter is not None:
+                limit = limiter.limit(config)
+                if not limit.acquire(cancel):
+                    # Scheda su disco invariata: il tentativo non conta
+                    os.replace(claimed, self.directory / 'pending' / f"{message_id}.json")
+                    return 'cancelled'
+            try:
+                if pool is not None:
+                    pool.send(msg, config)
+                else:
+                    server = _smtp_connect(_smtp_settings(config))
+                    try:
+                        _send_message(server, msg)
+                    finally:
+                        SmtpConnectionPool._quit(server)
+            finally:
+                if limit is not None:
+                    limit.release()
+        except Exception as e:
+            if limit is not None and _smtp_throttled(e):
+                limit.throttled()
+            meta['last_error'] = f"{type(e).__name__}: {e}"
+            permanent = _smtp_permanent(e) or isinstance(e, (FileNotFoundError, PermissionError))
+            if permanent or meta['attempts'] >= self.max_attempts:
+                return self._finish(claimed, meta, 'failed')
+            delay = min(self.backoff_max, self.backoff_base * 2 ** (meta['attempts'] - 1))
+            meta['next_attempt'] = time.time() + delay
+            meta.pop('claimed', None)
+            self._write_meta(claimed, meta)
+            os.replace(claimed, self.directory / 'pending' / f"{message_id}.json")
+            return 'deferred'
+        if limit is not None:
+            limit.succeeded()
+        meta['last_error'] = None
+        return self._finish(claimed, meta, 'sent')
+    
+    def _finish(self, claimed, meta, state):
+        meta['finished'] = time.time()
+        self._write_meta(claimed, meta)
+        os.replace(claimed, self.directory / state / f"{meta['id']}.json")
+        with contextlib.suppress(FileNotFoundError):
+            self._message_path(meta['id']).unlink()
+        return state
+    
+    def recover(self) -> int:
+        """
+        Rimette in pending/ i messaggi presi in carico da processi terminati
+        (o da più di ``lease`` secondi) ed elimina i residui di scritture
+        interrotte e le schede inviate più vecchie di ``keep_sent``.
+        Restituisce il numero di messaggi recuperati.
+        """
+        now = time.time()
+        recovered = 0
+        for path in (self.directory / 'sending').glob('*.json'):
+            message_id, _, pid = path.stem.partition('.')
+            try:
+                alive = _pid_alive(int(pid))
+                stalled = now - path.stat().st_mtime > self.lease and int(pid) != os.getpid()
+            except (ValueError, OSError):
+                continue
+            if alive and not stalled:
+                continue
+            done = any((self.directory / state / f"{message_id}.json").exists()
+                       for state in ('sent', 'failed'))
+            with contextlib.suppress(FileNotFoundError):
+                if done:
+                    path.unlink()
+                else:
+                    os.rename(path, self.directory / 'pending' / f"{message_id}.json")
+                    recovered += 1
+        known = {path.name.partition('.')[0] for state in ('pending', 'sending')
+                 for path in (self.directory / state).glob('*.json')}
+        for path in itertools.chain((self.directory / 'messages').glob('*.eml'),
+                                    *((self.directory / state).glob('*.tmp')
+                                      for state in ('messages',) + self.STATES)):
+            with contextlib.suppress(OSError):
+                if path.stem not in known and now - path.stat().st_mtime > self.lease:
+                    path.unlink()
+        for path in (self.directory / 'sent').glob('*.json'):
+            with contextlib.suppress(OSError):
+                if now - path.stat().st_mtime > self.keep_sent:
+                    path.unlink()
+        return recovered
+    
+    def retry_now(self) -> int:
+        """Anticipa a ora il prossimo tentativo dei messaggi in attesa; restituisce quanti."""
+        now = time.time()
+        changed = 0
+        for next_attempt, message_id in self._pending():
+            # Preso in carico prima di modificarlo: nessun altro mittente lo sta inviando
+            if next_attempt <= now or not self.claim(message_id):
+                continue
+            claimed = self._sending_path(message_id)
+            meta = self._read_meta(claimed)
+            meta['next_attempt'] = now
+            self._write_meta(claimed, meta)
+            os.replace(claimed, self.directory / 'pending' / f"{message_id}.json")
+            changed += 1
+        return changed
+    
+    def process(self, pool=None, force: bool = False) -> Dict[str, int]:
+        """
+        Invia subito tutti i messaggi scaduti (con force=True anche quelli in
+        attesa di un nuovo tentativo); restituisce i conteggi per esito.
+        """
+        counts = {'sent': 0, 'deferred': 0, 'failed': 0}
+        if force:
+            # Un solo tentativo per messaggio: quelli rinviati ora hanno un nuovo orario
+            self.retry_now()
+        while True:
+            message_id = self.claim_next()
+            if message_id is None:
+                return counts
+            counts[self.deliver(message_id, pool)] += 1
+    
+    def status(self, message_id) -> Optional[dict]:
+        """Scheda del messaggio con il suo stato ('state'), o None se sconosciuto."""
+        for state in self.STATES:
+            pattern = f"{message_id}.*json" if state == 'sending' else f"{message_id}.json"
+            for path in (self.directory / state).glob(pattern):
+                try:
+                    return dict(self._read_meta(path), state=state)
+                except (OSError, ValueError):
+                    continue
+        return None
+    
+    def counts(self) -> Dict[str, int]:
+        """Numero di messaggi in ciascuno stato."""
+        return {state: sum(1 for _ in (self.directory / state).glob('*.json'))
+                for state in self.STATES}
+
+
+class OutboxSender:
+    """
+    Svuota una EmailOutbox in sottofondo con ``workers`` thread, cioè fino a
+    ``workers`` connessioni SMTP contemporanee, che condividono un
+    SmtpConnectionPool. I messaggi accodati da questo processo vengono
+    inviati subito (EmailOutbox.wakeup), quelli di altri processi e i nuovi
+    tentativi entro ``poll_interval`` secondi. All'avvio recupera i messaggi
+    rimasti in sospeso da esecuzioni interrotte. Gli invii rispettano i
+    limiti per provider di ``limiter`` (SmtpRateLimiter) e rallentano da
+    soli sulle risposte 4xx; stats() riporta esiti e throughput.
+    """
+    
+    def __init__(self, outbox, workers: int = 2, poll_interval: float = 1.0, pool=None,
+                 limiter=None):
+        self.outbox = outbox if isinstance(outbox, EmailOutbox) else EmailOutbox(outbox)
+        self.workers = workers
+        self.poll_interval = poll_interval
+        self.pool = pool or SmtpConnectionPool(max_idle=workers)
+        self._own_pool = pool is None
+        self.limiter = limiter or SmtpRateLimiter(max_connections=workers)
+        self.counts = {'sent': 0, 'deferred': 0, 'failed': 0}
+        self._lock = threading.Lock()
+        self._stopping = threading.Event()
+        self._cancel = threading.Event()
+        self._drain = True
+        self._threads = []
+        self._started = None
+        self._stopped = None
+    
+    def start(self) -> 'OutboxSender':
+        self._started = time.monotonic()
+        self.outbox.recover()
+        for i in range(self.workers):
+            thread = threading.Thread(target=self._run, name=f"outbox-{i}", daemon=True)
+            thread.start()
+            self._threads.append(thread)
+        return self
+    
+    def wake(self):
+        """Controlla subito la coda (per esempio dopo un enqueue da un altro oggetto)."""
+        self.outbox.wakeup.set()
+    
+    def _run(self):
+        while not (self._stopping.is_set() and not self._drain):
             try:
-                offset_parts = [int(x) for x in args.shadow_offset.split(',')]
-                if len(offset_parts) == 2:
-                    kwargs['shadow_offset'] = tuple(offset_parts)
-            except ValueError:
-                print("⚠️ Formato offset ombra non valido, uso default")
-                kwargs['shadow_offset'] = (5, 5)
-        
-        # Timestamp
-        if args.timestamp:
-            kwargs['timestamp'] = True
-            kwargs['timestamp_format'] = args.timestamp_format
-            if args.timestamp_custom:
-                kwargs['timestamp_custom'] = args.timestamp_custom
-        
-        # Metadati
-        if args.add_metadata or args.author or args.title or args.subject:
-            kwargs['add_metadata'] = True
-            if args.author:
-                kwargs['author'] = args.author
-            if args.title:
-                kwargs['title'] = args.title
-            if args.subject:
-                kwargs['subject'] = args.subject
-        
-        # Email
-        if args.email_config and args.email_recipients:
-            kwargs['email_config'] = args.email_config
-            kwargs['email_recipients'] = [r.strip() for r in args.email_recipients.split(',')]
-            if args.email_template:
-                kwargs['email_template'] = args.email_template
+                message_id = self.outbox.claim_next()
+                if message_id is not None:
+                    state = self.outbox.deliver(message_id, self.pool, self.limiter, self._cancel)
+                    if state in self.counts:
+                        with self._lock:
+                            self.counts[state] += 1
+                    continue
+            except Exception as e:
+                print(f"⚠️ Errore nella coda email: {e}")
+            if self._stopping.is_set():
+                return
+            if self.outbox.wakeup.wait(self.poll_interval):
+                self.outbox.wakeup.clear()
+    
+    def stop(self, drain: bool = True):
+        """
+        Ferma i thread: con drain=True dopo aver inviato i messaggi già
+        scaduti, altrimenti dopo il messaggio in corso. I messaggi rinviati
+        restano nella coda per l'esecuzione successiva.
+        """
+        self._drain = drain
+        if not drain:
+            self._cancel.set()
+        self._stopping.set()
+        self.outbox.wakeup.set()
+        for thread in self._threads:
+            thread.join()
+        self._threads = []
+        self._stopped = time.monotonic()
+        if self._own_pool:
+            self.pool.close()
+    
+    def stats(self) -> dict:
+        """Esiti degli invii, throughput dall'avvio e stato dei limiti per provider."""
+        with self._lock:
+            counts = dict(self.counts)
+        end = self._stopped or time.monotonic()
+        elapsed = end - self._started if self._started else 0.0
+        return dict(counts,
+                    elapsed_s=round(elapsed, 3),
+                    messages_per_s=round(counts['sent'] / elapsed, 2) if elapsed else 0.0,
+                    providers=self.limiter.stats())
+    
+    def __enter__(self):
+        return self.start()
+    
+    def __exit__(self, *exc_info):
+        self.stop()
+
+
+def _print_outbox_summary(outbox, counts):
+    throughput = ""
+    if counts['sent'] and 'messages_per_s' in counts:
+        throughput = f" ({counts['messages_per_s']} email/s)"
+    print(f"📮 Coda email: {counts['sent']} inviate, {counts['deferred']} rinviate, "
+          f"{counts['failed']} fallite{throughput}")
+    for provider, limit in counts.get('providers', {}).items():
+        if limit['throttled']:
+            print(f"   {provider}: rallentato {limit['throttled']} volte dal server")
+    waiting = outbox.counts()['pending']
+    if waiting:
+        print(f"   {waiting} in attesa in {outbox.directory} (inviare con --outbox-send)")
+
+
+def _run_outbox_send(args):
+    """
+    Invia subito tutte le email in coda (--outbox-send), senza attendere i
+    tempi dei nuovi tentativi; 1 se qualcuna è fallita definitivamente.
+    """
+    outbox = EmailOutbox(args.outbox or DEFAULT_OUTBOX_DIR)
+    outbox.recover()
+    outbox.retry_now()
+    sender = OutboxSender(outbox, args.outbox_workers).start()
+    sender.stop()
+    stats = sender.stats()
+    _print_outbox_summary(outbox, stats)
+    return 1 if stats['failed'] else 0
+
+
+# Modalità di applicazione del marchio sulle pagine:
+# - "merge": page.merge_page() copia contenuto e risorse del marchio in ogni pagina
+# - "xobject": il marchio è registrato una sola volta come Form XObject e ogni
+#   pagina riceve solo un breve flusso "q ... cm /Nome Do Q" che lo richiama
+STAMP_MODES = ("merge", "xobject")
+
+
+class _XObjectStamper:
+    """
+    Applica un marchio registrato una sola volta come Form XObject.
+    
+    La destinazione è un PdfWriter oppure un _IncrementalUpdate (entrambi
+    espongono _add_object).
+    Le risorse del marchio (immagini, maschere) vengono copiate nel documento di
+    output una volta sola per ogni pagina marchio distinta (una per dimensione
+    visibile, vedi StampCache). Su ogni pagina firmata si aggiungono un
+    riferimento al XObject nelle risorse e due flussi di contenuto condivisi da
+    tutte le pagine con la stessa geometria: "q" prima del contenuto originale e
+    "Q q a b c d e f cm /Nome Do Q" dopo, così lo stato grafico della pagina non
+    influenza il marchio.
+    """
+    
+    NAME = '/PdfSignerStamp'
+    
+    def __init__(self, writer, stamp_page=None):
+        self.writer = writer
+        self.prefix_ref = self._add_stream(b"q\n")
+        self._xobjects = {}
+        self._suffix_refs = {}
+        self._resources = {}
+        self._stamp_page = stamp_page
+        self.xobject_ref = self._xobject_ref(stamp_page) if stamp_page is not None else None
+    
+    def _xobject_ref(self, stamp_page):
+        key = id(stamp_page)
+        if key not in self._xobjects:
+            ref = self.writer._add_object(self._page_to_xobject(stamp_page))
+            # Il riferimento alla pagina mantiene valido id(stamp_page) per la cache
+            self._xobjects[key] = (ref, stamp_page)
+        return self._xobjects[key][0]
+    
+    def _page_to_xobject(self, stamp_page):
+        """Converte la pagina del marchio in un Form XObject clonato nel writer."""
+        contents = stamp_page.get_contents()
+        if isinstance(contents, ArrayObject):
+            data = b"\n".join(part.get_object().get_data() for part in contents)
+        else:
+            data = contents.get_data()
+        form = DecodedStreamObject()
+        form.set_data(data)
+        form = form.flate_encode()
+        box = stamp_page.mediabox
+        form.update({
+            NameObject('/Type'): NameObject('/XObject'),
+            NameObject('/Subtype'): NameObject('/Form'),
+            NameObject('/BBox'): ArrayObject([
+                NumberObject(int(float(v))) if float(v).is_integer() else v
+                for v in (box.left, box.bottom, box.right, box.top)
+            ]),
+            NameObject('/Resources'): self._import(stamp_page['/Resources'].get_object()),
+        })
+        return form
+    
+    def _import(self, obj):
+        """Copia un oggetto del PDF del marchio nel documento di destinazione."""
+        if isinstance(self.writer, PdfWriter):
+            return obj.clone(self.writer)
+        # _IncrementalUpdate rinumera gli oggetti esterni durante la scrittura
+        return obj
+    
+    def _add_stream(self, data):
+        stream = DecodedStreamObject()
+        stream.set_data(data)
+        return self.writer._add_object(stream)
+    
+    def _suffix_ref(self, name, matrix=IDENTITY_MATRIX):
+        key = (name, matrix)
+        if key not in self._suffix_refs:
+            cm = " ".join(_pdf_number(v) for v in matrix)
+            self._suffix_refs[key] = self._add_stream(
+                f"\nQ\nq\n{cm} cm\n{name} Do\nQ\n".encode('ascii')
+            )
+        return self._suffix_refs[key]
+    
+    def _stamped_resources(self, page, xobject_ref):
+        """
+        Restituisce (riferimento risorse, nome XObject) per la pagina.
+        Le pagine che condividono lo stesso dizionario risorse e lo stesso
+        marchio condividono anche la copia con il marchio.
+        """
+        original = page.get('/Resources')
+        resources = original.get_object() if original is not None else DictionaryObject()
+        key = (id(resources), xobject_ref.idnum)
+        if key not in self._resources:
+            updated = DictionaryObject(resources)
+            xobjects = resources.get('/XObject')
+            xobjects = DictionaryObject(xobjects.get_object()) if xobjects is not None else DictionaryObject()
+            name, counter = self.NAME, 0
+            while name in xobjects and xobjects[name] != xobject_ref:
+                counter += 1
+                name = f"{self.NAME}{counter}"
+            xobjects[NameObject(name)] = xobject_ref
+            updated[NameObject('/XObject')] = xobjects
+            # Il riferimento all'originale mantiene valido id(resources) per la cache
+            self._resources[key] = (self.writer._add_object(updated), name, resources)
+        ref, name, _ = self._resources[key]
+        return ref, name
+    
+    def apply(self, page, stamp_pages=None, matrix=IDENTITY_MATRIX):
+        """
+        Aggiunge il marchio a una pagina già inserita nel writer.
         
-        print(f"🔄 Inizio elaborazione: {args.input_pdf}")
-        if kwargs:
-            features = []
-            if 'pages' in kwargs and kwargs['pages'] != 'all':
-                features.append(f"pagine: {kwargs['pages']}")
-            if 'border_width' in kwargs:
-                features.append("bordo")
-            if 'shadow_enabled' in kwargs:
-                features.append("ombra")
-            if 'timestamp' in kwargs:
-                features.append("timestamp")
-            if 'add_metadata' in kwargs:
-                features.append("metadati")
-            if 'email_config' in kwargs:
-                features.append("email")
-            
-            if features:
-                print(f"⚙️ Funzionalità attive: {', '.join(features)}")
-        
-        success = add_watermark_to_pdf(
-            args.input_pdf,
-            args.watermark,
-            args.output,
-            args.scale,
-            args.position,
-            **kwargs
+        stamp_pages e matrix sono quelli restituiti da StampCache.lookup()
+        (modalità "xobject"); se omessi si usa la pagina passata al costruttore.
+        """
+        stamp_page = stamp_pages[0] if stamp_pages else self._stamp_page
+        resources_ref, name = self._stamped_resources(page, self._xobject_ref(stamp_page))
+        contents = page.get('/Contents')
+        if contents is None:
+            items = []
+        else:
+            resolved = contents.get_object()
+            items = list(resolved) if isinstance(resolved, ArrayObject) else [contents]
+        page[NameObject('/Contents')] = ArrayObject(
+            [self.prefix_ref, *items, self._suffix_ref(name, matrix)]
         )
+        page[NameObject('/Resources')] = resources_ref
+
+
+def _pdf_number(value):
+    """Formatta un numero per un flusso di contenuto PDF (al più 4 decimali)."""
+    text = f"{float(value):.4f}".rstrip('0').rstrip('.')
+    return text if text not in ('', '-0') else '0'
+
+
+class _IncrementalUpdate:
+    """
+    Aggiornamento incrementale di un PDF esistente (ISO 32000-1, 7.5.6).
+    
+    I byte del file originale non vengono modificati: in coda si aggiungono solo
+    gli oggetti nuovi o modificati (XObject del marchio, dizionari pagina, flussi
+    di contenuto, metadati), una nuova sezione xref e un trailer con /Prev che
+    punta alla sezione precedente. Le firme digitali già presenti (ByteRange)
+    restano quindi valide. Se il file originale usa flussi xref, anche la nuova
+    sezione viene scritta come flusso xref.
+    
+    Gli oggetti che provengono da altri PDF (ad esempio le immagini del marchio)
+    ricevono nuovi numeri al momento della scrittura.
+    """
+    
+    def __init__(self, session):
+        reader = session.reader
+        if reader.is_encrypted:
+            raise ValueError("Aggiornamento incrementale non supportato per PDF cifrati")
+        self.session = session
+        self.reader = reader
+        self._pending = {}   # numero oggetto -> (generazione, oggetto)
+        self._imported = {}  # (id(pdf esterno), numero) -> numero assegnato
+        self._info_ref = reader.trailer.raw_get('/Info') if '/Info' in reader.trailer else None
+        self._prev_xref, self._prev_is_stream, size = self._locate_previous_xref()
+        self._next_number = size
+    
+    def _locate_previous_xref(self):
+        """
+        Restituisce (offset, è_flusso_xref, /Size) dell'ultima sezione xref
+        originale.
+        """
+        stream = self.reader.stream
+        stream.seek(0, os.SEEK_END)
+        file_size = stream.tell()
+        stream.seek(max(0, file_size - 16384))
+        tail = stream.read()
+        # L'ultimo startxref, anche se dopo %%EOF ci sono altri byte
+        # (riempimento con NUL o spazi di alcuni scanner)
+        matches = list(re.finditer(rb'startxref\s+(\d+)', tail))
+        if not matches:
+            raise ValueError("Impossibile individuare la sezione xref del PDF originale")
+        offset = int(matches[-1].group(1))
+        stream.seek(offset)
+        head = stream.read(4096)
+        is_stream = not head.startswith(b'xref')
         
-        if success:
-            print(f"✅ Completato! File salvato: {args.output}")
-            return 0
+        # Con i flussi xref PyPDF2 non riporta /Size nel trailer: lo si legge
+        # dal dizionario del flusso, tenendo comunque conto degli oggetti noti
+        size = self.reader.trailer.get('/Size')
+        if size is None:
+            found = re.search(rb'/Size\s+(\d+)', head.split(b'stream', 1)[0])
+            size = int(found.group(1)) if found else 0
+        known = [number for table in self.reader.xref.values() for number in table]
+        known.extend(self.reader.xref_objStm)
+        return offset, is_stream, max(int(size), max(known, default=0) + 1)
+    
+    def _add_object(self, obj):
+        """Aggiunge un nuovo oggetto e ne restituisce il riferimento."""
+        ref = IndirectObject(self._next_number, 0, self)
+        self._next_number += 1
+        self._pending[ref.idnum] = (0, obj)
+        return ref
+    
+    def update_object(self, obj):
+        """Registra una nuova versione di un oggetto del PDF originale."""
+        ref = obj.indirect_reference
+        self._pending[ref.idnum] = (ref.generation, obj)
+    
+    def add_metadata(self, infos):
+        """Aggiorna (o crea) il dizionario /Info con i metadati indicati."""
+        info = DictionaryObject()
+        if self._info_ref is not None:
+            info.update(self._info_ref.get_object())
+        for key, value in infos.items():
+            info[NameObject(key)] = create_string_object(value)
+        if isinstance(self._info_ref, IndirectObject):
+            self._pending[self._info_ref.idnum] = (self._info_ref.generation, info)
         else:
-            print("❌ Errore nell'elaborazione")
-            return 1
+            self._info_ref = self._add_object(info)
+    
+    def _reference(self, ref):
+        if ref.pdf is self.reader or ref.pdf is self:
+            return ref.idnum, ref.generation
+        key = (id(ref.pdf), ref.idnum)
+        if key not in self._imported:
+            self._imported[key] = self._add_object(ref.get_object()).idnum
+        return self._imported[key], 0
+    
+    def _write_reference(self, ref, out):
+        number, generation = self._reference(ref)
+        out.write(f"{number} {generation} R".encode('ascii'))
+    
+    def _serialize(self, obj, out):
+        if isinstance(obj, _SerializedObject):
+            out.write(obj.data)
+        elif isinstance(obj, IndirectObject):
+            self._write_reference(obj, out)
+        elif isinstance(obj, StreamObject):
+            data = obj._data
+            header = DictionaryObject(
+                (key, value) for key, value in obj.items() if key != '/Length'
+            )
+            header[NameObject('/Length')] = NumberObject(len(data))
+            self._serialize_dict(header, out)
+            out.write(b"\nstream\n")
+            out.write(data)
+            out.write(b"\nendstream")
+        elif isinstance(obj, DictionaryObject):
+            self._serialize_dict(obj, out)
+        elif isinstance(obj, ArrayObject):
+            out.write(b"[")
+            for item in obj:
+                out.write(b" ")
+                self._serialize(item, out)
+            out.write(b" ]")
+        else:
+            obj.write_to_stream(out, None)
+    
+    def _serialize_dict(self, obj, out):
+        out.write(b"<<\n")
+        for key, value in obj.items():
+            key.write_to_stream(out, None)
+            out.write(b" ")
+            self._serialize(value, out)
+            out.write(b"\n")
+        out.write(b">>")
+    
+    def _trailer_entries(self, digest):
+        entries = DictionaryObject({
+            NameObject('/Root'): self.reader.trailer.raw_get('/Root'),
+            NameObject('/Prev'): NumberObject(self._prev_xref),
+        })
+        if self._info_ref is not None:
+            entries[NameObject('/Info')] = self._info_ref
+        original_id = self.reader.trailer.get('/ID')
+        first_id = original_id[0] if original_id else ByteStringObject(digest)
+        entries[NameObject('/ID')] = ArrayObject([first_id, ByteStringObject(digest)])
+        return entries
+    
+    def build(self, base_offset):
+        """
+        Serializza l'aggiornamento; ``base_offset`` è la dimensione del file
+        originale a cui i byte verranno accodati.
+        """
+        out = io.BytesIO()
+        offsets = {}
+        while len(offsets) < len(self._pending):
+            for number in [n for n in self._pending if n not in offsets]:
+                generation, obj = self._pending[number]
+                offsets[number] = (base_offset + out.tell(), generation)
+                out.write(f"{number} {generation} obj\n".encode('ascii'))
+                self._serialize(obj, out)
+                out.write(b"\nendobj\n")
         
-    except Exception as e:
-        print(f"❌ Errore: {e}")
-        return 1
+        digest = hashlib.md5(out.getvalue()).digest()
+        xref_offset = base_offset + out.tell()
+        if self._prev_is_stream:
+            self._write_xref_stream(out, offsets, xref_offset, digest)
+        else:
+            self._write_xref_table(out, offsets, digest)
+        out.write(f"startxref\n{xref_offset}\n%%EOF\n".encode('ascii'))
+        return out.getvalue()
+    
+    @staticmethod
+    def _subsections(numbers):
+        """Raggruppa i numeri oggetto ordinati in sequenze consecutive."""
+        groups = []
+        for number in sorted(numbers):
+            if groups and number == groups[-1][-1] + 1:
+                groups[-1].append(number)
+            else:
+                groups.append([number])
+        return groups
+    
+    def _write_xref_table(self, out, offsets, digest):
+        out.write(b"xref\n")
+        for group in self._subsections(offsets):
+            out.write(f"{group[0]} {len(group)}\n".encode('ascii'))
+            for number in group:
+                offset, generation = offsets[number]
+                out.write(f"{offset:010d} {generation:05d} n \n".encode('ascii'))
+        trailer = self._trailer_entries(digest)
+        trailer[NameObject('/Size')] = NumberObject(self._next_number)
+        out.write(b"trailer\n")
+        self._serialize_dict(trailer, out)
+        out.write(b"\n")
+    
+    def _write_xref_stream(self, out, offsets, xref_offset, digest):
+        xref_number = self._next_number
+        self._next_number += 1
+        offsets = dict(offsets)
+        offsets[xref_number] = (xref_offset, 0)
+        width = max(4, (xref_offset.bit_length() + 7) // 8)
+        index = ArrayObject()
+        rows = []
+        for group in self._subsections(offsets):
+            index.extend([NumberObject(group[0]), NumberObject(len(group))])
+            for number in group:
+                offset, generation = offsets[number]
+                rows.append(b"\x01" + offset.to_bytes(width, 'big') + generation.to_bytes(2, 'big'))
+        xref = self._trailer_entries(digest)
+        xref.update({
+            NameObject('/Type'): NameObject('/XRef'),
+            NameObject('/Size'): NumberObject(self._next_number),
+            NameObject('/W'): ArrayObject([NumberObject(1), NumberObject(width), NumberObject(2)]),
+            NameObject('/Index'): index,
+            NameObject('/Filter'): NameObject('/FlateDecode'),
+        })
+        stream = DecodedStreamObject()
+        stream._data = zlib.compress(b"".join(rows))
+        stream.update(xref)
+        out.write(f"{xref_number} 0 obj\n".encode('ascii'))
+        self._serialize(stream, out)
+        out.write(b"\nendobj\n")
+    
+    def save(self, output_path):
+        """
+        Scrive il PDF aggiornato: se ``output_path`` coincide con l'input i byte
+        vengono solo accodati, altrimenti l'originale viene copiato e poi esteso.
+        ``output_path`` può essere anche un file-like binario aperto in scrittura.
+        
+        Returns:
+            Numero di byte aggiunti al file originale
+        """
+        source = self.session.path
+        stream = self.reader.stream
+        size = stream.seek(0, os.SEEK_END)
+        stream.seek(max(0, size - 1))
+        separator = b"" if stream.read(1) in (b"\n", b"\r") else b"\n"
+        update = separator + self.build(size + len(separator))
+        
+        if not _is_path(output_path):
+            self._copy_original(output_path)
+            output_path.write(update)
+            return len(update)
+        if source is None:
+            with open(output_path, 'wb') as f:
+                self._copy_original(f)
+        elif not (os.path.exists(output_path) and os.path.samefile(source, output_path)):
+            shutil.copyfile(source, output_path)
+        with open(output_path, 'ab') as f:
+            f.write(update)
+        return len(update)
+    
+    def _copy_original(self, out):
+        """Copia in out i byte del documento originale."""
+        stream = self.reader.stream
+        stream.seek(0)
+        shutil.copyfileobj(stream, out, 1024 * 1024)
 
 
-def main():
-    """Funzione principale del programma."""
-    # Se vengono passati argomenti da riga di comando (escludendo il nome del programma)
-    if len(sys.argv) > 1:
-        # Modalità riga di comando
-        return command_line_mode()
-    else:
-        # Modalità interattiva        print("=== PDF Signer - Programma per aggiungere marchio ai PDF ===")
-        print("🚀 Versione avanzata con funzionalità estese")
-        print("\nScegli la modalità:")
-        print("1. Modalità interattiva (guidata)")
-        print("2. Mostra aiuto per modalità riga di comando")
-        print("3. Esci")
-        
-        while True:
-            try:
-                choice = input("\nScegli un'opzione: ").strip()
-                
-                if choice == "1":
-                    interactive_mode()
-                    break
-                elif choice == "2":                    
-                    print("\n=== Modalità Riga di Comando ===")
-                    print("Usa il programma da terminale con questi parametri:")
-                    print(f"python {sys.argv[0]} <file_pdf> [opzioni]")
-                    print("\nOpzioni base:")
-                    print("  -o, --output PATH     Percorso del file PDF di output")
-                    print("  -s, --scale FLOAT     Fattore di scala per il marchio (default: 0.2)")
-                    print("  -w, --watermark PATH  Percorso dell'immagine marchio (default: sign.png)")
-                    print("  -p, --position POS    Posizione del marchio")
-                    print("  --pages SPEC          Pagine da firmare (all/first/last/1,3,5-10)")
-                    print("  --exclude SPEC        Pagine da escludere")
-                    print("  --border-width N      Spessore bordo")
-                    print("  --shadow              Abilita ombra")
-                    print("  --timestamp           Aggiungi data/ora")
-                    print("  --add-metadata        Aggiungi metadati")
-                    print("  --email-config PATH   Configurazione email")
-                    
-                    print("\nEsempi d'uso:")
-                    print(f"  python {sys.argv[0]} doc.pdf -s 0.3 -p top-left")
-                    print(f"  python {sys.argv[0]} doc.pdf --pages first --timestamp")
-                    print(f"  python {sys.argv[0]} doc.pdf --border-width 2 --shadow")
-                    input("\nPremi Invio per continuare...")
-                    continue
-                elif choice == "3":
-                    print("Arrivederci!")
-                    break
-                else:
-                    print("Opzione non valida. Scegli 1, 2 o 3.")
-                    
-            except KeyboardInterrupt:
-                print("\n\nProgramma interrotto dall'utente.")
-                break
-            except EOFError:
-                print("\n\nProgramma terminato.")
-                break
+class _SerializedObject(NamedTuple):
+    """Oggetto già serializzato (corpo tra "obj" ed "endobj")."""
+    data: bytes
+
+
+# Documenti con almeno questo numero di pagine da firmare vengono divisi tra
+# più processi quando è richiesta la modalità a shard
+SHARD_THRESHOLD = 2000
+
+
+class _SegmentWriter:
+    """
+    Buffer di serializzazione che tiene separati i riferimenti agli oggetti
+    nuovi: i numeri definitivi vengono assegnati solo in fase di assemblaggio.
+    """
     
-    return 0
+    def __init__(self):
+        self.segments = []
+        self._buffer = io.BytesIO()
+    
+    def write(self, data):
+        self._buffer.write(data)
+    
+    def ref(self, local_number):
+        self._flush()
+        self.segments.append(local_number)
+    
+    def _flush(self):
+        if self._buffer.tell():
+            self.segments.append(self._buffer.getvalue())
+            self._buffer = io.BytesIO()
+    
+    def close(self):
+        self._flush()
+        return self.segments
 
 
-# Funzioni avanzate integrate
-def parse_pages_specification(pages_str: str, total_pages: int):
+class _ShardUpdate(_IncrementalUpdate):
     """
-    Converte una stringa di pagine in una lista di numeri di pagina.
+    Aggiornamento incrementale parziale calcolato da un processo di lavoro
+    su un intervallo di pagine.
     
-    Args:
-        pages_str: Stringa formato "1,3,5-10" o "first", "last", "all", "odd", "even"
-        total_pages: Numero totale di pagine nel PDF
-        
-    Returns:
-        Lista di numeri di pagina (0-indexed)
+    Gli oggetti nuovi (marchio, flussi di contenuto, risorse) hanno numeri
+    locali al processo; export() restituisce i corpi serializzati come
+    segmenti di byte alternati ai numeri locali referenziati, che
+    _assemble_shards() sostituisce con i numeri definitivi.
     """
-    if not pages_str or pages_str.lower() == "all":
-        return list(range(total_pages))
     
-    if pages_str.lower() == "first":
-        return [0] if total_pages > 0 else []
+    def __init__(self, session):
+        super().__init__(session)
+        self._new = {}
+    
+    def _add_object(self, obj):
+        ref = IndirectObject(len(self._new), 0, self)
+        self._new[ref.idnum] = obj
+        return ref
     
-    if pages_str.lower() == "last":
-        return [total_pages - 1] if total_pages > 0 else []
+    def _write_reference(self, ref, out):
+        if ref.pdf is self.reader:
+            out.write(f"{ref.idnum} {ref.generation} R".encode('ascii'))
+            return
+        number, _ = self._reference(ref)
+        out.ref(number)
     
-    if pages_str.lower() == "odd":
-        return [i for i in range(0, total_pages, 2)]
+    def _segments(self, obj):
+        writer = _SegmentWriter()
+        self._serialize(obj, writer)
+        return writer.close()
     
-    if pages_str.lower() == "even":
-        return [i for i in range(1, total_pages, 2)]
+    def export(self):
+        """
+        Returns:
+            (pagine, nuovi): {numero: (generazione, segmenti)} per gli oggetti
+            originali aggiornati e {numero locale: segmenti} per quelli nuovi
+        """
+        pages = {number: (generation, self._segments(obj))
+                 for number, (generation, obj) in self._pending.items()}
+        new = {}
+        # La serializzazione può importare altri oggetti (immagini del marchio)
+        while len(new) < len(self._new):
+            for number in [n for n in self._new if n not in new]:
+                new[number] = self._segments(self._new[number])
+        return pages, new
+
+
+# Sessione già analizzata dal processo principale, ereditata dai processi
+# di lavoro creati con fork (evita di rianalizzare l'albero delle pagine)
+_SHARD_SESSION = None
+
+
+def _sign_shard(input_pdf_path, page_indices, stamp):
+    """Firma un intervallo di pagine in un processo di lavoro (vedi _ShardUpdate)."""
+    inherited = _SHARD_SESSION
+    if inherited is not None and inherited.path is None:
+        # Documento in memoria: ogni processo ha la sua copia dello stream
+        context = contextlib.nullcontext()
+        session = inherited
+    elif inherited is not None and inherited.path == input_pdf_path:
+        # Il descrittore ereditato condivide la posizione con gli altri processi
+        inherited.reader.stream = open(input_pdf_path, 'rb')
+        context = contextlib.closing(inherited.reader.stream)
+        session = inherited
+    else:
+        context = session = PdfDocumentSession(input_pdf_path)
+    with context:
+        stamps = StampCache(
+            stamp.image, stamp.scale_factor, stamp.position,
+            timestamp_image=stamp.timestamp_image,
+            timestamp_position=stamp.timestamp_position,
+            effects=stamp.effects, mode='xobject',
+        )
+        with stamps:
+            update = _ShardUpdate(session)
+            stamper = _XObjectStamper(update)
+            for i in page_indices:
+                page = session.reader.pages[i]
+                stamper.apply(page, *stamps.lookup(page))
+                update.update_object(page)
+            return update.export()
+
+
+def _assemble_shards(update, shards):
+    """
+    Riunisce i risultati di _sign_shard() in ``update`` (_IncrementalUpdate):
+    gli oggetti nuovi con contenuto identico (marchio, flussi e risorse
+    condivisi, prodotti da ogni processo) vengono scritti una sola volta.
     
-    pages = []
-    for part in pages_str.split(','):
-        part = part.strip()
+    Returns:
+        (oggetti nuovi ricevuti, oggetti nuovi scritti)
+    """
+    final = {}        # impronta del contenuto -> numero definitivo
+    received = 0
+    for pages, new in shards:
+        received += len(new)
+        digests = {}
         
-        if '-' in part:
-            # Range di pagine (es: 5-10)
-            try:
-                start, end = part.split('-', 1)
-                start = int(start) - 1  # Converti a 0-indexed
-                end = int(end) - 1
-                pages.extend(range(max(0, start), min(total_pages, end + 1)))
-            except ValueError:
-                print(f"Formato pagina non valido: {part}")
+        def digest(number):
+            # Impronta del contenuto, con i riferimenti sostituiti dalle impronte
+            if number not in digests:
+                h = hashlib.sha256()
+                for part in new[number]:
+                    h.update(part if isinstance(part, bytes) else b"\0R" + digest(part))
+                digests[number] = h.digest()
+            return digests[number]
+        
+        def number_of(local):
+            key = digest(local)
+            if key not in final:
+                final[key] = update._add_object(_SerializedObject(render(new[local]))).idnum
+            return final[key]
+        
+        def render(segments):
+            return b"".join(part if isinstance(part, bytes) else f"{number_of(part)} 0 R".encode('ascii')
+                            for part in segments)
+        
+        for number, (generation, segments) in pages.items():
+            update._pending[number] = (generation, _SerializedObject(render(segments)))
+    return received, len(final)
+
+
+def _split_shards(indices, count):
+    """Divide le pagine selezionate in ``count`` intervalli contigui bilanciati."""
+    indices = list(indices)
+    size, extra = divmod(len(indices), count)
+    shards, start = [], 0
+    for k in range(count):
+        stop = start + size + (1 if k < extra else 0)
+        if stop > start:
+            shards.append(indices[start:stop])
+        start = stop
+    return shards
+
+
+# Data della firma in modalità deterministica quando gli input non ne forniscono una
+DETERMINISTIC_EPOCH = datetime(1980, 1, 1)
+
+
+def _parse_pdf_date(value):
+    """Data di un campo /CreationDate o /ModDate ("D:AAAAMMGGhhmmss..."), o None."""
+    match = re.match(r"(?:D:)?(\d{4})(\d{2})?(\d{2})?(\d{2})?(\d{2})?(\d{2})?", str(value or ''))
+    if not match:
+        return None
+    year, month, day, hour, minute, second = (int(part) if part else None for part in match.groups())
+    try:
+        return datetime(year, month or 1, day or 1, hour or 0, minute or 0, second or 0)
+    except ValueError:
+        return None
+
+
+def signing_time(input_pdf_path, session=None, deterministic=False):
+    """
+    Data e ora della firma (timestamp e metadati).
+    
+    Normalmente è l'ora corrente. In modalità deterministica è derivata dagli
+    input, così la stessa firma sullo stesso documento produce sempre gli
+    stessi byte: SOURCE_DATE_EPOCH se impostata, altrimenti /ModDate o
+    /CreationDate del PDF di input, altrimenti DETERMINISTIC_EPOCH.
+    """
+    if not deterministic:
+        return datetime.now()
+    epoch = os.environ.get('SOURCE_DATE_EPOCH')
+    if epoch:
+        try:
+            return datetime.fromtimestamp(int(epoch), timezone.utc).replace(tzinfo=None)
+        except (ValueError, OverflowError, OSError):
+            print(f"⚠️ SOURCE_DATE_EPOCH non valida: {epoch}")
+    try:
+        if session:
+            info = session.reader.metadata or {}
         else:
-            # Singola pagina
-            try:
-                page = int(part) - 1  # Converti a 0-indexed
-                if 0 <= page < total_pages:
-                    pages.append(page)
-            except ValueError:
-                print(f"Numero pagina non valido: {part}")
+            with _open_binary(input_pdf_path) as stream:
+                # Le date vanno lette finché lo stream è aperto
+                info = {key: str(value) for key, value in (PdfReader(stream).metadata or {}).items()}
+    except Exception:
+        info = {}
+    for key in ('/ModDate', '/CreationDate'):
+        parsed = _parse_pdf_date(info.get(key))
+        if parsed:
+            return parsed
+    return DETERMINISTIC_EPOCH
+
+
+class _DeterministicUUID:
+    """
+    Sostituto del modulo uuid per PyPDF2: uuid4() derivati da un contatore per
+    il thread che firma in modo deterministico, casuali per gli altri thread.
+    """
     
-    return sorted(list(set(pages)))  # Rimuovi duplicati e ordina
+    def __init__(self):
+        self._counter = itertools.count()
+        self._owner = threading.get_ident()
+    
+    def uuid4(self):
+        if threading.get_ident() != self._owner:
+            return uuid.uuid4()
+        digest = hashlib.sha256(f"pdf_signer:{next(self._counter)}".encode('ascii')).digest()
+        return uuid.UUID(bytes=digest[:16], version=4)
 
 
-def process_image_format(image_path: str) -> str:
+# Il modulo di PyPDF2 è condiviso dal processo: una firma deterministica alla volta
+_DETERMINISTIC_NAMES_LOCK = threading.Lock()
+
+
+@contextlib.contextmanager
+def _deterministic_resource_names():
+    """
+    merge_page() di PyPDF2 rinomina le risorse in conflitto con uuid4(): qui i
+    nomi diventano riproducibili. Il modulo viene modificato per tutto il
+    processo, quindi le firme deterministiche in più thread si alternano sotto
+    _DETERMINISTIC_NAMES_LOCK; le altre firme continuano ad avere nomi casuali.
+    """
+    import PyPDF2._page as page_module
+    with _DETERMINISTIC_NAMES_LOCK:
+        previous = page_module.uuid
+        page_module.uuid = _DeterministicUUID()
+        try:
+            yield
+        finally:
+            page_module.uuid = previous
+
+
+def _signing_metadata(kwargs, now=None):
+    """Metadati da aggiungere al PDF firmato in base ai parametri avanzati."""
+    now = now or datetime.now()
+    metadata = {}
+    if kwargs.get('author'):
+        metadata['/Author'] = kwargs['author']
+    if kwargs.get('title'):
+        metadata['/Title'] = kwargs['title']
+    if kwargs.get('subject'):
+        metadata['/Subject'] = kwargs['subject']
+    
+    metadata.update({
+        '/Creator': 'PDF Signer Advanced',
+        '/Producer': 'PDF Signer Advanced',
+        '/CreationDate': f"D:{now.strftime('%Y%m%d%H%M%S')}",
+        '/ModDate': f"D:{now.strftime('%Y%m%d%H%M%S')}"
+    })
+    return metadata
+
+
+class StampSpec(NamedTuple):
+    """Parametri del marchio, comuni a tutti i motori PDF."""
+    image: object                       # percorso o PIL.Image.Image
+    scale_factor: float = 1.0
+    position: str = "bottom-right"
+    timestamp_image: object = None      # PIL.Image.Image o None
+    timestamp_position: str = "bottom-right"
+    effects: tuple = ()
+
+
+def _report_selection(pages_to_sign, total_pages):
+    print(f"📄 Pagine da firmare: {len(pages_to_sign)}/{total_pages}")
+    if len(pages_to_sign) < total_pages:
+        pages_display = [str(p+1) for p in pages_to_sign.head(5)]
+        if len(pages_to_sign) > 5:
+            pages_display.append('...')
+        print(f"📋 Pagine selezionate: {', '.join(pages_display)}")
+
+
+class PdfEngine(abc.ABC):
     """
-    Verifica e converte l'immagine in un formato supportato se necessario.
+    Interfaccia dei motori PDF usati da add_watermark_to_pdf_advanced().
     
-    Args:
-        image_path: Percorso dell'immagine
-        
-    Returns:
-        Percorso dell'immagine processata (potrebbe essere un file temporaneo)
+    Un motore apre il documento, applica il marchio descritto da una StampSpec
+    alle pagine selezionate, aggiunge i metadati e scrive il risultato
+    (eventualmente come aggiornamento incrementale). Selezione delle pagine e
+    posizione del marchio (calculate_watermark_position) sono condivise, così
+    tutti i motori producono lo stesso risultato visivo.
     """
-    supported_formats = {'.png', '.jpg', '.jpeg', '.gif', '.bmp', '.tiff', '.webp'}
     
-    if Path(image_path).suffix.lower() not in supported_formats:
-        print(f"Formato non supportato: {Path(image_path).suffix}")
-        return image_path
+    name = None
     
-    try:
-        # Verifica che l'immagine sia valida
-        with Image.open(image_path) as img:
-            # Converti in PNG se ha trasparenza e non è già PNG
-            if img.mode in ('RGBA', 'LA') and not image_path.lower().endswith('.png'):
-                temp_file = tempfile.NamedTemporaryFile(delete=False, suffix='.png')
-                temp_path = temp_file.name
-                temp_file.close()
-                img.save(temp_path, 'PNG')
-                print(f"Immagine convertita in PNG: {temp_path}")
-                return temp_path
-            
-    except Exception as e:
-        print(f"Errore nell'elaborazione dell'immagine: {e}")
+    @abc.abstractmethod
+    def sign(self, input_pdf_path, output_pdf_path, stamp, pages='all', exclude_pages=None,
+             metadata=None, stamp_mode='merge', incremental=False, session=None,
+             shards=1, shard_threshold=SHARD_THRESHOLD, deterministic=False):
+        """Applica il marchio alle pagine selezionate e scrive l'output (errori come eccezioni)."""
     
-    return image_path
+    @abc.abstractmethod
+    def version(self) -> str:
+        """Libreria e versione usate: a parità di input l'output può cambiare tra versioni."""
 
 
-def add_image_effects(image_path: str, border_width: int = 0, border_color=(0, 0, 0),
-                     shadow_enabled: bool = False, shadow_offset=(5, 5)) -> str:
+class PyPDF2Engine(PdfEngine):
     """
-    Aggiunge effetti all'immagine (bordo, ombra).
+    Motore in puro Python basato su PyPDF2 (predefinito).
     
-    Args:
-        image_path: Percorso dell'immagine
-        border_width: Spessore del bordo
-        border_color: Colore del bordo (R, G, B)
-        shadow_enabled: Abilita ombra
-        shadow_offset: Offset dell'ombra (x, y)
-        
-    Returns:
-        Percorso dell'immagine con effetti applicati
+    Supporta le modalità "merge" e "xobject" e l'aggiornamento incrementale.
+    Se viene passata una ``session`` (PdfDocumentSession già aperta sullo
+    stesso input) il documento non viene analizzato di nuovo.
+    
+    Con ``shards`` > 1 e almeno ``shard_threshold`` pagine da firmare le
+    pagine vengono divise tra più processi (vedi _sign_shard); il risultato
+    è sempre un aggiornamento incrementale con il marchio come XObject.
     """
-    if border_width == 0 and not shadow_enabled:
-        return image_path
     
-    try:
-        with Image.open(image_path) as img:
-            if img.mode != 'RGBA':
-                img = img.convert('RGBA')
-            
-            # Aggiungi bordo
-            if border_width > 0:
-                new_size = (img.width + 2 * border_width, img.height + 2 * border_width)
-                bordered_img = Image.new('RGBA', new_size, (*border_color, 255))
-                bordered_img.paste(img, (border_width, border_width), img)
-                img = bordered_img            # Aggiungi ombra (implementazione semplificata)
-            if shadow_enabled:
-                shadow_x, shadow_y = shadow_offset
-                shadow_size = (img.width + abs(shadow_x), img.height + abs(shadow_y))
-                shadow_img = Image.new('RGBA', shadow_size, (0, 0, 0, 0))
-                
-                # Crea ombra semplice
-                shadow = Image.new('RGBA', img.size, (50, 50, 50, 128))
-                shadow_img.paste(shadow, (max(0, shadow_x), max(0, shadow_y)), img.split()[-1])
-                shadow_img.paste(img, (max(0, -shadow_x), max(0, -shadow_y)), img)
-                img = shadow_img
+    name = 'pypdf2'
+    
+    def sign(self, input_pdf_path, output_pdf_path, stamp, pages='all', exclude_pages=None,
+             metadata=None, stamp_mode='merge', incremental=False, session=None,
+             shards=1, shard_threshold=SHARD_THRESHOLD, deterministic=False):
+        owns_session = session is None
+        if owns_session:
+            session = PdfDocumentSession(input_pdf_path)
+        try:
+            with _deterministic_resource_names() if deterministic else contextlib.nullcontext():
+                self._sign(session, output_pdf_path, stamp, pages, exclude_pages, metadata,
+                           stamp_mode, incremental, shards, shard_threshold)
+        finally:
+            if owns_session:
+                session.close()
+    
+    def version(self) -> str:
+        return f"PyPDF2 {PyPDF2.__version__}"
+    
+    def _sign(self, session, output_pdf_path, stamp, pages, exclude_pages, metadata,
+              stamp_mode, incremental, shards, shard_threshold):
+        pages_to_sign = session.select_pages(pages, exclude_pages)
+        _report_selection(pages_to_sign, session.total_pages)
+        
+        # Un documento in memoria arriva ai processi solo per fork
+        shardable = session.path is not None or 'fork' in get_all_start_methods()
+        if shards > 1 and shardable and len(pages_to_sign) >= max(shard_threshold, 2):
+            self._sign_sharded(session, output_pdf_path, stamp, pages_to_sign, metadata, shards)
+            return
+        
+        # Marchi (firma ed eventuale timestamp) compilati una volta per geometria di pagina
+        stamps = StampCache(
+            stamp.image, stamp.scale_factor, stamp.position,
+            timestamp_image=stamp.timestamp_image,
+            timestamp_position=stamp.timestamp_position,
+            effects=stamp.effects,
+            mode='xobject' if incremental else stamp_mode,
+        )
+        with stamps:
+            if incremental:
+                self._sign_incremental(session, output_pdf_path, stamps, pages_to_sign, metadata)
+            else:
+                self._sign_rewrite(session, output_pdf_path, stamps, pages_to_sign,
+                                   metadata, stamp_mode)
+    
+    @staticmethod
+    def _sign_incremental(session, output_pdf_path, stamps, pages_to_sign, metadata):
+        # Solo le pagine firmate vengono lette e accodate al file originale
+        update = _IncrementalUpdate(session)
+        stamper = _XObjectStamper(update)
+        for i in pages_to_sign:
+            page = session.reader.pages[i]
+            stamper.apply(page, *stamps.lookup(page))
+            update.update_object(page)
+            print(f"✓ Firmata pagina {i+1}")
+        
+        if metadata:
+            update.add_metadata(metadata)
+            print("📝 Metadati aggiunti")
+        
+        appended = update.save(output_pdf_path)
+        print(f"📎 Aggiornamento incrementale: {appended} byte aggiunti")
+    
+    @staticmethod
+    def _sign_sharded(session, output_pdf_path, stamp, pages_to_sign, metadata, shards):
+        # Ogni processo firma un intervallo contiguo e restituisce gli oggetti
+        # serializzati; qui si assemblano in un'unica sezione xref
+        ranges = _split_shards(pages_to_sign, min(shards, len(pages_to_sign)))
+        print(f"🧩 Firma a shard: {len(pages_to_sign)} pagine in {len(ranges)} processi")
+        update = _IncrementalUpdate(session)
+        global _SHARD_SESSION
+        _SHARD_SESSION = session
+        context = get_context('fork') if 'fork' in get_all_start_methods() else None
+        try:
+            with ProcessPoolExecutor(max_workers=len(ranges), mp_context=context) as pool:
+                futures = [pool.submit(_sign_shard, session.path, indices, stamp)
+                           for indices in ranges]
+                received, written = _assemble_shards(update, (f.result() for f in futures))
+        finally:
+            _SHARD_SESSION = None
+        print(f"✓ Firmate {len(pages_to_sign)} pagine "
+              f"({received} oggetti nuovi, {written} dopo la deduplicazione)")
+        
+        if metadata:
+            update.add_metadata(metadata)
+            print("📝 Metadati aggiunti")
+        
+        appended = update.save(output_pdf_path)
+        print(f"📎 Aggiornamento incrementale: {appended} byte aggiunti")
+    
+    @staticmethod
+    def _sign_rewrite(session, output_pdf_path, stamps, pages_to_sign, metadata, stamp_mode):
+        output_pdf = PdfWriter()
+        if stamp_mode == 'xobject':
+            stamper = _XObjectStamper(output_pdf)
+        
+        # Processa ogni pagina
+        for i, page in enumerate(session.reader.pages):
+            if stamp_mode == 'xobject':
+                if i in pages_to_sign:
+                    stamp_pages, matrix = stamps.lookup(page)
+                    page = output_pdf.add_page(page)
+                    stamper.apply(page, stamp_pages, matrix)
+                    print(f"✓ Firmata pagina {i+1}")
+                else:
+                    output_pdf.add_page(page)
+                continue
             
-            # Salva immagine con effetti
-            temp_file = tempfile.NamedTemporaryFile(delete=False, suffix='.png')
-            temp_path = temp_file.name
-            temp_file.close()
-            img.save(temp_path, 'PNG')
-            return temp_path
+            if i in pages_to_sign:
+                # Aggiungi firma e timestamp (già posizionati per la geometria della pagina)
+                for stamp_page in stamps.lookup(page)[0]:
+                    page.merge_page(stamp_page)
+                print(f"✓ Firmata pagina {i+1}")
             
-    except Exception as e:
-        print(f"Errore nell'applicazione degli effetti: {e}")
-        return image_path
+            output_pdf.add_page(page)
+        
+        # Aggiungi metadati se richiesti
+        if metadata:
+            output_pdf.add_metadata(metadata)
+            print("📝 Metadati aggiunti")
+        
+        # Salva PDF
+        with _output_stream(output_pdf_path) as output_file:
+            output_pdf.write(output_file)
 
 
-def create_timestamp_image(format_type: str = 'short', custom_format: Optional[str] = None) -> str:
+def _import_fitz():
+    """Importa PyMuPDF (nome moderno ``pymupdf`` o storico ``fitz``)."""
+    try:
+        import pymupdf
+        return pymupdf
+    except ImportError:
+        pass
+    try:
+        import fitz
+        return fitz
+    except ImportError:
+        raise ValueError("Il motore 'pymupdf' richiede PyMuPDF: pip install PyMuPDF") from None
+
+
+class PyMuPDFEngine(PdfEngine):
     """
-    Crea un'immagine con timestamp.
+    Motore basato su PyMuPDF (MuPDF in C).
     
-    Args:
-        format_type: Tipo di formato ('short', 'long', 'full', 'iso', 'custom')
-        custom_format: Formato personalizzato se format_type='custom'
-        
-    Returns:
-        Percorso dell'immagine timestamp
+    Ogni immagine (firma, timestamp) viene incorporata una sola volta con
+    Page.insert_image() e richiamata per xref su tutte le altre pagine; MuPDF
+    gestisce direttamente /CropBox e /Rotate. stamp_mode non ha effetto: il
+    riuso per xref equivale alla modalità "xobject". shards non è supportato.
     """
-    formats = {
-        'short': '%d/%m/%Y',
-        'long': '%d/%m/%Y %H:%M',
-        'full': '%d/%m/%Y %H:%M:%S',
-        'iso': '%Y-%m-%d %H:%M:%S'
-    }
     
-    if format_type == 'custom' and custom_format:
-        date_format = custom_format
-    else:
-        date_format = formats.get(format_type, formats['short'])
+    name = 'pymupdf'
     
-    # Genera timestamp
-    now = datetime.now()
-    timestamp_text = now.strftime(date_format)
+    # Corrispondenza tra chiavi /Info e chiavi di Document.set_metadata()
+    METADATA_KEYS = {
+        '/Author': 'author', '/Title': 'title', '/Subject': 'subject',
+        '/Creator': 'creator', '/Producer': 'producer',
+        '/CreationDate': 'creationDate', '/ModDate': 'modDate',
+    }
     
-    # Crea immagine semplice
-    font_size = 12
-    char_width = font_size * 0.6
-    text_width = int(len(timestamp_text) * char_width)
-    text_height = int(font_size * 1.5)
+    def __init__(self):
+        self.fitz = _import_fitz()
     
-    img = Image.new('RGBA', (text_width + 20, text_height + 10), (255, 255, 255, 0))
-    draw = ImageDraw.Draw(img)
-    draw.text((10, 5), timestamp_text, fill=(0, 0, 0, 255))
+    def version(self) -> str:
+        return f"PyMuPDF {self.fitz.VersionBind}"
     
-    # Salva in file temporaneo
-    temp_file = tempfile.NamedTemporaryFile(delete=False, suffix='.png')
-    temp_path = temp_file.name
-    temp_file.close()
-    img.save(temp_path, 'PNG')
-    return temp_path
-
-
-def add_pdf_metadata(pdf_path: str, metadata: dict) -> None:
-    """
-    Aggiunge metadati a un PDF esistente.
+    @staticmethod
+    def _pdf_buffer(source):
+        """Contenuto di un PDF in memoria come oggetto buffer, senza copie se possibile."""
+        if isinstance(source, (bytes, bytearray, memoryview)):
+            return source
+        if isinstance(source, io.BytesIO):
+            # getvalue() restituisce i bytes condivisi se lo stream non è stato modificato
+            return source.getvalue()
+        with _open_binary(source) as stream:
+            return stream.read()
     
-    Args:
-        pdf_path: Percorso del PDF
-        metadata: Dizionario con metadati da aggiungere
-    """
-    try:
-        # Leggi PDF esistente
-        with open(pdf_path, 'rb') as file:
-            reader = PdfReader(file)
-            writer = PdfWriter()
+    @staticmethod
+    def _image_bytes(image):
+        """Byte dell'immagine da incorporare (il file originale se possibile)."""
+        if isinstance(image, Image.Image):
+            buffer = io.BytesIO()
+            image.save(buffer, 'PNG')
+            return buffer.getvalue()
+        with open(image, 'rb') as f:
+            return f.read()
+    
+    def sign(self, input_pdf_path, output_pdf_path, stamp, pages='all', exclude_pages=None,
+             metadata=None, stamp_mode='merge', incremental=False, session=None,
+             shards=1, shard_threshold=SHARD_THRESHOLD, deterministic=False):
+        fitz = self.fitz
+        if shards > 1:
+            print("⚠️ Firma a shard non supportata dal motore pymupdf: uso un solo processo")
+        on_disk = _is_path(input_pdf_path) and _is_path(output_pdf_path)
+        if incremental and not on_disk:
+            raise ValueError("Aggiornamento incrementale con il motore pymupdf "
+                             "disponibile solo tra file su disco")
+        same_file = on_disk and os.path.abspath(input_pdf_path) == os.path.abspath(output_pdf_path)
+        if incremental and not same_file:
+            # L'aggiornamento incrementale estende una copia dell'originale
+            shutil.copyfile(input_pdf_path, output_pdf_path)
+        
+        if incremental:
+            original_size = os.path.getsize(input_pdf_path)
+            doc = fitz.open(output_pdf_path)
+        elif _is_path(input_pdf_path):
+            doc = fitz.open(input_pdf_path)
+        else:
+            # MuPDF legge direttamente bytes e buffer; i file-like vengono letti una volta
+            doc = fitz.open(stream=self._pdf_buffer(input_pdf_path), filetype='pdf')
+        try:
+            if incremental and doc.needs_pass:
+                raise ValueError("Aggiornamento incrementale non supportato per PDF cifrati")
+            pages_to_sign = PageSelection(pages or 'all', doc.page_count, exclude=exclude_pages)
+            _report_selection(pages_to_sign, doc.page_count)
             
-            # Copia tutte le pagine
-            for page in reader.pages:
-                writer.add_page(page)
+            images = [(stamp.image, stamp.scale_factor, stamp.position)]
+            if stamp.timestamp_image is not None:
+                images.append((stamp.timestamp_image, 0.5, stamp.timestamp_position))
+            streams = [self._image_bytes(image) for image, _, _ in images]
+            xrefs = [0] * len(images)
             
-            # Aggiungi metadati esistenti
-            if reader.metadata:
-                for key, value in reader.metadata.items():
-                    writer.add_metadata({key: value})
+            for i in pages_to_sign:
+                page = doc[i]
+                # page.rect è la pagina visualizzata (ritaglio e rotazione applicati)
+                width, height = page.rect.width, page.rect.height
+                for k, (image, scale_factor, position) in enumerate(images):
+                    x, y, w, h = calculate_watermark_position(
+                        image, scale_factor, position, (width, height)
+                    )
+                    visual = fitz.Rect(x, height - y - h, x + w, height - y)
+                    xrefs[k] = page.insert_image(
+                        visual * page.derotation_matrix,
+                        stream=None if xrefs[k] else streams[k],
+                        xref=xrefs[k],
+                        rotate=page.rotation,
+                        keep_proportion=False,
+                    )
+                print(f"✓ Firmata pagina {i+1}")
             
-            # Aggiungi nuovi metadati
-            writer.add_metadata(metadata)
-        
-        # Sovrascrivi il file
-        with open(pdf_path, 'wb') as file:
-            writer.write(file)
+            if metadata:
+                info = dict(doc.metadata or {})
+                info.update({self.METADATA_KEYS[key]: value for key, value in metadata.items()
+                             if key in self.METADATA_KEYS})
+                doc.set_metadata(info)
+                print("📝 Metadati aggiunti")
             
-    except Exception as e:
-        print(f"Errore nell'aggiunta dei metadati: {e}")
-
-
-def send_email_with_pdf(pdf_path: str, email_config: dict, recipients: list,
-                       subject: Optional[str] = None, body: Optional[str] = None,
-                       template_path: Optional[str] = None) -> bool: ,
-                       ssl_context: Optional[ssl.SSLContext] = None) -> bool:
-
-    """
-    Invia PDF firmato via email.
-    
-    Args:
-        pdf_path: Percorso del PDF da inviare
-        email_config: Configurazione server email
-        recipients: Lista destinatari
-        subject: Oggetto email
-        body: Corpo email
-        template_path: Percorso template email
-        ssl_context: Contesto SSL personalizzato
-        
-    Returns:
-        True se invio riuscito
-    """
-    try:
-        attachments = []
-        # Carica template se specificato
-        if template_path and os.path.exists(template_path):
-            if template_path.endswith(('.yaml', '.yml')):
-                with open(template_path, 'r', encoding='utf-8') as f:
-                    template_data = yaml.safe_load(f) or {}
-                subject = template_data.get('subject', subject)
-                body = template_data.get('body', body)
-                attachments = template_data.get('additional_attachments', [])
+            # In modalità deterministica si conserva l'/ID dell'originale invece di generarne uno
+            if incremental:
+                doc.save(output_pdf_path, incremental=True, encryption=fitz.PDF_ENCRYPT_KEEP,
+                         no_new_id=deterministic)
+            elif same_file:
+                data = doc.tobytes(deflate=True, no_new_id=deterministic)
             else:
-                with open(template_path, 'r', encoding='utf-8') as f:
-                    template_content = f.read()
-                body = template_content
+                doc.save(output_pdf_path, deflate=True, no_new_id=deterministic)
+        finally:
+            doc.close()
         
-        if not subject:
-            subject = f"PDF Firmato: {Path(pdf_path).name}"
+        if incremental:
+            appended = os.path.getsize(output_pdf_path) - original_size
+            print(f"📎 Aggiornamento incrementale: {appended} byte aggiunti")
+        elif same_file:
+            with open(output_pdf_path, 'wb') as f:
+                f.write(data)
 
-        if not body:
-            body = f"In allegato il PDF firmato: {Path(pdf_path).name}"
 
-        context = {
-            'filename': Path(pdf_path).name,
-            'pdf_name': Path(pdf_path).name,
-            'timestamp': datetime.now().strftime("%d/%m/%Y %H:%M")
-        }
+# Motori PDF disponibili (il primo è il predefinito)
+PDF_ENGINES = {
+    PyPDF2Engine.name: PyPDF2Engine,
+    PyMuPDFEngine.name: PyMuPDFEngine,
+}
 
-        subject = subject.format(**context)
-        body = body.format(**context)
-          # Crea messaggio email
-        msg = MIMEMultipart()
-        
-        # Gestisci diversi formati di configurazione
-        from_addr = email_config.get('from_address') or email_config.get('sender', {}).get('email')
-        if not from_addr:
-            from_addr = email_config.get('smtp', {}).get('username')
-        
-        msg['From'] = from_addr
-        msg['To'] = ', '.join(recipients)
-        msg['Subject'] = subject
-        
-        # Aggiungi corpo
-        msg.attach(MIMEText(body, 'plain', 'utf-8'))
-        
-        # Aggiungi allegato PDF
-        if os.path.exists(pdf_path):
-            with open(pdf_path, 'rb') as attachment:
-                part = MIMEBase('application', 'pdf')
-                part.set_payload(attachment.read())
-                encoders.encode_base64(part)
-                part.add_header(
-                    'Content-Disposition',
-                    f'attachment; filename= {Path(pdf_path).name}'
-                )
-                msg.attach(part)
-
-        # Aggiungi eventuali allegati extra dal template
-        for attach_path in attachments:
-            if os.path.exists(attach_path):
-                with open(attach_path, 'rb') as extra_file:
-                    part = MIMEBase('application', 'octet-stream')
-                    part.set_payload(extra_file.read())
-                    encoders.encode_base64(part)
-                    part.add_header(
-                        'Content-Disposition',
-                        f'attachment; filename= {Path(attach_path).name}'
-                    )
-                    msg.attach(part)
-        
-        # Connetti al server e invia - gestisci diverse strutture config
-        smtp_config = email_config.get('smtp', email_config)
-        smtp_server = smtp_config.get('server') or smtp_config.get('smtp_server')
-        smtp_port = smtp_config.get('port') or smtp_config.get('smtp_port', 587)
-        username = smtp_config.get('username')
-        password = smtp_config.get('password')
-        use_tls = smtp_config.get('use_tls', True)
-        
-        if not use_tls and smtp_port == 465:
-            server = smtplib.SMTP_SSL(smtp_server, smtp_port, context=ssl_context)
-        else:
-            server = smtplib.SMTP(smtp_server, smtp_port)
-            if use_tls:
-                if ssl_context:
-                    server.starttls(context=ssl_context)
-                else:
-                    server.starttls()
-        
-        if username and password:
-            server.login(username, password)
-        
-        server.send_message(msg)
-        server.quit()
-        
-        return True
-        
-    except Exception as e:
-        print(f"Errore nell'invio email: {e}")
-        return False
 
+def get_pdf_engine(name='pypdf2') -> PdfEngine:
+    """Crea il motore PDF richiesto; ValueError se sconosciuto o non installato."""
+    if name not in PDF_ENGINES:
+        raise ValueError(f"Motore PDF non valido: {name}. "
+                         f"Motori disponibili: {', '.join(PDF_ENGINES)}")
+    return PDF_ENGINES[name]()
 
-def load_email_config(config_path: str) -> dict:
-    """Carica configurazione email da file YAML."""
-    try:
-        with open(config_path, 'r', encoding='utf-8') as file:
-            if config_path.endswith('.yaml') or config_path.endswith('.yml'):
-                return yaml.safe_load(file)
-            else:
-                return json.load(file)
-    except Exception as e:
-        raise ValueError(f"Errore nel caricamento configurazione email: {e}")
+
+def available_pdf_engines() -> List[str]:
+    """Nomi dei motori PDF utilizzabili con le librerie installate."""
+    names = []
+    for name in PDF_ENGINES:
+        try:
+            get_pdf_engine(name)
+        except ValueError:
+            continue
+        names.append(name)
+    return names
 
 
 # Versione migliorata della funzione principale
 def add_watermark_to_pdf_advanced(input_pdf_path, watermark_image_path, output_pdf_path, 
-                                 scale_factor=1.0, position="bottom-right", **kwargs):
+                                 scale_factor=1.0, position="bottom-right", session=None,
+                                 **kwargs):
     """
     Versione avanzata per aggiungere watermark con tutte le funzionalità extra.
     
@@ -1165,9 +6758,23 @@ def add_watermark_to_pdf_advanced(input_pdf_path, watermark_image_path, output_p
     - email_config: percorso file configurazione email
     - email_recipients: lista email destinatari
     - email_template: percorso template email
-    """
-    temp_files = []  # Lista file temporanei da pulire
+    - email_outbox: cartella (o EmailOutbox) in cui accodare l'email invece di
+      inviarla subito (vedi OutboxSender)
+    - stamp_mode: "merge" (default) o "xobject" (marchio condiviso come Form XObject)
+    - incremental: True per accodare le modifiche al file originale
+      (aggiornamento incrementale, usa sempre il marchio come XObject)
+    - engine: motore PDF, "pypdf2" (default) o "pymupdf" (vedi PDF_ENGINES)
+    - shards: processi tra cui dividere le pagine di un documento grande
+      (solo motore pypdf2, output come aggiornamento incrementale)
+    - shard_threshold: pagine da firmare oltre cui si usano gli shard
+      (default: SHARD_THRESHOLD)
+    - deterministic: True per un output riproducibile byte per byte (date da
+      signing_time(), nomi delle risorse e /ID non casuali)
     
+    Se viene passata una ``session`` (PdfDocumentSession già aperta sullo stesso
+    input) il motore PyPDF2 non analizza di nuovo il documento; in caso
+    contrario la sessione viene aperta e chiusa dal motore.
+    """
     try:
         # Verifica esistenza file
         if not os.path.exists(input_pdf_path):
@@ -1176,166 +6783,188 @@ def add_watermark_to_pdf_advanced(input_pdf_path, watermark_image_path, output_p
         if not os.path.exists(watermark_image_path):
             raise FileNotFoundError(f"Immagine firma non trovata: {watermark_image_path}")
         
-        print(f"🔄 Elaborazione PDF: {Path(input_pdf_path).name}")
-        
-        # Processa immagine (formato, effetti)
-        processed_image = process_image_format(watermark_image_path)
-        if processed_image != watermark_image_path:
-            temp_files.append(processed_image)
-        
-        # Applica effetti immagine
-        if kwargs.get('border_width', 0) > 0 or kwargs.get('shadow_enabled', False):
-            processed_image = add_image_effects(
-                processed_image,
-                kwargs.get('border_width', 0),
-                kwargs.get('border_color', (0, 0, 0)),
-                kwargs.get('shadow_enabled', False),
-                kwargs.get('shadow_offset', (5, 5))
-            )
-            temp_files.append(processed_image)
-          # Crea timestamp se richiesto
-        timestamp_image = None
-        if kwargs.get('timestamp', False):
-            timestamp_format = kwargs.get('timestamp_format', 'short')
-            timestamp_custom = kwargs.get('timestamp_custom')
-            timestamp_image = create_timestamp_image(timestamp_format, timestamp_custom)
-            temp_files.append(timestamp_image)
-        
-        # Determina pagine da processare e dimensioni pagina
-        with open(input_pdf_path, 'rb') as file:
-            reader = PdfReader(file)
-            total_pages = len(reader.pages)
-            first_page = reader.pages[0]
-            page_size = (
-                float(first_page.mediabox.width),
-                float(first_page.mediabox.height),
-            )
-
-            pages_to_sign = parse_pages_specification(
-                kwargs.get('pages', 'all'), total_pages
-            )
-              # Escludi pagine se specificato
-            exclude_pages_str = kwargs.get('exclude_pages')
-            if exclude_pages_str:
-                excluded = parse_pages_specification(exclude_pages_str, total_pages)
-                pages_to_sign = [p for p in pages_to_sign if p not in excluded]
-        
-        print(f"📄 Pagine da firmare: {len(pages_to_sign)}/{total_pages}")
-        if len(pages_to_sign) < total_pages:
-            pages_display = [str(p+1) for p in pages_to_sign[:5]]
-            if len(pages_to_sign) > 5:
-                pages_display.append('...')
-            print(f"📋 Pagine selezionate: {', '.join(pages_display)}")
-        
-        # Crea watermark principale
-        watermark_pdf_path = create_watermark_pdf(
-            processed_image,
-            scale_factor,
-            position=position,
-            page_size=page_size,
-        )
-        temp_files.append(watermark_pdf_path)
-        
-        # Crea watermark timestamp se necessario
-        timestamp_pdf_path = None
-        if timestamp_image:
-            # Posiziona timestamp in base alla firma
-            timestamp_position = _get_timestamp_position(position, kwargs.get('timestamp_position', 'below'))
-            timestamp_pdf_path = create_watermark_pdf(
-                timestamp_image,
-                0.5,
-                position=timestamp_position,
-                page_size=page_size,
-            )
-            temp_files.append(timestamp_pdf_path)
-        
-        # Processa PDF
-        with open(input_pdf_path, 'rb') as input_file:
-            input_pdf = PdfReader(input_file)
-            output_pdf = PdfWriter()
-            
-            # Carica watermark
-            with open(watermark_pdf_path, 'rb') as wm_file:
-                watermark_pdf = PdfReader(wm_file)
-                watermark_page = watermark_pdf.pages[0]
-                
-                timestamp_page = None
-                if timestamp_pdf_path:
-                    with open(timestamp_pdf_path, 'rb') as ts_file:
-                        timestamp_pdf = PdfReader(ts_file)
-                        timestamp_page = timestamp_pdf.pages[0]
-                
-                # Processa ogni pagina
-                for i, page in enumerate(input_pdf.pages):
-                    if i in pages_to_sign:
-                        # Aggiungi firma
-                        page.merge_page(watermark_page)
-                        # Aggiungi timestamp se presente
-                        if timestamp_page:
-                            page.merge_page(timestamp_page)
-                        print(f"✓ Firmata pagina {i+1}")
-                    
-                    output_pdf.add_page(page)
-            
-            # Aggiungi metadati se richiesti
-            if kwargs.get('add_metadata', False):
-                metadata = {}
-                if kwargs.get('author'):
-                    metadata['/Author'] = kwargs['author']
-                if kwargs.get('title'):
-                    metadata['/Title'] = kwargs['title']
-                if kwargs.get('subject'):
-                    metadata['/Subject'] = kwargs['subject']
-                
-                metadata.update({
-                    '/Creator': 'PDF Signer Advanced',
-                    '/Producer': 'PDF Signer Advanced',
-                    '/CreationDate': f"D:{datetime.now().strftime('%Y%m%d%H%M%S')}",
-                    '/ModDate': f"D:{datetime.now().strftime('%Y%m%d%H%M%S')}"
-                })
-                
-                output_pdf.add_metadata(metadata)
-                print("📝 Metadati aggiunti")
-            
-            # Salva PDF
-            with open(output_pdf_path, 'wb') as output_file:
-                output_pdf.write(output_file)
+        _sign_document(input_pdf_path, watermark_image_path, output_pdf_path,
+                       scale_factor, position, session, kwargs)
         
         print(f"✅ PDF firmato salvato: {output_pdf_path}")
         
         # Invia email se richiesto
-        if kwargs.get('email_config') and kwargs.get('email_recipients'):
-            try:
-                config = load_email_config(kwargs['email_config'])
-                success = send_email_with_pdf(
-                    output_pdf_path, 
-                    config, 
-                    kwargs['email_recipients'],
-                    kwargs.get('email_subject'),
-                    kwargs.get('email_body'),
-                    kwargs.get('email_template')
-                )
-                if success:
-                    print(f"📧 Email inviata a: {', '.join(kwargs['email_recipients'])}")
-                else:
-                    print("⚠️ Errore nell'invio email")
-            except Exception as e:
-                print(f"⚠️ Errore configurazione email: {e}")
+        _email_signed_pdf(output_pdf_path, kwargs)
         
         return True
         
     except Exception as e:
         print(f"❌ Errore: {e}")
         return False
+
+
+def _sign_document(source, watermark, target, scale_factor, position, session, kwargs, name=None):
+    """
+    Pipeline di firma comune ad add_watermark_to_pdf_advanced() e
+    sign_pdf_bytes(): ``source`` e ``target`` sono percorsi o contenuti in
+    memoria, ``watermark`` un percorso, un'immagine o i suoi byte. Gli errori
+    vengono sollevati al chiamante.
+    """
+    stamp_mode = kwargs.get('stamp_mode', 'merge')
+    incremental = kwargs.get('incremental', False)
+    if stamp_mode not in STAMP_MODES:
+        raise ValueError(f"Modalità marchio non valida: {stamp_mode}. "
+                         f"Modalità disponibili: {', '.join(STAMP_MODES)}")
+    engine = get_pdf_engine(kwargs.get('engine') or 'pypdf2')
+    
+    print(f"🔄 Elaborazione PDF: {name or _source_name(source)}")
+    
+    owned_session = None
+    try:
+        deterministic = kwargs.get('deterministic', False)
+        if deterministic and session is None and engine.name == 'pypdf2':
+            # La stessa sessione fornisce la data della firma e le pagine al motore
+            session = owned_session = PdfDocumentSession(source)
+        now = signing_time(source, session, deterministic)
+        
+        # Processa immagine (formato, effetti) in memoria, senza file temporanei
+        image = decode_signature_image(watermark)
+        effect_args = (
+            kwargs.get('border_width', 0),
+            kwargs.get('border_color', (0, 0, 0)),
+            kwargs.get('shadow_enabled', False),
+            kwargs.get('shadow_offset', (5, 5)),
+        )
+        try:
+            if isinstance(image, Image.Image):
+                processed_image = apply_image_effects(image, *effect_args)
+            else:
+                processed_image = cached_signature_image(image, *effect_args)
+        except Exception as e:
+            print(f"Errore nell'applicazione degli effetti: {e}")
+            processed_image = image if isinstance(image, Image.Image) else load_signature_image(image)
+        
+        # Crea timestamp se richiesto
+        timestamp_image = None
+        if kwargs.get('timestamp', False):
+            timestamp_format = kwargs.get('timestamp_format', 'short')
+            timestamp_custom = kwargs.get('timestamp_custom')
+            timestamp_image = render_timestamp_image(timestamp_format, timestamp_custom, now)
         
+        timestamp_position = _get_timestamp_position(position, kwargs.get('timestamp_position', 'below'))
+        effects = (
+            kwargs.get('border_width', 0), tuple(kwargs.get('border_color', (0, 0, 0))),
+            kwargs.get('shadow_enabled', False), tuple(kwargs.get('shadow_offset', (5, 5))),
+            kwargs.get('opacity', 1.0),
+        )
+        stamp = StampSpec(processed_image, scale_factor, position,
+                          timestamp_image, timestamp_position, effects)
+        
+        metadata = _signing_metadata(kwargs, now) if kwargs.get('add_metadata', False) else None
+        
+        engine.sign(
+            source, target, stamp,
+            pages=kwargs.get('pages', 'all'),
+            exclude_pages=kwargs.get('exclude_pages'),
+            metadata=metadata,
+            stamp_mode=stamp_mode,
+            incremental=incremental,
+            session=session,
+            shards=kwargs.get('shards') or 1,
+            shard_threshold=kwargs.get('shard_threshold', SHARD_THRESHOLD),
+            deterministic=deterministic,
+        )
     finally:
-        # Pulizia file temporanei
-        for temp_file in temp_files:
-            try:
-                if os.path.exists(temp_file):
-                    os.unlink(temp_file)
-            except Exception:
-                pass
+        if owned_session is not None:
+            owned_session.close()
+
+
+def sign_pdf_bytes(pdf, watermark_image, scale_factor=1.0, position="bottom-right",
+                   output=None, filename='documento.pdf', **kwargs) -> Optional[bytes]:
+    """
+    Firma un PDF in memoria, senza passare dal filesystem.
+    
+    Accetta gli stessi parametri avanzati di add_watermark_to_pdf_advanced();
+    a differenza delle funzioni su file gli errori vengono sollevati invece
+    di restituire False.
+    
+    Args:
+        pdf: Contenuto del PDF: bytes (usati senza copia), bytearray,
+            memoryview o file-like binario
+        watermark_image: Immagine della firma: percorso, PIL.Image.Image,
+            bytes o file-like con i byte del file
+        scale_factor: Fattore di scala per il marchio
+        position: Posizione del marchio
+        output: File-like binario su cui scrivere il PDF firmato (opzionale)
+        filename: Nome del documento nei messaggi e nell'allegato email
+        **kwargs: Parametri avanzati (pages, timestamp, incremental, engine, ...)
+    
+    Returns:
+        bytes del PDF firmato, oppure None se è stato scritto su ``output``
+    """
+    emailing = kwargs.get('email_config') and kwargs.get('email_recipients')
+    if emailing and output is not None:
+        raise ValueError("L'invio email richiede il PDF firmato in memoria (output=None)")
+    
+    # Stessi input e parametri: il risultato arriva dalla cache degli output (se attiva)
+    cache = OUTPUT_CACHE
+    cache_key = cache.key(pdf, watermark_image, scale_factor, position, kwargs) if cache else None
+    data = cache.get(cache_key) if cache_key else None
+    if data is None:
+        target = io.BytesIO() if output is None or cache_key else output
+        _sign_document(pdf, watermark_image, target, scale_factor, position, None, kwargs, filename)
+        if target is not output:
+            # Nessuna copia: getvalue() restituisce il buffer già scritto
+            data = target.getvalue()
+            if cache_key:
+                cache.put(cache_key, data)
+    if data is not None and output is not None:
+        output.write(data)
+        data = None
+    
+    if emailing:
+        _email_signed_pdf(data, kwargs, filename)
+    return data
+
+
+def _email_signed_pdf(output_pdf_path, kwargs, filename=None):
+    """
+    Invia il PDF firmato (percorso o bytes) se i parametri lo richiedono; con
+    ``email_outbox`` (cartella o EmailOutbox) il messaggio viene solo accodato
+    e la firma non attende il server SMTP.
+    """
+    if kwargs.get('email_config') and kwargs.get('email_recipients'):
+        try:
+            config = load_email_config(kwargs['email_config'])
+            if kwargs.get('email_outbox'):
+                outbox = kwargs['email_outbox']
+                if not isinstance(outbox, EmailOutbox):
+                    outbox = EmailOutbox(outbox)
+                msg = build_email_message(
+                    output_pdf_path,
+                    config,
+                    kwargs['email_recipients'],
+                    kwargs.get('email_subject'),
+                    kwargs.get('email_body'),
+                    kwargs.get('email_template'),
+                    filename=filename,
+                    context=_signing_context(kwargs),
+                )
+                outbox.enqueue(msg, kwargs['email_config'], kwargs['email_recipients'])
+                print(f"📮 Email in coda per: {', '.join(kwargs['email_recipients'])}")
+                return
+            success = send_email_with_pdf(
+                output_pdf_path, 
+                config, 
+                kwargs['email_recipients'],
+                kwargs.get('email_subject'),
+                kwargs.get('email_body'),
+                kwargs.get('email_template'),
+                filename=filename,
+                pool=smtp_pool(),
+                context=_signing_context(kwargs),
+            )
+            if success:
+                print(f"📧 Email inviata a: {', '.join(kwargs['email_recipients'])}")
+            else:
+                print("⚠️ Errore nell'invio email")
+        except Exception as e:
+            print(f"⚠️ Errore configurazione email: {e}")
 
 
 def _get_timestamp_position(signature_position: str, timestamp_relative: str) -> str:
@@ -1383,18 +7012,20 @@ def calculate_watermark_size_points(image_path, scale_factor, dpi=300):
     Calcola la dimensione del watermark in punti PDF in modo coerente.
     
     Args:
-        image_path: Percorso all'immagine del watermark
+        image_path: Percorso all'immagine del watermark (o PIL.Image.Image già aperta)
         scale_factor: Fattore di scala da applicare
         dpi: DPI da assumere per la conversione pixel->punti
     
     Returns:
         Tuple (width_points, height_points, width_pixels, height_pixels)
     """
-    try:
-        with Image.open(image_path) as img:
-            img_width_px, img_height_px = img.size
-    except Exception as e:
-        raise ValueError(f"Errore nell'aprire l'immagine {image_path}: {e}")
+    if isinstance(image_path, Image.Image):
+        img_width_px, img_height_px = image_path.size
+    else:
+        try:
+            img_width_px, img_height_px = SIGNATURE_IMAGES.get(image_path).size
+        except Exception as e:
+            raise ValueError(f"Errore nell'aprire l'immagine {image_path}: {e}")
     
     # Converti da pixel a punti PDF (1 punto = 1/72 pollici)
     base_width_points = (img_width_px / dpi) * 72
@@ -1408,4 +7039,4 @@ def calculate_watermark_size_points(image_path, scale_factor, dpi=300):
 
 
 if __name__ == "__main__":
-    main()
+    sys.exit(main())
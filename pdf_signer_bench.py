@@ -0,0 +1,1393 @@
+#!/usr/bin/env python3
+"""
+Benchmark del percorso di firma di PDF Signer.
+
+Genera PDF sintetici con ReportLab e misura le fasi della pipeline di firma.
+I risultati vengono stampati in formato JSON.
+
+Uso:
+    python pdf_signer_bench.py parse --pages 2000
+    python pdf_signer_bench.py stamp --pages 5000 --timestamp
+    python pdf_signer_bench.py geometry --pages 10000
+    python pdf_signer_bench.py engine --pages 5000
+    python pdf_signer_bench.py shard --pages 50000 --max-jobs 8
+    python pdf_signer_bench.py journal --files 200 --records 20000 --pages 500
+    python pdf_signer_bench.py service --requests 500 --concurrency 8
+    python pdf_signer_bench.py smtp --messages 200 --latency-ms 20
+    python pdf_signer_bench.py outbox --documents 50 --latency-ms 200
+    python pdf_signer_bench.py mime --attachment-mb 200
+    python pdf_signer_bench.py template --messages 10000
+    python pdf_signer_bench.py sender --messages 200 --workers 1,4,8 --message-latency-ms 50
+    python pdf_signer_bench.py suite --pages 1,1000,100000 --output run.json
+    python pdf_signer_bench.py compare base.json run.json
+"""
+
+import argparse
+import hashlib
+import http.client
+import json
+import os
+import platform
+import random
+import shutil
+import socket
+import socketserver
+import statistics
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import uuid
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from multiprocessing import get_context
+from unittest import mock
+
+try:
+    import resource
+except ImportError:  # Windows: picco RSS non disponibile
+    resource = None
+
+from reportlab.pdfgen import canvas
+from reportlab.lib.pagesizes import A4, letter, landscape
+
+from PIL import Image
+
+import pdf_signer
+from pdf_signer import PdfReader, PdfWriter
+
+
+SIGN_IMAGE = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'sign.png')
+
+
+def generate_text_pdf(path, pages, page_size=A4):
+    """Crea un PDF sintetico con una riga di testo per pagina."""
+    c = canvas.Canvas(path, pagesize=page_size)
+    for i in range(pages):
+        c.drawString(72, page_size[1] - 72, f"Pagina di prova {i + 1}")
+        c.showPage()
+    c.save()
+    return path
+
+
+# Geometrie usate dal documento misto: (dimensione, /Rotate, /CropBox)
+MIXED_GEOMETRIES = (
+    (A4, 0, None),
+    (letter, 0, None),
+    (landscape(A4), 0, None),
+    (A4, 90, None),
+    (landscape(letter), 180, None),
+    (A4, 270, None),
+    (A4, 0, (36, 36, 559, 806)),
+)
+
+
+def generate_mixed_pdf(path, pages):
+    """Crea un PDF sintetico che alterna formati, rotazioni e /CropBox."""
+    c = canvas.Canvas(path)
+    for i in range(pages):
+        size, rotation, crop = MIXED_GEOMETRIES[i % len(MIXED_GEOMETRIES)]
+        c.setPageSize(size)
+        c.setPageRotation(rotation)
+        # ReportLab mantiene il /CropBox tra le pagine: va impostato sempre
+        c.setCropBox(crop)
+        c.drawString(72, size[1] - 72, f"Pagina di prova {i + 1}")
+        c.showPage()
+    c.save()
+    return path
+
+
+class _CountingReader(PdfReader):
+    """PdfReader che conta quante volte viene analizzato ciascun file."""
+
+    counts = {}
+
+    def __init__(self, stream, *args, **kwargs):
+        name = getattr(stream, 'name', stream)
+        _CountingReader.counts[name] = _CountingReader.counts.get(name, 0) + 1
+        super().__init__(stream, *args, **kwargs)
+
+
+def bench_parse(pages, repeat=3):
+    """
+    Misura quante volte il PDF di input viene analizzato da
+    add_watermark_to_pdf/add_watermark_to_pdf_advanced e il tempo risparmiato
+    rispetto alle analisi multiple della versione precedente.
+    """
+    workdir = tempfile.mkdtemp(prefix='pdf_signer_bench_')
+    input_pdf = generate_text_pdf(os.path.join(workdir, 'input.pdf'), pages)
+    output_pdf = os.path.join(workdir, 'output.pdf')
+
+    # Costo di una singola analisi completa (reader + conteggio pagine + geometria)
+    parse_times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        with open(input_pdf, 'rb') as f:
+            reader = PdfReader(f)
+            len(reader.pages)
+            reader.pages[0].mediabox.width
+        parse_times.append(time.perf_counter() - start)
+    parse_time = min(parse_times)
+
+    # Prima di PdfDocumentSession entrambe le modalità analizzavano l'input due volte
+    legacy_parses = {'standard': 2, 'advanced': 2}
+    results = {
+        'benchmark': 'parse',
+        'pages': pages,
+        'input_bytes': os.path.getsize(input_pdf),
+        'single_parse_s': round(parse_time, 4),
+        'modes': {},
+    }
+
+    original_reader = pdf_signer.PdfReader
+    pdf_signer.PdfReader = _CountingReader
+    try:
+        for mode, kwargs in (('standard', {}), ('advanced', {'pages': 'all'})):
+            _CountingReader.counts = {}
+            start = time.perf_counter()
+            pdf_signer.add_watermark_to_pdf(
+                input_pdf, SIGN_IMAGE, output_pdf, 0.2, 'bottom-right', **kwargs
+            )
+            elapsed = time.perf_counter() - start
+            parses = _CountingReader.counts.get(input_pdf, 0)
+            results['modes'][mode] = {
+                'parses_before': legacy_parses[mode],
+                'parses_after': parses,
+                'total_s': round(elapsed, 4),
+                'saved_s': round((legacy_parses[mode] - parses) * parse_time, 4),
+            }
+    finally:
+        pdf_signer.PdfReader = original_reader
+        for name in os.listdir(workdir):
+            os.unlink(os.path.join(workdir, name))
+        os.rmdir(workdir)
+
+    return results
+
+
+def bench_stamp(pages, timestamp=False):
+    """
+    Confronta le modalità di applicazione del marchio ("merge" e "xobject"):
+    pagine al secondo e dimensione del file prodotto.
+    """
+    workdir = tempfile.mkdtemp(prefix='pdf_signer_bench_')
+    input_pdf = generate_text_pdf(os.path.join(workdir, 'input.pdf'), pages)
+    results = {
+        'benchmark': 'stamp',
+        'pages': pages,
+        'timestamp': timestamp,
+        'input_bytes': os.path.getsize(input_pdf),
+        'modes': {},
+    }
+    try:
+        for mode in pdf_signer.STAMP_MODES:
+            output_pdf = os.path.join(workdir, f'output_{mode}.pdf')
+            start = time.perf_counter()
+            ok = pdf_signer.add_watermark_to_pdf_advanced(
+                input_pdf, SIGN_IMAGE, output_pdf, 0.2, 'bottom-right',
+                stamp_mode=mode, timestamp=timestamp,
+            )
+            elapsed = time.perf_counter() - start
+            if not ok:
+                raise RuntimeError(f"Firma fallita in modalità {mode}")
+            results['modes'][mode] = {
+                'total_s': round(elapsed, 4),
+                'pages_per_s': round(pages / elapsed, 1),
+                'output_bytes': os.path.getsize(output_pdf),
+            }
+    finally:
+        for name in os.listdir(workdir):
+            os.unlink(os.path.join(workdir, name))
+        os.rmdir(workdir)
+
+    return results
+
+
+def bench_geometry(pages):
+    """
+    Firma un documento con geometrie di pagina miste e misura quanti marchi
+    vengono generati (uno per dimensione visibile) rispetto alla rigenerazione
+    per ogni pagina, stimata dal costo medio di creazione di un marchio.
+    """
+    workdir = tempfile.mkdtemp(prefix='pdf_signer_bench_')
+    input_pdf = generate_mixed_pdf(os.path.join(workdir, 'input.pdf'), pages)
+    results = {
+        'benchmark': 'geometry',
+        'pages': pages,
+        'distinct_geometries': len(MIXED_GEOMETRIES),
+        'input_bytes': os.path.getsize(input_pdf),
+        'modes': {},
+    }
+    built = []
+    original_cache = pdf_signer.StampCache
+
+    class _RecordingCache(original_cache):
+        def __exit__(self, *exc):
+            built.append((self.stamps_built, self.geometries))
+            return super().__exit__(*exc)
+
+    pdf_signer.StampCache = _RecordingCache
+    try:
+        # Costo di generazione di un singolo marchio
+        start = time.perf_counter()
+        stamp_path = pdf_signer.create_watermark_pdf(SIGN_IMAGE, 0.2, page_size=A4)
+        with open(stamp_path, 'rb') as f:
+            PdfReader(f).pages[0].get_contents()
+        stamp_s = time.perf_counter() - start
+        os.unlink(stamp_path)
+        results['single_stamp_s'] = round(stamp_s, 5)
+
+        for mode in pdf_signer.STAMP_MODES:
+            output_pdf = os.path.join(workdir, f'output_{mode}.pdf')
+            start = time.perf_counter()
+            ok = pdf_signer.add_watermark_to_pdf_advanced(
+                input_pdf, SIGN_IMAGE, output_pdf, 0.2, 'bottom-right', stamp_mode=mode,
+            )
+            elapsed = time.perf_counter() - start
+            if not ok:
+                raise RuntimeError(f"Firma fallita in modalità {mode}")
+            stamps_built, geometries = built[-1]
+            results['modes'][mode] = {
+                'total_s': round(elapsed, 4),
+                'pages_per_s': round(pages / elapsed, 1),
+                'stamps_built': stamps_built,
+                'geometries': geometries,
+                'per_page_regeneration_s': round(pages * stamp_s, 4),
+                'output_bytes': os.path.getsize(output_pdf),
+            }
+    finally:
+        pdf_signer.StampCache = original_cache
+        for name in os.listdir(workdir):
+            os.unlink(os.path.join(workdir, name))
+        os.rmdir(workdir)
+
+    return results
+
+
+def bench_engine(pages):
+    """
+    Confronta i motori PDF installati sullo stesso documento con geometrie
+    miste: pagine al secondo e dimensione del file prodotto.
+    """
+    workdir = tempfile.mkdtemp(prefix='pdf_signer_bench_')
+    input_pdf = generate_mixed_pdf(os.path.join(workdir, 'input.pdf'), pages)
+    results = {
+        'benchmark': 'engine',
+        'pages': pages,
+        'input_bytes': os.path.getsize(input_pdf),
+        'engines': {},
+    }
+    try:
+        for engine in pdf_signer.available_pdf_engines():
+            output_pdf = os.path.join(workdir, f'output_{engine}.pdf')
+            start = time.perf_counter()
+            ok = pdf_signer.add_watermark_to_pdf_advanced(
+                input_pdf, SIGN_IMAGE, output_pdf, 0.2, 'bottom-right', engine=engine,
+            )
+            elapsed = time.perf_counter() - start
+            if not ok:
+                raise RuntimeError(f"Firma fallita con il motore {engine}")
+            results['engines'][engine] = {
+                'total_s': round(elapsed, 4),
+                'pages_per_s': round(pages / elapsed, 1),
+                'output_bytes': os.path.getsize(output_pdf),
+            }
+    finally:
+        for name in os.listdir(workdir):
+            os.unlink(os.path.join(workdir, name))
+        os.rmdir(workdir)
+
+    return results
+
+
+def bench_shard(pages, max_jobs=None):
+    """
+    Curva di scalabilità della firma a shard di un solo documento grande:
+    da 1 processo (firma incrementale seriale) a ``max_jobs`` processi.
+    """
+    max_jobs = max_jobs or os.cpu_count() or 1
+    workdir = tempfile.mkdtemp(prefix='pdf_signer_bench_')
+    input_pdf = generate_mixed_pdf(os.path.join(workdir, 'input.pdf'), pages)
+    results = {
+        'benchmark': 'shard',
+        'pages': pages,
+        'cpu_count': os.cpu_count(),
+        'input_bytes': os.path.getsize(input_pdf),
+        'jobs': {},
+    }
+    try:
+        baseline = None
+        for jobs in range(1, max_jobs + 1):
+            output_pdf = os.path.join(workdir, f'output_{jobs}.pdf')
+            # Un solo processo: stesso output (incrementale, XObject) senza shard
+            options = {'incremental': True} if jobs == 1 else {'shards': jobs, 'shard_threshold': 0}
+            start = time.perf_counter()
+            ok = pdf_signer.add_watermark_to_pdf_advanced(
+                input_pdf, SIGN_IMAGE, output_pdf, 0.2, 'bottom-right', **options
+            )
+            elapsed = time.perf_counter() - start
+            if not ok:
+                raise RuntimeError(f"Firma fallita con {jobs} processi")
+            baseline = baseline or elapsed
+            results['jobs'][jobs] = {
+                'total_s': round(elapsed, 4),
+                'pages_per_s': round(pages / elapsed, 1),
+                'speedup': round(baseline / elapsed, 2),
+                'efficiency': round(baseline / elapsed / jobs, 2),
+                'output_bytes': os.path.getsize(output_pdf),
+            }
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+
+    return results
+
+
+# Politiche di fsync del registro di ripresa: (righe per fsync, secondi tra fsync)
+JOURNAL_POLICIES = {
+    'every-record': (1, 0.0),
+    'batched': (64, 1.0),
+    'on-close': (10 ** 9, float('inf')),
+}
+
+
+def bench_journal(files, records, repeat=3, pages=1):
+    """
+    Costo del registro di ripresa (BatchJournal): scrittura di ``records``
+    righe con le diverse politiche di fsync, lettura e ricerca per la
+    ripresa, e incidenza sulla firma in blocco di ``files`` PDF di ``pages``
+    pagine (con input grandi l'impronta non deve rileggere il file).
+    """
+    workdir = tempfile.mkdtemp(prefix='pdf_signer_bench_')
+    results = {
+        'benchmark': 'journal',
+        'files': files,
+        'records': records,
+        'pages': pages,
+        'repeat': repeat,
+        'write_us_per_record': {},
+        'batch': {},
+    }
+    try:
+        source = generate_text_pdf(os.path.join(workdir, 'source.pdf'), pages)
+        results['input_bytes'] = os.path.getsize(source)
+        params = pdf_signer.job_params_hash(SIGN_IMAGE, 0.2, 'bottom-right', {})
+        fingerprint = pdf_signer.input_fingerprint(source)
+        start = time.perf_counter()
+        for _ in range(records):
+            pdf_signer.input_fingerprint(source)
+        results['fingerprint_us'] = round((time.perf_counter() - start) / records * 1e6, 2)
+
+        for name, (sync_every, sync_interval) in JOURNAL_POLICIES.items():
+            path = os.path.join(workdir, f'{name}.jsonl')
+            start = time.perf_counter()
+            with pdf_signer.BatchJournal(path, sync_every, sync_interval) as journal:
+                for i in range(records):
+                    journal.record(pdf_signer.BatchResult(
+                        f'in/{i}.pdf', f'out/{i}.pdf', True, 1, 0.01, None, fingerprint), params)
+            elapsed = time.perf_counter() - start
+            results['write_us_per_record'][name] = round(elapsed / records * 1e6, 2)
+
+        # Ripresa: lettura del registro e ricerca per lavoro
+        journal = pdf_signer.BatchJournal(os.path.join(workdir, 'batched.jsonl'))
+        start = time.perf_counter()
+        journal.load()
+        results['load_s'] = round(time.perf_counter() - start, 4)
+        start = time.perf_counter()
+        for i in range(records):
+            journal.is_completed(f'in/{i}.pdf', f'out/{i}.pdf', params)
+        results['lookup_us_per_job'] = round((time.perf_counter() - start) / records * 1e6, 2)
+
+        jobs = []
+        for i in range(files):
+            path = os.path.join(workdir, 'batch', f'{i}.pdf')
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            shutil.copyfile(source, path)
+            jobs.append((path, os.path.join(workdir, 'signed', f'{i}.pdf')))
+        # Primo giro a vuoto: immagine e marchio compilato in cache per tutte le varianti
+        pdf_signer.sign_batch(jobs, SIGN_IMAGE, 0.2, workers=1)
+        timings = {name: [] for name in ('none',) + tuple(JOURNAL_POLICIES)}
+        for round_ in range(repeat):
+            # Varianti alternate a ogni giro: il rumore della macchina si distribuisce
+            for name in timings:
+                journal = None
+                if name != 'none':
+                    journal = pdf_signer.BatchJournal(
+                        os.path.join(workdir, f'batch_{name}_{round_}.jsonl'), *JOURNAL_POLICIES[name])
+                start = time.perf_counter()
+                pdf_signer.sign_batch(jobs, SIGN_IMAGE, 0.2, workers=1, journal=journal)
+                if journal:
+                    journal.close()
+                timings[name].append(time.perf_counter() - start)
+        for name, runs in timings.items():
+            results['batch'][name] = {'total_s': round(statistics.median(runs), 4)}
+        baseline = results['batch']['none']['total_s']
+        for timing in results['batch'].values():
+            timing['overhead_pct'] = round((timing['total_s'] / baseline - 1) * 100, 2)
+            timing['overhead_ms_per_file'] = round((timing['total_s'] - baseline) / files * 1e3, 3)
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+
+    return results
+
+
+class _UnixHTTPConnection(http.client.HTTPConnection):
+    """Connessione HTTP su socket Unix (servizio avviato con --socket)."""
+
+    def __init__(self, path, timeout=60):
+        super().__init__('localhost', timeout=timeout)
+        self.socket_path = path
+
+    def connect(self):
+        self.sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        self.sock.settimeout(self.timeout)
+        self.sock.connect(self.socket_path)
+
+
+def _percentile(values, q):
+    """Percentile ``q`` (0-1) con il metodo nearest-rank su valori ordinati."""
+    if not values:
+        return 0.0
+    return values[min(len(values) - 1, max(0, int(round(q * len(values))) - 1))]
+
+
+def bench_service(requests, concurrency, pages=1, workers=None, address=None,
+                  subprocess_runs=3, params='scale=0.2'):
+    """
+    Prova di carico del servizio di firma (--serve): ``requests`` richieste da
+    ``concurrency`` client con connessioni persistenti. Riporta latenze
+    p50/p90/p99, richieste/s ed esiti (503 = respinte per coda piena).
+
+    ``address`` è "host:porta" o il percorso di un socket Unix; senza,
+    viene avviato un servizio locale con ``workers`` processi. Per confronto
+    misura anche ``subprocess_runs`` esecuzioni di pdf_signer.py come
+    processo separato, il costo pagato oggi per ogni richiesta.
+    """
+    workdir = tempfile.mkdtemp(prefix='pdf_signer_bench_')
+    input_pdf = generate_text_pdf(os.path.join(workdir, 'input.pdf'), pages)
+    with open(input_pdf, 'rb') as f:
+        body = f.read()
+    service = server = None
+    if address is None:
+        service = pdf_signer.SigningService(SIGN_IMAGE, 0.2, workers=workers).start()
+        server = service.make_server(port=0)
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        address = f"127.0.0.1:{server.server_address[1]}"
+
+    def connect():
+        if ':' in address and not os.path.exists(address):
+            host, port = address.rsplit(':', 1)
+            return http.client.HTTPConnection(host, int(port), timeout=60)
+        return _UnixHTTPConnection(address)
+
+    counter = iter(range(requests))
+    counter_lock = threading.Lock()
+
+    def client():
+        samples = []
+        conn = connect()
+        try:
+            while True:
+                with counter_lock:
+                    if next(counter, None) is None:
+                        return samples
+                start = time.perf_counter()
+                conn.request('POST', f'/sign?{params}', body, {'Content-Type': 'application/pdf'})
+                response = conn.getresponse()
+                response.read()
+                samples.append((time.perf_counter() - start, response.status))
+                if response.getheader('Connection') == 'close':
+                    conn.close()
+                    conn = connect()
+        finally:
+            conn.close()
+
+    try:
+        start = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=concurrency) as pool:
+            samples = [s for result in [pool.submit(client) for _ in range(concurrency)]
+                       for s in result.result()]
+        elapsed = time.perf_counter() - start
+
+        baseline = []
+        for _ in range(subprocess_runs):
+            t0 = time.perf_counter()
+            subprocess.run([sys.executable, pdf_signer.__file__, input_pdf, '-w', SIGN_IMAGE,
+                            '-o', os.path.join(workdir, 'cli.pdf')],
+                           check=True, capture_output=True)
+            baseline.append(time.perf_counter() - t0)
+    finally:
+        if server is not None:
+            server.shutdown()
+            server.server_close()
+            service.close()
+        shutil.rmtree(workdir, ignore_errors=True)
+
+    ok = sorted(latency for latency, status in samples if status == 200)
+    statuses = {}
+    for _, status in samples:
+        statuses[str(status)] = statuses.get(str(status), 0) + 1
+    return {
+        'benchmark': 'service',
+        'address': address,
+        'requests': requests,
+        'concurrency': concurrency,
+        'pages': pages,
+        'workers': service.workers if service else None,
+        'status': statuses,
+        'requests_per_s': round(len(ok) / elapsed, 1) if elapsed else 0.0,
+        'latency_ms': {
+            name: round(_percentile(ok, q) * 1000, 2)
+            for name, q in (('p50', 0.50), ('p90', 0.90), ('p99', 0.99), ('max', 1.0))
+        },
+        'subprocess_ms': round(statistics.median(baseline) * 1000, 1) if baseline else None,
+    }
+
+
+class _StubSmtpHandler(socketserver.StreamRequestHandler):
+    """Sessione SMTP minima: accetta tutto, simula la latenza di handshake e AUTH."""
+
+    def _reply(self, line):
+        self.wfile.write(line.encode('ascii') + b'\r\n')
+
+    def handle(self):
+        server = self.server
+        with server.lock:
+            server.connections += 1
+            server.active += 1
+            server.max_active = max(server.max_active, server.active)
+        try:
+            self._session(server)
+        finally:
+            with server.lock:
+                server.active -= 1
+
+    def _session(self, server):
+        time.sleep(server.latency)  # connessione e handshake TLS
+        self._reply('220 stub ESMTP')
+        sent = 0
+        while True:
+            line = self.rfile.readline()
+            if not line:
+                return
+            verb = line[:4].upper()
+            if verb == b'EHLO':
+                self.wfile.write(b'250-stub\r\n250-AUTH PLAIN LOGIN\r\n250 8BITMIME\r\n')
+            elif verb == b'AUTH':
+                time.sleep(server.latency)
+                self._reply('235 autenticato')
+            elif verb == b'DATA':
+                self._reply('354 fine con <CRLF>.<CRLF>')
+                lines = []
+                while True:
+                    line = self.rfile.readline()
+                    if line in (b'.\r\n', b''):
+                        break
+                    if server.keep:
+                        lines.append(line[1:] if line.startswith(b'..') else line)
+                time.sleep(server.message_latency)  # scansione e consegna del messaggio
+                sent += 1
+                with server.lock:
+                    server.messages += 1
+                    if server.keep:
+                        server.received.append(b''.join(lines))
+                self._reply('250 accettato')
+                if server.drop_after and sent >= server.drop_after:
+                    return  # Il relay chiude la connessione senza avvisare
+            elif verb == b'MAIL' and server.throttle_mail():
+                self._reply('451 4.7.0 troppi messaggi, riprovare piu tardi')
+            elif verb == b'NOOP':
+                with server.lock:
+                    server.noops += 1
+                self._reply('250 ok')
+            elif verb == b'QUIT':
+                self._reply('221 arrivederci')
+                return
+            else:  # HELO, MAIL, RCPT, RSET
+                self._reply('250 ok')
+
+
+class StubSmtpServer(socketserver.ThreadingTCPServer):
+    """
+    Server SMTP locale che sostituisce il relay nei benchmark e nei test.
+    ``latency`` secondi per connessione e per AUTH; con ``drop_after`` chiude
+    ogni connessione dopo quel numero di messaggi; con ``keep`` conserva i
+    messaggi ricevuti in ``received``. ``message_latency`` secondi per
+    messaggio; le prime ``throttle`` transazioni ricevono 451 (rallentare).
+    ``max_active`` registra il massimo di connessioni contemporanee.
+    """
+
+    daemon_threads = True
+    allow_reuse_address = True
+
+    def __init__(self, latency=0.0, drop_after=None, keep=False, message_latency=0.0, throttle=0):
+        super().__init__(('127.0.0.1', 0), _StubSmtpHandler)
+        self.latency = latency
+        self.drop_after = drop_after
+        self.keep = keep
+        self.received = []
+        self.message_latency = message_latency
+        self.throttle = throttle
+        self.throttled = self.active = self.max_active = 0
+        self.lock = threading.Lock()
+        self.connections = self.messages = self.noops = 0
+        threading.Thread(target=self.serve_forever, daemon=True).start()
+
+    def throttle_mail(self):
+        with self.lock:
+            if self.throttled < self.throttle:
+                self.throttled += 1
+                return True
+            return False
+
+    def email_config(self):
+        host, port = self.server_address
+        return {'smtp_server': host, 'smtp_port': port, 'use_tls': False,
+                'username': 'bench', 'password': 'bench', 'from_address': 'bench@example.com'}
+
+    def close(self):
+        self.shutdown()
+        self.server_close()
+
+
+def bench_smtp(messages, latency=0.02, attachment_kb=64, drop_after=None):
+    """
+    Invio di ``messages`` PDF firmati a un server SMTP locale che simula
+    ``latency`` secondi di handshake e di AUTH: una connessione per messaggio
+    (comportamento predefinito di send_email_with_pdf) contro
+    SmtpConnectionPool. Con ``drop_after`` il server chiude le connessioni
+    dopo quel numero di messaggi e il pool deve riaprirle.
+    """
+    attachment = os.urandom(attachment_kb * 1024)
+    results = {
+        'benchmark': 'smtp',
+        'messages': messages,
+        'latency_ms': latency * 1000,
+        'attachment_kb': attachment_kb,
+        'drop_after': drop_after,
+    }
+    for name in ('per_message', 'pooled'):
+        server = StubSmtpServer(latency, drop_after)
+        pool = pdf_signer.SmtpConnectionPool() if name == 'pooled' else None
+        try:
+            start = time.perf_counter()
+            delivered = sum(
+                pdf_signer.send_email_with_pdf(attachment, server.email_config(), ['a@example.com'],
+                                               filename=f'{i}.pdf', pool=pool)
+                for i in range(messages)
+            )
+            elapsed = time.perf_counter() - start
+            if pool:
+                pool.close()
+        finally:
+            server.close()
+        results[name] = {
+            'delivered': delivered,
+            'connections': server.connections,
+            'messages_per_s': round(delivered / elapsed, 1) if elapsed else 0.0,
+        }
+        if pool:
+            results[name]['pool'] = pool.stats()
+    per_message = results['per_message']['messages_per_s']
+    results['speedup'] = round(results['pooled']['messages_per_s'] / per_message, 2) if per_message else None
+    return results
+
+
+def bench_outbox(documents, latency=0.2, workers=2):
+    """
+    Firma di ``documents`` PDF con invio email a un server SMTP locale lento
+    (``latency`` secondi di handshake e AUTH): invio durante la firma contro
+    EmailOutbox, dove la firma accoda soltanto e OutboxSender spedisce in
+    sottofondo con ``workers`` thread. Misura la latenza di firma per
+    documento e il tempo fino all'ultima consegna.
+    """
+    results = {'benchmark': 'outbox', 'documents': documents, 'latency_ms': latency * 1000}
+    with tempfile.TemporaryDirectory() as tmp:
+        pdf_path = os.path.join(tmp, 'documento.pdf')
+        generate_text_pdf(pdf_path, 1)
+        with open(pdf_path, 'rb') as f:
+            data = f.read()
+        for name in ('direct', 'outbox'):
+            server = StubSmtpServer(latency)
+            config_path = os.path.join(tmp, f'{name}.json')
+            with open(config_path, 'w', encoding='utf-8') as f:
+                json.dump(server.email_config(), f)
+            kwargs = {'email_config': config_path, 'email_recipients': ['a@example.com']}
+            sender = None
+            if name == 'outbox':
+                sender = pdf_signer.OutboxSender(os.path.join(tmp, 'outbox'), workers).start()
+                kwargs['email_outbox'] = sender.outbox
+            try:
+                latencies = []
+                start = time.perf_counter()
+                for _ in range(documents):
+                    t0 = time.perf_counter()
+                    pdf_signer.sign_pdf_bytes(data, SIGN_IMAGE, 0.2, **kwargs)
+                    latencies.append(time.perf_counter() - t0)
+                signed = time.perf_counter() - start
+                latencies.sort()
+                if sender:
+                    sender.stop()
+                delivered = time.perf_counter() - start
+            finally:
+                pdf_signer.smtp_pool().close()
+                server.close()
+            results[name] = {
+                'sign_p50_ms': round(_percentile(latencies, 0.5) * 1000, 2),
+                'sign_p99_ms': round(_percentile(latencies, 0.99) * 1000, 2),
+                'signing_s': round(signed, 3),
+                'all_delivered_s': round(delivered, 3),
+                'messages': server.messages,
+            }
+            if sender:
+                results[name]['sender'] = dict(sender.counts)
+    return results
+
+
+# Processo separato per ogni misura: il picco RSS (ru_maxrss) non si azzera
+_MIME_CHILD = """
+import json, sys
+sys.path.insert(0, sys.argv[4])
+import pdf_signer, pdf_signer_bench as bench
+config, path, streamed = json.loads(sys.argv[1]), sys.argv[2], sys.argv[3] == '1'
+if not streamed:
+    pdf_signer.EMAIL_STREAM_THRESHOLD = float('inf')
+before = bench._peak_rss_bytes()
+ok = pdf_signer.send_email_with_pdf(path, config, ['a@example.com'])
+print(json.dumps({'ok': ok, 'before': before, 'after': bench._peak_rss_bytes()}))
+"""
+
+
+def bench_mime(attachment_mb):
+    """
+    Picco di memoria (RSS) per inviare un allegato di ``attachment_mb`` MB a
+    un server SMTP locale: messaggio costruito in memoria contro allegato
+    codificato in base64 a blocchi durante DATA (EMAIL_STREAM_THRESHOLD).
+    """
+    results = {'benchmark': 'mime', 'attachment_mb': attachment_mb}
+    root = os.path.dirname(os.path.abspath(__file__))
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, 'scansione.pdf')
+        with open(path, 'wb') as f:
+            for _ in range(attachment_mb):
+                f.write(os.urandom(1024 * 1024))
+        for name in ('buffered', 'streamed'):
+            server = StubSmtpServer()
+            try:
+                start = time.perf_counter()
+                proc = subprocess.run(
+                    [sys.executable, '-c', _MIME_CHILD, json.dumps(server.email_config()), path,
+                     '1' if name == 'streamed' else '0', root],
+                    capture_output=True, text=True, check=True)
+                elapsed = time.perf_counter() - start
+            finally:
+                server.close()
+            child = json.loads(proc.stdout.strip().splitlines()[-1])
+            results[name] = {
+                'delivered': child['ok'] and server.messages == 1,
+                'seconds': round(elapsed, 3),
+                'peak_rss_mb': round(child['after'] / 2 ** 20, 1) if child['after'] else None,
+                'peak_rss_growth_mb': (round((child['after'] - child['before']) / 2 ** 20, 1)
+                                       if child['after'] else None),
+            }
+    return results
+
+
+def bench_template(messages, attachment_kb=256):
+    """
+    Costruzione di ``messages`` email da un template YAML con un allegato
+    aggiuntivo di ``attachment_kb`` KB: template analizzato e allegato
+    codificato a ogni messaggio (cache svuotata) contro EMAIL_TEMPLATES.
+    """
+    results = {'benchmark': 'template', 'messages': messages, 'attachment_kb': attachment_kb}
+    config = {'smtp_server': 'localhost', 'from_address': 'bench@example.com'}
+    with tempfile.TemporaryDirectory() as tmp:
+        with open(os.path.join(tmp, 'allegato.bin'), 'wb') as f:
+            f.write(os.urandom(attachment_kb * 1024))
+        template = os.path.join(tmp, 'modello.yaml')
+        with open(template, 'w', encoding='utf-8') as f:
+            f.write('subject: "Firmato: {filename}"\n'
+                    'body: "Gentile {recipient}, in allegato {filename} ({pages_signed})."\n'
+                    'additional_attachments: [allegato.bin]\n')
+        for name in ('uncached', 'cached'):
+            pdf_signer.EMAIL_TEMPLATES.clear()
+            parses = 0
+            start = time.perf_counter()
+            for i in range(messages):
+                if name == 'uncached':
+                    parses += pdf_signer.EMAIL_TEMPLATES.stats()['parses']
+                    pdf_signer.EMAIL_TEMPLATES.clear()
+                pdf_signer.build_email_message(b'%PDF', config, ['a@example.com'],
+                                               template_path=template, filename=f'{i}.pdf')
+            elapsed = time.perf_counter() - start
+            results[name] = {
+                'messages_per_s': round(messages / elapsed, 1) if elapsed else 0.0,
+                'template_parses': parses + pdf_signer.EMAIL_TEMPLATES.stats()['parses'],
+            }
+    uncached = results['uncached']['messages_per_s']
+    results['speedup'] = round(results['cached']['messages_per_s'] / uncached, 2) if uncached else None
+    return results
+
+
+def bench_sender(messages, workers=(1, 4), message_latency=0.05, messages_per_minute=None,
+                 throttle=0):
+    """
+    Svuotamento di una coda di ``messages`` email con OutboxSender e 1..N
+    connessioni SMTP verso un server locale che impiega ``message_latency``
+    secondi per messaggio. Con ``messages_per_minute`` si applica il limite
+    del provider (token bucket); il server risponde 451 alle prime
+    ``throttle`` transazioni per mostrare il rallentamento adattivo.
+    """
+    results = {'benchmark': 'sender', 'messages': messages,
+               'message_latency_ms': message_latency * 1000,
+               'messages_per_minute': messages_per_minute, 'throttle': throttle, 'runs': {}}
+    with tempfile.TemporaryDirectory() as tmp:
+        for count in workers:
+            server = StubSmtpServer(message_latency=message_latency, throttle=throttle)
+            config = server.email_config()
+            if messages_per_minute:
+                config['rate_limit'] = {'messages_per_minute': messages_per_minute, 'burst': 1}
+            outbox = pdf_signer.EmailOutbox(os.path.join(tmp, f'coda-{count}'), backoff_base=0.05)
+            for i in range(messages):
+                msg = pdf_signer.build_email_message(b'%PDF', config, ['a@example.com'],
+                                                     filename=f'{i}.pdf')
+                outbox.enqueue(msg, config)
+            limiter = pdf_signer.SmtpRateLimiter(count, backoff_base=0.05, backoff_max=0.5)
+            sender = pdf_signer.OutboxSender(outbox, count, poll_interval=0.02, limiter=limiter)
+            try:
+                sender.start()
+                while outbox.counts()['sent'] + outbox.counts()['failed'] < messages:
+                    time.sleep(0.01)
+                sender.stop()
+            finally:
+                server.close()
+            stats = sender.stats()
+            results['runs'][str(count)] = {
+                'delivered': stats['sent'],
+                'deferred': stats['deferred'],
+                'failed': stats['failed'],
+                'messages_per_s': stats['messages_per_s'],
+                'max_connections_seen': server.max_active,
+                'throttled': sum(p['throttled'] for p in stats['providers'].values()),
+            }
+    return results
+
+
+# --- Suite di benchmark su corpus sintetico -------------------------------
+
+# Cambia quando cambia il contenuto generato: invalida i corpus conservati
+CORPUS_VERSION = 1
+CORPUS_KINDS = ('text', 'image', 'mixed', 'rotated', 'stamped')
+SUITE_SCHEMA = 1
+
+# Formati del corpus 'mixed' (le rotazioni sono nel corpus 'rotated')
+MIXED_SIZES = tuple((size, crop) for size, rotation, crop in MIXED_GEOMETRIES if rotation == 0)
+
+# Configurazioni di firma: (API, parametri)
+SUITE_CONFIGS = {
+    'basic': ('standard', {}),
+    'pages': ('advanced', {'pages': 'odd'}),
+    'effects': ('advanced', {'border_width': 3, 'shadow_enabled': True}),
+    'timestamp': ('advanced', {'timestamp': True}),
+    'metadata': ('advanced', {'add_metadata': True, 'author': 'Benchmark', 'title': 'Corpus'}),
+    'full': ('advanced', {
+        'pages': 'odd', 'border_width': 3, 'shadow_enabled': True,
+        'timestamp': True, 'add_metadata': True, 'author': 'Benchmark',
+    }),
+}
+
+WORDS = (
+    "firma documento pagina contratto allegato fattura ordine cliente "
+    "fornitore data importo totale articolo clausola sezione riferimento"
+).split()
+
+
+def _canvas(path, page_size=A4):
+    # invariant=1: niente data di creazione né /ID casuale, file riproducibili
+    return canvas.Canvas(path, pagesize=page_size, invariant=1)
+
+
+def _text_page(c, rng, size, lines):
+    width, height = size
+    c.setFont('Helvetica', 9)
+    for line in range(lines):
+        y = height - 54 - line * 11
+        if y < 54:
+            break
+        c.drawString(54, y, ' '.join(rng.choice(WORDS) for _ in range(14)))
+
+
+def _corpus_images(directory, seed, count=4):
+    """Immagini di rumore (non comprimibili) riutilizzate dal corpus 'image'."""
+    rng = random.Random(f'images:{seed}')
+    paths = []
+    for i in range(count):
+        path = os.path.join(directory, f'image_{i}.png')
+        if not os.path.exists(path):
+            data = bytes(rng.getrandbits(8) for _ in range(160 * 120 * 3))
+            Image.frombytes('RGB', (160, 120), data).save(path)
+        paths.append(path)
+    return paths
+
+
+def generate_corpus_pdf(path, kind, pages, seed=0):
+    """
+    Genera un PDF sintetico riproducibile (stessi byte a parità di argomenti).
+
+    kind:
+      - text: pagine A4 piene di testo
+      - image: una o più immagini raster per pagina
+      - mixed: formati e /CropBox diversi (MIXED_GEOMETRIES)
+      - rotated: pagine con /Rotate 90/180/270
+      - stamped: testo già firmato una volta (ri-firma di un documento firmato)
+    """
+    if kind not in CORPUS_KINDS:
+        raise ValueError(f"Tipo di corpus non valido: {kind}")
+    rng = random.Random(f'{kind}:{pages}:{seed}')
+
+    if kind == 'stamped':
+        source = path + '.text.pdf'
+        generate_corpus_pdf(source, 'text', pages, seed)
+        stdout = sys.stdout
+        sys.stdout = open(os.devnull, 'w')
+        # merge_page rinomina le risorse in conflitto con uuid4(): nomi riproducibili
+        seeded_uuid4 = lambda: uuid.UUID(int=rng.getrandbits(128), version=4)
+        try:
+            with mock.patch.object(uuid, 'uuid4', seeded_uuid4):
+                ok = pdf_signer.add_watermark_to_pdf(source, SIGN_IMAGE, path, 0.2, 'bottom-left')
+        finally:
+            sys.stdout.close()
+            sys.stdout = stdout
+            os.unlink(source)
+        if not ok:
+            raise RuntimeError("Generazione del corpus 'stamped' fallita")
+        return path
+
+    c = _canvas(path)
+    images = _corpus_images(os.path.dirname(path), seed) if kind == 'image' else ()
+    for i in range(pages):
+        size, rotation, crop = A4, 0, None
+        if kind == 'mixed':
+            size, crop = MIXED_SIZES[i % len(MIXED_SIZES)]
+        elif kind == 'rotated':
+            rotation = (0, 90, 180, 270)[i % 4]
+        c.setPageSize(size)
+        c.setPageRotation(rotation)
+        c.setCropBox(crop)
+        if kind == 'image':
+            for k in range(1 + i % 3):
+                c.drawImage(images[(i + k) % len(images)], 54 + k * 170, 400, 160, 120)
+            _text_page(c, rng, size, 4)
+        else:
+            _text_page(c, rng, size, 60 if kind == 'text' else 10)
+        c.showPage()
+    c.save()
+    return path
+
+
+def _file_sha256(path):
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(1 << 20), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def corpus_file(directory, kind, pages, seed=0):
+    """Percorso del PDF del corpus, generato solo se non è già presente."""
+    path = os.path.join(directory, f'v{CORPUS_VERSION}-{kind}-{pages}-{seed}.pdf')
+    if not os.path.exists(path):
+        generate_corpus_pdf(path + '.part', kind, pages, seed)
+        os.replace(path + '.part', path)
+    return path
+
+
+def _peak_rss_bytes():
+    if resource is None:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Linux riporta KiB, macOS byte
+    return peak if sys.platform == 'darwin' else peak * 1024
+
+
+class _StageTimer:
+    """
+    Misura le fasi della pipeline sostituendo temporaneamente le funzioni di
+    pdf_signer con versioni cronometrate (le chiamate annidate non si sommano).
+    """
+
+    STAGES = {
+        'image': (pdf_signer, ('cached_signature_image', 'load_signature_image')),
+        'timestamp': (pdf_signer, ('render_timestamp_image',)),
+        'parse': (pdf_signer.PdfDocumentSession, ('__init__',)),
+        'stamp_build': (pdf_signer, ('create_watermark_pdf_bytes',)),
+        'write': (PdfWriter, ('write',)),
+    }
+
+    def __init__(self):
+        self.times = dict.fromkeys(self.STAGES, 0.0)
+        self._active = None
+        self._patched = []
+
+    def _wrap(self, stage, func):
+        def timed(*args, **kwargs):
+            if self._active is not None:
+                return func(*args, **kwargs)
+            self._active = stage
+            start = time.perf_counter()
+            try:
+                return func(*args, **kwargs)
+            finally:
+                self.times[stage] += time.perf_counter() - start
+                self._active = None
+        return timed
+
+    def __enter__(self):
+        for stage, (owner, names) in self.STAGES.items():
+            for name in names:
+                original = getattr(owner, name)
+                self._patched.append((owner, name, original))
+                setattr(owner, name, self._wrap(stage, original))
+        return self
+
+    def __exit__(self, *exc):
+        for owner, name, original in reversed(self._patched):
+            setattr(owner, name, original)
+        self._patched = []
+        return False
+
+
+def _run_case(input_pdf, output_pdf, config, engine):
+    """
+    Esegue un caso in un processo nuovo (cache vuote, picco RSS separato) e
+    restituisce tempi, memoria e dimensione dell'output.
+    """
+    api, kwargs = SUITE_CONFIGS[config]
+    kwargs = dict(kwargs)
+    if engine != 'pypdf2':
+        api, kwargs['engine'] = 'advanced', engine
+    sign = pdf_signer.add_watermark_to_pdf if api == 'standard' else pdf_signer.add_watermark_to_pdf_advanced
+
+    rss_before = _peak_rss_bytes()
+    stdout = sys.stdout
+    sys.stdout = open(os.devnull, 'w')
+    try:
+        with _StageTimer() as timer:
+            start = time.perf_counter()
+            ok = sign(input_pdf, SIGN_IMAGE, output_pdf, 0.2, 'bottom-right', **kwargs)
+            total = time.perf_counter() - start
+    finally:
+        sys.stdout.close()
+        sys.stdout = stdout
+    if not ok:
+        raise RuntimeError(f"Firma fallita: {os.path.basename(input_pdf)} / {config} / {engine}")
+
+    stages = dict(timer.times)
+    # Tutto il resto: apertura e applicazione del marchio pagina per pagina
+    stages['pages'] = max(total - sum(stages.values()), 0.0)
+    rss_after = _peak_rss_bytes()
+    return {
+        'total_s': total,
+        'stages_s': stages,
+        'peak_rss_bytes': rss_after,
+        'rss_growth_bytes': None if rss_after is None else rss_after - rss_before,
+        'output_bytes': os.path.getsize(output_pdf),
+    }
+
+
+def _environment():
+    versions = {}
+    for name in ('PyPDF2', 'reportlab', 'PIL', 'pymupdf'):
+        try:
+            module = __import__(name)
+        except ImportError:
+            versions[name] = None
+            continue
+        versions[name] = getattr(module, '__version__', None) or getattr(module, 'Version', None)
+    return {
+        'python': platform.python_version(),
+        'implementation': platform.python_implementation(),
+        'platform': platform.platform(),
+        'machine': platform.machine(),
+        'cpu_count': os.cpu_count(),
+        'libraries': versions,
+    }
+
+
+def bench_suite(page_counts, kinds=CORPUS_KINDS, configs=tuple(SUITE_CONFIGS),
+                engines=('pypdf2',), repeat=3, corpus_dir=None, seed=0):
+    """
+    Firma il corpus sintetico con ogni combinazione tipo × pagine ×
+    configurazione × motore. Ogni ripetizione gira in un processo nuovo e
+    per ogni caso viene riportata la mediana; il corpus è riproducibile e
+    identificato dallo SHA-256, così due esecuzioni sono confrontabili con
+    il sottocomando ``compare``.
+    """
+    keep_corpus = corpus_dir is not None
+    corpus_dir = corpus_dir or tempfile.mkdtemp(prefix='pdf_signer_corpus_')
+    os.makedirs(corpus_dir, exist_ok=True)
+    workdir = tempfile.mkdtemp(prefix='pdf_signer_bench_')
+    results = {
+        'benchmark': 'suite',
+        'schema': SUITE_SCHEMA,
+        'corpus_version': CORPUS_VERSION,
+        'seed': seed,
+        'repeat': repeat,
+        'environment': _environment(),
+        'corpus': {},
+        'cases': {},
+    }
+    context = get_context('spawn')
+    try:
+        for kind in kinds:
+            for pages in page_counts:
+                start = time.perf_counter()
+                input_pdf = corpus_file(corpus_dir, kind, pages, seed)
+                results['corpus'][f'{kind}/{pages}'] = {
+                    'pages': pages,
+                    'bytes': os.path.getsize(input_pdf),
+                    'sha256': _file_sha256(input_pdf),
+                    'generate_s': round(time.perf_counter() - start, 4),
+                }
+                for engine in engines:
+                    for config in configs:
+                        case_id = f'{kind}/{pages}/{config}/{engine}'
+                        print(f"▶ {case_id}", file=sys.stderr)
+                        output_pdf = os.path.join(workdir, 'output.pdf')
+                        runs = []
+                        for _ in range(repeat):
+                            with ProcessPoolExecutor(max_workers=1, mp_context=context) as pool:
+                                runs.append(pool.submit(
+                                    _run_case, input_pdf, output_pdf, config, engine
+                                ).result())
+                        results['cases'][case_id] = _summarize_runs(runs, pages)
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+        if not keep_corpus:
+            shutil.rmtree(corpus_dir, ignore_errors=True)
+
+    return results
+
+
+def _summarize_runs(runs, pages):
+    def median(values):
+        values = [v for v in values if v is not None]
+        return statistics.median(values) if values else None
+
+    total = median(run['total_s'] for run in runs)
+    peak = median(run['peak_rss_bytes'] for run in runs)
+    growth = median(run['rss_growth_bytes'] for run in runs)
+    return {
+        'pages': pages,
+        'total_s': round(total, 4),
+        'total_s_min': round(min(run['total_s'] for run in runs), 4),
+        'total_s_max': round(max(run['total_s'] for run in runs), 4),
+        'pages_per_s': round(pages / total, 1) if total else None,
+        'peak_rss_bytes': None if peak is None else int(peak),
+        'rss_growth_bytes': None if growth is None else int(growth),
+        'output_bytes': runs[-1]['output_bytes'],
+        'stages_s': {
+            stage: round(median(run['stages_s'][stage] for run in runs), 4)
+            for stage in runs[0]['stages_s']
+        },
+    }
+
+
+# Metriche confrontate: (chiave, True se un valore più alto è migliore)
+COMPARE_METRICS = (
+    ('pages_per_s', True),
+    ('total_s', False),
+    ('peak_rss_bytes', False),
+    ('output_bytes', False),
+)
+
+
+def compare_results(base, current):
+    """
+    Confronta due risultati della suite caso per caso (variazione relativa,
+    positiva = peggioramento per le metriche di costo).
+    """
+    for name, data in (('base', base), ('current', current)):
+        if data.get('benchmark') != 'suite':
+            raise ValueError(f"Il file {name} non contiene risultati della suite")
+    if base.get('schema') != current.get('schema'):
+        raise ValueError("Versioni di schema diverse: risultati non confrontabili")
+
+    warnings = []
+    for key in set(base['corpus']) & set(current['corpus']):
+        if base['corpus'][key]['sha256'] != current['corpus'][key]['sha256']:
+            warnings.append(f"Corpus {key} diverso tra le due esecuzioni")
+    if base['environment'] != current['environment']:
+        warnings.append("Ambiente diverso (Python, piattaforma o librerie)")
+
+    cases = {}
+    for case_id in sorted(set(base['cases']) & set(current['cases'])):
+        before, after = base['cases'][case_id], current['cases'][case_id]
+        deltas = {}
+        for metric, higher_is_better in COMPARE_METRICS:
+            old, new = before.get(metric), after.get(metric)
+            if not old or new is None:
+                continue
+            change = (new - old) / old
+            deltas[metric] = {
+                'base': old,
+                'current': new,
+                'change': round(change, 4),
+                'regression': change < 0 if higher_is_better else change > 0,
+            }
+        cases[case_id] = deltas
+
+    return {
+        'benchmark': 'compare',
+        'warnings': warnings,
+        'only_in_base': sorted(set(base['cases']) - set(current['cases'])),
+        'only_in_current': sorted(set(current['cases']) - set(base['cases'])),
+        'cases': cases,
+    }
+
+
+def _csv(value):
+    return [item.strip() for item in value.split(',') if item.strip()]
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark di PDF Signer")
+    sub = parser.add_subparsers(dest='benchmark', required=True)
+
+    parse_cmd = sub.add_parser('parse', help="Numero di analisi del PDF di input")
+    parse_cmd.add_argument('--pages', type=int, default=2000)
+    parse_cmd.add_argument('--repeat', type=int, default=3)
+
+    stamp_cmd = sub.add_parser('stamp', help="Confronto merge_page / Form XObject")
+    stamp_cmd.add_argument('--pages', type=int, default=5000)
+    stamp_cmd.add_argument('--timestamp', action='store_true')
+
+    geometry_cmd = sub.add_parser('geometry', help="Documento con formati e rotazioni miste")
+    geometry_cmd.add_argument('--pages', type=int, default=10000)
+
+    engine_cmd = sub.add_parser('engine', help="Confronto dei motori PDF installati")
+    engine_cmd.add_argument('--pages', type=int, default=5000)
+
+    shard_cmd = sub.add_parser('shard', help="Scalabilità della firma a shard (1..N processi)")
+    shard_cmd.add_argument('--pages', type=int, default=50000)
+    shard_cmd.add_argument('--max-jobs', type=int, help="Default: numero di core")
+
+    journal_cmd = sub.add_parser('journal', help="Costo del registro di ripresa della firma in blocco")
+    journal_cmd.add_argument('--files', type=int, default=200)
+    journal_cmd.add_argument('--records', type=int, default=20000)
+    journal_cmd.add_argument('--repeat', type=int, default=5)
+    journal_cmd.add_argument('--pages', type=int, default=1, help="Pagine di ogni PDF del lotto")
+
+    service_cmd = sub.add_parser('service', help="Prova di carico del servizio di firma (p50/p99)")
+    service_cmd.add_argument('--requests', type=int, default=500)
+    service_cmd.add_argument('--concurrency', type=int, default=8)
+    service_cmd.add_argument('--pages', type=int, default=1)
+    service_cmd.add_argument('--workers', type=int, help="Processi del servizio locale (default: core)")
+    service_cmd.add_argument('--address', help="Servizio già avviato: host:porta o socket Unix")
+    service_cmd.add_argument('--params', default='scale=0.2', help="Query string di ogni richiesta")
+    service_cmd.add_argument('--subprocess-runs', type=int, default=3)
+
+    smtp_cmd = sub.add_parser('smtp', help="Invio email: connessione per messaggio o pool SMTP")
+    smtp_cmd.add_argument('--messages', type=int, default=200)
+    smtp_cmd.add_argument('--latency-ms', type=float, default=20.0,
+                          help="Latenza simulata di handshake e AUTH")
+    smtp_cmd.add_argument('--attachment-kb', type=int, default=64)
+    smtp_cmd.add_argument('--drop-after', type=int, help="Il server chiude dopo N messaggi")
+
+    outbox_cmd = sub.add_parser('outbox', help="Firma con email: invio diretto o coda EmailOutbox")
+    outbox_cmd.add_argument('--documents', type=int, default=50)
+    outbox_cmd.add_argument('--latency-ms', type=float, default=200.0,
+                            help="Latenza simulata di handshake e AUTH")
+    outbox_cmd.add_argument('--workers', type=int, default=2, help="Thread di invio della coda")
+
+    mime_cmd = sub.add_parser('mime', help="Memoria per allegati email grandi: in memoria o streaming")
+    mime_cmd.add_argument('--attachment-mb', type=int, default=200)
+
+    template_cmd = sub.add_parser('template', help="Costruzione email da template: con e senza cache")
+    template_cmd.add_argument('--messages', type=int, default=10000)
+    template_cmd.add_argument('--attachment-kb', type=int, default=256)
+
+    sender_cmd = sub.add_parser('sender', help="Invio parallelo della coda email con limiti per provider")
+    sender_cmd.add_argument('--messages', type=int, default=200)
+    sender_cmd.add_argument('--workers', type=lambda v: [int(n) for n in _csv(v)], default=[1, 4])
+    sender_cmd.add_argument('--message-latency-ms', type=float, default=50.0)
+    sender_cmd.add_argument('--messages-per-minute', type=float, help="Limite del provider")
+    sender_cmd.add_argument('--throttle', type=int, default=0, help="Risposte 451 iniziali del server")
+
+    suite_cmd = sub.add_parser('suite', help="Corpus sintetico × configurazioni di firma")
+    suite_cmd.add_argument('--pages', type=lambda v: [int(n) for n in _csv(v)],
+                           default=[1, 100, 1000], help="Numeri di pagine (1-100000)")
+    suite_cmd.add_argument('--kinds', type=_csv, default=list(CORPUS_KINDS))
+    suite_cmd.add_argument('--configs', type=_csv, default=list(SUITE_CONFIGS))
+    suite_cmd.add_argument('--engines', type=_csv, default=['pypdf2'])
+    suite_cmd.add_argument('--repeat', type=int, default=3)
+    suite_cmd.add_argument('--seed', type=int, default=0)
+    suite_cmd.add_argument('--corpus-dir', help="Conserva e riusa il corpus generato")
+    suite_cmd.add_argument('--output', help="Scrive il JSON anche su file")
+
+    compare_cmd = sub.add_parser('compare', help="Confronta due risultati della suite")
+    compare_cmd.add_argument('base')
+    compare_cmd.add_argument('current')
+
+    args = parser.parse_args(argv)
+
+    # I messaggi di avanzamento della libreria vanno su stderr, il JSON su stdout
+    stdout = sys.stdout
+    sys.stdout = sys.stderr
+    try:
+        if args.benchmark == 'parse':
+            results = bench_parse(args.pages, args.repeat)
+        elif args.benchmark == 'stamp':
+            results = bench_stamp(args.pages, args.timestamp)
+        elif args.benchmark == 'geometry':
+            results = bench_geometry(args.pages)
+        elif args.benchmark == 'engine':
+            results = bench_engine(args.pages)
+        elif args.benchmark == 'shard':
+            results = bench_shard(args.pages, args.max_jobs)
+        elif args.benchmark == 'service':
+            results = bench_service(args.requests, args.concurrency, args.pages, args.workers,
+                                    args.address, args.subprocess_runs, args.params)
+        elif args.benchmark == 'smtp':
+            results = bench_smtp(args.messages, args.latency_ms / 1000, args.attachment_kb,
+                                 args.drop_after)
+        elif args.benchmark == 'outbox':
+            results = bench_outbox(args.documents, args.latency_ms / 1000, args.workers)
+        elif args.benchmark == 'mime':
+            results = bench_mime(args.attachment_mb)
+        elif args.benchmark == 'template':
+            results = bench_template(args.messages, args.attachment_kb)
+        elif args.benchmark == 'sender':
+            results = bench_sender(args.messages, args.workers, args.message_latency_ms / 1000,
+                                   args.messages_per_minute, args.throttle)
+        elif args.benchmark == 'journal':
+            results = bench_journal(args.files, args.records, args.repeat, args.pages)
+        elif args.benchmark == 'suite':
+            for name, values, valid in (('tipo', args.kinds, CORPUS_KINDS),
+                                        ('configurazione', args.configs, SUITE_CONFIGS),
+                                        ('motore', args.engines, pdf_signer.PDF_ENGINES)):
+                for value in values:
+                    if value not in valid:
+                        parser.error(f"{name} non valido: {value} (validi: {', '.join(valid)})")
+            if any(not 1 <= pages <= 100000 for pages in args.pages):
+                parser.error("--pages accetta valori tra 1 e 100000")
+            results = bench_suite(args.pages, args.kinds, args.configs, args.engines,
+                                  args.repeat, args.corpus_dir, args.seed)
+        elif args.benchmark == 'compare':
+            with open(args.base, encoding='utf-8') as f:
+                base = json.load(f)
+            with open(args.current, encoding='utf-8') as f:
+                current = json.load(f)
+            results = compare_results(base, current)
+    finally:
+        sys.stdout = stdout
+
+    output = json.dumps(results, indent=2, sort_keys=True)
+    if getattr(args, 'output', None):
+        with open(args.output, 'w', encoding='utf-8') as f:
+            f.write(output + '\n')
+    print(output)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
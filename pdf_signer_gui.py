@@ -30,7 +30,10 @@ import sys
 import time
 
 # Import delle funzioni dal modulo originale
-from pdf_signer import add_watermark_to_pdf, create_watermark_pdf, calculate_watermark_size_points
+from pdf_signer import (
+    add_watermark_to_pdf, create_watermark_pdf, calculate_watermark_size_points, SIGNATURE_IMAGES,
+    available_pdf_engines, DEFAULT_OUTBOX_DIR, OutboxSender,
+)
 
 class ConfigManager:
     """Gestisce i profili e le configurazioni dell'applicazione."""
@@ -57,7 +60,8 @@ class ConfigManager:
             'default_opacity': 0.8,
             'window_geometry': '1200x800',
             'preview_quality': 'medium',
-            'benchmark_preview': False
+            'benchmark_preview': False,
+            'pdf_engine': 'pypdf2'
         }
         
         try:
@@ -330,8 +334,9 @@ class PDFPreviewCanvas(tk.Canvas):
                 display_width = int(width_points)
                 display_height = int(height_points)
             
-            # Carica e ridimensiona l'immagine watermark
-            img = Image.open(watermark_path)
+            # Immagine già decodificata dal registro condiviso: resize() ne crea
+            # una copia, quindi putalpha() non altera l'originale condivisa
+            img = SIGNATURE_IMAGES.get(watermark_path).image
             if img.mode != 'RGBA':
                 img = img.convert('RGBA')
             
@@ -490,6 +495,17 @@ class PDFSignerGUI:
         # Queue per threading
         self.processing_queue = queue.Queue()
         self.root.after(100, self.check_queue)
+        
+        # Coda email: riprende subito gli invii rimasti da una sessione precedente
+        self.outbox_sender = None
+        if any((DEFAULT_OUTBOX_DIR / 'pending').glob('*.json')):
+            self.email_outbox()
+    
+    def email_outbox(self):
+        """Coda email dell'applicazione, svuotata in sottofondo (creata al primo uso)."""
+        if self.outbox_sender is None:
+            self.outbox_sender = OutboxSender(DEFAULT_OUTBOX_DIR).start()
+        return self.outbox_sender.outbox
     
     def setup_window(self):
         """Configura la finestra principale."""
@@ -516,6 +532,7 @@ class PDFSignerGUI:
         self.scale_var = tk.DoubleVar(value=self.config_manager.config.get('default_scale', 1.0))
         self.position_var = tk.StringVar(value=self.config_manager.config.get('default_position', 'bottom-right'))
         self.opacity_var = tk.DoubleVar(value=self.config_manager.config.get('default_opacity', 0.8))
+        self.engine_var = tk.StringVar(value=self.config_manager.config.get('pdf_engine', 'pypdf2'))
         self.selected_profile = tk.StringVar(value="Nessun profilo")
         self.processing = False
         
@@ -747,6 +764,15 @@ class PDFSignerGUI:
         self.opacity_var.trace('w', update_opacity_label)
         update_opacity_label()
         
+        # Motore PDF (solo quelli installati sono selezionabili)
+        engine_frame = ttk.LabelFrame(scrollable_frame, text="Motore PDF", padding=5)
+        engine_frame.pack(fill='x', pady=(0, 10), padx=5)
+        
+        installed = available_pdf_engines()
+        for value, text in [('pypdf2', 'PyPDF2 (predefinito)'), ('pymupdf', 'PyMuPDF (veloce)')]:
+            ttk.Radiobutton(engine_frame, text=text, variable=self.engine_var, value=value,
+                           state='normal' if value in installed else 'disabled').pack(anchor='w')
+        
         # Anteprima watermark
         wm_preview_frame = ttk.LabelFrame(scrollable_frame, text="Anteprima Firma", padding=5)
         wm_preview_frame.pack(fill='x', pady=(0, 10), padx=5)
@@ -1271,9 +1297,8 @@ class PDFSignerGUI:
         """Aggiorna l'anteprima del watermark nei controlli."""
         if self.watermark_path.get() and os.path.exists(self.watermark_path.get()):
             try:
-                # Carica e ridimensiona per anteprima
-                img = Image.open(self.watermark_path.get())
-                img.thumbnail((100, 100), Image.Resampling.LANCZOS)
+                # Miniatura dal registro condiviso (calcolata una volta per immagine)
+                img = SIGNATURE_IMAGES.get(self.watermark_path.get()).thumbnail((100, 100))
                   # Converti per Tkinter
                 photo = ImageTk.PhotoImage(img)
                 self.wm_preview_label.config(image=photo, text="")
@@ -1516,7 +1541,8 @@ class PDFSignerGUI:
                 'add_metadata': bool(metadata),
                 'author': metadata.get('author'),
                 'title': metadata.get('title'),
-                'subject': metadata.get('subject')
+                'subject': metadata.get('subject'),
+                'engine': self.engine_var.get()
             }            # Aggiungi parametri email se abilitata
             if email_config and email_config.get('to'):
                 print(f"🔧 Debug: Email config ricevuta: {email_config}")
@@ -1547,7 +1573,8 @@ class PDFSignerGUI:
                         'email_recipients': email_recipients,
                         'email_subject': email_config.get('subject', 'PDF Firmato'),
                         'email_template': email_config.get('template_path'),
-                        'email_config': email_config_path
+                        'email_config': email_config_path,
+                        'email_outbox': self.email_outbox()
                     })
                     print(f"📧 Email abilitata con config: {email_config_path}")
                 else:
@@ -1567,7 +1594,7 @@ class PDFSignerGUI:
             
             message = f"PDF firmato salvato: {self.output_path.get()}"
             if email_config:
-                message += f"\nEmail inviata a: {email_config['to']}"
+                message += f"\nEmail in coda per: {email_config['to']}"
             
             self.processing_queue.put(("success", message))
             
@@ -1623,6 +1650,7 @@ class PDFSignerGUI:
             'default_scale': self.scale_var.get(),
             'default_position': self.position_var.get(),
             'default_opacity': self.opacity_var.get(),
+            'pdf_engine': self.engine_var.get(),
             'window_geometry': self.root.geometry()
         })
         self.config_manager.save_config()
@@ -1737,6 +1765,9 @@ Nuove Funzionalità v2.0:
     def on_closing(self):
         """Gestisce la chiusura dell'applicazione."""
         self.save_settings()
+        if self.outbox_sender is not None:
+            # Le email non ancora inviate restano in coda per la prossima sessione
+            self.outbox_sender.stop(drain=False)
         self.root.quit()
 
 
@@ -0,0 +1,30 @@
+import io
+import os
+
+import pytest
+from reportlab.lib.pagesizes import A4
+from reportlab.pdfgen import canvas
+
+
+def _make_pdf(path=None, pages=2, pagesize=A4):
+    """
+    PDF di prova con una riga di testo per pagina, riproducibile byte per byte.
+
+    Con ``path`` scrive il file (creando le directory) e ne restituisce il
+    percorso; senza, restituisce i byte del documento.
+    """
+    target = io.BytesIO() if path is None else str(path)
+    if path is not None:
+        os.makedirs(os.path.dirname(target) or '.', exist_ok=True)
+    c = canvas.Canvas(target, pagesize=pagesize, invariant=1)
+    for i in range(pages):
+        c.drawString(72, 720, f"Pagina {i + 1}")
+        c.showPage()
+    c.save()
+    return target if path is not None else target.getvalue()
+
+
+@pytest.fixture
+def make_pdf():
+    """Fabbrica dei PDF di prova condivisa dai test (vedi _make_pdf)."""
+    return _make_pdf
@@ -0,0 +1,101 @@
+import json
+import os
+import subprocess
+import sys
+
+
+from pdf_signer import BatchJournal, JOURNAL_NAME, job_params_hash, run_manifest, sign_batch
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+SIGN_PATH = os.path.join(ROOT, 'sign.png')
+
+
+def _jobs(tmp_path, make_pdf):
+    (tmp_path / 'in').mkdir()
+    for name in ('a', 'b', 'c'):
+        make_pdf(tmp_path / 'in' / f'{name}.pdf')
+    (tmp_path / 'in' / 'd.pdf').write_text("non è un PDF")
+    return [(str(tmp_path / 'in' / f'{name}.pdf'), str(tmp_path / 'out' / f'{name}.pdf'))
+            for name in ('a', 'b', 'c', 'd')]
+
+
+def test_resume_skips_completed(tmp_path, make_pdf):
+    jobs = _jobs(tmp_path, make_pdf)
+    path = str(tmp_path / 'journal.jsonl')
+    with BatchJournal(path) as journal:
+        results = sign_batch(jobs, SIGN_PATH, 0.2, workers=1, journal=journal)
+    assert [r.ok for r in results] == [True, True, True, False]
+    with open(path) as f:
+        entries = [json.loads(line) for line in f]
+    assert [e['status'] for e in entries] == ['ok', 'ok', 'ok', 'failed']
+    assert (entries[0]['input_size'], entries[0]['input_mtime_ns']) == results[0].fingerprint
+    # Senza registro l'impronta dell'input non serve
+    assert sign_batch(jobs[:1], SIGN_PATH, 0.2, workers=1)[0].fingerprint is None
+
+    # Input modificato e output cancellato: vanno rifirmati, insieme al file fallito
+    make_pdf(jobs[1][0], pages=3)
+    os.utime(jobs[1][0], ns=(0, 10 ** 9))
+    os.remove(jobs[2][1])
+    journal = BatchJournal(path)
+    assert journal.load() == 3
+    seen = []
+    with journal:
+        results = sign_batch(jobs, SIGN_PATH, 0.2, workers=2, progress=seen.append, journal=journal)
+    assert [r.skipped for r in results] == [True, False, False, False]
+    assert sorted(r.input_path for r in seen) == sorted(path for path, _ in jobs[1:])
+    assert results[1].pages == 3
+
+    # Parametri diversi: niente da saltare
+    journal = BatchJournal(path)
+    journal.load()
+    params = job_params_hash(SIGN_PATH, 0.3, 'bottom-right', {})
+    assert not any(journal.is_completed(inp, out, params) for inp, out in jobs)
+    assert journal.is_completed(*jobs[0], job_params_hash(SIGN_PATH, 0.2, 'bottom-right', {}))
+
+
+def test_torn_line_and_sync_batching(tmp_path, make_pdf):
+    path = str(tmp_path / 'journal.jsonl')
+    jobs = _jobs(tmp_path, make_pdf)
+    with BatchJournal(path, sync_every=2, sync_interval=3600) as journal:
+        sign_batch(jobs[:3], SIGN_PATH, 0.2, workers=1, journal=journal)
+        assert journal.syncs == 1
+    assert (journal.records, journal.syncs) == (3, 2)
+    # Interruzione durante la scrittura dell'ultima riga
+    with open(path, 'a') as f:
+        f.write('{"input": "/tronc')
+    journal = BatchJournal(path)
+    assert journal.load() == 3
+    with journal:
+        sign_batch(jobs, SIGN_PATH, 0.2, workers=1, journal=journal)
+    assert journal.records == 1
+    assert BatchJournal(path).load() == 3
+
+
+def test_manifest_resume(tmp_path, make_pdf):
+    for name in ('a', 'b'):
+        make_pdf(tmp_path / f'{name}.pdf')
+    rows = [(1, {'input': 'a.pdf'}), (2, {'input': 'b.pdf', 'scale': '0.3'})]
+    path = str(tmp_path / 'journal.jsonl')
+    options = dict(defaults={'watermark': SIGN_PATH}, workers=1, base_dir=str(tmp_path))
+    with BatchJournal(path) as journal:
+        assert all(r.ok for _, r in run_manifest(rows, journal=journal, **options))
+    rows.append((3, {'input': 'a.pdf', 'output': 'a_bis.pdf'}))
+    journal = BatchJournal(path)
+    journal.load()
+    with journal:
+        results = dict(run_manifest(rows, journal=journal, **options))
+    assert [results[row].skipped for row in (1, 2, 3)] == [True, True, False]
+    assert (tmp_path / 'a_bis.pdf').exists()
+
+
+def test_cli_resume(tmp_path, make_pdf):
+    jobs = _jobs(tmp_path, make_pdf)
+    os.remove(jobs[3][0])
+    command = [sys.executable, os.path.join(ROOT, 'pdf_signer.py'), str(tmp_path / 'in'),
+               '-w', SIGN_PATH, '--output-dir', str(tmp_path / 'out'), '-j', '1']
+    assert subprocess.run(command, capture_output=True, cwd=str(tmp_path)).returncode == 0
+    assert (tmp_path / 'out' / JOURNAL_NAME).exists()
+    proc = subprocess.run(command + ['--resume'], capture_output=True, text=True, cwd=str(tmp_path))
+    assert proc.returncode == 0
+    assert '3 file già firmati saltati' in proc.stdout
+    assert 'Firmati 0/3 file' in proc.stdout
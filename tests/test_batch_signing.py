@@ -0,0 +1,66 @@
+import os
+import subprocess
+import sys
+
+from PyPDF2 import PdfReader
+
+import pdf_signer
+from pdf_signer import batch_output_path, expand_pdf_inputs, sign_batch, summarize_batch
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+SIGN_PATH = os.path.join(ROOT, 'sign.png')
+
+
+def _tree(tmp_path, make_pdf):
+    make_pdf(tmp_path / 'in' / 'a.pdf', 2)
+    make_pdf(tmp_path / 'in' / 'sub' / 'b.pdf', 3)
+    (tmp_path / 'in' / 'sub' / 'broken.pdf').write_text("non è un PDF")
+    (tmp_path / 'in' / 'notes.txt').write_text("ignorato")
+    return tmp_path / 'in'
+
+
+def test_expand_inputs_and_naming(tmp_path, make_pdf):
+    root = str(_tree(tmp_path, make_pdf))
+    from_dir = [path for path, _ in expand_pdf_inputs([root])]
+    assert [os.path.relpath(p, root) for p in from_dir] == ['a.pdf', 'sub/b.pdf', 'sub/broken.pdf']
+    from_glob = expand_pdf_inputs([os.path.join(root, '**', 'b.pdf'), from_dir[1]])
+    assert from_glob == [(from_dir[1], root)]
+
+    out = batch_output_path(from_dir[1], root, str(tmp_path / 'out'), '{index}-{stem}.signed{suffix}', 7)
+    assert out == str(tmp_path / 'out' / 'sub' / '7-b.signed.pdf')
+    assert batch_output_path(from_dir[0], root) == os.path.join(root, 'a_signed.pdf')
+
+
+def test_failure_is_isolated(tmp_path, make_pdf):
+    root = str(_tree(tmp_path, make_pdf))
+    jobs = [(path, batch_output_path(path, r, str(tmp_path / 'out')))
+            for path, r in expand_pdf_inputs([root])]
+    seen = []
+    results = sign_batch(jobs, SIGN_PATH, 0.2, workers=2, progress=seen.append, timestamp=True)
+    assert len(seen) == 3
+    assert [r.ok for r in results] == [True, True, False]
+    assert 'PdfReadError' in results[2].error
+    assert len(PdfReader(results[1].output_path).pages) == 3
+    summary = summarize_batch(results, 1.0)
+    assert (summary['signed'], summary['failed'], summary['pages']) == (2, 1, 5)
+
+
+def test_in_process_batch_reuses_stamp(tmp_path, make_pdf):
+    root = str(_tree(tmp_path, make_pdf))
+    jobs = [(os.path.join(root, 'a.pdf'), str(tmp_path / f'out{i}.pdf')) for i in range(3)]
+    pdf_signer.STAMP_CACHE.clear()
+    results = sign_batch(jobs, SIGN_PATH, 0.2, workers=1)
+    assert all(r.ok and r.pages == 2 for r in results)
+    assert pdf_signer.STAMP_CACHE.stats()['misses'] == 1
+
+
+def test_cli_exit_code(tmp_path, make_pdf):
+    root = str(_tree(tmp_path, make_pdf))
+    proc = subprocess.run(
+        [sys.executable, os.path.join(ROOT, 'pdf_signer.py'), root, '-w', SIGN_PATH,
+         '--output-dir', str(tmp_path / 'out'), '--jobs', '2'],
+        capture_output=True, text=True, cwd=str(tmp_path),
+    )
+    assert proc.returncode == 1
+    assert 'Firmati 2/3 file, 5 pagine' in proc.stdout
+    assert (tmp_path / 'out' / 'sub' / 'b_signed.pdf').exists()
@@ -0,0 +1,80 @@
+import copy
+import os
+
+from PyPDF2 import PdfReader
+
+import pdf_signer_bench as bench
+
+
+def test_corpus_is_reproducible(tmp_path):
+    for kind in bench.CORPUS_KINDS:
+        first = bench.generate_corpus_pdf(str(tmp_path / f'{kind}_a.pdf'), kind, 8)
+        second = bench.generate_corpus_pdf(str(tmp_path / f'{kind}_b.pdf'), kind, 8)
+        assert bench._file_sha256(first) == bench._file_sha256(second)
+        assert len(PdfReader(first).pages) == 8
+    rotations = [page.get('/Rotate', 0) for page in PdfReader(str(tmp_path / 'rotated_a.pdf')).pages]
+    assert set(rotations) == {0, 90, 180, 270}
+
+
+def test_suite_and_compare(tmp_path):
+    results = bench.bench_suite([3], kinds=['stamped'], configs=['basic', 'full'], repeat=1,
+                                corpus_dir=str(tmp_path / 'corpus'))
+    assert os.listdir(tmp_path / 'corpus')
+    case = results['cases']['stamped/3/full/pypdf2']
+    assert case['pages_per_s'] > 0
+    assert case['output_bytes'] > 0
+    assert case['stages_s']['timestamp'] > 0
+    assert set(case['stages_s']) == set(bench._StageTimer.STAGES) | {'pages'}
+
+    slower = copy.deepcopy(results)
+    slower['cases']['stamped/3/basic/pypdf2']['pages_per_s'] /= 2
+    report = bench.compare_results(results, slower)
+    assert report['warnings'] == []
+    assert report['cases']['stamped/3/basic/pypdf2']['pages_per_s']['regression']
+    assert not report['cases']['stamped/3/full/pypdf2']['pages_per_s']['regression']
+
+
+def test_journal_benchmark():
+    results = bench.bench_journal(files=3, records=50, repeat=1, pages=20)
+    assert set(results['batch']) == {'none'} | set(bench.JOURNAL_POLICIES)
+    assert results['input_bytes'] > 0
+    assert all('overhead_ms_per_file' in timing for timing in results['batch'].values())
+    assert all(cost > 0 for cost in results['write_us_per_record'].values())
+    assert results['lookup_us_per_job'] > 0
+
+
+def test_service_load_test():
+    results = bench.bench_service(6, 2, workers=1, subprocess_runs=0)
+    assert results['status'] == {'200': 6}
+    assert results['latency_ms']['p99'] >= results['latency_ms']['p50'] > 0
+
+
+def test_smtp_benchmark():
+    results = bench.bench_smtp(6, latency=0.001, attachment_kb=1, drop_after=4)
+    assert results['per_message']['connections'] == 6
+    assert results['pooled']['delivered'] == 6
+    assert results['pooled']['pool']['reconnects'] == 1
+
+
+def test_outbox_benchmark():
+    results = bench.bench_outbox(3, latency=0.001)
+    assert results['direct']['messages'] == results['outbox']['messages'] == 3
+    assert results['outbox']['sender']['sent'] == 3
+
+
+def test_mime_benchmark():
+    results = bench.bench_mime(16)
+    assert results['buffered']['delivered'] and results['streamed']['delivered']
+    assert results['streamed']['peak_rss_mb'] < results['buffered']['peak_rss_mb']
+
+
+def test_template_benchmark():
+    results = bench.bench_template(20, attachment_kb=4)
+    assert results['uncached']['template_parses'] == 20
+    assert results['cached']['template_parses'] == 1
+
+
+def test_sender_benchmark():
+    results = bench.bench_sender(8, workers=(1, 2), message_latency=0.01, throttle=1)
+    assert all(run['delivered'] == 8 for run in results['runs'].values())
+    assert results['runs']['2']['max_connections_seen'] <= 2
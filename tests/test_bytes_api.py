@@ -0,0 +1,107 @@
+import io
+import os
+import tempfile
+from email import message_from_bytes
+from unittest import mock
+
+import pytest
+from PIL import Image
+from reportlab.lib.pagesizes import A4
+from PyPDF2 import PdfReader
+
+import pdf_signer
+from pdf_signer import (OutputCache, add_watermark_to_pdf, create_watermark_pdf_bytes,
+                        send_email_with_pdf, sign_pdf_bytes)
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+SIGN_PATH = os.path.join(ROOT, 'sign.png')
+
+
+def _sign_bytes():
+    with open(SIGN_PATH, 'rb') as f:
+        return f.read()
+
+
+class _Unseekable(io.RawIOBase):
+    def __init__(self, data):
+        self._stream = io.BytesIO(data)
+
+    def readable(self):
+        return True
+
+    def readinto(self, buffer):
+        return self._stream.readinto(buffer)
+
+
+def test_same_output_as_file_api(tmp_path, make_pdf):
+    data = make_pdf()
+    (tmp_path / 'in.pdf').write_bytes(data)
+    options = {'deterministic': True, 'timestamp': True, 'pages': 'first'}
+    assert add_watermark_to_pdf(str(tmp_path / 'in.pdf'), SIGN_PATH, str(tmp_path / 'out.pdf'),
+                                0.2, **options)
+    expected = (tmp_path / 'out.pdf').read_bytes()
+    for source in (data, bytearray(data), memoryview(data), io.BytesIO(data), _Unseekable(data)):
+        assert sign_pdf_bytes(source, SIGN_PATH, 0.2, **options) == expected
+    # Firma anche in memoria: byte del file o immagine già aperta
+    assert sign_pdf_bytes(data, _sign_bytes(), 0.2, **options) == expected
+    assert sign_pdf_bytes(data, Image.open(SIGN_PATH), 0.2, **options).startswith(b'%PDF')
+
+
+def test_no_filesystem_access(make_pdf):
+    data, image = make_pdf(), _sign_bytes()
+    with mock.patch('builtins.open', side_effect=AssertionError("accesso al filesystem")), \
+            mock.patch.object(tempfile, 'mkstemp', side_effect=AssertionError("file temporaneo")):
+        signed = sign_pdf_bytes(data, image, 0.2, stamp_mode='xobject')
+        stamp = create_watermark_pdf_bytes(image, 0.2, page_size=A4)
+    assert len(PdfReader(io.BytesIO(signed)).pages) == 2
+    assert stamp.startswith(b'%PDF')
+
+
+def test_output_stream_and_incremental(make_pdf):
+    data = make_pdf(pages=3)
+    out = io.BytesIO()
+    assert sign_pdf_bytes(data, SIGN_PATH, 0.2, output=out, incremental=True) is None
+    # L'aggiornamento incrementale conserva i byte originali in testa
+    assert out.getvalue().startswith(data)
+    assert len(PdfReader(io.BytesIO(out.getvalue())).pages) == 3
+
+
+def test_pymupdf_engine(make_pdf):
+    pytest.importorskip('pymupdf')
+    signed = sign_pdf_bytes(memoryview(make_pdf()), _sign_bytes(), 0.2, engine='pymupdf')
+    assert len(PdfReader(io.BytesIO(signed)).pages) == 2
+    with pytest.raises(ValueError):
+        sign_pdf_bytes(make_pdf(), SIGN_PATH, 0.2, engine='pymupdf', incremental=True)
+
+
+def test_errors_are_raised(make_pdf):
+    with pytest.raises(Exception, match='EOF|PDF'):
+        sign_pdf_bytes(b'non un PDF', SIGN_PATH, 0.2)
+    with pytest.raises(OSError):
+        sign_pdf_bytes(make_pdf(), b'non una immagine', 0.2)
+    with pytest.raises(TypeError):
+        sign_pdf_bytes(12345, SIGN_PATH, 0.2)
+
+
+def test_output_cache_in_memory(tmp_path, make_pdf):
+    cache = OutputCache(tmp_path / 'cache')
+    data = make_pdf()
+    with mock.patch.object(pdf_signer, 'OUTPUT_CACHE', cache):
+        first = sign_pdf_bytes(data, SIGN_PATH, 0.2)
+        out = io.BytesIO()
+        sign_pdf_bytes(bytearray(data), SIGN_PATH, 0.2, output=out)
+    assert out.getvalue() == first
+    stats = cache.stats()
+    assert (stats['hits'], stats['stores'], stats['bytes_saved']) == (1, 1, len(first))
+
+
+@mock.patch('pdf_signer.smtplib.SMTP')
+def test_email_attachment_from_bytes(mock_smtp):
+    server = mock_smtp.return_value
+    config = {'smtp_server': 'smtp.example.com', 'smtp_port': 25, 'use_tls': False}
+    assert send_email_with_pdf(b'%PDF-firmato', config, ['a@example.com'], filename='contratto.pdf')
+    message = message_from_bytes(server.send_message.call_args[0][0].as_bytes())
+    assert message['Subject'] == 'PDF Firmato: contratto.pdf'
+    attachment = message.get_payload()[1]
+    assert attachment.get_payload(decode=True) == b'%PDF-firmato'
+    assert 'contratto.pdf' in attachment['Content-Disposition']
@@ -0,0 +1,109 @@
+import os
+import tempfile
+import time
+import unittest
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+
+import pdf_signer
+from pdf_signer import CompiledStampCache, DiskStampCache
+
+SIGN_PATH = os.path.join(os.path.dirname(os.path.dirname(__file__)), 'sign.png')
+PAYLOADS = {f'key{i}': bytes([i]) * (1000 + i) for i in range(8)}
+
+
+def _worker(directory):
+    cache = DiskStampCache(directory, max_bytes=4000, prune_interval=0)
+    for _ in range(20):
+        for key, data in PAYLOADS.items():
+            cached = cache.get(key)
+            if cached is not None and cached != data:
+                return False
+            cache.put(key, data)
+    return True
+
+
+class TestDiskStampCache(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.TemporaryDirectory()
+
+    def tearDown(self):
+        self.tmpdir.cleanup()
+
+    def test_shared_between_process_caches(self):
+        first = CompiledStampCache()
+        first.disk = DiskStampCache(self.tmpdir.name)
+        self.assertEqual(first.get_or_build(('a', 1.0), lambda: b'stamp'), b'stamp')
+        # Una nuova cache in memoria (nuovo processo) trova la voce su disco
+        second = CompiledStampCache()
+        second.disk = DiskStampCache(self.tmpdir.name)
+        self.assertEqual(second.get_or_build(('a', 1.0), lambda: self.fail("ricompilato")), b'stamp')
+        self.assertEqual(second.stats()['disk']['hits'], 1)
+
+    def test_age_and_size_eviction(self):
+        cache = DiskStampCache(self.tmpdir.name, max_bytes=2500, max_age=3600)
+        for key in ('old', 'a', 'b', 'c'):
+            cache.put(key, b'x' * 1000)
+        past = time.time() - 7200
+        os.utime(cache._path('old'), (past, past))
+        os.utime(cache._path('a'), (past + 3700, past + 3700))
+        cache.prune()
+        self.assertIsNone(cache.get('old'))
+        self.assertIsNone(cache.get('a'))
+        self.assertEqual(cache.get('c'), b'x' * 1000)
+        self.assertEqual(cache.evictions, 2)
+
+    def test_concurrent_writers(self):
+        with ProcessPoolExecutor(max_workers=4) as pool:
+            results = list(pool.map(_worker, [self.tmpdir.name] * 4))
+        self.assertTrue(all(results))
+        leftovers = [name for _, _, files in os.walk(self.tmpdir.name)
+                     for name in files if name.endswith('.tmp')]
+        self.assertEqual(leftovers, [])
+
+    def test_enable_disk_cache(self):
+        previous = pdf_signer.STAMP_CACHE.disk
+        try:
+            disk = pdf_signer.enable_disk_stamp_cache(self.tmpdir.name, 1024)
+            self.assertIs(pdf_signer.STAMP_CACHE.disk, disk)
+            self.assertEqual(disk.max_bytes, 1024)
+        finally:
+            pdf_signer.STAMP_CACHE.disk = previous
+
+    def test_counters_shared_by_threads(self):
+        cache = DiskStampCache(self.tmpdir.name)
+        cache.put('a', b'stamp')
+        with ThreadPoolExecutor(max_workers=8) as pool:
+            list(pool.map(lambda key: [cache.get(key) for _ in range(500)], ['a', 'b'] * 4))
+        self.assertEqual((cache.hits, cache.misses), (2000, 2000))
+
+
+def test_timestamp_stamps_are_not_cached(tmp_path, make_pdf):
+    source = make_pdf(tmp_path / 'in.pdf')
+    previous = pdf_signer.STAMP_CACHE.disk
+    pdf_signer.STAMP_CACHE.clear()
+    try:
+        disk = pdf_signer.enable_disk_stamp_cache(str(tmp_path / 'cache'))
+        for i in range(3):
+            assert pdf_signer.add_watermark_to_pdf(source, SIGN_PATH, str(tmp_path / f'{i}.pdf'),
+                                                   0.2, timestamp=True)
+        # Solo il marchio della firma: il timestamp cambia a ogni firma
+        assert pdf_signer.STAMP_CACHE.stats()['entries'] == 1
+        assert len(list(disk.directory.glob('*/*.bin'))) == 1
+    finally:
+        pdf_signer.STAMP_CACHE.disk = previous
+        pdf_signer.STAMP_CACHE.clear()
+
+
+def test_serial_batch_restores_disk_cache(tmp_path, make_pdf):
+    # Con un solo processo la firma in blocco gira nel chiamante: la cache su
+    # disco attivata per il lotto non deve restare attiva dopo
+    source = make_pdf(tmp_path / 'in.pdf')
+    previous = pdf_signer.STAMP_CACHE.disk
+    results = pdf_signer.sign_batch([(source, str(tmp_path / 'out.pdf'))], SIGN_PATH, 0.2,
+                                    workers=1, stamp_cache=(str(tmp_path / 'cache'), 1 << 20))
+    assert results[0].ok
+    assert pdf_signer.STAMP_CACHE.disk is previous
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,40 @@
+import os
+import unittest
+from unittest.mock import patch
+
+import pytest
+from reportlab.lib.pagesizes import A4
+
+import pdf_signer
+from pdf_signer import PdfDocumentSession
+
+SIGN_PATH = os.path.join(os.path.dirname(os.path.dirname(__file__)), 'sign.png')
+
+
+class TestPdfDocumentSession(unittest.TestCase):
+    @pytest.fixture(autouse=True)
+    def _input(self, tmp_path, make_pdf):
+        self.input_pdf = make_pdf(tmp_path / 'in.pdf', 6)
+        self.output_pdf = str(tmp_path / 'out.pdf')
+
+    def test_shared_geometry_and_selection(self):
+        with PdfDocumentSession(self.input_pdf) as session:
+            self.assertEqual(session.total_pages, 6)
+            self.assertAlmostEqual(session.page_size[0], A4[0], places=2)
+            self.assertEqual(session.select_pages('1-4', '2'), [0, 2, 3])
+        self.assertTrue(session._file.closed)
+
+    def test_input_parsed_once(self):
+        for kwargs in ({}, {'pages': 'odd'}):
+            before = PdfDocumentSession.parse_count
+            with patch.object(pdf_signer, 'PdfReader', wraps=pdf_signer.PdfReader) as reader:
+                result = pdf_signer.add_watermark_to_pdf(
+                    self.input_pdf, SIGN_PATH, self.output_pdf, 0.2, **kwargs
+                )
+            self.assertTrue(result)
+            self.assertEqual(PdfDocumentSession.parse_count - before, 1)
+            input_reads = [
+                call for call in reader.call_args_list
+                if getattr(call.args[0], 'name', None) == self.input_pdf
+            ]
+            self.assertEqual(len(input_reads), 1)
@@ -0,0 +1,128 @@
+import json
+import os
+import smtplib
+import subprocess
+import sys
+import time
+
+import pytest
+
+import pdf_signer
+from pdf_signer import EmailOutbox, OutboxSender, build_email_message
+from pdf_signer_bench import StubSmtpServer
+
+
+@pytest.fixture
+def relay():
+    server = StubSmtpServer()
+    yield server
+    server.close()
+
+
+class _FailingPool:
+    def __init__(self, *errors):
+        self.errors = list(errors)
+
+    def send(self, msg, email_config, ssl_context=None):
+        if self.errors:
+            raise self.errors.pop(0)
+
+
+def _enqueue(outbox, config, name='doc.pdf'):
+    msg = build_email_message(b'%PDF-firmato', config, ['a@example.com'], filename=name)
+    return outbox.enqueue(msg, config)
+
+
+def test_enqueue_and_deliver(tmp_path, relay):
+    outbox = EmailOutbox(tmp_path)
+    ids = [_enqueue(outbox, relay.email_config(), f'{i}.pdf') for i in range(3)]
+    assert outbox.counts()['pending'] == 3
+    assert outbox.due() == ids
+    assert outbox.process() == {'sent': 3, 'deferred': 0, 'failed': 0}
+    assert relay.messages == 3
+    assert outbox.counts() == {'pending': 0, 'sending': 0, 'sent': 3, 'failed': 0}
+    assert outbox.status(ids[0])['state'] == 'sent'
+    assert list((tmp_path / 'messages').iterdir()) == []
+
+
+def test_credentials_stay_out_of_the_queue(tmp_path, relay, monkeypatch):
+    outbox = EmailOutbox(tmp_path / 'coda')
+    config = dict(relay.email_config(), username='firma', password='segreta')
+    message_id = _enqueue(outbox, config)
+    pending = tmp_path / 'coda' / 'pending' / f'{message_id}.json'
+    assert b'segreta' not in pending.read_bytes()
+    assert config['password'] == 'segreta'
+    assert outbox.process()['sent'] == 1
+    # Dal file: la scheda riporta solo il percorso, riletto all'invio
+    config_path = tmp_path / 'email.json'
+    config_path.write_text(json.dumps(config))
+    message_id = outbox.enqueue(build_email_message(b'%PDF', config, ['a@example.com']),
+                                str(config_path))
+    assert b'segreta' not in (tmp_path / 'coda' / 'pending' / f'{message_id}.json').read_bytes()
+    assert outbox.process()['sent'] == 1
+    # Password in memoria persa (nuovo processo): il messaggio fallisce
+    message_id = _enqueue(outbox, config)
+    monkeypatch.setattr(pdf_signer, '_OUTBOX_PASSWORDS', {})
+    assert outbox.process()['failed'] == 1
+    assert 'password SMTP non disponibile' in outbox.status(message_id)['last_error']
+
+
+def test_retry_with_backoff_and_permanent_failure(tmp_path, relay):
+    outbox = EmailOutbox(tmp_path, backoff_base=10, max_attempts=3)
+    message_id = _enqueue(outbox, relay.email_config())
+    pool = _FailingPool(smtplib.SMTPServerDisconnected('chiusa'),
+                        smtplib.SMTPResponseException(451, b'riprova'))
+    assert outbox.process(pool)['deferred'] == 1
+    status = outbox.status(message_id)
+    assert (status['state'], status['attempts']) == ('pending', 1)
+    assert 9 < status['next_attempt'] - time.time() <= 10
+    assert outbox.due() == []
+    # Secondo tentativo: attesa raddoppiata
+    assert outbox.process(pool) == {'sent': 0, 'deferred': 0, 'failed': 0}
+    assert outbox.due(now=time.time() + 10) == [message_id]
+    with pytest.MonkeyPatch.context() as patch:
+        patch.setattr(pdf_signer.time, 'time', lambda: status['next_attempt'] + 1)
+        assert outbox.process(pool)['deferred'] == 1
+    assert 19 < outbox.status(message_id)['next_attempt'] - status['next_attempt'] <= 21
+    # --outbox-send: un tentativo subito, senza attendere
+    assert outbox.process(force=True)['sent'] == 1
+    # Rifiuto definitivo (5xx): nessun nuovo tentativo
+    other = _enqueue(outbox, relay.email_config())
+    refused = smtplib.SMTPRecipientsRefused({'a@example.com': (550, b'sconosciuto')})
+    assert outbox.process(_FailingPool(refused))['failed'] == 1
+    assert 'SMTPRecipientsRefused' in outbox.status(other)['last_error']
+
+
+def test_recover_after_crash(tmp_path, relay):
+    outbox = EmailOutbox(tmp_path)
+    message_id = _enqueue(outbox, relay.email_config())
+    # Un processo terminato durante l'invio lascia il messaggio in sending/
+    dead = subprocess.Popen([sys.executable, '-c', 'pass'])
+    dead.wait()
+    os.rename(tmp_path / 'pending' / f'{message_id}.json',
+              tmp_path / 'sending' / f'{message_id}.{dead.pid}.json')
+    assert outbox.claim_next() is None
+    assert outbox.recover() == 1
+    assert outbox.process() == {'sent': 1, 'deferred': 0, 'failed': 0}
+    # Presi in carico da questo processo (vivo): non vengono toccati
+    other = _enqueue(outbox, relay.email_config())
+    assert outbox.claim_next() == other
+    assert outbox.recover() == 0
+    assert outbox.status(other)['state'] == 'sending'
+
+
+def test_sender_drains_concurrently(tmp_path):
+    relay = StubSmtpServer(latency=0.02)
+    try:
+        config_path = tmp_path / 'email.json'
+        config_path.write_text(json.dumps(relay.email_config()))
+        kwargs = {'email_config': str(config_path), 'email_recipients': ['a@example.com'],
+                  'email_outbox': str(tmp_path / 'coda')}
+        with OutboxSender(tmp_path / 'coda', workers=2, poll_interval=0.05) as sender:
+            for i in range(6):
+                pdf_signer._email_signed_pdf(b'%PDF', kwargs, f'{i}.pdf')
+        assert sender.counts == {'sent': 6, 'deferred': 0, 'failed': 0}
+        assert relay.messages == 6
+        assert relay.connections <= 2
+    finally:
+        relay.close()
@@ -0,0 +1,118 @@
+import email
+import json
+import os
+import subprocess
+import sys
+import tracemalloc
+
+import pytest
+
+import pdf_signer
+import pdf_signer_bench
+from pdf_signer import (EmailOutbox, _dot_stuffed, _EmlFile, build_email_message, iter_message_bytes,
+                        send_email_with_pdf)
+from pdf_signer_bench import StubSmtpServer
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+@pytest.fixture
+def relay():
+    server = StubSmtpServer(keep=True)
+    yield server
+    server.close()
+
+
+@pytest.fixture
+def scan(tmp_path):
+    path = tmp_path / 'scansione.pdf'
+    path.write_bytes(os.urandom(3 * 1024 * 1024 + 17))
+    return path
+
+
+def _attachment(raw):
+    message = email.message_from_bytes(raw)
+    return message, message.get_payload()[1]
+
+
+def test_streamed_attachment_round_trip(monkeypatch, relay, scan):
+    monkeypatch.setattr(pdf_signer, 'EMAIL_STREAM_THRESHOLD', 1024 * 1024)
+    body = ".riga con punto\n..due punti\nfine"
+    assert send_email_with_pdf(str(scan), relay.email_config(), ['a@example.com'], body=body)
+    message, attachment = _attachment(relay.received[0])
+    assert message['Subject'] == 'PDF Firmato: scansione.pdf'
+    assert message.get_payload()[0].get_payload(decode=True).decode().splitlines() == body.splitlines()
+    assert attachment.get_payload(decode=True) == scan.read_bytes()
+    assert 'scansione.pdf' in attachment['Content-Disposition']
+    # Stesso allegato della costruzione in memoria (sotto la soglia)
+    streamed = build_email_message(str(scan), relay.email_config(), ['a@example.com'])
+    monkeypatch.setattr(pdf_signer, 'EMAIL_STREAM_THRESHOLD', 8 * 1024 * 1024)
+    buffered = build_email_message(str(scan), relay.email_config(), ['a@example.com'])
+    assert pdf_signer._streamed_parts(streamed) and not pdf_signer._streamed_parts(buffered)
+    for msg in (streamed, buffered):
+        part = _attachment(b''.join(iter_message_bytes(msg)))[1]
+        assert part.get_payload(decode=True) == scan.read_bytes()
+
+
+def _peak_rss_growth(config, path, streamed):
+    """Crescita del picco RSS per l'invio, misurata in un processo separato."""
+    proc = subprocess.run([sys.executable, '-c', pdf_signer_bench._MIME_CHILD, json.dumps(config),
+                           str(path), '1' if streamed else '0', ROOT],
+                          capture_output=True, text=True, check=True)
+    result = json.loads(proc.stdout.strip().splitlines()[-1])
+    assert result['ok']
+    return result['after'] - result['before']
+
+
+@pytest.mark.skipif(pdf_signer_bench.resource is None, reason="ru_maxrss non disponibile")
+def test_memory_stays_constant(scan, tmp_path):
+    big = tmp_path / 'grande.pdf'
+    with open(big, 'wb') as f:
+        for _ in range(8):
+            f.write(scan.read_bytes())
+    assert big.stat().st_size > pdf_signer.EMAIL_STREAM_THRESHOLD
+    relay = StubSmtpServer()
+    try:
+        streamed = _peak_rss_growth(relay.email_config(), big, True)
+        buffered = _peak_rss_growth(relay.email_config(), big, False)
+    finally:
+        relay.close()
+    # ~25 MB di allegato (34 MB in base64): in memoria il picco cresce di decine di MB
+    assert streamed < 8 * 1024 * 1024
+    assert buffered > 4 * streamed
+    assert relay.messages == 2
+
+
+def test_eml_file_blocks(tmp_path, monkeypatch):
+    monkeypatch.setattr(pdf_signer, '_EML_BLOCK', 7)
+    path = tmp_path / 'messaggio.eml'
+    path.write_bytes(b'Subject: x\r\n\r\n.prima\r\nseconda\n.terza\rquarta\r\n..fine\r')
+    chunks = list(_EmlFile(path, ['a@example.com']).chunks())
+    assert len(chunks) > 1
+    assert b''.join(_dot_stuffed(chunks)) == (
+        b'Subject: x\r\n\r\n..prima\r\nseconda\r\n..terza\r\nquarta\r\n...fine\r\n')
+
+
+def test_outbox_streams_from_disk(monkeypatch, relay, scan, tmp_path):
+    monkeypatch.setattr(pdf_signer, 'EMAIL_STREAM_THRESHOLD', 1024 * 1024)
+    outbox = EmailOutbox(tmp_path / 'coda')
+    msg = build_email_message(str(scan), relay.email_config(), ['a@example.com'])
+    tracemalloc.start()
+    try:
+        outbox.enqueue(msg, relay.email_config())
+        peak = tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+    assert peak < 1024 * 1024
+    sends = []
+    send = pdf_signer.smtplib.SMTP.send
+
+    def counting_send(server, data):
+        sends.append(len(data))
+        return send(server, data)
+
+    monkeypatch.setattr(pdf_signer.smtplib.SMTP, 'send', counting_send)
+    assert outbox.process()['sent'] == 1
+    assert _attachment(relay.received[0])[1].get_payload(decode=True) == scan.read_bytes()
+    # DATA a blocchi: una scrittura sul socket ogni 64 KiB, non una per riga
+    assert len(sends) < 100 and max(sends) >= pdf_signer._EML_BLOCK
@@ -0,0 +1,97 @@
+import os
+
+import pytest
+
+import pdf_signer
+from pdf_signer import (EMAIL_CONFIGS, EMAIL_TEMPLATES, EmailFormat, build_email_message,
+                        load_email_config)
+
+CONFIG = {'smtp_server': 'localhost', 'from_address': 'firma@example.com',
+          'sender': {'name': 'Ufficio Firme'}}
+
+
+@pytest.fixture(autouse=True)
+def fresh_caches():
+    EMAIL_TEMPLATES.clear()
+    EMAIL_CONFIGS.clear()
+    yield
+    EMAIL_TEMPLATES.clear()
+    EMAIL_CONFIGS.clear()
+
+
+def _write_template(path, subject):
+    path.write_text(
+        f'subject: "{subject}"\n'
+        'body: |\n'
+        '  Gentile {recipient},\n'
+        '  {filename} ({stem}) firmato il {date}, pagine: {pages_signed}.\n'
+        '  Autore: {author} - {sconosciuto} - {{letterale}}\n'
+        '  {sender_name}\n'
+        'additional_attachments:\n'
+        '  - istruzioni.txt\n'
+        '  - mancante.txt\n',
+        encoding='utf-8')
+
+
+def _parts(msg):
+    return [part.get_payload(decode=True) for part in msg.get_payload()]
+
+
+def test_template_is_parsed_once(tmp_path, capsys):
+    template = tmp_path / 'modello.yaml'
+    _write_template(template, 'Firmato: {filename}')
+    (tmp_path / 'istruzioni.txt').write_bytes(b'leggere con attenzione')
+    messages = [build_email_message(b'%PDF', CONFIG, ['a@example.com'], template_path=str(template),
+                                    filename=f'{i}.pdf', context={'pages_signed': '1-3'})
+                for i in range(10_000)]
+    assert EMAIL_TEMPLATES.stats()['parses'] == 1
+    assert capsys.readouterr().out.count('mancante.txt') == 1
+    first, last = messages[0], messages[-1]
+    assert last['Subject'] == 'Firmato: 9999.pdf'
+    body, pdf, extra = _parts(last)
+    assert body.decode().splitlines()[:3] == [
+        'Gentile a@example.com,',
+        f'9999.pdf (9999) firmato il {pdf_signer.datetime.now():%d/%m/%Y}, pagine: 1-3.',
+        'Autore:  - {sconosciuto} - {letterale}',
+    ]
+    assert 'Ufficio Firme' in body.decode()
+    assert (pdf, extra) == (b'%PDF', b'leggere con attenzione')
+    # La codifica base64 dell'allegato del template è la stessa per tutti i messaggi
+    assert first.get_payload()[2].get_payload() is last.get_payload()[2].get_payload()
+
+
+def test_changed_files_are_parsed_again(tmp_path):
+    template = tmp_path / 'modello.yaml'
+    _write_template(template, 'Prima')
+    assert build_email_message(b'%PDF', CONFIG, ['a@b.it'], template_path=str(template))['Subject'] == 'Prima'
+    _write_template(template, 'Dopo: {title}')
+    stat = template.stat()
+    os.utime(template, ns=(stat.st_atime_ns, stat.st_mtime_ns + 1_000_000))
+    msg = build_email_message(b'%PDF', CONFIG, ['a@b.it'], template_path=str(template),
+                              context={'title': 'Contratto'})
+    assert msg['Subject'] == 'Dopo: Contratto'
+    assert EMAIL_TEMPLATES.stats()['parses'] == 2
+
+    config = tmp_path / 'email.yaml'
+    config.write_text('smtp_server: smtp.example.com\nsmtp_port: 25\n', encoding='utf-8')
+    first = load_email_config(str(config))
+    first['smtp_port'] = 2525
+    assert load_email_config(str(config))['smtp_port'] == 25
+    assert EMAIL_CONFIGS.stats() == {'hits': 1, 'parses': 1, 'entries': 1}
+
+
+def test_text_template_and_format_rules(tmp_path):
+    template = tmp_path / 'modello.txt'
+    template.write_text('Oggetto: Documento {filename}\n\nIn allegato {pdf_name}.\n', encoding='utf-8')
+    msg = build_email_message(b'%PDF', CONFIG, ['a@b.it'], template_path=str(template),
+                              filename='x{1}.pdf')
+    assert msg['Subject'] == 'Documento x{1}.pdf'
+    assert _parts(msg)[0].decode().strip() == 'In allegato x{1}.pdf.'
+
+    assert EmailFormat('{n:>3}|{n!r}|{altro:>3}').render({'n': 7}) == '  7|7|{altro:>3}'
+    for text in ('{aperta', '{a.b}', '{0}', '{a:{b}}'):
+        with pytest.raises(ValueError):
+            EmailFormat(text)
+    template.write_text('{non chiusa', encoding='utf-8')
+    assert not pdf_signer.send_email_with_pdf(b'%PDF', CONFIG, ['a@b.it'],
+                                              template_path=str(template))
@@ -0,0 +1,53 @@
+import io
+import os
+import tempfile
+import unittest
+from unittest.mock import patch
+
+from PIL import Image
+from reportlab.lib.pagesizes import A4
+from reportlab.pdfgen import canvas
+from PyPDF2 import PdfReader
+
+import pdf_signer
+
+SIGN_PATH = os.path.join(os.path.dirname(os.path.dirname(__file__)), 'sign.png')
+
+
+class TestInMemoryStamp(unittest.TestCase):
+    def test_bytes_api(self):
+        image = pdf_signer.load_signature_image(SIGN_PATH)
+        self.assertIsInstance(image, Image.Image)
+        data = pdf_signer.create_watermark_pdf_bytes(image, 0.2, 'center', A4)
+        self.assertTrue(data.startswith(b'%PDF'))
+        page = PdfReader(io.BytesIO(data)).pages[0]
+        self.assertAlmostEqual(float(page.mediabox.width), A4[0], places=2)
+        self.assertIn('/XObject', page['/Resources'])
+
+    def test_effects_do_not_mutate_input(self):
+        image = pdf_signer.load_signature_image(SIGN_PATH)
+        size = image.size
+        result = pdf_signer.apply_image_effects(image, border_width=3, shadow_enabled=True)
+        self.assertEqual(image.size, size)
+        self.assertEqual(result.size, (size[0] + 6 + 5, size[1] + 6 + 5))
+        self.assertIs(pdf_signer.apply_image_effects(image), image)
+
+    def test_signing_without_temp_files(self):
+        with tempfile.TemporaryDirectory() as tmpdir:
+            input_pdf = os.path.join(tmpdir, 'in.pdf')
+            output_pdf = os.path.join(tmpdir, 'out.pdf')
+            c = canvas.Canvas(input_pdf, pagesize=A4)
+            c.drawString(72, 720, "Pagina 1")
+            c.showPage()
+            c.save()
+            with patch.object(tempfile, 'NamedTemporaryFile',
+                              side_effect=AssertionError("file temporaneo creato")):
+                self.assertTrue(pdf_signer.add_watermark_to_pdf_advanced(
+                    input_pdf, SIGN_PATH, output_pdf, 0.2,
+                    timestamp=True, border_width=2, shadow_enabled=True,
+                ))
+            self.assertEqual(len(PdfReader(output_pdf).pages), 1)
+
+
+if __name__ == '__main__':
+    unittest.main()
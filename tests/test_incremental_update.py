@@ -0,0 +1,75 @@
+import os
+import tempfile
+import unittest
+
+from reportlab.lib.pagesizes import A4
+from reportlab.pdfgen import canvas
+from PyPDF2 import PdfReader
+
+from pdf_signer import add_watermark_to_pdf_advanced
+
+SIGN_PATH = os.path.join(os.path.dirname(os.path.dirname(__file__)), 'sign.png')
+
+
+class TestIncrementalUpdate(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.input_pdf = os.path.join(self.tmpdir.name, 'in.pdf')
+        c = canvas.Canvas(self.input_pdf, pagesize=A4)
+        for i in range(5):
+            c.drawString(72, 720, f"Pagina {i + 1}")
+            c.showPage()
+        c.save()
+        with open(self.input_pdf, 'rb') as f:
+            self.original = f.read()
+
+    def tearDown(self):
+        self.tmpdir.cleanup()
+
+    def _check_output(self, output):
+        with open(output, 'rb') as f:
+            data = f.read()
+        self.assertTrue(data.startswith(self.original))
+        self.assertGreater(len(data), len(self.original))
+        self.assertEqual(data.count(b'startxref'), 2)
+
+        reader = PdfReader(output)
+        self.assertEqual(len(reader.pages), 5)
+        self.assertEqual(reader.metadata.get('/Title'), 'Contratto')
+        for i, page in enumerate(reader.pages):
+            xobjects = page['/Resources'].get('/XObject', {})
+            self.assertEqual('/PdfSignerStamp' in xobjects, i == 4)
+
+    def test_append_to_copy(self):
+        output = os.path.join(self.tmpdir.name, 'out.pdf')
+        self.assertTrue(add_watermark_to_pdf_advanced(
+            self.input_pdf, SIGN_PATH, output, 0.2,
+            pages='last', incremental=True, add_metadata=True, title='Contratto',
+        ))
+        self._check_output(output)
+        with open(self.input_pdf, 'rb') as f:
+            self.assertEqual(f.read(), self.original)
+
+    def test_in_place(self):
+        self.assertTrue(add_watermark_to_pdf_advanced(
+            self.input_pdf, SIGN_PATH, self.input_pdf, 0.2,
+            pages='last', incremental=True, add_metadata=True, title='Contratto',
+        ))
+        self._check_output(self.input_pdf)
+
+    def test_trailing_bytes_after_eof(self):
+        # Riempimento dopo %%EOF, come nei PDF di alcuni scanner
+        with open(self.input_pdf, 'ab') as f:
+            f.write(b'\r\n' + b'\x00' * 3000)
+        with open(self.input_pdf, 'rb') as f:
+            self.original = f.read()
+        output = os.path.join(self.tmpdir.name, 'out.pdf')
+        self.assertTrue(add_watermark_to_pdf_advanced(
+            self.input_pdf, SIGN_PATH, output, 0.2,
+            pages='last', incremental=True, add_metadata=True, title='Contratto',
+        ))
+        self._check_output(output)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,105 @@
+import csv
+import json
+import os
+import subprocess
+import sys
+
+import pytest
+from PyPDF2 import PdfReader
+
+from pdf_signer import (
+    _group_jobs, iter_manifest, profile_options, resolve_manifest_row, run_manifest,
+)
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+SIGN_PATH = os.path.join(ROOT, 'sign.png')
+PROFILES = {
+    "Contratti": {
+        "scale": 0.3, "position": "top-left", "watermark_path": SIGN_PATH,
+        "pages": "custom", "pages_range": "1", "add_metadata": True,
+        "metadata_author": "Ufficio legale", "timestamp_enabled": False,
+        "email_enabled": True, "email_to": "a@example.com", "email_cc": "b@example.com",
+        "description": "ignorata",
+    }
+}
+
+
+def test_profile_and_row_precedence():
+    assert profile_options(PROFILES['Contratti'])['email_recipients'] == ['a@example.com', 'b@example.com']
+    job = resolve_manifest_row(
+        {'input': 'a.pdf', 'profile': 'Contratti', 'scale': '0.5', 'title': 'Contratto 7',
+         'border_color': '255,0,0', 'incremental': 'sì'},
+        {'watermark': SIGN_PATH, 'scale': 0.2, 'timestamp': True}, PROFILES,
+        base_dir='/data', output_dir='/out', index=3,
+    )
+    assert (job.input_path, job.output_path) == ('/data/a.pdf', '/out/a_signed.pdf')
+    assert (job.scale, job.position) == (0.5, 'top-left')
+    assert job.kwargs['pages'] == '1'
+    assert job.kwargs['author'] == 'Ufficio legale'
+    assert job.kwargs['border_color'] == (255, 0, 0)
+    # Il profilo prevale sui valori della riga di comando
+    assert job.kwargs['incremental'] is True and job.kwargs['timestamp'] is False
+
+    for row in ({'input': 'a.pdf', 'colore': 'rosso'}, {'input': 'a.pdf', 'profile': 'X'},
+                {'input': 'a.pdf', 'pages': '1-x'}, {'output': 'b.pdf'}):
+        with pytest.raises(ValueError):
+            resolve_manifest_row(row, {}, PROFILES)
+
+
+def test_rows_are_grouped_by_stamp():
+    jobs = [resolve_manifest_row({'input': f'{i}.pdf', 'scale': str(0.2 + (i % 2) / 10),
+                                  'author': f'A{i}'}, {}, {}, index=i) for i in range(6)]
+    groups = list(_group_jobs(jobs, group_size=2))
+    assert [[job.row for job in group] for group in groups] == [[0, 2], [4], [1, 3], [5]]
+
+
+def test_manifest_formats_and_parallel_run(tmp_path, make_pdf):
+    for name in ('a', 'b', 'c'):
+        make_pdf(tmp_path / f'{name}.pdf', pages=3)
+    jsonl = tmp_path / 'jobs.jsonl'
+    jsonl.write_text("\n".join([
+        json.dumps({'input': 'a.pdf', 'pages': 'first', 'author': 'Uno', 'add_metadata': True}),
+        "# commento",
+        json.dumps({'input': 'b.pdf', 'output': 'out/b-firmato.pdf', 'profile': 'Contratti',
+                    'email_recipients': []}),
+        "{non json",
+        json.dumps({'input': 'manca.pdf'}),
+    ]), encoding='utf-8')
+    rows = list(iter_manifest(str(jsonl)))
+    assert [number for number, _ in rows] == [1, 3, 4, 5]
+
+    results = dict(run_manifest(iter(rows), {'watermark': SIGN_PATH}, PROFILES, workers=2,
+                                base_dir=str(tmp_path)))
+    assert sorted(results) == [1, 3, 4, 5]
+    assert [results[n].ok for n in (1, 3, 4, 5)] == [True, True, False, False]
+    assert 'JSON non valido' in results[4].error
+    assert PdfReader(str(tmp_path / 'a_signed.pdf')).metadata['/Author'] == 'Uno'
+    assert PdfReader(str(tmp_path / 'out' / 'b-firmato.pdf')).metadata['/Author'] == 'Ufficio legale'
+
+    csv_path = tmp_path / 'jobs.csv'
+    with open(csv_path, 'w', newline='', encoding='utf-8') as f:
+        writer = csv.writer(f)
+        writer.writerow(['input', 'scale', 'timestamp', 'shadow_offset'])
+        writer.writerow(['c.pdf', '0.3', 'yes', '3,3'])
+        writer.writerow(['a.pdf', '', '', ''])
+    rows = list(iter_manifest(str(csv_path)))
+    assert rows == [(2, {'input': 'c.pdf', 'scale': '0.3', 'timestamp': 'yes', 'shadow_offset': '3,3'}),
+                    (3, {'input': 'a.pdf'})]
+
+
+def test_cli_manifest(tmp_path, make_pdf):
+    make_pdf(tmp_path / 'a.pdf', pages=3)
+    profiles = tmp_path / 'profiles.json'
+    profiles.write_text(json.dumps(PROFILES), encoding='utf-8')
+    manifest = tmp_path / 'jobs.jsonl'
+    manifest.write_text(json.dumps({'input': 'a.pdf', 'profile': 'Contratti',
+                                    'email_recipients': ''}) + "\n", encoding='utf-8')
+    proc = subprocess.run(
+        [sys.executable, os.path.join(ROOT, 'pdf_signer.py'), '--manifest', str(manifest),
+         '--profiles', str(profiles), '-w', SIGN_PATH, '--output-dir', str(tmp_path / 'out'),
+         '-j', '2'],
+        capture_output=True, text=True,
+    )
+    assert proc.returncode == 0, proc.stdout
+    assert 'Firmati 1/1 file' in proc.stdout
+    assert (tmp_path / 'out' / 'a_signed.pdf').exists()
@@ -0,0 +1,166 @@
+import functools
+import multiprocessing
+import os
+import shutil
+import subprocess
+import sys
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from unittest import mock
+
+import pytest
+from PyPDF2 import PdfReader
+
+import pdf_signer
+from pdf_signer import OutputCache, add_watermark_to_pdf, run_manifest, sign_batch, summarize_batch
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+SIGN_PATH = os.path.join(ROOT, 'sign.png')
+
+
+def _read(path):
+    with open(path, 'rb') as f:
+        return f.read()
+
+
+@pytest.fixture
+def output_cache(tmp_path):
+    cache = OutputCache(tmp_path / 'cache')
+    with mock.patch.object(pdf_signer, 'OUTPUT_CACHE', cache):
+        yield cache
+
+
+@pytest.mark.parametrize('options', [
+    {'timestamp': True, 'add_metadata': True, 'author': 'A'},
+    {'incremental': True, 'add_metadata': True},
+    {'engine': 'pymupdf', 'timestamp': True, 'add_metadata': True},
+])
+def test_deterministic_output(tmp_path, options, make_pdf):
+    if options.get('engine') == 'pymupdf':
+        pytest.importorskip('pymupdf')
+    source = make_pdf(tmp_path / 'in.pdf')
+    outputs = []
+    for name in ('a', 'b'):
+        outputs.append(str(tmp_path / f'{name}.pdf'))
+        # Ore diverse tra le due firme: non devono entrare nell'output
+        with mock.patch.object(pdf_signer, 'datetime', wraps=pdf_signer.datetime) as clock:
+            clock.now.return_value = pdf_signer.datetime(2030, 1, 1 + len(outputs))
+            assert add_watermark_to_pdf(source, SIGN_PATH, outputs[-1], 0.2,
+                                        deterministic=True, **options)
+    assert _read(outputs[0]) == _read(outputs[1])
+    info = PdfReader(outputs[0]).metadata
+    if options.get('add_metadata'):
+        # canvas invariant: data di creazione fissa del 2000
+        assert info['/ModDate'].startswith('D:2000')
+
+    with mock.patch.dict(os.environ, {'SOURCE_DATE_EPOCH': '1700000000'}):
+        assert add_watermark_to_pdf(source, SIGN_PATH, str(tmp_path / 'c.pdf'), 0.2,
+                                    deterministic=True, **options)
+    assert _read(tmp_path / 'c.pdf') != _read(outputs[0])
+
+
+def test_merge_resource_names_are_reproducible(tmp_path, make_pdf):
+    source = make_pdf(tmp_path / 'in.pdf')
+    for name in ('a', 'b'):
+        assert add_watermark_to_pdf(source, SIGN_PATH, str(tmp_path / f'{name}.pdf'), 0.2,
+                                    deterministic=True)
+    assert _read(tmp_path / 'a.pdf') == _read(tmp_path / 'b.pdf')
+
+
+def test_deterministic_names_across_threads(make_pdf):
+    # Firme deterministiche e normali in parallelo: le prime restano identiche
+    source = make_pdf()
+    reference = pdf_signer.sign_pdf_bytes(source, SIGN_PATH, 0.2, deterministic=True)
+    with ThreadPoolExecutor(max_workers=8) as pool:
+        outputs = list(pool.map(
+            lambda i: pdf_signer.sign_pdf_bytes(source, SIGN_PATH, 0.2, deterministic=i % 2 == 0),
+            range(16)))
+    assert all(output == reference for output in outputs[::2])
+    assert all(output != reference for output in outputs[1::2])
+
+
+def test_parse_pdf_date():
+    assert pdf_signer._parse_pdf_date("D:20240131235959+01'00'") == pdf_signer.datetime(2024, 1, 31, 23, 59, 59)
+    assert pdf_signer._parse_pdf_date("D:2024") == pdf_signer.datetime(2024, 1, 1)
+    assert pdf_signer._parse_pdf_date("ieri") is None
+
+
+def test_hit_copies_previous_output(tmp_path, output_cache, make_pdf):
+    first = make_pdf(tmp_path / 'modulo.pdf')
+    again = str(tmp_path / 'ripresentato.pdf')
+    shutil.copyfile(first, again)
+    options = {'deterministic': True, 'timestamp': True}
+    assert add_watermark_to_pdf(first, SIGN_PATH, str(tmp_path / 'out1.pdf'), 0.2, **options)
+    with mock.patch.object(pdf_signer, 'PdfDocumentSession') as session:
+        assert add_watermark_to_pdf(again, SIGN_PATH, str(tmp_path / 'out2.pdf'), 0.2, **options)
+    session.assert_not_called()
+    assert _read(tmp_path / 'out1.pdf') == _read(tmp_path / 'out2.pdf')
+    stats = output_cache.stats()
+    assert (stats['hits'], stats['misses'], stats['stores']) == (1, 1, 1)
+    assert stats['hit_rate'] == 0.5
+    assert stats['bytes_saved'] == os.path.getsize(tmp_path / 'out2.pdf')
+
+    # Parametri diversi: nuova firma
+    assert add_watermark_to_pdf(again, SIGN_PATH, str(tmp_path / 'out3.pdf'), 0.3, **options)
+    assert output_cache.stats()['misses'] == 2
+    # Timestamp all'ora corrente: l'output non è riproducibile e non passa dalla cache
+    assert output_cache.key(again, SIGN_PATH, 0.2, 'bottom-right', {'timestamp': True}) is None
+
+
+def test_hard_links_are_detached_before_rewrite(tmp_path, output_cache, make_pdf):
+    output_cache.link = True
+    source = make_pdf(tmp_path / 'in.pdf')
+    output = str(tmp_path / 'out.pdf')
+    assert add_watermark_to_pdf(source, SIGN_PATH, output, 0.2)
+    assert add_watermark_to_pdf(source, SIGN_PATH, output, 0.2)
+    assert os.stat(output).st_nlink == 2
+    cached = _read(output)
+    # Nuova firma con altri parametri sullo stesso output: la voce in cache resta intatta
+    assert add_watermark_to_pdf(source, SIGN_PATH, output, 0.4)
+    assert add_watermark_to_pdf(source, SIGN_PATH, str(tmp_path / 'again.pdf'), 0.2)
+    assert _read(tmp_path / 'again.pdf') == cached
+
+
+def test_batch_statistics(tmp_path, make_pdf):
+    jobs = []
+    for i in range(3):
+        source = make_pdf(tmp_path / f'{i}.pdf')
+        jobs.append((source, str(tmp_path / 'out' / f'{i}.pdf')))
+    cache = (str(tmp_path / 'cache'), 1 << 30, False)
+    results = sign_batch(jobs, SIGN_PATH, 0.2, workers=2, output_cache=cache, deterministic=True)
+    assert all(r.ok and r.pages == 2 for r in results)
+    # Stessi contenuti: tutte le firme dopo la prima arrivano dalla cache
+    summary = summarize_batch(results, 1.0)
+    assert summary['cache_hits'] >= 1
+    results = sign_batch(jobs, SIGN_PATH, 0.2, workers=1, output_cache=cache, deterministic=True)
+    summary = summarize_batch(results, 1.0)
+    assert (summary['cache_hits'], summary['cache_hit_rate']) == (3, 1.0)
+    assert summary['bytes_saved'] == sum(os.path.getsize(out) for _, out in jobs)
+    assert pdf_signer.OUTPUT_CACHE is None
+
+
+def test_manifest_workers_enable_cache(tmp_path, make_pdf, monkeypatch):
+    # Con spawn (Windows, macOS) i processi non ereditano la cache attivata dal principale
+    spawn = functools.partial(ProcessPoolExecutor, mp_context=multiprocessing.get_context('spawn'))
+    monkeypatch.setattr(pdf_signer, 'ProcessPoolExecutor', spawn)
+    for i in range(3):
+        make_pdf(tmp_path / f'{i}.pdf')
+    rows = [(i, {'input': f'{i}.pdf'}) for i in range(3)]
+    options = dict(defaults={'watermark': SIGN_PATH, 'deterministic': True}, workers=2,
+                   base_dir=str(tmp_path), output_cache=(str(tmp_path / 'cache'), 1 << 30, False))
+    assert all(r.ok for _, r in run_manifest(rows, **options))
+    results = [r for _, r in run_manifest(rows, **options)]
+    assert summarize_batch(results, 1.0)['cache_hits'] == 3
+    assert pdf_signer.OUTPUT_CACHE is None
+
+
+def test_cli_output_cache(tmp_path, make_pdf):
+    source = make_pdf(tmp_path / 'in.pdf')
+    command = [sys.executable, os.path.join(ROOT, 'pdf_signer.py'), source, '-w', SIGN_PATH,
+               '--timestamp', '--output-cache', str(tmp_path / 'cache')]
+    for deterministic in (False, True):
+        for _ in range(2):
+            proc = subprocess.run(command + ['--deterministic'] * deterministic,
+                                  capture_output=True, text=True, cwd=str(tmp_path))
+            assert proc.returncode == 0, proc.stdout
+        # Senza --deterministic il timestamp porta l'ora corrente: niente cache
+        assert ('Output dalla cache' in proc.stdout) == deterministic
@@ -0,0 +1,90 @@
+import os
+import tempfile
+import unittest
+
+from reportlab.lib.pagesizes import A4, landscape, letter
+from reportlab.pdfgen import canvas
+from PyPDF2 import PdfReader
+
+from pdf_signer import (
+    StampCache, add_watermark_to_pdf_advanced, page_geometry, placement_matrix,
+    visual_page_size,
+)
+
+SIGN_PATH = os.path.join(os.path.dirname(os.path.dirname(__file__)), 'sign.png')
+
+# (dimensione, /Rotate, /CropBox)
+GEOMETRIES = [
+    (A4, 0, None),
+    (landscape(letter), 0, None),
+    (landscape(A4), 90, None),
+    (A4, 180, None),
+    (landscape(A4), 270, None),
+    (A4, 0, (100, 100, 450, 700)),
+]
+
+
+def _apply(matrix, x, y):
+    a, b, c, d, e, f = matrix
+    return a * x + c * y + e, b * x + d * y + f
+
+
+class TestPageGeometry(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.input_pdf = os.path.join(self.tmpdir.name, 'in.pdf')
+        c = canvas.Canvas(self.input_pdf)
+        for size, rotation, crop in GEOMETRIES * 3:
+            c.setPageSize(size)
+            c.setPageRotation(rotation)
+            c.setCropBox(crop)
+            c.drawString(72, 72, "Pagina")
+            c.showPage()
+        c.save()
+
+    def tearDown(self):
+        self.tmpdir.cleanup()
+
+    def test_placement_matrix_maps_visual_corners(self):
+        # Il vertice in basso a destra della pagina visualizzata deve finire
+        # nel vertice del riquadro che il lettore mostra in basso a destra
+        box = (10, 20, 610, 820)
+        expected = {0: (610, 20), 90: (610, 820), 180: (10, 820), 270: (10, 20)}
+        for rotation, corner in expected.items():
+            geometry = box + (rotation,)
+            width, _ = visual_page_size(geometry)
+            self.assertEqual(_apply(placement_matrix(geometry), width, 0), corner)
+
+    def test_one_stamp_per_geometry(self):
+        reader = PdfReader(self.input_pdf)
+        geometries = {page_geometry(page) for page in reader.pages}
+        self.assertEqual(len(geometries), len(GEOMETRIES))
+        with StampCache(SIGN_PATH, 0.2) as stamps:
+            for page in reader.pages:
+                stamps.lookup(page)
+            self.assertEqual(stamps.geometries, len(GEOMETRIES))
+            # A4 verticale, Letter orizzontale, A4 orizzontale, riquadro ritagliato
+            self.assertEqual(stamps.stamps_built, 4)
+            first = stamps.lookup(reader.pages[0])
+            self.assertIs(stamps.lookup(reader.pages[len(GEOMETRIES)]), first)
+
+    def test_signed_pages_keep_geometry(self):
+        for mode in ('merge', 'xobject'):
+            output = os.path.join(self.tmpdir.name, f'out_{mode}.pdf')
+            self.assertTrue(add_watermark_to_pdf_advanced(
+                self.input_pdf, SIGN_PATH, output, 0.2, stamp_mode=mode,
+            ))
+            original = PdfReader(self.input_pdf).pages
+            for page, signed in zip(original, PdfReader(output).pages):
+                self.assertEqual(page_geometry(signed), page_geometry(page))
+            rotated = PdfReader(output).pages[2]
+            x0, y0, x1, y1, _ = page_geometry(rotated)
+            cm = f'0 1 -1 0 {x1:g} {y0:g} cm'.encode()
+            contents = rotated.get_contents()
+            parts = contents if isinstance(contents, list) else [contents]
+            data = b''.join(part.get_object().get_data() for part in parts)
+            self.assertIn(cm, data)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,40 @@
+import pytest
+
+from pdf_signer import PageSelection, parse_pages_specification
+
+
+@pytest.mark.parametrize("spec,expected", [
+    ("all", list(range(10))),
+    ("odd", [0, 2, 4, 6, 8]),
+    ("even", [1, 3, 5, 7, 9]),
+    ("first,last", [0, 9]),
+    ("-1", [9]),
+    ("-3--1", [7, 8, 9]),
+    ("last-5", [4]),
+    ("last-2-last", [7, 8, 9]),
+    ("8-", [7, 8, 9]),
+    ("1-10:3", [0, 3, 6, 9]),
+    ("2-:4", [1, 5, 9]),
+    ("5-3,0,11", []),
+])
+def test_spec_syntax(spec, expected):
+    assert list(PageSelection(spec, 10)) == expected
+
+
+def test_exclude_and_membership():
+    selection = PageSelection("all", 20000, exclude="1-100:2")
+    assert len(selection) == 19950
+    assert 0 not in selection
+    assert 1 in selection
+    assert 19999 in selection
+    assert 20000 not in selection
+    assert selection.head(3) == [1, 3, 5]
+
+
+def test_lenient_and_strict_parsing():
+    assert parse_pages_specification("1,x,3", 5) == [0, 2]
+    with pytest.raises(ValueError):
+        PageSelection("1,x,3", 5, strict=True)
+    with pytest.raises(ValueError):
+        PageSelection.validate("1-5:0")
+    assert PageSelection.validate("1-100:2,last-5") == "1-100:2,last-5"
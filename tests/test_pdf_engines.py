@@ -0,0 +1,113 @@
+import os
+
+import pytest
+from reportlab.lib.pagesizes import A4, landscape, letter
+from reportlab.pdfgen import canvas
+from PyPDF2 import PdfReader
+
+import pdf_signer
+
+fitz = pytest.importorskip("pymupdf")
+
+SIGN_PATH = os.path.join(os.path.dirname(os.path.dirname(__file__)), 'sign.png')
+
+# (dimensione, /Rotate, /CropBox)
+GEOMETRIES = [
+    (A4, 0, None),
+    (landscape(letter), 0, None),
+    (landscape(A4), 90, None),
+    (A4, 180, None),
+    (landscape(A4), 270, None),
+    (A4, 0, (100, 100, 450, 700)),
+]
+
+ENGINES = list(pdf_signer.PDF_ENGINES)
+
+
+@pytest.fixture
+def input_pdf(tmp_path):
+    path = str(tmp_path / 'in.pdf')
+    c = canvas.Canvas(path)
+    for size, rotation, crop in GEOMETRIES:
+        c.setPageSize(size)
+        c.setPageRotation(rotation)
+        c.setCropBox(crop)
+        c.drawString(72, 72, "Pagina")
+        c.showPage()
+    c.save()
+    return path
+
+
+def _visual_bboxes(path):
+    """Riquadri delle immagini per pagina, in coordinate visualizzate."""
+    with fitz.open(path) as doc:
+        return [
+            [fitz.Rect(info['bbox']) * page.rotation_matrix for info in page.get_image_info()]
+            for page in doc
+        ]
+
+
+@pytest.mark.parametrize('engine', ENGINES)
+def test_stamp_in_visual_corner(engine, input_pdf, tmp_path):
+    output = str(tmp_path / f'out_{engine}.pdf')
+    assert pdf_signer.add_watermark_to_pdf_advanced(
+        input_pdf, SIGN_PATH, output, 0.2, engine=engine, pages='1-5',
+    )
+    with fitz.open(output) as doc:
+        sizes = [(page.rect.width, page.rect.height) for page in doc]
+    bboxes = _visual_bboxes(output)
+    assert len(bboxes) == len(GEOMETRIES)
+    assert bboxes[5] == []
+    for (width, height), boxes in zip(sizes[:5], bboxes[:5]):
+        assert len(boxes) == 1
+        x, y, w, h = pdf_signer.calculate_watermark_position(SIGN_PATH, 0.2, 'bottom-right',
+                                                             (width, height))
+        box = boxes[0]
+        assert box.x1 == pytest.approx(x + w, abs=0.5)
+        assert box.y1 == pytest.approx(height - y, abs=0.5)
+        assert box.width == pytest.approx(w, abs=0.5)
+
+
+@pytest.mark.parametrize('engine', ENGINES)
+def test_metadata_and_incremental(engine, input_pdf, tmp_path):
+    output = str(tmp_path / f'inc_{engine}.pdf')
+    assert pdf_signer.add_watermark_to_pdf_advanced(
+        input_pdf, SIGN_PATH, output, 0.2, engine=engine, incremental=True,
+        add_metadata=True, author='Mario Rossi', timestamp=True,
+    )
+    with open(input_pdf, 'rb') as f:
+        original = f.read()
+    with open(output, 'rb') as f:
+        assert f.read().startswith(original)
+    reader = PdfReader(output)
+    assert reader.metadata['/Author'] == 'Mario Rossi'
+    assert len(reader.pages) == len(GEOMETRIES)
+    assert all(len(boxes) == 2 for boxes in _visual_bboxes(output))
+
+
+def test_pymupdf_embeds_image_once(input_pdf, tmp_path):
+    output = str(tmp_path / 'out.pdf')
+    assert pdf_signer.add_watermark_to_pdf_advanced(
+        input_pdf, SIGN_PATH, output, 0.2, engine='pymupdf', border_width=2,
+    )
+    with fitz.open(output) as doc:
+        xrefs = {image[0] for page in doc for image in page.get_images()}
+    assert len(xrefs) == 1
+
+
+def test_unknown_engine():
+    with pytest.raises(ValueError):
+        pdf_signer.get_pdf_engine('qpdf')
+
+
+def test_engine_interface_is_abstract():
+    class Incomplete(pdf_signer.PdfEngine):
+        name = 'incompleto'
+
+        def version(self):
+            return 'incompleto 0'
+
+    with pytest.raises(TypeError):
+        pdf_signer.PdfEngine()
+    with pytest.raises(TypeError):
+        Incomplete()
@@ -0,0 +1,84 @@
+import contextlib
+import io
+import os
+import tempfile
+import unittest
+
+from reportlab.lib.pagesizes import A4, landscape
+from reportlab.pdfgen import canvas
+from PyPDF2 import PdfReader
+
+import pdf_signer
+from pdf_signer import _split_shards, add_watermark_to_pdf_advanced, page_geometry
+
+SIGN_PATH = os.path.join(os.path.dirname(os.path.dirname(__file__)), 'sign.png')
+
+
+def _stamp_names(page):
+    xobjects = page['/Resources'].get_object().get('/XObject')
+    return [name for name in (xobjects.get_object() if xobjects else {})
+            if name.startswith('/PdfSignerStamp')]
+
+
+class TestSharding(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.input_pdf = os.path.join(self.tmpdir.name, 'in.pdf')
+        c = canvas.Canvas(self.input_pdf)
+        for i in range(30):
+            c.setPageSize(landscape(A4) if i % 3 else A4)
+            c.setPageRotation(90 if i % 5 == 0 else 0)
+            c.drawString(72, 72, f"Pagina {i + 1}")
+            c.showPage()
+        c.save()
+
+    def tearDown(self):
+        self.tmpdir.cleanup()
+
+    def _sign(self, name, **kwargs):
+        output = os.path.join(self.tmpdir.name, name)
+        log = io.StringIO()
+        with contextlib.redirect_stdout(log):
+            self.assertTrue(add_watermark_to_pdf_advanced(
+                self.input_pdf, SIGN_PATH, output, 0.2, **kwargs
+            ))
+        return output, log.getvalue()
+
+    def test_split_is_balanced(self):
+        shards = _split_shards(range(10), 3)
+        self.assertEqual([len(s) for s in shards], [4, 3, 3])
+        self.assertEqual(sum(shards, []), list(range(10)))
+        self.assertEqual(len(_split_shards(range(2), 4)), 2)
+
+    def test_sharded_matches_serial(self):
+        options = dict(pages='2-', exclude_pages='7', add_metadata=True, author='Anna')
+        serial, _ = self._sign('serial.pdf', incremental=True, **options)
+        sharded, log = self._sign('sharded.pdf', shards=3, shard_threshold=0, **options)
+        self.assertIn('3 processi', log)
+
+        with open(self.input_pdf, 'rb') as f:
+            original = f.read()
+        with open(sharded, 'rb') as f:
+            self.assertTrue(f.read().startswith(original))
+
+        expected, result = PdfReader(serial), PdfReader(sharded)
+        self.assertEqual(result.metadata['/Author'], 'Anna')
+        self.assertEqual(len(result.pages), 30)
+        for i, (a, b) in enumerate(zip(expected.pages, result.pages)):
+            self.assertEqual(page_geometry(b), page_geometry(a))
+            self.assertEqual(bool(_stamp_names(b)), i not in (0, 6), i)
+        # Un solo XObject del marchio per geometria, condiviso tra gli shard
+        forms = {b['/Resources']['/XObject'].raw_get(_stamp_names(b)[0]).idnum
+                 for b in result.pages if _stamp_names(b)}
+        self.assertEqual(len(forms), 2)
+        self.assertLess(os.path.getsize(sharded), os.path.getsize(serial))
+
+    def test_small_documents_stay_single_process(self):
+        output, log = self._sign('small.pdf', shards=4)
+        self.assertLess(30, pdf_signer.SHARD_THRESHOLD)
+        self.assertNotIn('shard', log)
+        self.assertEqual(len(PdfReader(output).pages), 30)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,67 @@
+import os
+import shutil
+import tempfile
+import unittest
+from unittest.mock import patch
+
+from PIL import Image
+
+import pdf_signer
+from pdf_signer import SignatureImageRegistry
+
+SIGN_PATH = os.path.join(os.path.dirname(os.path.dirname(__file__)), 'sign.png')
+
+
+class TestSignatureImageRegistry(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.sign = os.path.join(self.tmpdir.name, 'sign.png')
+        shutil.copy(SIGN_PATH, self.sign)
+
+    def tearDown(self):
+        self.tmpdir.cleanup()
+
+    def test_decoded_once_and_shared(self):
+        registry = SignatureImageRegistry()
+        with patch.object(pdf_signer.Image, 'open', wraps=Image.open) as opened:
+            first = registry.get(self.sign)
+            self.assertIs(registry.get(self.sign), first)
+        self.assertEqual(opened.call_count, 1)
+        self.assertTrue(first.has_alpha)
+        self.assertEqual(first.size, first.image.size)
+        thumb = first.thumbnail((100, 100))
+        self.assertIs(first.thumbnail((100, 100)), thumb)
+        self.assertLessEqual(max(thumb.size), 100)
+        self.assertEqual(first.image.size, first.size)
+
+    def test_reloaded_when_file_changes(self):
+        registry = SignatureImageRegistry()
+        first = registry.get(self.sign)
+        Image.new('RGB', (10, 20)).save(self.sign)
+        os.utime(self.sign, ns=(0, 10 ** 9))
+        second = registry.get(self.sign)
+        self.assertIsNot(second, first)
+        self.assertEqual(second.size, (10, 20))
+        self.assertNotEqual(second.digest, first.digest)
+
+    def test_bounded_memory(self):
+        other = os.path.join(self.tmpdir.name, 'other.png')
+        Image.new('RGBA', (50, 50)).save(other)
+        registry = SignatureImageRegistry(max_bytes=50 * 50 * 4)
+        registry.get(other)
+        registry.get(self.sign)
+        stats = registry.stats()
+        self.assertEqual(stats['entries'], 1)
+        self.assertEqual(stats['misses'], 2)
+
+    def test_sizing_and_effects_use_registry(self):
+        entry = pdf_signer.SIGNATURE_IMAGES.get(self.sign)
+        width, height, px_w, px_h = pdf_signer.calculate_watermark_size_points(self.sign, 1.0)
+        self.assertEqual((px_w, px_h), entry.size)
+        before = entry.image.tobytes()
+        pdf_signer.apply_image_effects(self.sign, border_width=2, shadow_enabled=True)
+        self.assertEqual(entry.image.tobytes(), before)
+
+
+if __name__ == '__main__':
+    unittest.main()
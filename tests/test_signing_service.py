@@ -0,0 +1,162 @@
+import http.client
+import io
+import json
+import os
+import threading
+import time
+
+import pytest
+from PyPDF2 import PdfReader
+
+from pdf_signer import SigningService
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+SIGN_PATH = os.path.join(ROOT, 'sign.png')
+
+
+@pytest.fixture(scope='module')
+def service():
+    profiles = {'Ufficio': {'scale': 0.3, 'position': 'top-left', 'pages': 'first'}}
+    with SigningService(SIGN_PATH, 0.2, workers=1, max_queue=1, max_upload=100_000,
+                        profiles=profiles) as service:
+        server = service.make_server(port=0)
+        thread = threading.Thread(target=server.serve_forever, daemon=True)
+        thread.start()
+        service.port = server.server_address[1]
+        yield service
+        server.shutdown()
+        server.server_close()
+
+
+def _request(service, method, path, body=None, headers=None):
+    conn = http.client.HTTPConnection('127.0.0.1', service.port, timeout=30)
+    try:
+        conn.request(method, path, body, headers or {})
+        response = conn.getresponse()
+        return response.status, dict(response.getheaders()), response.read()
+    finally:
+        conn.close()
+
+
+def test_sign_raw_and_multipart(service, make_pdf):
+    status, headers, body = _request(service, 'POST', '/sign?pages=1&timestamp=yes', make_pdf(),
+                                     {'Content-Type': 'application/pdf'})
+    assert status == 200
+    assert headers['X-Pdf-Pages'] == '2'
+    assert len(PdfReader(io.BytesIO(body)).pages) == 2
+
+    boundary = 'confine'
+    form = (
+        f'--{boundary}\r\nContent-Disposition: form-data; name="profile"\r\n\r\nUfficio\r\n'
+        f'--{boundary}\r\nContent-Disposition: form-data; name="file"; filename="a.pdf"\r\n'
+        f'Content-Type: application/pdf\r\n\r\n'
+    ).encode() + make_pdf(pages=3) + f'\r\n--{boundary}--\r\n'.encode()
+    status, _, body = _request(service, 'POST', '/sign', form,
+                               {'Content-Type': f'multipart/form-data; boundary={boundary}'})
+    assert status == 200
+    assert body.startswith(b'%PDF')
+
+
+def test_errors(service, make_pdf):
+    assert _request(service, 'POST', '/sign?watermark=/etc/passwd', make_pdf())[0] == 400
+    assert _request(service, 'POST', '/sign?scale=molto', make_pdf())[0] == 400
+    assert _request(service, 'POST', '/sign?profile=Nessuno', make_pdf())[0] == 400
+    # L'account SMTP del servizio non è utilizzabile dai client
+    for query in ('email_recipients=x@example.com', 'email_subject=Ciao', 'email_body=Testo'):
+        status, _, body = _request(service, 'POST', f'/sign?{query}', make_pdf())
+        assert status == 400 and 'non ammessi' in json.loads(body)['error']
+    status, _, body = _request(service, 'POST', '/sign', b'non un PDF')
+    assert status == 422
+    assert 'PdfReadError' in json.loads(body)['error']
+    assert _request(service, 'POST', '/sign', b'x' * 200_000)[0] == 413
+    status, headers, _ = _request(service, 'POST', '/sign', headers={'Content-Length': '-1'})
+    assert status == 400 and headers['Connection'] == 'close'
+    # Un campo a sua volta multipart non è un valore valido
+    boundary, inner = 'confine', 'interno'
+    form = (
+        f'--{boundary}\r\nContent-Disposition: form-data; name="profile"\r\n'
+        f'Content-Type: multipart/mixed; boundary={inner}\r\n\r\n'
+        f'--{inner}\r\n\r\nUfficio\r\n--{inner}--\r\n'
+        f'\r\n--{boundary}\r\nContent-Disposition: form-data; name="file"; filename="a.pdf"\r\n'
+        f'Content-Type: application/pdf\r\n\r\n'
+    ).encode() + make_pdf() + f'\r\n--{boundary}--\r\n'.encode()
+    status, _, body = _request(service, 'POST', '/sign', form,
+                               {'Content-Type': f'multipart/form-data; boundary={boundary}'})
+    assert status == 400 and 'campo non valido' in json.loads(body)['error']
+    assert _request(service, 'GET', '/altro')[0] == 404
+
+
+def test_backpressure(service, make_pdf):
+    # Occupa tutti i posti (1 processo + 1 in coda): la richiesta successiva va respinta subito
+    for _ in range(2):
+        service._slots.acquire()
+    try:
+        status, headers, _ = _request(service, 'POST', '/sign', make_pdf())
+    finally:
+        for _ in range(2):
+            service._slots.release()
+    assert status == 503
+    assert headers['Retry-After'] == '1'
+    # Il corpo non è stato letto: la connessione non è riutilizzabile
+    assert headers['Connection'] == 'close'
+    assert _request(service, 'POST', '/sign', make_pdf())[0] == 200
+
+
+def test_admission_before_body(service, make_pdf):
+    # Il posto va preso prima di leggere il corpo: una richiesta che invia
+    # solo le intestazioni occupa il posto, le altre vengono respinte subito
+    conn = http.client.HTTPConnection('127.0.0.1', service.port, timeout=30)
+    conn.putrequest('POST', '/sign')
+    conn.putheader('Content-Length', '50000')
+    conn.endheaders()
+    try:
+        for _ in range(50):
+            if service._in_flight:
+                break
+            time.sleep(0.02)
+        assert service._in_flight == 1
+        service._slots.acquire()
+        try:
+            assert _request(service, 'POST', '/sign', make_pdf())[0] == 503
+        finally:
+            service._slots.release()
+    finally:
+        conn.close()
+    for _ in range(50):
+        if not service._in_flight:
+            break
+        time.sleep(0.02)
+    assert service._in_flight == 0
+    assert _request(service, 'POST', '/sign', make_pdf())[0] == 200
+
+
+def test_health_and_metrics(service):
+    status, _, body = _request(service, 'GET', '/health')
+    health = json.loads(body)
+    assert status == 200
+    assert (health['status'], health['workers'], health['capacity']) == ('ok', 1, 2)
+    metrics = json.loads(_request(service, 'GET', '/metrics?format=json')[2])
+    assert metrics['requests']['200'] >= 1
+    assert metrics['latency_s']['p99'] >= metrics['latency_s']['p50'] > 0
+    text = _request(service, 'GET', '/metrics')[2].decode()
+    assert 'pdf_signer_requests_total{code="200"}' in text
+    assert 'pdf_signer_request_seconds{quantile="0.99"}' in text
+
+
+def test_unix_socket(tmp_path, make_pdf):
+    import pdf_signer_bench as bench
+
+    path = str(tmp_path / 'firma.sock')
+    with SigningService(SIGN_PATH, 0.2, workers=1) as service:
+        server = service.make_server(socket_path=path)
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        try:
+            conn = bench._UnixHTTPConnection(path)
+            conn.request('POST', '/sign', make_pdf())
+            response = conn.getresponse()
+            assert response.status == 200
+            assert response.read().startswith(b'%PDF')
+            conn.close()
+        finally:
+            server.shutdown()
+            server.server_close()
@@ -0,0 +1,79 @@
+import time
+from email.message import EmailMessage
+
+import pytest
+
+import pdf_signer
+from pdf_signer import SmtpConnectionPool, send_email_with_pdf
+from pdf_signer_bench import StubSmtpServer
+
+
+@pytest.fixture
+def relay():
+    server = StubSmtpServer()
+    yield server
+    server.close()
+
+
+def _send(relay, pool, count=1):
+    return [send_email_with_pdf(b'%PDF-firmato', relay.email_config(), ['a@example.com'],
+                                filename=f'{i}.pdf', pool=pool) for i in range(count)]
+
+
+def test_connections_are_reused(relay):
+    with SmtpConnectionPool(noop_interval=60) as pool:
+        assert all(_send(relay, pool, 5))
+        stats = pool.stats()
+    assert (stats['connects'], stats['reuses'], stats['messages']) == (1, 4, 5)
+    assert (relay.connections, relay.messages, relay.noops) == (1, 5, 0)
+    # Senza pool: una connessione per messaggio
+    assert all(_send(relay, None, 2))
+    assert relay.connections == 3
+
+
+def test_noop_and_idle_timeout(relay):
+    with SmtpConnectionPool(noop_interval=0) as pool:
+        _send(relay, pool, 3)
+        assert pool.stats()['noops'] == 2
+    assert relay.noops == 2
+    with SmtpConnectionPool(idle_timeout=0) as pool:
+        _send(relay, pool, 2)
+        time.sleep(0.01)
+        _send(relay, pool, 1)
+        assert pool.stats()['connects'] == 3
+
+
+def test_reconnect_after_server_drop():
+    relay = StubSmtpServer(drop_after=2)
+    try:
+        with SmtpConnectionPool(noop_interval=60) as pool:
+            assert all(_send(relay, pool, 5))
+            stats = pool.stats()
+    finally:
+        relay.close()
+    assert relay.messages == 5
+    assert (stats['connects'], stats['reconnects']) == (3, 2)
+
+
+def test_max_messages_and_errors(relay):
+    with SmtpConnectionPool(max_messages=2) as pool:
+        _send(relay, pool, 5)
+        assert pool.stats()['connects'] == 3
+    config = dict(relay.email_config(), smtp_port=1)
+    with pytest.raises(OSError):
+        SmtpConnectionPool().send(EmailMessage(), config)
+
+
+def test_process_pool_is_shared_and_closed_at_exit(relay):
+    pdf_signer.SMTP_POOL = None
+    try:
+        kwargs = {'email_config': 'email.yaml', 'email_recipients': ['a@example.com']}
+        with pytest.MonkeyPatch.context() as patch:
+            patch.setattr(pdf_signer, 'load_email_config', lambda path: relay.email_config())
+            for _ in range(3):
+                pdf_signer._email_signed_pdf(b'%PDF', kwargs, 'doc.pdf')
+        assert relay.connections == 1
+        assert pdf_signer.smtp_pool() is pdf_signer.SMTP_POOL
+    finally:
+        pdf_signer.SMTP_POOL.close()
+        pdf_signer.SMTP_POOL = None
@@ -0,0 +1,104 @@
+import smtplib
+import threading
+import time
+
+from pdf_signer import (EmailOutbox, OutboxSender, ProviderLimit, SmtpRateLimiter,
+                        build_email_message)
+from pdf_signer_bench import StubSmtpServer
+
+
+def _fill(outbox, config, count):
+    for i in range(count):
+        outbox.enqueue(build_email_message(b'%PDF', config, ['a@example.com'],
+                                           filename=f'{i}.pdf'), config)
+
+
+def _drain(outbox, sender, total, timeout=30):
+    deadline = time.monotonic() + timeout
+    while outbox.counts()['sent'] + outbox.counts()['failed'] < total:
+        assert time.monotonic() < deadline
+        time.sleep(0.01)
+    sender.stop()
+    return sender.stats()
+
+
+def test_token_bucket_and_adaptive_backoff():
+    limit = ProviderLimit(messages_per_minute=600, burst=2, backoff_base=0.2)
+    start = time.monotonic()
+    for _ in range(4):
+        assert limit.acquire()
+        limit.release()
+    # Due gettoni subito, poi uno ogni 0,1 s
+    assert 0.15 < time.monotonic() - start < 0.5
+    limit.throttled()
+    assert limit.stats()['messages_per_minute'] == 300
+    start = time.monotonic()
+    assert limit.acquire()
+    assert time.monotonic() - start >= 0.19
+    limit.succeeded()
+    assert limit.stats()['messages_per_minute'] == 360
+    # Una pausa lunga si interrompe con cancel
+    limit.throttled()
+    limit.throttled()
+    cancel = threading.Event()
+    threading.Timer(0.05, cancel.set).start()
+    assert not limit.acquire(cancel)
+
+
+def test_limits_from_provider_table_and_config():
+    limiter = SmtpRateLimiter(max_connections=8)
+    gmail = limiter.limit({'smtp_server': 'smtp.gmail.com', 'username': 'a'})
+    assert (gmail.rate * 60, gmail.max_connections) == (60, 3)
+    custom = limiter.limit({'smtp': {'server': 'mail.example.com', 'rate_limit': {
+        'messages_per_minute': 120, 'max_connections': 2}}})
+    assert (custom.rate * 60, custom.max_connections) == (120, 2)
+    assert limiter.limit({'smtp_server': 'altro.example.com'}).rate is None
+    assert limiter.limit({'smtp_server': 'smtp.gmail.com', 'username': 'a'}) is gmail
+
+
+def test_parallel_connections_respect_provider_limit(tmp_path):
+    relay = StubSmtpServer(message_latency=0.05)
+    try:
+        config = dict(relay.email_config(), rate_limit={'max_connections': 2})
+        outbox = EmailOutbox(tmp_path)
+        _fill(outbox, config, 12)
+        sender = OutboxSender(outbox, workers=4, poll_interval=0.02).start()
+        stats = _drain(outbox, sender, 12)
+    finally:
+        relay.close()
+    assert (stats['sent'], stats['deferred'], stats['failed']) == (12, 0, 0)
+    assert relay.max_active == 2
+    assert stats['messages_per_s'] > 0
+    assert list(stats['providers'].values())[0]['sent'] == 12
+
+
+def test_throttling_is_deferred_and_slows_down(tmp_path):
+    relay = StubSmtpServer(throttle=2)
+    try:
+        config = relay.email_config()
+        outbox = EmailOutbox(tmp_path, backoff_base=0.05)
+        _fill(outbox, config, 5)
+        limiter = SmtpRateLimiter(backoff_base=0.05, backoff_max=0.1)
+        sender = OutboxSender(outbox, workers=2, poll_interval=0.02, limiter=limiter).start()
+        stats = _drain(outbox, sender, 5)
+    finally:
+        relay.close()
+    assert (stats['sent'], stats['deferred'], stats['failed']) == (5, 2, 0)
+    assert list(stats['providers'].values())[0]['throttled'] == 2
+    assert relay.messages == 5
+
+
+def test_permanent_rejection_is_not_throttling(tmp_path):
+    limiter = SmtpRateLimiter()
+    outbox = EmailOutbox(tmp_path)
+    config = {'smtp_server': 'localhost'}
+    _fill(outbox, config, 1)
+
+    class Pool:
+        def send(self, msg, email_config, ssl_context=None):
+            raise smtplib.SMTPDataError(554, b'rifiutato')
+
+    message_id = outbox.claim_next()
+    assert outbox.deliver(message_id, Pool(), limiter) == 'failed'
+    assert limiter.limit(config).stats()['throttled'] == 0
+    assert outbox.status(message_id)['state'] == 'failed'
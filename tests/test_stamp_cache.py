@@ -0,0 +1,58 @@
+import os
+import tempfile
+import unittest
+
+from reportlab.lib.pagesizes import A4
+from reportlab.pdfgen import canvas
+
+import pdf_signer
+from pdf_signer import CompiledStampCache, image_digest
+
+SIGN_PATH = os.path.join(os.path.dirname(os.path.dirname(__file__)), 'sign.png')
+
+
+class TestCompiledStampCache(unittest.TestCase):
+    def test_lru_eviction_by_size(self):
+        cache = CompiledStampCache(max_bytes=10)
+        self.assertEqual(cache.get_or_build('a', lambda: b'1234'), b'1234')
+        cache.get_or_build('b', lambda: b'5678')
+        cache.get_or_build('a', lambda: self.fail("voce già in cache"))
+        cache.get_or_build('c', lambda: b'90ab')
+        # 'b' è la voce usata meno di recente
+        self.assertEqual(cache.stats(), {
+            'hits': 1, 'misses': 3, 'evictions': 1,
+            'entries': 2, 'bytes': 8, 'max_bytes': 10,
+        })
+        cache.get_or_build('big', lambda: b'x' * 11)
+        self.assertEqual(cache.stats()['entries'], 2)
+        cache.resize(4)
+        self.assertEqual(cache.stats()['evictions'], 2)
+
+    def test_digest_by_content(self):
+        image = pdf_signer.load_signature_image(SIGN_PATH)
+        self.assertEqual(image_digest(image), image_digest(image.copy()))
+        self.assertNotEqual(image_digest(image), image_digest(image.rotate(90, expand=True)))
+
+    def test_reused_across_calls(self):
+        with tempfile.TemporaryDirectory() as tmpdir:
+            input_pdf = os.path.join(tmpdir, 'in.pdf')
+            c = canvas.Canvas(input_pdf, pagesize=A4)
+            c.drawString(72, 720, "Pagina 1")
+            c.showPage()
+            c.save()
+            pdf_signer.STAMP_CACHE.clear()
+            for i in range(3):
+                self.assertTrue(pdf_signer.add_watermark_to_pdf(
+                    input_pdf, SIGN_PATH, os.path.join(tmpdir, f'out{i}.pdf'), 0.2
+                ))
+            stats = pdf_signer.STAMP_CACHE.stats()
+            self.assertEqual((stats['misses'], stats['hits']), (1, 2))
+            # Una scala diversa produce un nuovo marchio
+            pdf_signer.add_watermark_to_pdf(
+                input_pdf, SIGN_PATH, os.path.join(tmpdir, 'out.pdf'), 0.3
+            )
+            self.assertEqual(pdf_signer.STAMP_CACHE.stats()['misses'], 2)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,62 @@
+import io
+import os
+import subprocess
+import sys
+
+from PyPDF2 import PdfReader
+
+from pdf_signer import _spool_stream
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+SIGN_PATH = os.path.join(ROOT, 'sign.png')
+SCRIPT = os.path.join(ROOT, 'pdf_signer.py')
+
+
+def _run(args, data, cwd):
+    return subprocess.run([sys.executable, SCRIPT, *args, '-w', SIGN_PATH], input=data,
+                          capture_output=True, cwd=str(cwd))
+
+
+def test_stdin_to_stdout(tmp_path, make_pdf):
+    data = make_pdf(pages=3)
+    proc = _run(['-', '-o', '-', '--timestamp'], data, tmp_path)
+    assert proc.returncode == 0, proc.stderr.decode()
+    # stdout contiene solo il PDF, i messaggi sono su stderr
+    assert proc.stdout.startswith(b'%PDF') and proc.stdout.rstrip().endswith(b'%%EOF')
+    assert len(PdfReader(io.BytesIO(proc.stdout)).pages) == 3
+    assert 'Firmata pagina 3' in proc.stderr.decode()
+    # Senza -o l'output di un PDF letto da stdin va su stdout; nessun file creato
+    proc = _run(['-', '--incremental'], data, tmp_path)
+    assert proc.returncode == 0
+    assert proc.stdout.startswith(data)
+    assert os.listdir(tmp_path) == []
+
+
+def test_file_to_stdout_and_stdin_to_file(tmp_path, make_pdf):
+    (tmp_path / 'in.pdf').write_bytes(make_pdf())
+    proc = _run(['in.pdf', '-o', '-'], None, tmp_path)
+    assert proc.returncode == 0
+    assert len(PdfReader(io.BytesIO(proc.stdout)).pages) == 2
+    proc = _run(['-', '-o', 'out.pdf'], make_pdf(), tmp_path)
+    assert proc.returncode == 0
+    assert len(PdfReader(str(tmp_path / 'out.pdf')).pages) == 2
+
+
+def test_errors_leave_stdout_empty(tmp_path):
+    proc = _run(['-'], b'non un PDF', tmp_path)
+    assert proc.returncode == 1
+    assert proc.stdout == b''
+    assert 'Errore' in proc.stderr.decode()
+    proc = _run(['-', 'altro.pdf'], b'', tmp_path)
+    assert proc.returncode == 2
+    assert b"'-' (stdin) vale per un solo file" in proc.stderr
+
+
+def test_spool_rolls_over_to_anonymous_file(make_pdf):
+    data = make_pdf()
+    with _spool_stream(io.BytesIO(data), max_size=len(data) * 2) as spool:
+        assert not spool._rolled
+        assert spool.read() == data
+    with _spool_stream(io.BytesIO(data), max_size=1024) as spool:
+        assert spool._rolled
+        assert spool.read() == data
@@ -0,0 +1,129 @@
+import contextlib
+import io
+import multiprocessing
+import os
+import signal
+import threading
+import time
+
+import pytest
+
+import pdf_signer
+from pdf_signer import WatchFolder, _StabilityTracker, create_watcher
+
+SIGN_PATH = os.path.join(os.path.dirname(os.path.dirname(__file__)), 'sign.png')
+BACKENDS = ['polling'] + (['inotify'] if pdf_signer.sys.platform.startswith('linux') else [])
+
+
+def _wait_for(condition, timeout=20):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if condition():
+            return True
+        time.sleep(0.05)
+    return False
+
+
+def _crashing_sign(input_pdf_path, output_pdf_path):
+    # Simula un crash di una libreria PDF nel processo di lavoro
+    if os.path.basename(input_pdf_path).startswith('crash'):
+        os._exit(1)
+    return pdf_signer._sign_one(input_pdf_path, output_pdf_path, *pdf_signer._BATCH_JOB)
+
+
+@contextlib.contextmanager
+def _running(watch):
+    log = io.StringIO()
+
+    def run():
+        with contextlib.redirect_stdout(log):
+            watch.run()
+
+    thread = threading.Thread(target=run)
+    thread.start()
+    try:
+        yield log
+    finally:
+        watch.stop()
+        thread.join(timeout=20)
+    assert not thread.is_alive()
+
+
+def test_stability_tracker(tmp_path):
+    path = tmp_path / 'scan.pdf'
+    path.write_bytes(b'%PDF-1.4')
+    tracker = _StabilityTracker(settle=1.0)
+    tracker.add(str(path))
+    assert tracker.ready(now=100.0) == []
+    assert tracker.ready(now=100.5) == []
+    # Lo scanner scrive ancora: il conteggio riparte
+    with open(path, 'ab') as f:
+        f.write(b'\n1 0 obj')
+    assert tracker.ready(now=101.2) == []
+    assert tracker.ready(now=102.3) == [str(path)]
+    path.unlink()
+    assert tracker.ready(now=103.0) == [] and len(tracker) == 0
+
+
+@pytest.mark.parametrize('backend', BACKENDS)
+def test_watcher_reports_new_pdfs(backend, tmp_path):
+    (tmp_path / 'old.pdf').write_bytes(b'x')
+    watcher = create_watcher([str(tmp_path)], backend, poll_interval=0.05)
+    try:
+        assert watcher.name == backend
+        assert watcher.poll(0.2) == [str(tmp_path / 'old.pdf')]
+        (tmp_path / 'note.txt').write_text('ignorato')
+        (tmp_path / '.scan.pdf.part').write_bytes(b'x')
+        (tmp_path / 'new.pdf').write_bytes(b'x')
+        seen = set()
+        assert _wait_for(lambda: seen.update(watcher.poll(0.1)) or str(tmp_path / 'new.pdf') in seen)
+        assert all(path.endswith(('old.pdf', 'new.pdf')) for path in seen)
+    finally:
+        watcher.close()
+
+
+@pytest.mark.parametrize('backend', BACKENDS)
+def test_signs_files_as_they_land(backend, tmp_path, make_pdf):
+    inbox = tmp_path / 'inbox'
+    inbox.mkdir()
+    watch = WatchFolder([str(inbox)], SIGN_PATH, 0.2, output_dir=str(tmp_path / 'out'),
+                        workers=2, settle=0.2, backend=backend, poll_interval=0.05)
+    with _running(watch) as log:
+        make_pdf(inbox / 'a.pdf')
+        (inbox / 'broken.pdf').write_text("non è un PDF")
+        make_pdf(inbox / 'b.pdf', pages=3)
+        assert _wait_for(lambda: watch.stats['signed'] == 2 and watch.stats['failed'] == 1), log.getvalue()
+    assert sorted(os.listdir(tmp_path / 'out')) == ['a_signed.pdf', 'b_signed.pdf']
+    assert sorted(os.listdir(inbox / 'processed')) == ['a.pdf', 'b.pdf']
+    assert sorted(os.listdir(inbox / 'failed')) == ['broken.pdf', 'broken.pdf.error.txt']
+    assert watch.stats['pages'] == 5
+    assert [name for name in os.listdir(inbox) if name.endswith('.pdf')] == []
+
+
+@pytest.mark.skipif(multiprocessing.get_start_method() != 'fork',
+                    reason="il crash simulato richiede processi creati con fork")
+def test_survives_killed_workers(tmp_path, make_pdf, monkeypatch):
+    monkeypatch.setattr(pdf_signer, '_batch_sign_one', _crashing_sign)
+    inbox = tmp_path / 'inbox'
+    inbox.mkdir()
+    watch = WatchFolder([str(inbox)], SIGN_PATH, 0.2, output_dir=str(tmp_path / 'out'),
+                        workers=2, settle=0.1, backend='polling', poll_interval=0.05)
+    with _running(watch) as log:
+        make_pdf(inbox / 'a.pdf')
+        assert _wait_for(lambda: watch.stats['signed'] == 1), log.getvalue()
+        # Processo ucciso mentre il pool è inattivo (es. memoria esaurita)
+        os.kill(next(iter(watch._pool._processes)), signal.SIGKILL)
+        time.sleep(0.2)
+        make_pdf(inbox / 'b.pdf')
+        make_pdf(inbox / 'crash.pdf')
+        make_pdf(inbox / 'c.pdf')
+        assert _wait_for(lambda: watch.stats['signed'] == 3 and watch.stats['failed'] == 1), log.getvalue()
+    assert watch.stats['pool_restarts'] >= 2
+    assert sorted(os.listdir(tmp_path / 'out')) == ['a_signed.pdf', 'b_signed.pdf', 'c_signed.pdf']
+    assert sorted(os.listdir(inbox / 'failed')) == ['crash.pdf', 'crash.pdf.error.txt']
+    assert 'processo di firma terminato' in (inbox / 'failed' / 'crash.pdf.error.txt').read_text()
+
+
+def test_rejects_output_inside_watch_list(tmp_path):
+    with pytest.raises(ValueError):
+        WatchFolder([str(tmp_path)], SIGN_PATH, output_dir=str(tmp_path))
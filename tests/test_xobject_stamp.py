@@ -0,0 +1,62 @@
+import os
+import tempfile
+import unittest
+
+from reportlab.lib.pagesizes import A4
+from reportlab.pdfgen import canvas
+from PyPDF2 import PdfReader
+
+from pdf_signer import add_watermark_to_pdf_advanced
+
+SIGN_PATH = os.path.join(os.path.dirname(os.path.dirname(__file__)), 'sign.png')
+
+
+class TestXObjectStampMode(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.input_pdf = os.path.join(self.tmpdir.name, 'in.pdf')
+        c = canvas.Canvas(self.input_pdf, pagesize=A4)
+        for i in range(8):
+            c.drawString(72, 720, f"Pagina {i + 1}")
+            c.showPage()
+        c.save()
+
+    def tearDown(self):
+        self.tmpdir.cleanup()
+
+    def _sign(self, mode, **kwargs):
+        output = os.path.join(self.tmpdir.name, f'out_{mode}.pdf')
+        self.assertTrue(add_watermark_to_pdf_advanced(
+            self.input_pdf, SIGN_PATH, output, 0.2, stamp_mode=mode, **kwargs
+        ))
+        return output
+
+    def test_single_shared_xobject(self):
+        output = self._sign('xobject', pages='odd', timestamp=True)
+        reader = PdfReader(output)
+        refs = set()
+        for i, page in enumerate(reader.pages):
+            xobjects = page['/Resources'].get('/XObject', {})
+            if i % 2 == 0:
+                ref = xobjects.raw_get('/PdfSignerStamp')
+                refs.add(ref.idnum)
+                data = b''.join(part.get_object().get_data() for part in page['/Contents'])
+                self.assertIn(b'/PdfSignerStamp Do', data)
+            else:
+                self.assertNotIn('/PdfSignerStamp', xobjects)
+        self.assertEqual(len(refs), 1)
+
+    def test_smaller_than_merge(self):
+        merged = self._sign('merge')
+        shared = self._sign('xobject')
+        self.assertLess(os.path.getsize(shared), os.path.getsize(merged))
+
+    def test_invalid_mode(self):
+        output = os.path.join(self.tmpdir.name, 'out.pdf')
+        self.assertFalse(add_watermark_to_pdf_advanced(
+            self.input_pdf, SIGN_PATH, output, 0.2, stamp_mode='bogus'
+        ))
+
+
+if __name__ == '__main__':
+    unittest.main()